@@ -0,0 +1,260 @@
+from typing import Union, List, Tuple, Dict
+from collections import OrderedDict
+import threading
+import shutil
+import json
+import math
+import zlib
+import os
+import numpy as np
+
+# Tamaño por defecto de los fragmentos en que se dividen los arrays guardados
+FRAGMENTOS = (512, 512)
+
+# Numero de fragmentos descomprimidos que cada array mantiene en memoria para las lecturas repetidas del visor
+FRAGMENTOS_EN_MEMORIA = 16
+
+class ArrayFragmentado:
+    """
+    Clase que da acceso de solo lectura a un array 2D guardado en disco en fragmentos comprimidos, leyendo solo los
+    fragmentos que corta cada consulta.
+
+    El formato es el de un array zarr v2 (un archivo .zarray con los metadatos y un archivo comprimido con zlib por
+    fragmento, llamado 'fila.columna'), por lo que tambien puede abrirse con zarr. Los fragmentos que solo contienen
+    ceros no se escriben, de forma que las imagenes de etiquetas, mayoritariamente vacias, ocupan muy poco.
+
+    Se comporta como un array de numpy para el visor y para dask (shape, dtype, ndim, indexado por cortes) y se
+    convierte en un array completo con np.asarray.
+
+    Al abrirlo se anotan los fragmentos escritos y la identidad del archivo .zarray, de forma que un fragmento que no
+    se escribio se lee como ceros, pero si el array se elimina o se reescribe mientras esta abierto (por ejemplo al
+    desalojarlo de la cache) la lectura falla en lugar de devolver ceros o datos de otro array.
+
+    Argumentos:
+    ruta (str): Directorio del array.
+    """
+
+    def __init__(self, ruta: str):
+
+        try:
+            self.ruta = ruta
+            with open(os.path.join(ruta, ".zarray")) as archivo:
+                metadatos = json.load(archivo)
+                estado = os.fstat(archivo.fileno())
+            self.identidad = (estado.st_ino, estado.st_mtime_ns)
+            self.fragmentosEscritos = frozenset(nombre for nombre in os.listdir(ruta) if not nombre.startswith("."))
+            self.shape = tuple(metadatos["shape"])
+            self.chunks = tuple(metadatos["chunks"])
+            self.dtype = np.dtype(metadatos["dtype"])
+            self.fill_value = metadatos["fill_value"]
+            self.niveles = [self]
+            self.cache = OrderedDict()
+            self.cerrojo = threading.Lock()
+        except Exception:
+            raise
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __array__(self, dtype=None) -> np.ndarray:
+        array = self[:, :]
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+    @staticmethod
+    def crear(ruta: str, array: np.ndarray, fragmentos: Tuple[int, int] = FRAGMENTOS, nivel: int = 1) -> "ArrayFragmentado":
+        """
+        Guarda un array 2D en fragmentos comprimidos.
+
+        Args:
+            ruta (str): Directorio del array. No debe existir.
+            array (np.ndarray): El array a guardar.
+            fragmentos (tuple[int, int]): Altura y anchura de los fragmentos.
+            nivel (int): Nivel de compresion de zlib.
+
+        Returns:
+            ArrayFragmentado: El array guardado, abierto para lectura.
+        """
+        try:
+            array = np.asarray(array)
+            os.makedirs(ruta)
+            metadatos = {
+                "zarr_format": 2, "shape": list(array.shape), "chunks": list(fragmentos), "dtype": array.dtype.str,
+                "compressor": {"id": "zlib", "level": nivel}, "fill_value": 0, "order": "C", "filters": None,
+                "dimension_separator": ".",
+            }
+            with open(os.path.join(ruta, ".zarray"), "w") as archivo:
+                json.dump(metadatos, archivo)
+
+            altoFragmento, anchoFragmento = fragmentos
+            for fila in range(math.ceil(array.shape[0] / altoFragmento)):
+                for columna in range(math.ceil(array.shape[1] / anchoFragmento)):
+                    fragmento = array[fila * altoFragmento:(fila + 1) * altoFragmento, columna * anchoFragmento:(columna + 1) * anchoFragmento]
+                    if not fragmento.any():
+                        continue
+                    # Los fragmentos del borde se completan con ceros hasta el tamaño de fragmento, como en zarr
+                    if fragmento.shape != tuple(fragmentos):
+                        completo = np.zeros(fragmentos, dtype=array.dtype)
+                        completo[:fragmento.shape[0], :fragmento.shape[1]] = fragmento
+                        fragmento = completo
+                    with open(os.path.join(ruta, f"{fila}.{columna}"), "wb") as archivo:
+                        archivo.write(zlib.compress(np.ascontiguousarray(fragmento).tobytes(), nivel))
+            return ArrayFragmentado(ruta)
+        except Exception:
+            raise
+
+    def __fragmento(self, fila: int, columna: int) -> Union[np.ndarray, None]:
+        """
+        Lee y descomprime un fragmento, o devuelve None si no se escribio porque solo contenia ceros.
+        """
+        with self.cerrojo:
+            if (fila, columna) in self.cache:
+                self.cache.move_to_end((fila, columna))
+                return self.cache[(fila, columna)]
+        nombre = f"{fila}.{columna}"
+        if nombre not in self.fragmentosEscritos:
+            return None
+        try:
+            with open(os.path.join(self.ruta, nombre), "rb") as archivo:
+                fragmento = np.frombuffer(zlib.decompress(archivo.read()), dtype=self.dtype).reshape(self.chunks)
+            estado = os.stat(os.path.join(self.ruta, ".zarray"))
+        except FileNotFoundError:
+            estado = None
+        # El fragmento se escribio al crear el array, por lo que si falta o el .zarray es otro el array ya no es el abierto
+        if estado is None or (estado.st_ino, estado.st_mtime_ns) != self.identidad:
+            raise FileNotFoundError(f"El array {self.ruta} se ha eliminado o reescrito despues de abrirlo")
+        with self.cerrojo:
+            self.cache[(fila, columna)] = fragmento
+            if len(self.cache) > FRAGMENTOS_EN_MEMORIA:
+                self.cache.popitem(last=False)
+        return fragmento
+
+    def __getitem__(self, indice) -> np.ndarray:
+        if not isinstance(indice, tuple):
+            indice = (indice,)
+        if any(i is Ellipsis for i in indice):
+            posicion = indice.index(Ellipsis)
+            indice = indice[:posicion] + (slice(None),) * (self.ndim - len(indice) + 1) + indice[posicion + 1:]
+        indice = indice + (slice(None),) * (self.ndim - len(indice))
+
+        # Se lee la region que cubren los cortes y despues se aplican los pasos y los indices enteros
+        region, ajuste = [], []
+        for eje, i in enumerate(indice):
+            if isinstance(i, slice):
+                inicio, fin, paso = i.indices(self.shape[eje])
+                if paso < 0:
+                    raise IndexError("No se admiten cortes con paso negativo")
+                fin = max(fin, inicio)
+                region.append((inicio, fin))
+                ajuste.append(slice(None, None, paso))
+            else:
+                i = int(i) + (self.shape[eje] if int(i) < 0 else 0)
+                if not 0 <= i < self.shape[eje]:
+                    raise IndexError(f"Indice {i} fuera de rango en el eje {eje}")
+                region.append((i, i + 1))
+                ajuste.append(0)
+
+        (y0, y1), (x0, x1) = region
+        resultado = np.full((y1 - y0, x1 - x0), self.fill_value, dtype=self.dtype)
+        altoFragmento, anchoFragmento = self.chunks
+        for fila in range(y0 // altoFragmento, math.ceil(y1 / altoFragmento)):
+            for columna in range(x0 // anchoFragmento, math.ceil(x1 / anchoFragmento)):
+                fragmento = self.__fragmento(fila, columna)
+                if fragmento is None:
+                    continue
+                fy, fx = fila * altoFragmento, columna * anchoFragmento
+                ay0, ay1 = max(y0, fy), min(y1, fy + altoFragmento)
+                ax0, ax1 = max(x0, fx), min(x1, fx + anchoFragmento)
+                resultado[ay0 - y0:ay1 - y0, ax0 - x0:ax1 - x0] = fragmento[ay0 - fy:ay1 - fy, ax0 - fx:ax1 - fx]
+        return resultado[tuple(ajuste)]
+
+class AlmacenFragmentado:
+    """
+    Clase que guarda imagenes de etiquetas como piramides multiescala de arrays fragmentados, para que el visor muestre
+    cualquier nivel de zoom leyendo solo los fragmentos visibles.
+
+    Cada piramide es un grupo zarr con un array por nivel ('0' es la resolucion completa y cada nivel siguiente reduce
+    a la mitad tomando uno de cada dos pixeles, lo que conserva los valores de las etiquetas) y los niveles anotados en
+    .zattrs como en OME-Zarr.
+    """
+
+    @staticmethod
+    def escribirMultiescala(ruta: str, array: np.ndarray, fragmentos: Tuple[int, int] = FRAGMENTOS, tamañoMinimo: int = 512) -> List[ArrayFragmentado]:
+        """
+        Guarda una imagen de etiquetas como piramide multiescala.
+
+        Args:
+            ruta (str): Directorio de la piramide. No debe existir.
+            array (np.ndarray): La imagen de etiquetas.
+            fragmentos (tuple[int, int]): Altura y anchura de los fragmentos.
+            tamañoMinimo (int): Lado mayor a partir del cual se deja de reducir.
+
+        Returns:
+            list[ArrayFragmentado]: Los niveles guardados, de mayor a menor resolucion.
+        """
+        try:
+            os.makedirs(ruta)
+            with open(os.path.join(ruta, ".zgroup"), "w") as archivo:
+                json.dump({"zarr_format": 2}, archivo)
+            nivel, numero = np.asarray(array), 0
+            while True:
+                ArrayFragmentado.crear(os.path.join(ruta, str(numero)), nivel, fragmentos)
+                numero += 1
+                if max(nivel.shape) <= tamañoMinimo:
+                    break
+                nivel = nivel[::2, ::2]
+            with open(os.path.join(ruta, ".zattrs"), "w") as archivo:
+                json.dump({"multiscales": [{"version": "0.4", "datasets": [{"path": str(i)} for i in range(numero)]}]}, archivo)
+            return AlmacenFragmentado.abrirMultiescala(ruta)
+        except Exception:
+            if os.path.isdir(ruta):
+                shutil.rmtree(ruta, ignore_errors=True)
+            raise
+
+    @staticmethod
+    def abrirMultiescala(ruta: str) -> ArrayFragmentado:
+        """
+        Abre una piramide multiescala sin leer sus fragmentos.
+
+        Args:
+            ruta (str): Directorio de la piramide.
+
+        Returns:
+            ArrayFragmentado: El nivel de resolucion completa. Su atributo niveles contiene todos los niveles.
+        """
+        try:
+            with open(os.path.join(ruta, ".zattrs")) as archivo:
+                datasets = json.load(archivo)["multiscales"][0]["datasets"]
+            niveles = [ArrayFragmentado(os.path.join(ruta, dataset["path"])) for dataset in datasets]
+            niveles[0].niveles = niveles
+            return niveles[0]
+        except Exception:
+            raise
+
+    @staticmethod
+    def paraVisor(etiquetas: Union[np.ndarray, ArrayFragmentado]) -> Dict[str, any]:
+        """
+        Prepara una imagen de etiquetas para añadirla al visor. Las piramides guardadas se pasan como una imagen
+        multiescala de arrays de dask, que napari lee por fragmentos segun la zona y el zoom visibles.
+
+        Args:
+            etiquetas (np.ndarray o ArrayFragmentado): La imagen de etiquetas.
+
+        Returns:
+            dict: Argumentos data y multiscale para viewer.add_labels.
+        """
+        try:
+            if not isinstance(etiquetas, ArrayFragmentado):
+                return {"data": etiquetas, "multiscale": False}
+            import dask.array as da
+            niveles = [da.from_array(nivel, chunks=nivel.chunks, name=f"fragmentado-{os.path.abspath(nivel.ruta)}", asarray=False, fancy=False) for nivel in etiquetas.niveles]
+            return {"data": niveles if len(niveles) > 1 else niveles[0], "multiscale": len(niveles) > 1}
+        except Exception:
+            raise
@@ -0,0 +1,207 @@
+from typing import Union, List, Tuple, Dict
+from collections import OrderedDict
+import threading
+import tempfile
+import numpy as np
+
+# Memoria maxima, en MB, que ocupan por defecto los recortes de las mascaras de una segmentacion
+PRESUPUESTO_MASCARAS_MB = 512
+
+class AlmacenMascaras:
+    """
+    Clase que guarda las segmentaciones de las mascaras de una imagen con un presupuesto de memoria.
+
+    De cada mascara solo se guarda el recorte de su caja envolvente, en lugar de una imagen booleana del tamaño de la
+    imagen completa. Los recortes usados mas recientemente se mantienen en memoria mientras quepan en el presupuesto;
+    el resto se empaqueta a bits en un archivo temporal del disco local, proyectado en memoria, y se vuelve a leer
+    cuando se necesita. Asi una segmentacion con miles de rodaballos termina siempre con todos sus resultados y con un
+    uso de memoria predecible.
+
+    Argumentos:
+    dimensiones (tuple[int, int]): Altura y anchura de la imagen completa.
+    presupuestoMB (float): Memoria maxima de los recortes en memoria.
+    directorio (str o None): Directorio del archivo temporal. Por defecto el temporal del sistema.
+    """
+
+    def __init__(self, dimensiones: Tuple[int, int], presupuestoMB: float = PRESUPUESTO_MASCARAS_MB, directorio: Union[str, None] = None):
+
+        try:
+            self.dimensiones = tuple(dimensiones)
+            self.presupuesto = int(presupuestoMB * 2**20)
+            self.directorio = directorio
+            self.cajas = []                     # Indice -> (y0, x0, altura, anchura) del recorte en la imagen completa
+            self.enMemoria = OrderedDict()      # Indice -> recorte booleano, del menos al mas usado recientemente
+            self.enDisco = {}                   # Indice -> posicion en el archivo de los bits del recorte
+            self.bytesMemoria = 0
+            self.archivo = None
+            self.mapa = None
+            self.tamañoArchivo = 0
+            self.cerrojo = threading.Lock()
+        except Exception:
+            raise
+
+    def añadir(self, segmentacion: np.ndarray, desplazamiento: Tuple[int, int] = (0, 0)) -> int:
+        """
+        Añade la segmentacion de una mascara, guardando solo el recorte de su caja envolvente.
+
+        Args:
+            segmentacion (np.ndarray): Imagen booleana de la mascara, de la imagen completa o de un cuadrante.
+            desplazamiento (tuple[int, int]): Posicion (y, x) de la esquina de la segmentacion en la imagen completa.
+
+        Returns:
+            int: Indice de la mascara en el almacen.
+        """
+        try:
+            filas, columnas = np.flatnonzero(segmentacion.any(axis=1)), np.flatnonzero(segmentacion.any(axis=0))
+            if filas.size == 0:
+                y0 = x0 = 0
+                recorte = np.zeros((0, 0), dtype=bool)
+            else:
+                y0, x0 = int(filas[0]), int(columnas[0])
+                recorte = np.array(segmentacion[y0:filas[-1] + 1, x0:columnas[-1] + 1], dtype=bool)
+            with self.cerrojo:
+                indice = len(self.cajas)
+                self.cajas.append((y0 + desplazamiento[0], x0 + desplazamiento[1]) + recorte.shape)
+                self.enMemoria[indice] = recorte
+                self.bytesMemoria += recorte.nbytes
+                self.__desalojar()
+            return indice
+        except Exception:
+            raise
+
+    def añadirMascaras(self, mascaras: List[Dict[str, any]], desplazamiento: Tuple[int, int] = (0, 0)) -> List["MascaraAlmacenada"]:
+        """
+        Pasa una lista de mascaras de SAM al almacen. Las mascaras devueltas tienen las mismas propiedades y su
+        segmentacion, en coordenadas de la imagen completa, se reconstruye al consultarla.
+
+        Args:
+            mascaras (list[dict]): Mascaras de SAM.
+            desplazamiento (tuple[int, int]): Posicion (y, x) del cuadrante de las mascaras en la imagen completa.
+
+        Returns:
+            list[MascaraAlmacenada]: Las mascaras almacenadas.
+        """
+        try:
+            almacenadas = []
+            for mascara in mascaras:
+                propiedades = {clave: valor for clave, valor in mascara.items() if clave != "segmentation"}
+                almacenadas.append(MascaraAlmacenada(self, self.añadir(mascara["segmentation"], desplazamiento), propiedades))
+            return almacenadas
+        except Exception:
+            raise
+
+    def __desalojar(self) -> None:
+        """
+        Lleva al disco los recortes usados hace mas tiempo hasta que los que quedan en memoria caben en el presupuesto.
+        Se llama con el cerrojo adquirido.
+        """
+        while self.bytesMemoria > self.presupuesto and len(self.enMemoria) > 1:
+            indice, recorte = self.enMemoria.popitem(last=False)
+            self.bytesMemoria -= recorte.nbytes
+            if indice in self.enDisco:
+                continue
+            if self.archivo is None:
+                self.archivo = tempfile.TemporaryFile(prefix="mascaras-", dir=self.directorio)
+            datos = np.packbits(recorte, axis=None).tobytes()
+            self.archivo.seek(self.tamañoArchivo)
+            self.archivo.write(datos)
+            self.enDisco[indice] = self.tamañoArchivo
+            self.tamañoArchivo += len(datos)
+
+    def recorte(self, indice: int) -> Tuple[int, int, np.ndarray]:
+        """
+        Obtiene el recorte de una mascara, leyendolo del disco si no esta en memoria.
+
+        Args:
+            indice (int): Indice de la mascara.
+
+        Returns:
+            tuple: Fila y columna de la esquina del recorte en la imagen completa y el recorte booleano.
+        """
+        try:
+            with self.cerrojo:
+                y0, x0, altura, anchura = self.cajas[indice]
+                if indice in self.enMemoria:
+                    self.enMemoria.move_to_end(indice)
+                    return y0, x0, self.enMemoria[indice]
+
+                if self.mapa is None or self.mapa.size < self.tamañoArchivo:
+                    self.archivo.flush()
+                    self.mapa = np.memmap(self.archivo, dtype=np.uint8, mode="r", shape=(self.tamañoArchivo,))
+                inicio = self.enDisco[indice]
+                bits = altura * anchura
+                recorte = np.unpackbits(self.mapa[inicio:inicio + (bits + 7) // 8], count=bits).reshape(altura, anchura).astype(bool)
+                self.enMemoria[indice] = recorte
+                self.bytesMemoria += recorte.nbytes
+                self.__desalojar()
+                return y0, x0, recorte
+        except Exception:
+            raise
+
+    def segmentacion(self, indice: int) -> np.ndarray:
+        """
+        Reconstruye la segmentacion de una mascara con el tamaño de la imagen completa.
+
+        Args:
+            indice (int): Indice de la mascara.
+
+        Returns:
+            np.ndarray: Imagen booleana de la mascara.
+        """
+        try:
+            y0, x0, recorte = self.recorte(indice)
+            segmentacion = np.zeros(self.dimensiones, dtype=bool)
+            segmentacion[y0:y0 + recorte.shape[0], x0:x0 + recorte.shape[1]] = recorte
+            return segmentacion
+        except Exception:
+            raise
+
+    def cerrar(self) -> None:
+        with self.cerrojo:
+            self.mapa = None
+            self.enMemoria.clear()
+            self.bytesMemoria = 0
+            if self.archivo is not None:
+                self.archivo.close()
+                self.archivo = None
+
+class MascaraAlmacenada(dict):
+    """
+    Clase que representa una mascara de SAM cuya segmentacion esta en un AlmacenMascaras. Es un diccionario con las
+    propiedades de la mascara; la clave 'segmentation' no se guarda en el, sino que se reconstruye en cada consulta con
+    el tamaño de la imagen completa, por lo que el codigo que trabaja con mascaras de SAM funciona sin cambios.
+
+    Argumentos:
+    almacen (AlmacenMascaras): Almacen con la segmentacion.
+    indice (int): Indice de la mascara en el almacen.
+    propiedades (dict): Propiedades de la mascara sin la segmentacion.
+    """
+
+    def __init__(self, almacen: AlmacenMascaras, indice: int, propiedades: Dict[str, any]):
+        super().__init__(propiedades)
+        self.almacen = almacen
+        self.indice = indice
+
+    def __getitem__(self, clave: str) -> any:
+        if clave == "segmentation":
+            return self.almacen.segmentacion(self.indice)
+        return super().__getitem__(clave)
+
+    def __contains__(self, clave: object) -> bool:
+        return clave == "segmentation" or super().__contains__(clave)
+
+    def get(self, clave: str, defecto: any = None) -> any:
+        return self["segmentation"] if clave == "segmentation" else super().get(clave, defecto)
+
+    @property
+    def dimensiones(self) -> Tuple[int, int]:
+        return self.almacen.dimensiones
+
+    def recorte(self) -> Tuple[int, int, np.ndarray]:
+        """
+        Obtiene el recorte de la caja envolvente de la mascara sin reconstruir la imagen completa.
+
+        Returns:
+            tuple: Fila y columna de la esquina del recorte en la imagen completa y el recorte booleano.
+        """
+        return self.almacen.recorte(self.indice)
@@ -0,0 +1,343 @@
+from scripts.Utils import Utils
+from scripts.Configuraciones import Configuraciones, DIRECTORIO_CONFIGURACIONES
+from scripts.Dataset import Dataset, DIRECTORIO_IMAGENES
+from scripts.Evaluacion import Evaluacion, RADIO_DEFECTO
+from typing import Union, List, Tuple, Dict
+import argparse
+import copy
+import json
+import math
+import time
+import sys
+import os
+import numpy as np
+
+# Valores que puede tomar cada parametro en la busqueda. Los limites de postprocesamiento de tamaño son factores sobre
+# los de la configuracion de referencia del grupo, porque dependen de si la imagen tiene zoom
+ESPACIO_BUSQUEDA = {
+    "points_per_side": [16, 24, 32, 48, 64],
+    "points_per_batch": [32, 64, 128, 256],
+    "pred_iou_thresh": [0.80, 0.84, 0.88, 0.92],
+    "stability_score_thresh": [0.85, 0.90, 0.95],
+    "box_nms_thresh": [0.2, 0.3, 0.4, 0.5],
+    "numCuadrantes": [None, 4, 9, 16],
+    "factorMinSize": [0.5, 0.75, 1.0, 1.5, 2.0],
+    "factorMaxSize": [0.5, 1.0, 2.0],
+    "min_intensity": [0, 5, 10, 20],
+}
+
+class Autoajuste:
+    """
+    Clase que busca de forma automatica las configuraciones mas rapidas para cada error admisible sobre las imagenes
+    anotadas de un grupo (subconjunto con/sin zoom o camara).
+
+    Las configuraciones candidatas se evaluan por rondas de eliminacion sucesiva: todas empiezan con pocas imagenes y
+    solo las mejores pasan a la siguiente ronda, que añade mas imagenes. Se descartan antes de tiempo las que superan
+    con holgura el error admisible y las mucho mas lentas que la mejor configuracion admisible encontrada. Las salidas
+    del codificador se guardan en una CacheEmbeddings, de modo que cada imagen o cuadrante se codifica una unica vez
+    para todas las configuraciones; el tiempo de codificacion ahorrado se suma a la latencia de cada prueba para que
+    las latencias sean comparables.
+
+    El resultado es el frente de Pareto latencia/error, que se guarda como configuraciones con nombre en
+    configuraciones/autoajuste_<grupo>.json, donde las cargan Configuraciones, la interfaz y el benchmark.
+    """
+
+    def __init__(self, dataset: Dataset, objetivo: str = "conteo", presupuestoError: float = 10.0, radio: float = RADIO_DEFECTO,
+                 eta: int = 3, imagenesIniciales: int = 2, factorLento: float = 3.0, semilla: int = 0, capacidadCache: int = 64):
+        from scripts.TurbotSAM import TurbotSAM
+
+        try:
+            self.dataset = dataset
+            self.objetivo = objetivo
+            self.presupuestoError = presupuestoError
+            self.radio = radio
+            self.eta = eta
+            self.imagenesIniciales = imagenesIniciales
+            self.factorLento = factorLento
+            self.generador = np.random.default_rng(semilla)
+
+            referencia = Configuraciones.obtener("conZoom")
+            self.turbotSam = TurbotSAM(**referencia["parametros"])
+            self.cache = self.turbotSam.activarCacheEmbeddings(capacidadCache)
+            self.parametrosActuales = dict(referencia["parametros"])
+        except Exception:
+            raise
+
+    @staticmethod
+    def claveConfiguracion(configuracion: Dict[str, any]) -> str:
+        """
+        Obtiene una clave unica de una configuracion para detectar candidatas repetidas.
+
+        Args:
+            configuracion (dict): La configuracion.
+
+        Returns:
+            str: La clave.
+        """
+        return json.dumps({k: configuracion[k] for k in ("parametros", "numCuadrantes", "procesamiento", "paramsProcesamiento")}, sort_keys=True)
+
+    def muestrearConfiguraciones(self, referencia: Dict[str, any], numero: int) -> List[Dict[str, any]]:
+        """
+        Genera configuraciones candidatas al azar a partir de una configuracion de referencia, que se incluye siempre.
+
+        Args:
+            referencia (dict): Configuracion de referencia del grupo.
+            numero (int): Numero de configuraciones aleatorias.
+
+        Returns:
+            list[dict]: Configuraciones candidatas sin repetir.
+        """
+        try:
+            candidatas = {Autoajuste.claveConfiguracion(referencia): copy.deepcopy(referencia)}
+            intentos = 0
+            while len(candidatas) < numero + 1 and intentos < numero * 20:
+                intentos += 1
+                valores = {nombre: opciones[self.generador.integers(len(opciones))] for nombre, opciones in ESPACIO_BUSQUEDA.items()}
+                configuracion = copy.deepcopy(referencia)
+                for nombre in ("points_per_side", "points_per_batch", "pred_iou_thresh", "stability_score_thresh", "box_nms_thresh"):
+                    configuracion["parametros"][nombre] = valores[nombre]
+                configuracion["numCuadrantes"] = valores["numCuadrantes"]
+                configuracion["procesamiento"] = True
+                configuracion["paramsProcesamiento"] = {
+                    "min_size": max(1, int(round(referencia["paramsProcesamiento"]["min_size"] * valores["factorMinSize"]))),
+                    "max_size": round(referencia["paramsProcesamiento"]["max_size"] * valores["factorMaxSize"], 6),
+                    "min_intensity": valores["min_intensity"],
+                }
+                candidatas.setdefault(Autoajuste.claveConfiguracion(configuracion), configuracion)
+            return list(candidatas.values())
+        except Exception:
+            raise
+
+    def probar(self, configuracion: Dict[str, any], entrada: Dict[str, any], imagen: np.ndarray) -> Dict[str, any]:
+        """
+        Segmenta una imagen con una configuracion y mide la latencia y el error.
+
+        Args:
+            configuracion (dict): Configuracion a probar.
+            entrada (dict): Entrada del manifiesto de la imagen.
+            imagen (np.ndarray): La imagen en escala de grises ya cargada.
+
+        Returns:
+            dict: Latencia (incluido el tiempo de codificacion ahorrado por la cache), error de conteo y error de puntos.
+        """
+        from scripts.PipelineSegmentacion import PipelineSegmentacion
+
+        try:
+            if configuracion["parametros"] != self.parametrosActuales:
+                self.turbotSam.configurarGenerador(**configuracion["parametros"])
+                self.parametrosActuales = dict(configuracion["parametros"])
+
+            ahorradoAntes = self.cache.tiempoAhorrado
+            inicio = time.perf_counter()
+            resultados = PipelineSegmentacion.ejecutar(self.turbotSam, imagen, configuracion["numCuadrantes"], configuracion["procesamiento"], configuracion["paramsProcesamiento"])
+            latencia = time.perf_counter() - inicio + (self.cache.tiempoAhorrado - ahorradoAntes)
+
+            _, errorRelativo = Utils.calcularErrores(entrada["conteoReal"], resultados["numeroRodCalculado"])
+            medida = {"latencia": latencia, "errorConteo": errorRelativo, "errorPuntos": None}
+            puntosReales = self.dataset.puntosReales(entrada)
+            if puntosReales is not None:
+                centroides = resultados["listaPuntosProcesados"] if configuracion["procesamiento"] else resultados["listaPuntosGenerados"]
+                medida["errorPuntos"] = round((1 - Evaluacion.evaluar(centroides, puntosReales, self.radio)["f1"]) * 100, 2)
+            return medida
+        except Exception:
+            raise
+
+    def resumir(self, medidas: List[Dict[str, any]]) -> Dict[str, float]:
+        """
+        Resume las medidas de una configuracion en las imagenes evaluadas hasta el momento.
+
+        Args:
+            medidas (list[dict]): Medidas de cada imagen.
+
+        Returns:
+            dict: Latencia media, error de conteo medio, error de puntos medio y error usado como objetivo.
+        """
+        latencia = float(np.mean([m["latencia"] for m in medidas]))
+        errorConteo = float(np.mean([m["errorConteo"] for m in medidas]))
+        conPuntos = [m["errorPuntos"] for m in medidas if m["errorPuntos"] is not None]
+        errorPuntos = float(np.mean(conPuntos)) if conPuntos else None
+        error = errorPuntos if self.objetivo == "puntos" and errorPuntos is not None else errorConteo
+        return {"latencia": round(latencia, 4), "errorConteo": round(errorConteo, 2), "errorPuntos": round(errorPuntos, 2) if errorPuntos is not None else None, "error": round(error, 2), "imagenes": len(medidas)}
+
+    @staticmethod
+    def rangosPareto(puntos: List[Tuple[float, float]]) -> List[int]:
+        """
+        Calcula el rango de Pareto de cada punto (latencia, error), donde 0 es el frente no dominado.
+
+        Args:
+            puntos (list[tuple]): Pares (latencia, error), menores son mejores.
+
+        Returns:
+            list[int]: Rango de cada punto.
+        """
+        rangos = [None] * len(puntos)
+        restantes = set(range(len(puntos)))
+        rango = 0
+        while restantes:
+            frente = {i for i in restantes if not any(puntos[j][0] <= puntos[i][0] and puntos[j][1] <= puntos[i][1] and puntos[j] != puntos[i] for j in restantes)}
+            for i in frente:
+                rangos[i] = rango
+            restantes -= frente
+            rango += 1
+        return rangos
+
+    def ajustarGrupo(self, grupo: str, entradas: List[Dict[str, any]], referencia: Dict[str, any], numeroPruebas: int) -> Dict[str, any]:
+        """
+        Busca el frente de Pareto de un grupo de imagenes por eliminacion sucesiva.
+
+        Args:
+            grupo (str): Nombre del grupo.
+            entradas (list[dict]): Entradas del manifiesto del grupo.
+            referencia (dict): Configuracion de referencia del grupo.
+            numeroPruebas (int): Numero de configuraciones aleatorias candidatas.
+
+        Returns:
+            dict: Candidatas con sus medidas resumidas y ronda alcanzada, y el frente de Pareto final.
+        """
+        try:
+            orden = list(self.generador.permutation(len(entradas)))
+            entradas = [entradas[i] for i in orden]
+            candidatas = [{"configuracion": c, "medidas": [], "ronda": 0, "descartada": None} for c in self.muestrearConfiguraciones(referencia, numeroPruebas)]
+            vivas = list(candidatas)
+
+            numImagenes, ronda, evaluadas = min(self.imagenesIniciales, len(entradas)), 0, 0
+            while vivas:
+                # Las imagenes van en el bucle exterior para que sus embeddings se reutilicen en todas las candidatas
+                for entrada in entradas[evaluadas:numImagenes]:
+                    imagen = Utils.cargarImagen(entrada["ruta"])
+                    for candidata in vivas:
+                        candidata["medidas"].append(self.probar(candidata["configuracion"], entrada, imagen))
+                    self.cache.vaciar()
+                evaluadas = numImagenes
+
+                for candidata in vivas:
+                    candidata["resumen"] = self.resumir(candidata["medidas"])
+                    candidata["ronda"] = ronda
+                final = numImagenes >= len(entradas)
+                print(f"[INFO] {grupo} ronda {ronda}: {len(vivas)} configuraciones con {numImagenes} imagenes. Cache: {self.cache.aciertos} aciertos, {self.cache.fallos} fallos")
+                if final:
+                    break
+
+                # Poda por error (con holgura mientras hay pocas imagenes) y por lentitud respecto a la mejor admisible. La
+                # candidata de menor error no se poda nunca, para que siempre quede alguna aunque ninguna cumpla el error
+                holgura = 1 + 1 / (ronda + 1)
+                admisibles = [c["resumen"]["latencia"] for c in vivas if c["resumen"]["error"] <= self.presupuestoError]
+                limiteLatencia = min(admisibles) * self.factorLento if admisibles else math.inf
+                mejor = min(vivas, key=lambda c: (c["resumen"]["error"], c["resumen"]["latencia"]))
+                for candidata in vivas:
+                    if candidata is mejor:
+                        continue
+                    if candidata["resumen"]["error"] > self.presupuestoError * holgura * 2:
+                        candidata["descartada"] = "error"
+                    elif candidata["resumen"]["latencia"] > limiteLatencia:
+                        candidata["descartada"] = "lenta"
+                vivas = [c for c in vivas if c["descartada"] is None]
+
+                # Eliminacion sucesiva: pasan el frente de Pareto y las mejores por rango y latencia hasta 1/eta
+                rangos = Autoajuste.rangosPareto([(c["resumen"]["latencia"], c["resumen"]["error"]) for c in vivas])
+                ordenadas = sorted(zip(rangos, vivas), key=lambda x: (x[0], x[1]["resumen"]["latencia"]))
+                plazas = max(math.ceil(len(vivas) / self.eta), rangos.count(0))
+                for i, (_, candidata) in enumerate(ordenadas):
+                    if i >= plazas:
+                        candidata["descartada"] = "eliminacion"
+                vivas = [c for _, c in ordenadas[:plazas]]
+
+                numImagenes = min(len(entradas), numImagenes * self.eta)
+                ronda += 1
+
+            rangos = Autoajuste.rangosPareto([(c["resumen"]["latencia"], c["resumen"]["error"]) for c in vivas])
+            frente = sorted([c for c, r in zip(vivas, rangos) if r == 0], key=lambda c: c["resumen"]["latencia"])
+            return {"candidatas": candidatas, "frente": frente}
+        except Exception:
+            raise
+
+    def guardarPresets(self, grupo: str, frente: List[Dict[str, any]], directorio: str = DIRECTORIO_CONFIGURACIONES) -> str:
+        """
+        Guarda el frente de Pareto de un grupo como configuraciones con nombre. auto_<grupo> es la configuracion mas
+        rapida dentro del error admisible (o la de menor error si ninguna lo cumple) y auto_<grupo>_<i> cada punto del
+        frente ordenado de mas rapido a mas preciso.
+
+        Args:
+            grupo (str): Nombre del grupo.
+            frente (list[dict]): Candidatas del frente de Pareto ordenadas por latencia.
+            directorio (str): Directorio de configuraciones.
+
+        Returns:
+            str: Ruta del archivo guardado.
+        """
+        try:
+            if not frente:
+                raise ValueError(f"El frente de Pareto del grupo {grupo} esta vacio")
+            presets = {}
+            for i, candidata in enumerate(frente, start=1):
+                presets[f"auto_{grupo}_{i}"] = dict(candidata["configuracion"], metricas=candidata["resumen"])
+
+            admisibles = [c for c in frente if c["resumen"]["error"] <= self.presupuestoError]
+            elegida = admisibles[0] if admisibles else min(frente, key=lambda c: c["resumen"]["error"])
+            presets[f"auto_{grupo}"] = dict(elegida["configuracion"], metricas=elegida["resumen"])
+
+            os.makedirs(directorio, exist_ok=True)
+            ruta = os.path.join(directorio, f"autoajuste_{grupo}.json")
+            temporal = ruta + ".tmp"
+            with open(temporal, "w") as archivo:
+                json.dump(presets, archivo, indent=2)
+            os.replace(temporal, ruta)
+            return ruta
+        except Exception:
+            raise
+
+def obtenerGrupo(entrada: Dict[str, any], agrupar: str) -> str:
+    """
+    Obtiene el grupo de ajuste de una imagen.
+
+    Args:
+        entrada (dict): Entrada del manifiesto.
+        agrupar (str): 'conjunto' para agrupar por con/sin zoom o 'camara' para agrupar por linea y tanque.
+
+    Returns:
+        str: Nombre del grupo.
+    """
+    if agrupar == "camara" and entrada.get("linea") is not None:
+        return f"{entrada['conjunto']}_L{entrada['linea']:02d}T{entrada['tanque']:02d}"
+    return entrada["conjunto"]
+
+def main(argumentos: Union[List[str], None] = None) -> int:
+    parser = argparse.ArgumentParser(description="Busqueda automatica de configuraciones rapidas dentro de un error admisible.")
+    parser.add_argument("--directorio", default=DIRECTORIO_IMAGENES, help="Directorio del conjunto de imagenes.")
+    parser.add_argument("--agrupar", choices=("conjunto", "camara"), default="conjunto", help="Genera configuraciones por subconjunto con/sin zoom o por camara.")
+    parser.add_argument("--objetivo", choices=("conteo", "puntos"), default="conteo", help="Error a minimizar: relativo de conteo o 1-F1 de los centroides, en %%.")
+    parser.add_argument("--presupuesto", type=float, default=10.0, help="Error admisible en %%.")
+    parser.add_argument("--pruebas", type=int, default=32, help="Numero de configuraciones aleatorias por grupo.")
+    parser.add_argument("--eta", type=int, default=3, help="Factor de eliminacion entre rondas.")
+    parser.add_argument("--imagenes-iniciales", type=int, default=2, help="Imagenes de la primera ronda.")
+    parser.add_argument("--radio", type=float, default=RADIO_DEFECTO, help="Distancia maxima de emparejamiento de los centroides en pixeles.")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", default=DIRECTORIO_CONFIGURACIONES, help="Directorio donde se guardan las configuraciones.")
+    args = parser.parse_args(argumentos)
+
+    dataset = Dataset(args.directorio)
+    grupos = {}
+    for entrada in dataset.cargar():
+        grupos.setdefault(obtenerGrupo(entrada, args.agrupar), []).append(entrada)
+
+    autoajuste = Autoajuste(dataset, args.objetivo, args.presupuesto, args.radio, args.eta, args.imagenes_iniciales, semilla=args.semilla)
+    for grupo, entradas in grupos.items():
+        referencia = Configuraciones.obtener("conZoom" if entradas[0]["zoom"] else "sinZoom")
+        resultado = autoajuste.ajustarGrupo(grupo, entradas, referencia, args.pruebas)
+        if not resultado["frente"]:
+            print(f"[ERROR] {grupo}: ninguna configuracion ha llegado al final del ajuste")
+            continue
+        ruta = autoajuste.guardarPresets(grupo, resultado["frente"], args.salida)
+
+        print(f"[INFO] {grupo}: frente de Pareto guardado en {ruta}")
+        for candidata in resultado["frente"]:
+            resumen = candidata["resumen"]
+            print(f"    latencia {resumen['latencia']:.2f} s  error {resumen['error']:.2f} %  cuadrantes {candidata['configuracion']['numCuadrantes']}  points_per_side {candidata['configuracion']['parametros']['points_per_side']}")
+
+        os.makedirs("resultados_benchmark", exist_ok=True)
+        with open(os.path.join("resultados_benchmark", f"autoajuste_{grupo}_pruebas.json"), "w") as archivo:
+            json.dump([{k: v for k, v in c.items() if k != "medidas"} for c in resultado["candidatas"]], archivo, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+from scripts.Dataset import Dataset
+from typing import Union, List, Dict
+import argparse
+import datetime
+import threading
+import sqlite3
+import json
+import sys
+import os
+import numpy as np
+
+# Ruta por defecto de la base de datos de resultados
+RUTA_BASE_RESULTADOS = "resultados.sqlite"
+
+# Version del esquema, guardada en PRAGMA user_version
+VERSION_ESQUEMA = 1
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS ejecuciones (
+    id INTEGER PRIMARY KEY,
+    directorio TEXT NOT NULL UNIQUE,
+    configuracion TEXT NOT NULL,
+    parametros TEXT NOT NULL,
+    inicio TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS imagenes (
+    id INTEGER PRIMARY KEY,
+    ejecucion INTEGER NOT NULL REFERENCES ejecuciones(id) ON DELETE CASCADE,
+    ruta TEXT NOT NULL,
+    clave TEXT,
+    tanque TEXT,
+    linea INTEGER,
+    camara INTEGER,
+    fotograma INTEGER,
+    captura TEXT,
+    configuracion TEXT NOT NULL,
+    numCuadrantes INTEGER,
+    procesamiento INTEGER NOT NULL,
+    conteo INTEGER,
+    latencia REAL,
+    origen TEXT,
+    registro TEXT NOT NULL,
+    UNIQUE (ejecucion, ruta)
+);
+CREATE INDEX IF NOT EXISTS imagenesTanqueCaptura ON imagenes (tanque, captura);
+CREATE INDEX IF NOT EXISTS imagenesCaptura ON imagenes (captura);
+CREATE INDEX IF NOT EXISTS imagenesConfiguracion ON imagenes (configuracion, captura);
+CREATE TABLE IF NOT EXISTS mascaras (
+    imagen INTEGER NOT NULL REFERENCES imagenes(id) ON DELETE CASCADE,
+    mascara INTEGER NOT NULL,
+    cuadrante INTEGER,
+    area INTEGER,
+    bbox_x INTEGER, bbox_y INTEGER, bbox_w INTEGER, bbox_h INTEGER,
+    predicted_iou REAL,
+    stability_score REAL,
+    centroide_x INTEGER,
+    centroide_y INTEGER,
+    PRIMARY KEY (imagen, mascara)
+) WITHOUT ROWID;
+"""
+
+# Columnas de la tabla mascaras que se rellenan con la tabla de Exportaciones.tablaMascaras
+COLUMNAS_MASCARAS = ("cuadrante", "area", "bbox_x", "bbox_y", "bbox_w", "bbox_h", "predicted_iou", "stability_score", "centroide_x", "centroide_y")
+
+class BaseResultados:
+    """
+    Clase que guarda los resultados de las segmentaciones en una base de datos SQLite: cada ejecucion con su
+    configuracion, cada imagen con su tanque y fecha de captura (extraidos del nombre), su conteo y sus tiempos, y la
+    tabla de propiedades de sus mascaras.
+
+    Las imagenes estan indexadas por tanque y fecha de captura y por configuracion, de forma que la evolucion del
+    conteo de un tanque se obtiene con una consulta en lugar de recorrer los directorios de resultados. Una misma
+    conexion se comparte entre los hilos de exportacion y cada imagen se inserta en una unica transaccion.
+
+    Argumentos:
+    ruta (str): Ruta del archivo de la base de datos.
+    """
+
+    def __init__(self, ruta: str = RUTA_BASE_RESULTADOS):
+
+        try:
+            self.ruta = ruta
+            if os.path.dirname(ruta):
+                os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            self.cerrojo = threading.Lock()
+            self.conexion = sqlite3.connect(ruta, check_same_thread=False)
+            self.conexion.execute("PRAGMA journal_mode=WAL")
+            self.conexion.execute("PRAGMA synchronous=NORMAL")
+            self.conexion.execute("PRAGMA foreign_keys=ON")
+            with self.conexion:
+                self.conexion.executescript(ESQUEMA)
+                self.conexion.execute(f"PRAGMA user_version={VERSION_ESQUEMA}")
+        except Exception:
+            raise
+
+    def iniciarEjecucion(self, directorio: str, configuracion: Dict[str, any]) -> int:
+        """
+        Registra una ejecucion, o recupera la existente si el directorio de salida ya se uso, como al reanudar un lote.
+
+        Args:
+            directorio (str): Directorio de salida de la ejecucion, que la identifica.
+            configuracion (dict): Configuracion de la segmentacion, con su nombre en la clave 'nombre'.
+
+        Returns:
+            int: Identificador de la ejecucion.
+        """
+        try:
+            directorio = os.path.abspath(directorio)
+            with self.cerrojo, self.conexion:
+                self.conexion.execute(
+                    "INSERT OR IGNORE INTO ejecuciones (directorio, configuracion, parametros, inicio) VALUES (?, ?, ?, ?)",
+                    (directorio, configuracion.get("nombre", ""), json.dumps(configuracion, sort_keys=True), datetime.datetime.now().isoformat(timespec="seconds")),
+                )
+                return self.conexion.execute("SELECT id FROM ejecuciones WHERE directorio = ?", (directorio,)).fetchone()[0]
+        except Exception:
+            raise
+
+    def registrarImagen(self, ejecucion: int, ruta: str, configuracion: Dict[str, any], resultado: Dict[str, any], tabla: Union[Dict[str, np.ndarray], None] = None) -> int:
+        """
+        Inserta una imagen y todas sus mascaras en una transaccion. Si la imagen ya estaba registrada en la ejecucion
+        (por ejemplo, si el lote se interrumpio tras registrarla) se sustituye.
+
+        Args:
+            ejecucion (int): Identificador de la ejecucion.
+            ruta (str): Ruta de la imagen. El tanque y la fecha de captura se extraen de su nombre.
+            configuracion (dict): Configuracion de la segmentacion.
+            resultado (dict): Datos de la imagen terminada: clave, conteo, latencia y origen.
+            tabla (dict o None): Tabla de mascaras de Exportaciones.tablaMascaras.
+
+        Returns:
+            int: Identificador de la imagen.
+        """
+        try:
+            datos = Dataset.parsearNombre(ruta)
+            tanque = f"L{datos['linea']:02d}T{datos['tanque']:02d}" if datos else None
+            fila = (
+                ejecucion, ruta, resultado.get("clave"), tanque, datos.get("linea"), datos.get("camara"),
+                datos.get("fotograma"), datos.get("inicio"), configuracion.get("nombre", ""),
+                configuracion.get("numCuadrantes"), int(bool(configuracion.get("procesamiento"))),
+                resultado.get("conteo"), resultado.get("latencia"), resultado.get("origen"),
+                datetime.datetime.now().isoformat(timespec="seconds"),
+            )
+            with self.cerrojo, self.conexion:
+                self.conexion.execute("DELETE FROM imagenes WHERE ejecucion = ? AND ruta = ?", (ejecucion, ruta))
+                cursor = self.conexion.execute(
+                    "INSERT INTO imagenes (ejecucion, ruta, clave, tanque, linea, camara, fotograma, captura, configuracion, "
+                    "numCuadrantes, procesamiento, conteo, latencia, origen, registro) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    fila,
+                )
+                idImagen = cursor.lastrowid
+                if tabla is not None and len(tabla["mascara"]):
+                    columnas = [tabla["mascara"].tolist()] + [tabla[columna].tolist() for columna in COLUMNAS_MASCARAS]
+                    self.conexion.executemany(
+                        f"INSERT INTO mascaras (imagen, mascara, {', '.join(COLUMNAS_MASCARAS)}) VALUES (?, ?{', ?' * len(COLUMNAS_MASCARAS)})",
+                        ((idImagen,) + valores for valores in zip(*columnas)),
+                    )
+            return idImagen
+        except Exception:
+            raise
+
+    def conteos(self, tanque: str, desde: Union[str, None] = None, hasta: Union[str, None] = None, configuracion: Union[str, None] = None) -> List[Dict[str, any]]:
+        """
+        Obtiene la serie temporal de conteos de un tanque, ordenada por fecha de captura.
+
+        Args:
+            tanque (str): Codigo del tanque, por ejemplo L04T01.
+            desde (str o None): Fecha de captura minima (ISO 8601, incluida).
+            hasta (str o None): Fecha de captura maxima (ISO 8601, excluida).
+            configuracion (str o None): Nombre de la configuracion.
+
+        Returns:
+            list[dict]: Fecha de captura, conteo, ruta, configuracion y ejecucion de cada imagen.
+        """
+        try:
+            consulta = "SELECT captura, conteo, ruta, configuracion, ejecucion FROM imagenes WHERE tanque = ?"
+            parametros = [tanque]
+            if desde is not None:
+                consulta += " AND captura >= ?"
+                parametros.append(desde)
+            if hasta is not None:
+                consulta += " AND captura < ?"
+                parametros.append(hasta)
+            if configuracion is not None:
+                consulta += " AND configuracion = ?"
+                parametros.append(configuracion)
+            with self.cerrojo:
+                filas = self.conexion.execute(consulta + " ORDER BY captura", parametros).fetchall()
+            return [dict(zip(("captura", "conteo", "ruta", "configuracion", "ejecucion"), fila)) for fila in filas]
+        except Exception:
+            raise
+
+    def cerrar(self) -> None:
+        with self.cerrojo:
+            self.conexion.close()
+
+def main(argumentos: Union[List[str], None] = None) -> int:
+    parser = argparse.ArgumentParser(description="Consulta la evolucion del conteo de un tanque en la base de datos de resultados.")
+    parser.add_argument("tanque", help="Codigo del tanque, por ejemplo L04T01.")
+    parser.add_argument("--base-datos", default=RUTA_BASE_RESULTADOS, help="Ruta de la base de datos de resultados.")
+    parser.add_argument("--desde", default=None, help="Fecha de captura minima (AAAA-MM-DD).")
+    parser.add_argument("--hasta", default=None, help="Fecha de captura maxima, excluida (AAAA-MM-DD).")
+    parser.add_argument("--dias", type=int, default=None, help="Limita la consulta a los ultimos dias indicados.")
+    parser.add_argument("--configuracion", default=None, help="Solo los resultados de esta configuracion.")
+    args = parser.parse_args(argumentos)
+
+    if not os.path.exists(args.base_datos):
+        print(f"[ERROR] No existe la base de datos {args.base_datos}")
+        return 1
+
+    desde = args.desde
+    if args.dias is not None:
+        desde = (datetime.datetime.now() - datetime.timedelta(days=args.dias)).isoformat(timespec="seconds")
+    base = BaseResultados(args.base_datos)
+    try:
+        filas = base.conteos(args.tanque, desde, args.hasta, args.configuracion)
+    finally:
+        base.cerrar()
+
+    print("captura,conteo,configuracion,ruta")
+    for fila in filas:
+        print(f"{fila['captura']},{fila['conteo']},{fila['configuracion']},{fila['ruta']}")
+    print(f"[INFO] {len(filas)} imagenes del tanque {args.tanque}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,393 @@
+from scripts.Utils import Utils
+from scripts.Configuraciones import Configuraciones
+from scripts.Evaluacion import Evaluacion, RADIO_DEFECTO
+from scripts.Dataset import Dataset, DIRECTORIO_IMAGENES, CONJUNTOS
+from typing import Union, List, Dict
+import argparse
+import datetime
+import platform
+import subprocess
+import threading
+import json
+import time
+import sys
+import os
+import cv2
+import psutil
+import numpy as np
+
+class MonitorMemoria:
+    """
+    Contexto que mide el pico de memoria residente (RSS) del proceso mientras esta activo, muestreandolo desde un hilo
+    cada intervalo segundos. Funciona igual en Windows y en Linux.
+    """
+
+    def __init__(self, intervalo: float = 0.01):
+        self.intervalo = intervalo
+        self.proceso = psutil.Process()
+        self.pico = 0
+        self.detenido = threading.Event()
+        self.hilo = None
+
+    def __muestrear(self) -> None:
+        while not self.detenido.wait(self.intervalo):
+            self.pico = max(self.pico, self.proceso.memory_info().rss)
+
+    def __enter__(self):
+        self.pico = self.proceso.memory_info().rss
+        self.detenido.clear()
+        self.hilo = threading.Thread(target=self.__muestrear, daemon=True)
+        self.hilo.start()
+        return self
+
+    def __exit__(self, *excepcion):
+        self.detenido.set()
+        self.hilo.join()
+        self.pico = max(self.pico, self.proceso.memory_info().rss)
+        return False
+
+class Benchmark:
+    """
+    Clase que mide la velocidad, la memoria y el error de conteo del proceso de segmentacion sobre el conjunto de
+    imagenes incluido en el repositorio, sin interfaz grafica.
+
+    Uso:
+        python -m scripts.Benchmark --configuracion conZoom --conjunto conZoom
+        python -m scripts.Benchmark --comparar resultados_benchmark/antes.json resultados_benchmark/despues.json
+    """
+
+    @staticmethod
+    def obtenerEntorno() -> Dict[str, any]:
+        """
+        Obtiene los datos del entorno de ejecucion necesarios para interpretar los resultados: commit, plataforma y
+        versiones.
+
+        Args:
+            None
+
+        Returns:
+            dict: Datos del entorno.
+        """
+        entorno = {
+            "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+            "plataforma": platform.platform(),
+            "procesador": platform.processor(),
+            "cpus": os.cpu_count(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "commit": None,
+            "cambiosSinCommit": None,
+        }
+        try:
+            entorno["commit"] = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+            entorno["cambiosSinCommit"] = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True).stdout.strip())
+        except Exception:
+            pass
+        return entorno
+
+    @staticmethod
+    def medirImagen(turbotSam, imagen: Dict[str, any], configuracion: Dict[str, any], puntosReales: Union[np.ndarray, None] = None, radio: float = RADIO_DEFECTO) -> Dict[str, any]:
+        """
+        Procesa una imagen midiendo la latencia de carga y de segmentacion, el pico de memoria, el error de conteo y, si
+        la imagen tiene puntos anotados, la precision y el recall de los centroides.
+
+        Args:
+            turbotSam (TurbotSAM): Instancia de TurbotSAM configurada.
+            imagen (dict): Entrada del manifiesto del conjunto de imagenes.
+            configuracion (dict): Configuracion con la que se procesa.
+            puntosReales (np.ndarray o None): Puntos anotados de la imagen.
+            radio (float): Distancia maxima de emparejamiento de los centroides en pixeles.
+
+        Returns:
+            dict: Medidas de la imagen.
+        """
+        from scripts.PipelineSegmentacion import PipelineSegmentacion
+
+        try:
+            medida = dict(imagen)
+            with MonitorMemoria() as monitor:
+                inicio = time.perf_counter()
+                imagenGrises = Utils.cargarImagen(imagen["ruta"])
+                finCarga = time.perf_counter()
+                resultados = PipelineSegmentacion.ejecutar(turbotSam, imagenGrises, configuracion["numCuadrantes"], configuracion["procesamiento"], configuracion["paramsProcesamiento"])
+                fin = time.perf_counter()
+
+            conteoCalculado = resultados["numeroRodCalculado"]
+            errorAbsoluto, errorRelativo = Utils.calcularErrores(imagen["conteoReal"], conteoCalculado)
+            medida.update({
+                "conteoCalculado": conteoCalculado,
+                "numeroMascaras": len(resultados["listaMascaras"]),
+                "errorAbsoluto": errorAbsoluto,
+                "errorRelativo": errorRelativo,
+                "latenciaCarga": round(finCarga - inicio, 4),
+                "latenciaSegmentacion": round(fin - finCarga, 4),
+                "latencia": round(fin - inicio, 4),
+                "rssPicoMB": round(monitor.pico / 2**20, 1),
+            })
+
+            if puntosReales is not None:
+                centroides = resultados["listaPuntosProcesados"] if configuracion["procesamiento"] else resultados["listaPuntosGenerados"]
+                medida["evaluacion"] = Evaluacion.evaluar(centroides, puntosReales, radio, imagenGrises.shape[:2], configuracion["numCuadrantes"])
+            return medida
+        except Exception:
+            raise
+
+    @staticmethod
+    def agregar(medidas: List[Dict[str, any]], duracion: float) -> Dict[str, any]:
+        """
+        Calcula las medidas agregadas de un conjunto de imagenes.
+
+        Args:
+            medidas (list[dict]): Medidas de cada imagen procesada correctamente.
+            duracion (float): Tiempo total de reloj empleado en procesar las imagenes.
+
+        Returns:
+            dict: Medidas agregadas (latencias, rendimiento, memoria, error de conteo y metricas de los centroides).
+        """
+        try:
+            if not medidas:
+                return {"imagenes": 0}
+            latencias = np.array([m["latencia"] for m in medidas])
+            errores = np.array([m["conteoCalculado"] - m["conteoReal"] for m in medidas])
+            evaluaciones = [m["evaluacion"] for m in medidas if "evaluacion" in m]
+            agregado = {
+                "imagenes": len(medidas),
+                "latenciaMedia": round(float(latencias.mean()), 4),
+                "latenciaMediana": round(float(np.median(latencias)), 4),
+                "latenciaP95": round(float(np.percentile(latencias, 95)), 4),
+                "latenciaMaxima": round(float(latencias.max()), 4),
+                "latenciaSegmentacionMedia": round(float(np.mean([m["latenciaSegmentacion"] for m in medidas])), 4),
+                "rendimiento": round(len(medidas) / duracion, 4) if duracion > 0 else None,
+                "rssPicoMB": max(m["rssPicoMB"] for m in medidas),
+                "errorAbsolutoMedio": round(float(np.abs(errores).mean()), 2),
+                "errorRelativoMedio": round(float(np.mean([m["errorRelativo"] for m in medidas])), 2),
+                "sesgoMedio": round(float(errores.mean()), 2),
+            }
+            if evaluaciones:
+                evaluacion = Evaluacion.acumular(evaluaciones)
+                agregado.update({clave: evaluacion[clave] for clave in ("precision", "recall", "f1", "errorLocalizacionMedio")})
+            return agregado
+        except Exception:
+            raise
+
+    @staticmethod
+    def ejecutar(nombreConfiguracion: str, dataset: Dataset, imagenes: List[Dict[str, any]], calentamiento: bool = True, radio: float = RADIO_DEFECTO) -> Dict[str, any]:
+        """
+        Procesa todas las imagenes con una configuracion y devuelve las medidas por imagen, por subconjunto y globales.
+
+        Args:
+            nombreConfiguracion (str): Nombre de la configuracion o ruta de un archivo JSON con la configuracion.
+            dataset (Dataset): Conjunto de imagenes cargado, del que se leen los puntos anotados.
+            imagenes (list[dict]): Entradas del manifiesto a procesar.
+            calentamiento (bool): Indica si se procesa antes la primera imagen sin medirla, para que la inicializacion
+                del modelo y de CUDA no se cuente en la latencia.
+            radio (float): Distancia maxima de emparejamiento de los centroides en pixeles.
+
+        Returns:
+            dict: Resultados del benchmark.
+        """
+        from scripts.TurbotSAM import TurbotSAM
+        import torch
+
+        try:
+            configuracion = Configuraciones.obtener(nombreConfiguracion)
+            entorno = Benchmark.obtenerEntorno()
+            entorno["torch"] = torch.__version__
+
+            inicioModelo = time.perf_counter()
+            turbotSam = TurbotSAM(**configuracion["parametros"])
+            entorno["dispositivo"] = turbotSam.device
+            entorno["cargaModelo"] = round(time.perf_counter() - inicioModelo, 4)
+
+            if calentamiento and imagenes:
+                Benchmark.medirImagen(turbotSam, imagenes[0], configuracion, None, radio)
+
+            medidas, fallos = [], []
+            inicio = time.perf_counter()
+            for i, imagen in enumerate(imagenes):
+                try:
+                    medida = Benchmark.medirImagen(turbotSam, imagen, configuracion, dataset.puntosReales(imagen), radio)
+                    medidas.append(medida)
+                    print(f"[INFO] ({i + 1}/{len(imagenes)}) {imagen['ruta']}: {medida['conteoCalculado']}/{medida['conteoReal']} rodaballos, {medida['latencia']:.2f} s, {medida['rssPicoMB']:.0f} MB")
+                except Exception as e:
+                    fallos.append({"ruta": imagen["ruta"], "error": str(e)})
+                    print(f"[ERROR] ({i + 1}/{len(imagenes)}) {imagen['ruta']}: {str(e)}")
+            duracion = time.perf_counter() - inicio
+
+            porConjunto = {}
+            for conjunto in sorted(set(m["conjunto"] for m in medidas)):
+                delConjunto = [m for m in medidas if m["conjunto"] == conjunto]
+                porConjunto[conjunto] = Benchmark.agregar(delConjunto, sum(m["latencia"] for m in delConjunto))
+
+            return {
+                "configuracion": {"nombre": nombreConfiguracion, **configuracion},
+                "entorno": entorno,
+                "global": Benchmark.agregar(medidas, duracion),
+                "porConjunto": porConjunto,
+                "imagenes": medidas,
+                "fallos": fallos,
+            }
+        except Exception:
+            raise
+
+    @staticmethod
+    def guardar(resultados: Dict[str, any], ruta: str) -> None:
+        """
+        Guarda los resultados del benchmark en formato JSON.
+
+        Args:
+            resultados (dict): Resultados devueltos por ejecutar.
+            ruta (str): Ruta del archivo JSON.
+
+        Returns:
+            None
+        """
+        try:
+            directorio = os.path.dirname(ruta)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+            with open(ruta, "w") as archivo:
+                json.dump(resultados, archivo, indent=2)
+        except Exception:
+            raise
+
+    @staticmethod
+    def comparar(base: Dict[str, any], nuevo: Dict[str, any], umbral: float = 10.0) -> Dict[str, any]:
+        """
+        Compara dos resultados de benchmark (dos commits o dos configuraciones) y detecta regresiones de velocidad,
+        memoria o precision.
+
+        Args:
+            base (dict): Resultados de referencia.
+            nuevo (dict): Resultados a comparar.
+            umbral (float): Porcentaje de empeoramiento de latencia, rendimiento o memoria a partir del cual se considera
+                una regresion.
+
+        Returns:
+            dict: Diferencias agregadas, diferencias por imagen y lista de regresiones detectadas.
+        """
+        try:
+            # Metricas agregadas y si un valor mayor es peor
+            metricas = {
+                "latenciaMedia": True, "latenciaMediana": True, "latenciaP95": True, "rendimiento": False, "rssPicoMB": True,
+                "errorAbsolutoMedio": True, "errorRelativoMedio": True, "precision": False, "recall": False, "f1": False,
+                "errorLocalizacionMedio": True,
+            }
+            diferencias, regresiones = {}, []
+            for metrica, mayorEsPeor in metricas.items():
+                valorBase, valorNuevo = base["global"].get(metrica), nuevo["global"].get(metrica)
+                if valorBase is None or valorNuevo is None:
+                    continue
+                cambio = round((valorNuevo - valorBase) / valorBase * 100, 2) if valorBase else None
+                diferencias[metrica] = {"base": valorBase, "nuevo": valorNuevo, "diferencia": round(valorNuevo - valorBase, 4), "cambio": cambio}
+
+                empeora = (valorNuevo > valorBase) if mayorEsPeor else (valorNuevo < valorBase)
+                if metrica in ("errorAbsolutoMedio", "errorRelativoMedio", "precision", "recall", "f1"):
+                    # Cualquier empeoramiento del error de conteo o de las metricas de deteccion es una regresion de precision
+                    if empeora:
+                        regresiones.append(metrica)
+                elif empeora and cambio is not None and abs(cambio) > umbral:
+                    regresiones.append(metrica)
+
+            medidasBase = {m["ruta"]: m for m in base["imagenes"]}
+            porImagen = []
+            for medida in nuevo["imagenes"]:
+                anterior = medidasBase.get(medida["ruta"])
+                if anterior is None:
+                    continue
+                porImagen.append({
+                    "ruta": medida["ruta"],
+                    "conteoReal": medida["conteoReal"],
+                    "conteoBase": anterior["conteoCalculado"],
+                    "conteoNuevo": medida["conteoCalculado"],
+                    "latenciaBase": anterior["latencia"],
+                    "latenciaNueva": medida["latencia"],
+                })
+
+            return {"global": diferencias, "imagenes": porImagen, "regresiones": regresiones}
+        except Exception:
+            raise
+
+    @staticmethod
+    def formatearComparacion(comparacion: Dict[str, any]) -> str:
+        """
+        Genera una tabla de texto con la comparacion de dos resultados.
+
+        Args:
+            comparacion (dict): Resultado de comparar.
+
+        Returns:
+            str: La tabla de comparacion.
+        """
+        try:
+            lineas = [f"{'Metrica':<22}{'Base':>12}{'Nuevo':>12}{'Cambio [%]':>12}"]
+            for metrica, valores in comparacion["global"].items():
+                cambio = f"{valores['cambio']:+.2f}" if valores["cambio"] is not None else "-"
+                lineas.append(f"{metrica:<22}{valores['base']:>12}{valores['nuevo']:>12}{cambio:>12}")
+
+            cambiosConteo = [m for m in comparacion["imagenes"] if m["conteoBase"] != m["conteoNuevo"]]
+            if cambiosConteo:
+                lineas.append("")
+                lineas.append(f"{'Imagen':<70}{'Real':>8}{'Base':>8}{'Nuevo':>8}")
+                for m in cambiosConteo:
+                    lineas.append(f"{m['ruta']:<70}{m['conteoReal']:>8}{m['conteoBase']:>8}{m['conteoNuevo']:>8}")
+
+            lineas.append("")
+            lineas.append("Regresiones: " + (", ".join(comparacion["regresiones"]) if comparacion["regresiones"] else "ninguna"))
+            return "\n".join(lineas)
+        except Exception:
+            raise
+
+def main(argumentos: Union[List[str], None] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de TURBOT SAM sobre el conjunto de imagenes con conteo real.")
+    parser.add_argument("--configuracion", help=f"Nombre de la configuracion ({', '.join(Configuraciones.listar())}) o ruta de un JSON.")
+    parser.add_argument("--conjunto", choices=tuple(CONJUNTOS) + ("todos",), default=None, help="Subconjunto de imagenes. Por defecto el que coincide con la configuracion o todos.")
+    parser.add_argument("--directorio", default=DIRECTORIO_IMAGENES, help="Directorio del conjunto de imagenes.")
+    parser.add_argument("--reindexar", action="store_true", help="Vuelve a indexar todo el conjunto de imagenes ignorando el manifiesto.")
+    parser.add_argument("--limite", type=int, default=None, help="Numero maximo de imagenes a procesar.")
+    parser.add_argument("--radio", type=float, default=RADIO_DEFECTO, help="Distancia maxima de emparejamiento de los centroides en pixeles.")
+    parser.add_argument("--sin-calentamiento", action="store_true", help="No procesar la primera imagen antes de medir.")
+    parser.add_argument("--salida", default=None, help="Ruta del JSON de resultados.")
+    parser.add_argument("--comparar", nargs=2, metavar=("BASE", "NUEVO"), help="Compara dos JSON de resultados en lugar de ejecutar el benchmark.")
+    parser.add_argument("--umbral", type=float, default=10.0, help="Porcentaje de empeoramiento considerado regresion al comparar.")
+    args = parser.parse_args(argumentos)
+
+    if args.comparar:
+        with open(args.comparar[0], "r") as archivo:
+            base = json.load(archivo)
+        with open(args.comparar[1], "r") as archivo:
+            nuevo = json.load(archivo)
+        comparacion = Benchmark.comparar(base, nuevo, args.umbral)
+        print(Benchmark.formatearComparacion(comparacion))
+        return 1 if comparacion["regresiones"] else 0
+
+    if args.configuracion is None:
+        parser.error("se requiere --configuracion o --comparar")
+
+    conjunto = args.conjunto or (args.configuracion if args.configuracion in CONJUNTOS else "todos")
+    dataset = Dataset(args.directorio)
+    dataset.cargar(args.reindexar)
+    imagenes = dataset.entradas(None if conjunto == "todos" else [conjunto])
+    if args.limite is not None:
+        imagenes = imagenes[:args.limite]
+    if not imagenes:
+        print(f"[ERROR] No se han encontrado imagenes en {args.directorio}")
+        return 1
+
+    resultados = Benchmark.ejecutar(args.configuracion, dataset, imagenes, not args.sin_calentamiento, args.radio)
+    resultados["conjunto"] = conjunto
+
+    salida = args.salida
+    if salida is None:
+        nombre = os.path.splitext(os.path.basename(args.configuracion))[0]
+        commit = (resultados["entorno"]["commit"] or "sincommit")[:8]
+        salida = os.path.join("resultados_benchmark", f"{nombre}_{conjunto}_{commit}_{time.strftime('%Y%m%d%H%M%S')}.json")
+    Benchmark.guardar(resultados, salida)
+
+    print(json.dumps(resultados["global"], indent=2))
+    print(f"[INFO] Resultados guardados en {salida}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
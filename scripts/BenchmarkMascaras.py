@@ -0,0 +1,291 @@
+import matplotlib
+matplotlib.use("Agg")
+
+from scripts.ProcesarMascaras import ProcesarMascaras
+from scripts.MascarasSinteticas import GeneradorMascarasSinteticas
+from typing import Union, List, Tuple, Dict, Callable
+import matplotlib.pyplot as plt
+import argparse
+import tracemalloc
+import json
+import time
+import gc
+import sys
+import os
+import psutil
+import numpy as np
+
+# Funciones de ProcesarMascaras que se miden
+FUNCIONES = ("superponerMascaras", "mostrarLabels", "procesarMascaras", "calcularCentroides", "mostrarMascaras")
+
+# Pendiente log-log del tiempo frente al numero de mascaras a partir de la cual se avisa de un crecimiento superlineal
+PENDIENTE_AVISO = 1.3
+
+class BenchmarkMascaras:
+    """
+    Clase que mide el tiempo y el pico de memoria de las funciones de ProcesarMascaras con mascaras sinteticas, y
+    obtiene curvas de escalado frente al numero de mascaras, el tamaño de imagen y el numero de cuadrantes.
+
+    Uso:
+        python -m scripts.BenchmarkMascaras
+        python -m scripts.BenchmarkMascaras --mascaras 500 1000 2000 --dimensiones 960x1280 1920x2560 --grafica curvas.png
+    """
+
+    @staticmethod
+    def estimarMemoria(funcion: str, numMascaras: int, dimensiones: Tuple[int, int], numCuadrantes: int) -> int:
+        """
+        Estima los bytes necesarios para las entradas y la salida de una funcion, para omitir los casos que no caben en
+        memoria en lugar de llevar el equipo al intercambio.
+
+        Args:
+            funcion (str): Nombre de la funcion.
+            numMascaras (int): Numero de mascaras.
+            dimensiones (tuple): Dimensiones de la imagen (altura, anchura).
+            numCuadrantes (int): Numero de cuadrantes.
+
+        Returns:
+            int: Bytes estimados.
+        """
+        pixeles = dimensiones[0] * dimensiones[1]
+        porCuadrante = numMascaras * pixeles // numCuadrantes
+        completas = numMascaras * pixeles
+        if funcion == "superponerMascaras":
+            return porCuadrante + completas
+        if funcion == "mostrarLabels":
+            return porCuadrante + 2 * completas + 4 * pixeles
+        if funcion == "mostrarMascaras":
+            return porCuadrante + completas + 32 * pixeles
+        return porCuadrante + completas + 16 * pixeles
+
+    @staticmethod
+    def prepararEntradas(funcion: str, generador: GeneradorMascarasSinteticas, mascarasPorCuadrante: List[List[Dict[str, any]]]) -> Callable[[], tuple]:
+        """
+        Devuelve una funcion que construye los argumentos de cada llamada. Las entradas que no se modifican se crean una
+        unica vez; la imagen de etiquetas de procesarMascaras se crea de nuevo en cada llamada porque la funcion la modifica.
+
+        Args:
+            funcion (str): Nombre de la funcion.
+            generador (GeneradorMascarasSinteticas): Generador con las dimensiones y cuadrantes del caso.
+            mascarasPorCuadrante (list[list[dict]]): Mascaras sinteticas del caso.
+
+        Returns:
+            Callable: Funcion sin argumentos que devuelve la tupla de argumentos.
+        """
+        if funcion == "superponerMascaras":
+            argumentos = (mascarasPorCuadrante, generador.dimensiones)
+            return lambda: argumentos
+
+        mascaras = generador.aImagenCompleta(mascarasPorCuadrante)
+        if funcion != "procesarMascaras":
+            return lambda: (mascaras,)
+
+        temp = generador.generarImagen(mascarasPorCuadrante)
+        altura, anchura = generador.dimensiones
+        maxSize = 0.0015 * altura * anchura
+        return lambda: (np.zeros((altura, anchura), dtype=np.uint16), mascaras, temp, 100 * (altura / 1920) ** 2, maxSize, 10)
+
+    @staticmethod
+    def medir(funcion: str, numMascaras: int, dimensiones: Tuple[int, int], numCuadrantes: int, repeticiones: int = 3, presupuesto: Union[int, None] = None, semilla: int = 0) -> Dict[str, any]:
+        """
+        Mide una funcion de ProcesarMascaras para un caso concreto. El tiempo se mide sin tracemalloc en varias
+        repeticiones y el pico de memoria en una llamada adicional con tracemalloc.
+
+        Args:
+            funcion (str): Nombre de la funcion.
+            numMascaras (int): Numero de mascaras.
+            dimensiones (tuple): Dimensiones de la imagen (altura, anchura).
+            numCuadrantes (int): Numero de cuadrantes.
+            repeticiones (int): Numero de llamadas cronometradas.
+            presupuesto (int o None): Bytes maximos que puede ocupar el caso. Si la estimacion lo supera se omite.
+            semilla (int): Semilla del generador de mascaras.
+
+        Returns:
+            dict: Medida del caso con los tiempos en segundos y el pico en MB, o el motivo por el que se ha omitido.
+        """
+        medida = {"funcion": funcion, "numMascaras": numMascaras, "dimensiones": list(dimensiones), "numCuadrantes": numCuadrantes}
+        try:
+            estimacion = BenchmarkMascaras.estimarMemoria(funcion, numMascaras, dimensiones, numCuadrantes)
+            medida["memoriaEstimadaMB"] = round(estimacion / 2**20, 1)
+            if presupuesto is not None and estimacion > presupuesto:
+                medida["omitido"] = f"memoria estimada {estimacion / 2**30:.1f} GB por encima del presupuesto {presupuesto / 2**30:.1f} GB"
+                return medida
+
+            generador = GeneradorMascarasSinteticas(dimensiones, numCuadrantes, semilla)
+            mascarasPorCuadrante = generador.generarPorCuadrante(numMascaras)
+            argumentos = BenchmarkMascaras.prepararEntradas(funcion, generador, mascarasPorCuadrante)
+            metodo = getattr(ProcesarMascaras, funcion)
+
+            tiempos = []
+            for _ in range(repeticiones):
+                args = argumentos()
+                gc.collect()
+                inicio = time.perf_counter()
+                resultado = metodo(*args)
+                tiempos.append(time.perf_counter() - inicio)
+                del resultado, args
+                plt.close("all")
+
+            args = argumentos()
+            gc.collect()
+            tracemalloc.start()
+            try:
+                resultado = metodo(*args)
+                _, pico = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            del resultado, args
+            plt.close("all")
+
+            medida.update({
+                "tiempoMediana": round(float(np.median(tiempos)), 5),
+                "tiempoMinimo": round(float(min(tiempos)), 5),
+                "picoMB": round(pico / 2**20, 1),
+            })
+            return medida
+        except MemoryError as e:
+            medida["omitido"] = f"MemoryError: {str(e)}"
+            return medida
+        except Exception:
+            raise
+
+    @staticmethod
+    def pendiente(medidas: List[Dict[str, any]], eje: str) -> Union[float, None]:
+        """
+        Calcula la pendiente de la recta log-log del tiempo frente a un eje. Una pendiente cercana a 1 indica
+        crecimiento lineal y cercana a 2 crecimiento cuadratico.
+
+        Args:
+            medidas (list[dict]): Medidas de una misma funcion en las que solo varia el eje.
+            eje (str): 'numMascaras', 'pixeles' o 'numCuadrantes'.
+
+        Returns:
+            float o None: La pendiente, o None si hay menos de dos medidas validas.
+        """
+        validas = [m for m in medidas if "tiempoMediana" in m and m["tiempoMediana"] > 0]
+        if len(validas) < 2:
+            return None
+        x = np.log([m["dimensiones"][0] * m["dimensiones"][1] if eje == "pixeles" else m[eje] for m in validas])
+        y = np.log([m["tiempoMediana"] for m in validas])
+        if np.ptp(x) == 0:
+            return None
+        return round(float(np.polyfit(x, y, 1)[0]), 3)
+
+    @staticmethod
+    def ejecutar(funciones: List[str], listaMascaras: List[int], listaDimensiones: List[Tuple[int, int]], listaCuadrantes: List[int], repeticiones: int = 3, presupuesto: Union[int, None] = None) -> Dict[str, any]:
+        """
+        Obtiene las curvas de escalado de cada funcion:
+        - frente al numero de mascaras, con la mayor resolucion y el numero de cuadrantes intermedio,
+        - frente al tamaño de imagen, con el menor numero de mascaras,
+        - frente al numero de cuadrantes (solo superponerMascaras), con el menor numero de mascaras y la mayor resolucion.
+
+        Args:
+            funciones (list[str]): Funciones a medir.
+            listaMascaras (list[int]): Numeros de mascaras.
+            listaDimensiones (list[tuple]): Dimensiones de imagen (altura, anchura).
+            listaCuadrantes (list[int]): Numeros de cuadrantes.
+            repeticiones (int): Numero de llamadas cronometradas por caso.
+            presupuesto (int o None): Bytes maximos que puede ocupar un caso.
+
+        Returns:
+            dict: Medidas de cada curva, pendientes de escalado y avisos de crecimiento superlineal.
+        """
+        try:
+            dimensionesMayor = max(listaDimensiones, key=lambda d: d[0] * d[1])
+            cuadrantesReferencia = sorted(listaCuadrantes)[len(listaCuadrantes) // 2]
+            mascarasReferencia = min(listaMascaras)
+
+            curvas, pendientes, avisos = {}, {}, []
+            for funcion in funciones:
+                casos = {
+                    "numMascaras": [(n, dimensionesMayor, cuadrantesReferencia) for n in sorted(listaMascaras)],
+                    "pixeles": [(mascarasReferencia, d, cuadrantesReferencia) for d in sorted(listaDimensiones, key=lambda d: d[0] * d[1])],
+                }
+                if funcion == "superponerMascaras":
+                    casos["numCuadrantes"] = [(mascarasReferencia, dimensionesMayor, c) for c in sorted(listaCuadrantes)]
+
+                curvas[funcion], pendientes[funcion] = {}, {}
+                for eje, lista in casos.items():
+                    medidas = []
+                    for numMascaras, dimensiones, numCuadrantes in lista:
+                        medida = BenchmarkMascaras.medir(funcion, numMascaras, dimensiones, numCuadrantes, repeticiones, presupuesto)
+                        medidas.append(medida)
+                        if "omitido" in medida:
+                            print(f"[WARNING] {funcion} {numMascaras} mascaras {dimensiones[0]}x{dimensiones[1]} {numCuadrantes} cuadrantes: omitido ({medida['omitido']})")
+                        else:
+                            print(f"[INFO] {funcion} {numMascaras} mascaras {dimensiones[0]}x{dimensiones[1]} {numCuadrantes} cuadrantes: {medida['tiempoMediana']:.4f} s, {medida['picoMB']:.1f} MB")
+                    curvas[funcion][eje] = medidas
+                    pendientes[funcion][eje] = BenchmarkMascaras.pendiente(medidas, eje)
+
+                pendienteMascaras = pendientes[funcion]["numMascaras"]
+                if pendienteMascaras is not None and pendienteMascaras > PENDIENTE_AVISO:
+                    avisos.append(f"{funcion}: el tiempo crece con exponente {pendienteMascaras} respecto al numero de mascaras")
+
+            return {"curvas": curvas, "pendientes": pendientes, "avisos": avisos}
+        except Exception:
+            raise
+
+    @staticmethod
+    def graficar(resultados: Dict[str, any], ruta: str) -> None:
+        """
+        Dibuja las curvas de escalado en escala logaritmica y las guarda como imagen.
+
+        Args:
+            resultados (dict): Resultados devueltos por ejecutar.
+            ruta (str): Ruta de la imagen.
+
+        Returns:
+            None
+        """
+        try:
+            ejes = ("numMascaras", "pixeles", "numCuadrantes")
+            fig, axs = plt.subplots(1, len(ejes), figsize=(6 * len(ejes), 5))
+            for ax, eje in zip(axs, ejes):
+                for funcion, curvas in resultados["curvas"].items():
+                    validas = [m for m in curvas.get(eje, []) if "tiempoMediana" in m]
+                    if not validas:
+                        continue
+                    x = [m["dimensiones"][0] * m["dimensiones"][1] if eje == "pixeles" else m[eje] for m in validas]
+                    ax.loglog(x, [m["tiempoMediana"] for m in validas], marker="o", label=funcion)
+                ax.set_xlabel(eje)
+                ax.set_ylabel("Tiempo [s]")
+                ax.grid(True, which="both", alpha=0.3)
+                ax.legend(fontsize=8)
+            fig.tight_layout()
+            fig.savefig(ruta)
+            plt.close(fig)
+        except Exception:
+            raise
+
+def main(argumentos: Union[List[str], None] = None) -> int:
+    parser = argparse.ArgumentParser(description="Micro benchmark de ProcesarMascaras con mascaras sinteticas.")
+    parser.add_argument("--funciones", nargs="+", choices=FUNCIONES, default=list(FUNCIONES))
+    parser.add_argument("--mascaras", nargs="+", type=int, default=[500, 1000, 2000, 4000, 8000])
+    parser.add_argument("--dimensiones", nargs="+", default=["480x640", "960x1280", "1920x2560"], help="Dimensiones ALTOxANCHO.")
+    parser.add_argument("--cuadrantes", nargs="+", type=int, default=[4, 9, 16, 36])
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--presupuesto", type=float, default=None, help="GB maximos por caso. Por defecto la mitad de la memoria disponible.")
+    parser.add_argument("--salida", default=os.path.join("resultados_benchmark", "mascaras.json"))
+    parser.add_argument("--grafica", default=None, help="Ruta de la imagen con las curvas de escalado.")
+    args = parser.parse_args(argumentos)
+
+    dimensiones = [tuple(int(v) for v in d.lower().split("x")) for d in args.dimensiones]
+    presupuesto = int(args.presupuesto * 2**30) if args.presupuesto is not None else psutil.virtual_memory().available // 2
+
+    resultados = BenchmarkMascaras.ejecutar(args.funciones, args.mascaras, dimensiones, args.cuadrantes, args.repeticiones, presupuesto)
+
+    directorio = os.path.dirname(args.salida)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+    with open(args.salida, "w") as archivo:
+        json.dump(resultados, archivo, indent=2)
+    if args.grafica:
+        BenchmarkMascaras.graficar(resultados, args.grafica)
+
+    print(json.dumps(resultados["pendientes"], indent=2))
+    for aviso in resultados["avisos"]:
+        print(f"[WARNING] {aviso}")
+    print(f"[INFO] Resultados guardados en {args.salida}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
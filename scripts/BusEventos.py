@@ -0,0 +1,166 @@
+from qtpy.QtCore import QObject, QTimer, Signal, Slot, Qt
+from qtpy.QtWidgets import QTextEdit
+from typing import Union, List
+from collections import deque
+import threading
+import time
+
+# Colores con los que se muestra cada nivel de mensaje en el cuadro de salida
+COLORES_NIVEL = {"INFO": "green", "WARNING": "yellow", "ERROR": "red"}
+
+class Evento:
+    """
+    Clase que representa un evento estructurado del proceso de segmentacion.
+
+    Argumentos:
+    nivel (str): Nivel del mensaje ('INFO', 'WARNING' o 'ERROR').
+    mensaje (str o None): Texto a mostrar en el cuadro de salida. Si es None el evento solo actualiza el progreso.
+    etapa (str o None): Etapa del proceso que genera el evento (generacion, superposicion, etiquetas, centroides, postprocesamiento...).
+    cuadrante (int o None): Cuadrante procesado, si procede.
+    porcentaje (float o None): Porcentaje de progreso alcanzado.
+    tiempo (float o None): Segundos transcurridos desde el inicio del trabajo.
+    idTrabajo (int o None): Identificador del trabajo que genera el evento.
+    """
+
+    def __init__(self, nivel: str, mensaje: Union[str, None] = None, etapa: Union[str, None] = None, cuadrante: Union[int, None] = None,
+                 porcentaje: Union[float, None] = None, tiempo: Union[float, None] = None, idTrabajo: Union[int, None] = None):
+        self.nivel = nivel
+        self.mensaje = mensaje
+        self.etapa = etapa
+        self.cuadrante = cuadrante
+        self.porcentaje = porcentaje
+        self.tiempo = tiempo
+        self.idTrabajo = idTrabajo
+
+    def html(self, porcentajeActual: float) -> str:
+        """
+        Genera la linea HTML con la que se muestra el evento en el cuadro de salida. Los mensajes informativos de un
+        trabajo de segmentacion incluyen el progreso y el tiempo transcurrido.
+
+        Args:
+            porcentajeActual (float): Porcentaje de progreso en el momento del evento.
+
+        Returns:
+            str: La linea HTML del evento.
+        """
+        linea = f"<span style='color: {COLORES_NIVEL.get(self.nivel, 'red')};'>[{self.nivel}]</span> {self.mensaje}"
+        if self.nivel == "INFO" and self.idTrabajo is not None:
+            linea += f" Progreso: {porcentajeActual:.2f}%"
+            if self.tiempo is not None:
+                linea += f" ({self.tiempo:.1f} s)"
+        return linea
+
+class BusEventos(QObject):
+    """
+    Clase que recibe eventos de progreso desde cualquier hilo y los entrega agrupados en el hilo de la interfaz.
+
+    Publicar un evento solo añade el evento a un buffer acotado protegido por un cerrojo. La primera publicacion tras
+    un vaciado emite una señal, que Qt entrega en el hilo de la interfaz, y esta programa un unico vaciado como mucho
+    cada intervaloMs milisegundos. En cada vaciado las lineas pendientes se entregan juntas y los porcentajes de
+    progreso se reducen al ultimo valor recibido.
+    """
+
+    lineasPublicadas = Signal(list)       # Lineas HTML pendientes, entregadas juntas en cada vaciado
+    progresoActualizado = Signal(float)   # Ultimo porcentaje de progreso recibido
+    vaciadoSolicitado = Signal()
+
+    def __init__(self, intervaloMs: int = 100, capacidad: int = 1000):
+        super().__init__()
+
+        self.intervaloMs = intervaloMs
+        self.cerrojo = threading.Lock()
+        self.pendientes = deque(maxlen=capacidad)   # Si se llena, se descartan las lineas mas antiguas
+        self.porcentaje = 0.0
+        self.porcentajePendiente = None
+        self.vaciadoProgramado = False
+        self.ultimoVaciado = 0.0
+
+        self.vaciadoSolicitado.connect(self.__programarVaciado, Qt.QueuedConnection)
+
+    def publicar(self, evento: Evento) -> None:
+        """
+        Publica un evento. Puede llamarse desde cualquier hilo.
+
+        Args:
+            evento (Evento): El evento a publicar.
+
+        Returns:
+            None
+        """
+        with self.cerrojo:
+            if evento.porcentaje is not None:
+                self.porcentaje = evento.porcentaje
+                self.porcentajePendiente = evento.porcentaje
+            if evento.mensaje is not None:
+                self.pendientes.append(evento.html(self.porcentaje))
+            if self.vaciadoProgramado:
+                return
+            self.vaciadoProgramado = True
+        self.vaciadoSolicitado.emit()
+
+    @Slot()
+    def __programarVaciado(self) -> None:
+        """
+        Programa el siguiente vaciado respetando el intervalo minimo entre vaciados. Se ejecuta en el hilo de la interfaz.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        espera = self.intervaloMs - (time.monotonic() - self.ultimoVaciado) * 1000
+        QTimer.singleShot(max(0, int(espera)), self.__vaciar)
+
+    @Slot()
+    def __vaciar(self) -> None:
+        """
+        Entrega las lineas y el progreso acumulados. Se ejecuta en el hilo de la interfaz.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self.cerrojo:
+            lineas = list(self.pendientes)
+            self.pendientes.clear()
+            porcentaje = self.porcentajePendiente
+            self.porcentajePendiente = None
+            self.vaciadoProgramado = False
+            self.ultimoVaciado = time.monotonic()
+
+        if lineas:
+            self.lineasPublicadas.emit(lineas)
+        if porcentaje is not None:
+            self.progresoActualizado.emit(porcentaje)
+
+class CuadroSalida(QTextEdit):
+    """
+    Cuadro de texto para los logs con un numero maximo de lineas. Al superarlo se eliminan las lineas
+    mas antiguas, de modo que el coste de añadir lineas no crece con la duracion de la sesion.
+    """
+
+    def __init__(self, capacidad: int = 2000):
+        super().__init__()
+
+        self.document().setMaximumBlockCount(capacidad)
+
+    @Slot(list)
+    def agregarLineas(self, lineas: List[str]) -> None:
+        """
+        Añade varias lineas HTML repintando el cuadro una unica vez.
+
+        Args:
+            lineas (list[str]): Las lineas a añadir.
+
+        Returns:
+            None
+        """
+        self.setUpdatesEnabled(False)
+        try:
+            for linea in lineas:
+                self.append(linea)
+        finally:
+            self.setUpdatesEnabled(True)
@@ -0,0 +1,342 @@
+from scripts.Configuraciones import RUTA_CHECKPOINT
+from scripts.AlmacenFragmentado import AlmacenFragmentado
+from typing import Union, List, Dict
+from collections import OrderedDict
+import hashlib
+import threading
+import shutil
+import json
+import glob
+import time
+import os
+import numpy as np
+
+# Directorio por defecto de la cache de resultados
+DIRECTORIO_CACHE = os.path.join("cache", "resultados")
+
+# Segundos sin modificarse a partir de los cuales una entrada temporal se considera de una escritura interrumpida. Las
+# mas recientes pueden ser escrituras en curso de otro proceso que comparte el directorio de la cache
+ANTIGUEDAD_TEMPORALES = 3600
+
+# Version del formato de las entradas. Forma parte de la clave, por lo que un cambio de formato invalida las anteriores
+VERSION_CACHE = 4
+
+# Numero de huellas de archivos que se mantienen en memoria para no volver a leer los archivos ya vistos
+HUELLAS_EN_MEMORIA = 4096
+
+# Archivo de cada entrada con los centroides, la tabla de propiedades de las mascaras y el conteo
+ARCHIVO_TABLA = "tabla.npz"
+
+# Claves de los resultados de la segmentacion que son imagenes de etiquetas
+CLAVES_IMAGENES = ("mascarasGeneradas", "mascarasProcesadas")
+
+# Claves de los resultados que son listas de mascaras y listas de centroides
+CLAVES_LISTAS_MASCARAS = ("listaMascaras", "listaMascarasProcesadas")
+CLAVES_LISTAS_PUNTOS = ("listaPuntosGenerados", "listaPuntosProcesados")
+
+# Claves de los resultados con las propiedades de cada centroide (un array por propiedad)
+CLAVES_PROPIEDADES_PUNTOS = ("puntosGenerados", "puntosProcesados")
+
+class CacheResultados:
+    """
+    Clase que guarda en disco los resultados de la segmentacion indexados por el contenido de la imagen, todos los
+    parametros de SAM y de postprocesamiento y la huella del checkpoint del modelo.
+
+    Cada entrada es un directorio con un archivo .npz comprimido con los centroides y sus propiedades y la tabla de
+    propiedades de las mascaras (sin la segmentacion), y una piramide de fragmentos comprimidos por cada imagen de
+    etiquetas. Al recuperar una entrada las imagenes no se leen: se devuelven como arrays fragmentados que el visor y
+    las exportaciones leen bajo demanda, por lo que recuperar una segmentacion de miles de rodaballos es inmediato.
+
+    Al recuperar una entrada se actualiza su fecha de modificacion y, cuando el tamaño total supera el limite, se
+    eliminan las entradas usadas hace mas tiempo.
+    """
+
+    _huellasArchivos = OrderedDict()
+    _cerrojoHuellas = threading.Lock()
+
+    def __init__(self, directorio: str = DIRECTORIO_CACHE, limiteMB: float = 2048, rutaCheckpoint: str = RUTA_CHECKPOINT):
+
+        try:
+            self.directorio = directorio
+            self.limite = int(limiteMB * 2**20)
+            self.rutaCheckpoint = rutaCheckpoint
+            self.cerrojo = threading.Lock()
+            os.makedirs(directorio, exist_ok=True)
+
+            # Entradas temporales de escrituras interrumpidas y entradas de la version anterior, que ya no se usan
+            ahora = time.time()
+            temporales = []
+            for temporal in glob.glob(os.path.join(directorio, "*.tmp")):
+                try:
+                    if ahora - os.path.getmtime(temporal) > ANTIGUEDAD_TEMPORALES:
+                        temporales.append(temporal)
+                except FileNotFoundError:
+                    continue
+            for obsoleta in temporales + glob.glob(os.path.join(directorio, "*.npz")):
+                if os.path.isdir(obsoleta):
+                    shutil.rmtree(obsoleta, ignore_errors=True)
+                else:
+                    try:
+                        os.remove(obsoleta)
+                    except FileNotFoundError:
+                        pass
+        except Exception:
+            raise
+
+    @staticmethod
+    def huellaImagen(imagen: np.ndarray) -> str:
+        """
+        Calcula la huella del contenido de una imagen, incluida su forma y su tipo.
+
+        Args:
+            imagen (np.ndarray): La imagen.
+
+        Returns:
+            str: Huella SHA-256 en hexadecimal.
+        """
+        try:
+            huella = hashlib.sha256(f"{imagen.shape}-{imagen.dtype.str}".encode())
+            huella.update(np.ascontiguousarray(imagen).data)
+            return huella.hexdigest()
+        except Exception:
+            raise
+
+    @staticmethod
+    def huellaArchivo(ruta: str) -> str:
+        """
+        Calcula la huella SHA-256 de un archivo. Las ultimas huellas calculadas se recuerdan por ruta, tamaño y fecha de
+        modificacion para no volver a leer el archivo en cada consulta.
+
+        Args:
+            ruta (str): Ruta del archivo.
+
+        Returns:
+            str: Huella en hexadecimal, o 'sin-checkpoint' si el archivo no existe.
+        """
+        try:
+            if not os.path.isfile(ruta):
+                return "sin-checkpoint"
+            estado = os.stat(ruta)
+            identificador = (os.path.abspath(ruta), estado.st_size, estado.st_mtime_ns)
+            with CacheResultados._cerrojoHuellas:
+                if identificador in CacheResultados._huellasArchivos:
+                    CacheResultados._huellasArchivos.move_to_end(identificador)
+                    return CacheResultados._huellasArchivos[identificador]
+            huella = hashlib.sha256()
+            with open(ruta, "rb") as archivo:
+                for bloque in iter(lambda: archivo.read(2**20), b""):
+                    huella.update(bloque)
+            with CacheResultados._cerrojoHuellas:
+                CacheResultados._huellasArchivos[identificador] = huella.hexdigest()
+                if len(CacheResultados._huellasArchivos) > HUELLAS_EN_MEMORIA:
+                    CacheResultados._huellasArchivos.popitem(last=False)
+            return huella.hexdigest()
+        except Exception:
+            raise
+
+    def clave(self, huellaImagen: str, parametros: Dict[str, Union[int, float]], numCuadrantes: Union[int, None], procesamiento: bool, paramsProcesamiento: Dict[str, Union[int, float]], secuencia: bool = False) -> str:
+        """
+        Calcula la clave de una segmentacion.
+
+        Args:
+            huellaImagen (str): Huella de la imagen obtenida con huellaImagen.
+            parametros (dict): Parametros de segmentacion de SAM.
+            numCuadrantes (int o None): Numero de cuadrantes.
+            procesamiento (bool): Indica si se realiza el postprocesamiento.
+            paramsProcesamiento (dict): Parametros de postprocesamiento.
+            secuencia (bool): Indica si la imagen se segmenta a partir de la anterior de su secuencia, con lo que sus
+                resultados no coinciden con los de la cuadricula completa.
+
+        Returns:
+            str: Clave SHA-256 en hexadecimal.
+        """
+        try:
+            # Los valores numericos se normalizan para que 1 y 1.0 den la misma clave
+            descripcion = {
+                "version": VERSION_CACHE,
+                "imagen": huellaImagen,
+                "checkpoint": CacheResultados.huellaArchivo(self.rutaCheckpoint),
+                "parametros": {k: float(v) for k, v in parametros.items()},
+                "numCuadrantes": numCuadrantes,
+                "procesamiento": bool(procesamiento),
+                "paramsProcesamiento": {k: float(v) for k, v in paramsProcesamiento.items()} if procesamiento else None,
+            }
+            # Las claves sin secuencia no cambian respecto a las ya guardadas
+            if secuencia:
+                descripcion["secuencia"] = True
+            return hashlib.sha256(json.dumps(descripcion, sort_keys=True).encode()).hexdigest()
+        except Exception:
+            raise
+
+    def __ruta(self, clave: str) -> str:
+        return os.path.join(self.directorio, clave)
+
+    def obtener(self, clave: str) -> Union[Dict[str, any], None]:
+        """
+        Recupera los resultados de una segmentacion.
+
+        Args:
+            clave (str): Clave de la segmentacion.
+
+        Returns:
+            dict o None: Resultados con las mismas claves que PipelineSegmentacion.ejecutar (las mascaras sin su
+            segmentacion y las imagenes como ArrayFragmentado), o None si no estan en la cache.
+        """
+        try:
+            ruta = self.__ruta(clave)
+            try:
+                with np.load(os.path.join(ruta, ARCHIVO_TABLA), allow_pickle=False) as datos:
+                    resultados = CacheResultados.decodificar({nombre: datos[nombre] for nombre in datos.files})
+                for nombre in CLAVES_IMAGENES:
+                    if os.path.isdir(os.path.join(ruta, nombre)):
+                        resultados[nombre] = AlmacenFragmentado.abrirMultiescala(os.path.join(ruta, nombre))
+            except FileNotFoundError:
+                return None
+            os.utime(ruta)
+            return resultados
+        except Exception:
+            raise
+
+    def guardar(self, clave: str, resultados: Dict[str, any]) -> None:
+        """
+        Guarda los resultados de una segmentacion de forma atomica y aplica el limite de tamaño.
+
+        Args:
+            clave (str): Clave de la segmentacion.
+            resultados (dict): Resultados de PipelineSegmentacion.ejecutar.
+
+        Returns:
+            None
+        """
+        try:
+            ruta = self.__ruta(clave)
+            temporal = ruta + f".{os.getpid()}.{threading.get_ident()}.tmp"
+            os.makedirs(temporal)
+            try:
+                with open(os.path.join(temporal, ARCHIVO_TABLA), "wb") as archivo:
+                    np.savez_compressed(archivo, **CacheResultados.codificar(resultados))
+                for nombre in CLAVES_IMAGENES:
+                    if resultados.get(nombre) is not None:
+                        AlmacenFragmentado.escribirMultiescala(os.path.join(temporal, nombre), resultados[nombre])
+                if os.path.isdir(ruta):
+                    shutil.rmtree(ruta, ignore_errors=True)
+                os.replace(temporal, ruta)
+            except OSError:
+                # Otra escritura de la misma entrada ha terminado antes; su contenido es el mismo
+                shutil.rmtree(temporal, ignore_errors=True)
+                if not os.path.isdir(ruta):
+                    raise
+            self.desalojar()
+        except Exception:
+            raise
+
+    def guardarEnSegundoPlano(self, clave: str, resultados: Dict[str, any]) -> threading.Thread:
+        """
+        Copia los resultados y los guarda desde un hilo, para no bloquear la interfaz mientras se comprimen.
+
+        Args:
+            clave (str): Clave de la segmentacion.
+            resultados (dict): Resultados de PipelineSegmentacion.ejecutar.
+
+        Returns:
+            threading.Thread: El hilo que realiza la escritura.
+        """
+        try:
+            copia = {k: (np.array(v) if isinstance(v, np.ndarray) else v) for k, v in resultados.items()}
+            hilo = threading.Thread(target=self.guardar, args=(clave, copia), daemon=True)
+            hilo.start()
+            return hilo
+        except Exception:
+            raise
+
+    def desalojar(self) -> None:
+        """
+        Elimina las entradas usadas hace mas tiempo hasta que el tamaño total no supera el limite.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        try:
+            with self.cerrojo:
+                entradas = []
+                for elemento in os.scandir(self.directorio):
+                    if elemento.is_dir() and not elemento.name.endswith(".tmp"):
+                        tamaño = sum(os.path.getsize(os.path.join(raiz, archivo)) for raiz, _, archivos in os.walk(elemento.path) for archivo in archivos)
+                        entradas.append((elemento.stat().st_mtime_ns, tamaño, elemento.path))
+                total = sum(tamaño for _, tamaño, _ in entradas)
+                for _, tamaño, ruta in sorted(entradas):
+                    if total <= self.limite:
+                        break
+                    shutil.rmtree(ruta, ignore_errors=True)
+                    total -= tamaño
+        except Exception:
+            raise
+
+    @staticmethod
+    def codificar(resultados: Dict[str, any]) -> Dict[str, np.ndarray]:
+        """
+        Convierte los resultados, salvo las imagenes, en arrays para guardarlos en un .npz. Las listas de mascaras se
+        guardan como tabla por columnas (una columna por propiedad) y se omite la segmentacion.
+
+        Args:
+            resultados (dict): Resultados de PipelineSegmentacion.ejecutar.
+
+        Returns:
+            dict: Arrays con nombre.
+        """
+        try:
+            arrays = {"numeroRodCalculado": np.array(-1 if resultados["numeroRodCalculado"] is None else resultados["numeroRodCalculado"])}
+            for clave in CLAVES_LISTAS_PUNTOS:
+                if resultados.get(clave) is not None:
+                    arrays[clave] = np.asarray(resultados[clave], dtype=np.int64).reshape(-1, 2)
+            for clave in CLAVES_PROPIEDADES_PUNTOS:
+                for propiedad, valores in (resultados.get(clave) or {}).items():
+                    arrays[f"{clave}__{propiedad}"] = np.asarray(valores)
+            for clave in CLAVES_LISTAS_MASCARAS:
+                mascaras = resultados.get(clave)
+                if mascaras is None:
+                    continue
+                arrays[f"{clave}__n"] = np.array(len(mascaras))
+                # Solo las propiedades presentes en todas las mascaras, para que cada columna sea un array homogeneo
+                columnas = [k for k in (mascaras[0] if mascaras else {}) if k != "segmentation" and all(k in mascara for mascara in mascaras)]
+                for columna in columnas:
+                    arrays[f"{clave}__{columna}"] = np.asarray([mascara[columna] for mascara in mascaras])
+            return arrays
+        except Exception:
+            raise
+
+    @staticmethod
+    def decodificar(arrays: Dict[str, np.ndarray]) -> Dict[str, any]:
+        """
+        Reconstruye los resultados a partir de los arrays guardados por codificar.
+
+        Args:
+            arrays (dict): Arrays con nombre.
+
+        Returns:
+            dict: Resultados con las mismas claves que PipelineSegmentacion.ejecutar. Las imagenes, que se guardan
+            aparte, quedan a None.
+        """
+        try:
+            numeroRod = int(arrays["numeroRodCalculado"])
+            resultados = {"numeroRodCalculado": numeroRod if numeroRod >= 0 else None, "perfil": None}
+            for clave in CLAVES_IMAGENES:
+                resultados[clave] = None
+            for clave in CLAVES_LISTAS_PUNTOS:
+                resultados[clave] = arrays[clave] if clave in arrays else None
+            for claveLista, clave in zip(CLAVES_LISTAS_PUNTOS, CLAVES_PROPIEDADES_PUNTOS):
+                prefijo = f"{clave}__"
+                resultados[clave] = {nombre[len(prefijo):]: arrays[nombre] for nombre in arrays if nombre.startswith(prefijo)} if claveLista in arrays else None
+            for clave in CLAVES_LISTAS_MASCARAS:
+                if f"{clave}__n" not in arrays:
+                    resultados[clave] = None
+                    continue
+                prefijo = f"{clave}__"
+                columnas = {nombre[len(prefijo):]: arrays[nombre].tolist() for nombre in arrays if nombre.startswith(prefijo) and nombre != f"{clave}__n"}
+                resultados[clave] = [{columna: valores[i] for columna, valores in columnas.items()} for i in range(int(arrays[f"{clave}__n"]))]
+            return resultados
+        except Exception:
+            raise
@@ -0,0 +1,132 @@
+from typing import List, Dict
+import copy
+import glob
+import json
+import os
+
+# Checkpoint del modelo MobileSAM
+RUTA_CHECKPOINT = "models/mobile_sam.pt"
+
+# Directorio con configuraciones adicionales en formato JSON (por ejemplo las generadas automaticamente)
+DIRECTORIO_CONFIGURACIONES = "configuraciones"
+
+class Configuraciones:
+    """
+    Clase que contiene las configuraciones con nombre (parametros de SAM, cuadrantes y postprocesamiento) que
+    comparten la interfaz y los procesos sin interfaz.
+
+    Cada configuracion es un diccionario con las claves:
+    parametros (dict): Parametros de segmentacion de SAM.
+    numCuadrantes (int o None): Numero de cuadrantes o None para procesar la imagen completa.
+    procesamiento (bool): Indica si se realiza el postprocesamiento.
+    paramsProcesamiento (dict): Parametros de postprocesamiento (min_size, max_size, min_intensity).
+    """
+
+    PRESETS = {
+        "conZoom": {
+            "parametros": {
+                "points_per_side": 64,
+                "points_per_batch": 64,
+                "pred_iou_thresh": 0.88,
+                "stability_score_thresh": 0.95,
+                "stability_score_offset": 1,
+                "box_nms_thresh": 0.2,
+                "crop_n_layers": 0,
+                "crop_nms_thresh": 0.3,
+                "crop_overlap_ratio": 0.5,
+                "crop_n_points_downscale_factor": 2,
+                "min_mask_region_area": 0,
+            },
+            "numCuadrantes": None,
+            "procesamiento": True,
+            "paramsProcesamiento": {
+                "min_size": 100,
+                "max_size": 0.0015,
+                "min_intensity": 10,
+            },
+        },
+        "sinZoom": {
+            "parametros": {
+                "points_per_side": 64,
+                "points_per_batch": 64,
+                "pred_iou_thresh": 0.88,
+                "stability_score_thresh": 0.95,
+                "stability_score_offset": 1,
+                "box_nms_thresh": 0.2,
+                "crop_n_layers": 0,
+                "crop_nms_thresh": 0.3,
+                "crop_overlap_ratio": 0.5,
+                "crop_n_points_downscale_factor": 2,
+                "min_mask_region_area": 0,
+            },
+            "numCuadrantes": None,
+            "procesamiento": True,
+            "paramsProcesamiento": {
+                "min_size": 50,
+                "max_size": 0.0005,
+                "min_intensity": 10,
+            },
+        },
+    }
+
+    @staticmethod
+    def cargarArchivos(directorio: str = DIRECTORIO_CONFIGURACIONES) -> Dict[str, Dict[str, any]]:
+        """
+        Carga las configuraciones guardadas en los archivos JSON de un directorio. Cada archivo contiene un diccionario
+        con el nombre de cada configuracion y su contenido.
+
+        Args:
+            directorio (str): Directorio con los archivos JSON.
+
+        Returns:
+            dict: Configuraciones cargadas por nombre.
+        """
+        try:
+            configuraciones = {}
+            for ruta in sorted(glob.glob(os.path.join(directorio, "*.json"))):
+                with open(ruta, "r") as archivo:
+                    configuraciones.update(json.load(archivo))
+            return configuraciones
+        except Exception:
+            raise
+
+    @staticmethod
+    def listar() -> List[str]:
+        """
+        Obtiene los nombres de todas las configuraciones disponibles.
+
+        Args:
+            None
+
+        Returns:
+            list[str]: Nombres de las configuraciones predefinidas y de las guardadas en archivos.
+        """
+        try:
+            return list(Configuraciones.PRESETS) + [nombre for nombre in Configuraciones.cargarArchivos() if nombre not in Configuraciones.PRESETS]
+        except Exception:
+            raise
+
+    @staticmethod
+    def obtener(nombre: str) -> Dict[str, any]:
+        """
+        Obtiene una copia de una configuracion a partir de su nombre o de la ruta de un archivo JSON con una unica
+        configuracion.
+
+        Args:
+            nombre (str): Nombre de la configuracion o ruta del archivo JSON.
+
+        Returns:
+            dict: La configuracion solicitada.
+        """
+        try:
+            if nombre.endswith(".json") and os.path.isfile(nombre):
+                with open(nombre, "r") as archivo:
+                    return json.load(archivo)
+            if nombre in Configuraciones.PRESETS:
+                return copy.deepcopy(Configuraciones.PRESETS[nombre])
+            configuraciones = Configuraciones.cargarArchivos()
+            if nombre in configuraciones:
+                return configuraciones[nombre]
+            raise KeyError(f"No existe la configuración '{nombre}'. Configuraciones disponibles: {', '.join(Configuraciones.listar())}")
+        except Exception:
+            raise
@@ -0,0 +1,222 @@
+from scripts.Evaluacion import Evaluacion, ARCHIVO_PUNTOS_EXPORTADOS
+from typing import Union, List, Dict
+import datetime
+import json
+import re
+import os
+import imagesize
+import numpy as np
+
+# Directorio del conjunto de imagenes incluido en el repositorio. Cada carpeta tiene como nombre el numero real de rodaballos
+DIRECTORIO_IMAGENES = "imagenes"
+
+# Subconjuntos del conjunto de imagenes y si sus imagenes tienen zoom
+CONJUNTOS = {"conZoom": True, "sinZoom": False}
+
+# Nombre del manifiesto dentro del directorio del conjunto de imagenes
+NOMBRE_MANIFIESTO = ".manifiesto.json"
+
+# Version del formato del manifiesto. Si cambia, el manifiesto guardado se regenera completo
+VERSION_MANIFIESTO = 1
+
+# Archivos generados a partir de la segmentacion
+ARCHIVO_IMAGEN_PUNTOS = "ImagenPuntos.jpg"
+ARCHIVO_HISTOGRAMA = "Histograma.png"
+
+# Nombres de captura: L<linea>T<tanque>-<inicio>-<fin>[_<camara>]_<fotograma>[_c][_Manual]
+PATRON_NOMBRE = re.compile(r"^L(?P<linea>\d+)T(?P<tanque>\d+)-(?P<inicio>\d{14})-(?P<fin>\d{14})(?:_(?P<camara>\d+))?_(?P<fotograma>\d+)(?P<resto>_.*)?$")
+
+class Dataset:
+    """
+    Clase que indexa el conjunto de imagenes una unica vez y guarda el resultado en un manifiesto JSON.
+
+    Para cada imagen se registran su subconjunto, si tiene zoom, su numero real de rodaballos, sus dimensiones, los datos
+    extraidos de su nombre (linea, tanque, camara, fotograma y fechas de inicio y fin de la captura) y la ubicacion de
+    su anotacion y de los archivos derivados. Las siguientes cargas solo vuelven a recorrer las carpetas cuya fecha de
+    modificacion ha cambiado. Los puntos anotados se leen bajo demanda y se mantienen en memoria.
+    """
+
+    def __init__(self, directorio: str = DIRECTORIO_IMAGENES, rutaManifiesto: Union[str, None] = None):
+        self.directorio = directorio
+        self.rutaManifiesto = rutaManifiesto or os.path.join(directorio, NOMBRE_MANIFIESTO)
+        self.carpetas = {}
+        self.puntos = {}
+
+    @staticmethod
+    def parsearNombre(nombre: str) -> Dict[str, any]:
+        """
+        Extrae los datos de captura del nombre de un archivo, por ejemplo L04T07-20230222120450-20230222120950_2_300_c.jpg.
+
+        Args:
+            nombre (str): Nombre del archivo, con o sin extension.
+
+        Returns:
+            dict: linea, tanque, camara, fotograma, inicio y fin (ISO 8601), o un diccionario vacio si el nombre no sigue
+            el patron.
+        """
+        try:
+            coincidencia = PATRON_NOMBRE.match(os.path.splitext(os.path.basename(nombre))[0])
+            if coincidencia is None:
+                return {}
+            return {
+                "linea": int(coincidencia["linea"]),
+                "tanque": int(coincidencia["tanque"]),
+                "camara": int(coincidencia["camara"]) if coincidencia["camara"] is not None else None,
+                "fotograma": int(coincidencia["fotograma"]),
+                "inicio": datetime.datetime.strptime(coincidencia["inicio"], "%Y%m%d%H%M%S").isoformat(),
+                "fin": datetime.datetime.strptime(coincidencia["fin"], "%Y%m%d%H%M%S").isoformat(),
+            }
+        except Exception:
+            raise
+
+    @staticmethod
+    def clasificarArchivo(nombre: str) -> str:
+        """
+        Clasifica un archivo de una carpeta del conjunto de imagenes.
+
+        Args:
+            nombre (str): Nombre del archivo.
+
+        Returns:
+            str: 'imagen', 'imagenManual', 'anotacionCSV', 'anotacionMAT', 'puntosExportados', 'imagenPuntos',
+            'histograma' u 'otro'.
+        """
+        minusculas = nombre.lower()
+        if nombre == ARCHIVO_PUNTOS_EXPORTADOS:
+            return "puntosExportados"
+        if nombre == ARCHIVO_IMAGEN_PUNTOS:
+            return "imagenPuntos"
+        if nombre == ARCHIVO_HISTOGRAMA:
+            return "histograma"
+        if minusculas.endswith("_manual.jpg"):
+            return "imagenManual"
+        if minusculas.endswith((".jpg", ".jpeg", ".png", ".tif", ".tiff")):
+            return "imagen"
+        if minusculas.endswith(".csv"):
+            return "anotacionCSV"
+        if minusculas.endswith("_c.mat"):
+            return "anotacionMAT"
+        return "otro"
+
+    def __indexarCarpeta(self, carpeta: str, conjunto: str) -> List[Dict[str, any]]:
+        """
+        Indexa las imagenes de una carpeta del conjunto de imagenes.
+
+        Args:
+            carpeta (str): Ruta de la carpeta.
+            conjunto (str): Subconjunto al que pertenece.
+
+        Returns:
+            list[dict]: Entradas del manifiesto de las imagenes de la carpeta.
+        """
+        archivos = {}
+        for elemento in sorted(os.scandir(carpeta), key=lambda e: e.name):
+            if elemento.is_file():
+                archivos.setdefault(Dataset.clasificarArchivo(elemento.name), []).append(elemento.path.replace(os.sep, "/"))
+
+        # El CSV de puntos anotados tiene prioridad sobre el .mat, como en Evaluacion.buscarAnotacion
+        anotacion, tipoAnotacion = None, None
+        if archivos.get("anotacionCSV"):
+            anotacion, tipoAnotacion = archivos["anotacionCSV"][0], "csv"
+        elif archivos.get("anotacionMAT"):
+            anotacion, tipoAnotacion = archivos["anotacionMAT"][0], "mat"
+
+        entradas = []
+        for ruta in archivos.get("imagen", []):
+            anchura, altura = imagesize.get(ruta)
+            entrada = {
+                "ruta": ruta,
+                "conjunto": conjunto,
+                "zoom": CONJUNTOS[conjunto],
+                "conteoReal": int(os.path.basename(carpeta)),
+                "anchura": anchura,
+                "altura": altura,
+                "anotacion": anotacion,
+                "tipoAnotacion": tipoAnotacion,
+                "imagenManual": (archivos.get("imagenManual") or [None])[0],
+                "puntosExportados": (archivos.get("puntosExportados") or [None])[0],
+                "imagenPuntos": (archivos.get("imagenPuntos") or [None])[0],
+                "histograma": (archivos.get("histograma") or [None])[0],
+            }
+            entrada.update(Dataset.parsearNombre(ruta))
+            entradas.append(entrada)
+        return entradas
+
+    def cargar(self, forzar: bool = False) -> List[Dict[str, any]]:
+        """
+        Carga el manifiesto, reindexando solo las carpetas nuevas o modificadas, y lo guarda si ha cambiado.
+
+        Args:
+            forzar (bool): Indica si se reindexan todas las carpetas.
+
+        Returns:
+            list[dict]: Entradas del manifiesto ordenadas por subconjunto y numero de rodaballos.
+        """
+        try:
+            guardadas = {}
+            if not forzar and os.path.isfile(self.rutaManifiesto):
+                with open(self.rutaManifiesto, "r") as archivo:
+                    manifiesto = json.load(archivo)
+                if manifiesto.get("version") == VERSION_MANIFIESTO:
+                    guardadas = manifiesto["carpetas"]
+
+            carpetas, cambios = {}, forzar
+            for conjunto in CONJUNTOS:
+                directorioConjunto = os.path.join(self.directorio, conjunto)
+                if not os.path.isdir(directorioConjunto):
+                    continue
+                for elemento in os.scandir(directorioConjunto):
+                    if not elemento.is_dir() or not elemento.name.isdigit():
+                        continue
+                    clave = f"{conjunto}/{elemento.name}"
+                    modificacion = elemento.stat().st_mtime_ns
+                    guardada = guardadas.get(clave)
+                    if guardada is not None and guardada["modificacion"] == modificacion:
+                        carpetas[clave] = guardada
+                    else:
+                        carpetas[clave] = {"modificacion": modificacion, "entradas": self.__indexarCarpeta(elemento.path, conjunto)}
+                        cambios = True
+            cambios = cambios or set(carpetas) != set(guardadas)
+
+            if cambios:
+                temporal = self.rutaManifiesto + ".tmp"
+                with open(temporal, "w") as archivo:
+                    json.dump({"version": VERSION_MANIFIESTO, "carpetas": carpetas}, archivo)
+                os.replace(temporal, self.rutaManifiesto)
+
+            self.carpetas = carpetas
+            return self.entradas()
+        except Exception:
+            raise
+
+    def entradas(self, conjuntos: Union[List[str], None] = None) -> List[Dict[str, any]]:
+        """
+        Obtiene las entradas del manifiesto cargado.
+
+        Args:
+            conjuntos (list[str] o None): Subconjuntos a incluir. Si es None se incluyen todos.
+
+        Returns:
+            list[dict]: Entradas ordenadas por subconjunto y numero de rodaballos.
+        """
+        claves = sorted(self.carpetas, key=lambda c: (list(CONJUNTOS).index(c.split("/")[0]), int(c.split("/")[1])))
+        return [entrada for clave in claves for entrada in self.carpetas[clave]["entradas"] if conjuntos is None or entrada["conjunto"] in conjuntos]
+
+    def puntosReales(self, entrada: Dict[str, any]) -> Union[np.ndarray, None]:
+        """
+        Obtiene los puntos anotados de una entrada, leyendolos del CSV o del .mat la primera vez que se piden.
+
+        Args:
+            entrada (dict): Entrada del manifiesto.
+
+        Returns:
+            np.ndarray o None: Array (N, 2) de puntos x, y, o None si la imagen no tiene anotacion.
+        """
+        try:
+            if entrada["anotacion"] is None:
+                return None
+            if entrada["anotacion"] not in self.puntos:
+                self.puntos[entrada["anotacion"]] = Evaluacion.cargarPuntos(entrada["anotacion"])
+            return self.puntos[entrada["anotacion"]]
+        except Exception:
+            raise
@@ -0,0 +1,165 @@
+from typing import Union, List, Dict, Callable, Iterable
+import threading
+import queue
+import time
+
+# Marca de fin de los elementos que recorre una cadena de etapas
+_FIN = object()
+
+class Etapa:
+    """
+    Clase que representa una etapa de una cadena productor/consumidor: una funcion ejecutada por uno o varios hilos que
+    leen de una cola de entrada acotada y entregan su resultado a la siguiente etapa.
+
+    Argumentos:
+    nombre (str): Nombre de la etapa en las metricas.
+    funcion (Callable): Funcion que recibe un elemento y devuelve el elemento para la siguiente etapa, o None para no
+        pasarlo.
+    trabajadores (int): Numero de hilos de la etapa.
+    capacidad (int): Numero maximo de elementos esperando en la cola de entrada. Si la cola esta llena, la etapa
+        anterior espera, de forma que la memoria queda acotada.
+    """
+
+    def __init__(self, nombre: str, funcion: Callable[[any], any], trabajadores: int = 1, capacidad: int = 2):
+        self.nombre = nombre
+        self.funcion = funcion
+        self.trabajadores = max(1, trabajadores)
+        self.entrada = queue.Queue(max(1, capacidad))
+        self.siguiente = None
+        self.cerrojo = threading.Lock()
+        self.activos = 0
+        self.procesados = 0
+        self.fallidos = 0
+        self.ocupado = 0.0            # Segundos ejecutando la funcion, sumados entre los hilos
+        self.esperaEntrada = 0.0      # Segundos esperando un elemento, sumados entre los hilos
+        self.bloqueoSalida = 0.0      # Segundos esperando sitio en la cola de la siguiente etapa
+        self.tiempoHilos = 0.0        # Segundos desde que arranca hasta que termina cada hilo, sumados entre los hilos
+
+class CadenaEtapas:
+    """
+    Clase que ejecuta una secuencia de etapas en paralelo, de forma que mientras una etapa procesa un elemento las demas
+    avanzan con los elementos anteriores y siguientes. Mide la ocupacion de cada etapa para localizar el cuello de
+    botella: la etapa con mayor ocupacion es la que limita el rendimiento de toda la cadena.
+    """
+
+    def __init__(self, etapas: List[Etapa], alFallar: Union[Callable[[str, any, Exception], None], None] = None):
+        self.etapas = etapas
+        self.alFallar = alFallar
+        for etapa, siguiente in zip(etapas, etapas[1:]):
+            etapa.siguiente = siguiente
+
+    def __bucle(self, etapa: Etapa) -> None:
+        """
+        Bucle de cada hilo de una etapa. El ultimo hilo en recibir la marca de fin la pasa a la siguiente etapa.
+        """
+        comienzo = time.perf_counter()
+        while True:
+            inicio = time.perf_counter()
+            elemento = etapa.entrada.get()
+            espera = time.perf_counter() - inicio
+            if elemento is _FIN:
+                # Devolver la marca para el resto de hilos de la etapa
+                etapa.entrada.put(_FIN)
+                with etapa.cerrojo:
+                    etapa.esperaEntrada += espera
+                    etapa.tiempoHilos += time.perf_counter() - comienzo
+                    etapa.activos -= 1
+                    ultimo = etapa.activos == 0
+                if ultimo and etapa.siguiente is not None:
+                    etapa.siguiente.entrada.put(_FIN)
+                return
+
+            inicio = time.perf_counter()
+            try:
+                resultado = etapa.funcion(elemento)
+                fallo = None
+            except Exception as e:
+                resultado, fallo = None, e
+            ocupado = time.perf_counter() - inicio
+            if fallo is not None and self.alFallar is not None:
+                # Un fallo en la notificacion no puede terminar el hilo: la marca de fin no llegaria a las demas etapas
+                try:
+                    self.alFallar(etapa.nombre, elemento, fallo)
+                except Exception as e:
+                    print(f"[ERROR] Error al notificar el fallo de la etapa {etapa.nombre}: {e}")
+
+            bloqueo = 0.0
+            if resultado is not None and etapa.siguiente is not None:
+                inicio = time.perf_counter()
+                etapa.siguiente.entrada.put(resultado)
+                bloqueo = time.perf_counter() - inicio
+
+            with etapa.cerrojo:
+                etapa.esperaEntrada += espera
+                etapa.ocupado += ocupado
+                etapa.bloqueoSalida += bloqueo
+                if fallo is None:
+                    etapa.procesados += 1
+                else:
+                    etapa.fallidos += 1
+
+    def ejecutar(self, elementos: Iterable[any]) -> Dict[str, any]:
+        """
+        Pasa todos los elementos por la cadena y espera a que terminen.
+
+        Args:
+            elementos (Iterable): Elementos de entrada de la primera etapa.
+
+        Returns:
+            dict: Duracion total y, por etapa, hilos, elementos procesados y fallidos y fracciones del tiempo de vida de
+            sus hilos ocupados, esperando entrada y bloqueados en la salida. Incluye el nombre de la etapa cuello de
+            botella.
+        """
+        try:
+            hilos = []
+            inicio = time.perf_counter()
+            for etapa in self.etapas:
+                etapa.activos = etapa.trabajadores
+                for i in range(etapa.trabajadores):
+                    hilo = threading.Thread(target=self.__bucle, args=(etapa,), name=f"{etapa.nombre}-{i}", daemon=True)
+                    hilo.start()
+                    hilos.append(hilo)
+
+            primera = self.etapas[0]
+            for elemento in elementos:
+                primera.entrada.put(elemento)
+            primera.entrada.put(_FIN)
+            for hilo in hilos:
+                hilo.join()
+            duracion = time.perf_counter() - inicio
+
+            metricas = {"duracion": round(duracion, 4), "etapas": {}}
+            for etapa in self.etapas:
+                # Las fracciones se calculan sobre el tiempo de vida de los hilos de la etapa, que incluye todas las esperas
+                tiempoHilos = max(etapa.tiempoHilos, 1e-9)
+                metricas["etapas"][etapa.nombre] = {
+                    "trabajadores": etapa.trabajadores,
+                    "procesados": etapa.procesados,
+                    "fallidos": etapa.fallidos,
+                    "ocupacion": round(etapa.ocupado / tiempoHilos, 4),
+                    "esperaEntrada": round(etapa.esperaEntrada / tiempoHilos, 4),
+                    "bloqueoSalida": round(etapa.bloqueoSalida / tiempoHilos, 4),
+                    "tiempoMedio": round(etapa.ocupado / etapa.procesados, 4) if etapa.procesados else None,
+                }
+            metricas["cuelloBotella"] = max(metricas["etapas"], key=lambda nombre: metricas["etapas"][nombre]["ocupacion"]) if self.etapas else None
+            return metricas
+        except Exception:
+            raise
+
+    @staticmethod
+    def formatearMetricas(metricas: Dict[str, any]) -> str:
+        """
+        Formatea las metricas de una ejecucion como una tabla de texto.
+
+        Args:
+            metricas (dict): Metricas devueltas por ejecutar.
+
+        Returns:
+            str: La tabla.
+        """
+        lineas = [f"{'Etapa':<19}{'Hilos':>6}{'Elementos':>11}{'Ocupacion':>11}{'Espera':>9}{'Bloqueo':>9}{'Medio (s)':>11}"]
+        for nombre, etapa in metricas["etapas"].items():
+            medio = f"{etapa['tiempoMedio']:.3f}" if etapa["tiempoMedio"] is not None else "-"
+            marca = " <- cuello de botella" if nombre == metricas["cuelloBotella"] else ""
+            lineas.append(f"{nombre:<19}{etapa['trabajadores']:>6}{etapa['procesados']:>11}{etapa['ocupacion']:>10.0%}{etapa['esperaEntrada']:>9.0%}{etapa['bloqueoSalida']:>9.0%}{medio:>11}{marca}")
+        return "\n".join(lineas)
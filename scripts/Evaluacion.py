@@ -0,0 +1,278 @@
+from scipy.spatial import cKDTree
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+from scipy.io import loadmat
+from typing import Union, List, Tuple, Dict
+import argparse
+import glob
+import json
+import math
+import sys
+import os
+import numpy as np
+
+# Radio por defecto, en pixeles, dentro del cual un centroide predicho puede emparejarse con un punto anotado
+RADIO_DEFECTO = 20.0
+
+# Archivo con los puntos exportados desde la interfaz, que no es una anotacion
+ARCHIVO_PUNTOS_EXPORTADOS = "CSVPuntos.csv"
+
+class Evaluacion:
+    """
+    Clase que evalua los centroides predichos frente a los puntos anotados emparejandolos uno a uno dentro de un radio.
+
+    Los candidatos se buscan con un KD-tree y el emparejamiento optimo se resuelve sobre el grafo disperso de
+    candidatos, de modo que el coste depende del numero de parejas cercanas y no del producto del numero de puntos.
+    El emparejamiento maximiza primero el numero de parejas y, entre los de igual numero, minimiza la distancia total.
+    """
+
+    @staticmethod
+    def cargarPuntos(ruta: str) -> np.ndarray:
+        """
+        Carga puntos (x, y) desde un CSV con cabecera x,y o desde un .mat con la variable turbotCentroidS
+        ([etiqueta, x, y] con coordenadas de MATLAB, que empiezan en 1).
+
+        Args:
+            ruta (str): Ruta del archivo CSV o .mat.
+
+        Returns:
+            np.ndarray: Array (N, 2) con las coordenadas x, y en pixeles empezando en 0.
+        """
+        try:
+            if ruta.lower().endswith(".mat"):
+                centroides = loadmat(ruta, variable_names=["turbotCentroidS"])["turbotCentroidS"]
+                return np.asarray(centroides[:, 1:3], dtype=np.float64).reshape(-1, 2) - 1
+            return np.loadtxt(ruta, delimiter=",", skiprows=1, ndmin=2, dtype=np.float64).reshape(-1, 2)
+        except Exception:
+            raise
+
+    @staticmethod
+    def buscarAnotacion(carpeta: str) -> Union[str, None]:
+        """
+        Busca el archivo de anotaciones de una carpeta del conjunto de imagenes: el CSV de puntos anotados o, si no
+        existe, el .mat con los centroides.
+
+        Args:
+            carpeta (str): Carpeta de la imagen.
+
+        Returns:
+            str o None: Ruta del archivo de anotaciones.
+        """
+        try:
+            csvs = [r for r in sorted(glob.glob(os.path.join(carpeta, "*.csv"))) if os.path.basename(r) != ARCHIVO_PUNTOS_EXPORTADOS]
+            if csvs:
+                return csvs[0]
+            mats = sorted(glob.glob(os.path.join(carpeta, "*_c.mat")))
+            return mats[0] if mats else None
+        except Exception:
+            raise
+
+    @staticmethod
+    def emparejar(predichos: np.ndarray, reales: np.ndarray, radio: float = RADIO_DEFECTO) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Empareja uno a uno los puntos predichos con los reales a una distancia no mayor que el radio.
+
+        Cada punto puede quedar sin pareja a traves de un nodo ficticio por punto predicho y por punto real, y se
+        resuelve un emparejamiento completo de coste minimo sobre el grafo disperso. El coste de quedar sin pareja es
+        mayor que la suma de las distancias de cualquier emparejamiento, de forma que el numero de parejas es siempre el
+        maximo y la distancia total solo decide entre emparejamientos con el mismo numero de parejas.
+
+        Args:
+            predichos (np.ndarray): Array (N, 2) de puntos predichos.
+            reales (np.ndarray): Array (M, 2) de puntos reales.
+            radio (float): Distancia maxima de emparejamiento en pixeles.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: Indices de los puntos predichos emparejados, indices de sus puntos
+            reales y distancias de cada pareja.
+        """
+        try:
+            predichos = np.asarray(predichos, dtype=np.float64).reshape(-1, 2)
+            reales = np.asarray(reales, dtype=np.float64).reshape(-1, 2)
+            n, m = len(predichos), len(reales)
+            vacio = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0))
+            if n == 0 or m == 0:
+                return vacio
+
+            candidatos = cKDTree(predichos).sparse_distance_matrix(cKDTree(reales), radio, output_type="ndarray")
+            if len(candidatos) == 0:
+                return vacio
+            filas, columnas, distancias = candidatos["i"].astype(np.int64), candidatos["j"].astype(np.int64), candidatos["v"]
+
+            # Las aristas con peso cero no se consideran, por eso todos los costes se desplazan un epsilon. Una pareja mas
+            # deja dos puntos menos sin pareja, lo que compensa cualquier aumento de la distancia total (como mucho el
+            # radio por el numero maximo de parejas)
+            epsilon = radio * 1e-6 + 1e-12
+            sinPareja = radio * (min(n, m) + 1)
+            indicesN, indicesM = np.arange(n), np.arange(m)
+            # Filas: predichos (n) y ficticios de reales (m). Columnas: reales (m) y ficticios de predichos (n)
+            filasGrafo = np.concatenate([filas, indicesN, n + indicesM, n + columnas])
+            columnasGrafo = np.concatenate([columnas, m + indicesN, indicesM, m + filas])
+            pesos = np.concatenate([distancias + epsilon, np.full(n, sinPareja + epsilon), np.full(m, sinPareja + epsilon), np.full(len(filas), epsilon)])
+            grafo = coo_matrix((pesos, (filasGrafo, columnasGrafo)), shape=(n + m, m + n)).tocsr()
+
+            _, asignacion = min_weight_full_bipartite_matching(grafo)
+            asignacion = asignacion[:n]
+            emparejados = np.nonzero(asignacion < m)[0]
+            parejas = asignacion[emparejados]
+            return emparejados, parejas, np.linalg.norm(predichos[emparejados] - reales[parejas], axis=1)
+        except Exception:
+            raise
+
+    @staticmethod
+    def cuadrantesPuntos(puntos: np.ndarray, dimensiones: Tuple[int, int], numCuadrantes: int) -> np.ndarray:
+        """
+        Obtiene el cuadrante de cada punto con la misma division que Utils.recortarCuadrantes. Los puntos del margen que
+        queda fuera de los cuadrantes al dividir se asignan al cuadrante mas cercano.
+
+        Args:
+            puntos (np.ndarray): Array (N, 2) de puntos x, y.
+            dimensiones (tuple): Dimensiones de la imagen (altura, anchura).
+            numCuadrantes (int): Numero de cuadrantes.
+
+        Returns:
+            np.ndarray: Indice de cuadrante (desde 0) de cada punto.
+        """
+        try:
+            raiz = int(math.sqrt(numCuadrantes))
+            alturaCuadrante, anchuraCuadrante = dimensiones[0] // raiz, dimensiones[1] // raiz
+            fila = np.clip((puntos[:, 1] // alturaCuadrante).astype(np.int64), 0, raiz - 1)
+            columna = np.clip((puntos[:, 0] // anchuraCuadrante).astype(np.int64), 0, raiz - 1)
+            return fila * raiz + columna
+        except Exception:
+            raise
+
+    @staticmethod
+    def metricas(tp: int, fp: int, fn: int, distancias: np.ndarray) -> Dict[str, any]:
+        """
+        Calcula las metricas de deteccion y de localizacion a partir de los recuentos.
+
+        Args:
+            tp (int): Verdaderos positivos.
+            fp (int): Falsos positivos.
+            fn (int): Falsos negativos.
+            distancias (np.ndarray): Distancias de las parejas.
+
+        Returns:
+            dict: TP, FP, FN, precision, recall, F1 y error de localizacion medio, mediano y percentil 95 en pixeles.
+        """
+        tp, fp, fn = int(tp), int(fp), int(fn)
+        precision = tp / (tp + fp) if tp + fp else 0.0
+        recall = tp / (tp + fn) if tp + fn else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        return {
+            "tp": tp,
+            "fp": fp,
+            "fn": fn,
+            "precision": round(precision, 4),
+            "recall": round(recall, 4),
+            "f1": round(f1, 4),
+            "errorLocalizacionMedio": round(float(np.mean(distancias)), 3) if len(distancias) else None,
+            "errorLocalizacionMediana": round(float(np.median(distancias)), 3) if len(distancias) else None,
+            "errorLocalizacionP95": round(float(np.percentile(distancias, 95)), 3) if len(distancias) else None,
+        }
+
+    @staticmethod
+    def evaluar(predichos: Union[np.ndarray, List[Tuple[int, int]]], reales: np.ndarray, radio: float = RADIO_DEFECTO, dimensiones: Union[Tuple[int, int], None] = None, numCuadrantes: Union[int, None] = None) -> Dict[str, any]:
+        """
+        Evalua los centroides predichos de una imagen frente a sus puntos anotados.
+
+        Args:
+            predichos (np.ndarray o list): Puntos predichos (x, y), por ejemplo la lista de centroides de la segmentacion.
+            reales (np.ndarray): Puntos anotados (x, y).
+            radio (float): Distancia maxima de emparejamiento en pixeles.
+            dimensiones (tuple o None): Dimensiones de la imagen (altura, anchura), necesarias para el desglose por cuadrantes.
+            numCuadrantes (int o None): Numero de cuadrantes del desglose. Si es None no se desglosa.
+
+        Returns:
+            dict: Metricas globales y, si se ha pedido, una lista con las metricas de cada cuadrante.
+        """
+        try:
+            predichos = np.asarray(predichos, dtype=np.float64).reshape(-1, 2)
+            reales = np.asarray(reales, dtype=np.float64).reshape(-1, 2)
+            emparejados, parejas, distancias = Evaluacion.emparejar(predichos, reales, radio)
+
+            resultado = Evaluacion.metricas(len(emparejados), len(predichos) - len(emparejados), len(reales) - len(parejas), distancias)
+            resultado["radio"] = radio
+
+            if numCuadrantes is not None and dimensiones is not None:
+                # Los aciertos y los falsos negativos se asignan al cuadrante del punto anotado y los falsos positivos al del predicho
+                cuadrantePredichos = Evaluacion.cuadrantesPuntos(predichos, dimensiones, numCuadrantes)
+                cuadranteReales = Evaluacion.cuadrantesPuntos(reales, dimensiones, numCuadrantes)
+                esTp = np.zeros(len(reales), dtype=bool)
+                esTp[parejas] = True
+                esFp = np.ones(len(predichos), dtype=bool)
+                esFp[emparejados] = False
+                distanciaReal = np.zeros(len(reales))
+                distanciaReal[parejas] = distancias
+
+                porCuadrante = []
+                for cuadrante in range(int(math.sqrt(numCuadrantes)) ** 2):
+                    enCuadrante = cuadranteReales == cuadrante
+                    tpCuadrante = esTp & enCuadrante
+                    metricasCuadrante = Evaluacion.metricas(tpCuadrante.sum(), (esFp & (cuadrantePredichos == cuadrante)).sum(), (~esTp & enCuadrante).sum(), distanciaReal[tpCuadrante])
+                    metricasCuadrante["cuadrante"] = cuadrante + 1
+                    porCuadrante.append(metricasCuadrante)
+                resultado["porCuadrante"] = porCuadrante
+
+            return resultado
+        except Exception:
+            raise
+
+    @staticmethod
+    def acumular(evaluaciones: List[Dict[str, any]]) -> Dict[str, any]:
+        """
+        Suma los TP, FP y FN de varias imagenes y calcula las metricas globales del conjunto.
+
+        Args:
+            evaluaciones (list[dict]): Evaluaciones de cada imagen.
+
+        Returns:
+            dict: Metricas del conjunto. El error de localizacion es la media ponderada por el numero de aciertos.
+        """
+        try:
+            tp = sum(e["tp"] for e in evaluaciones)
+            fp = sum(e["fp"] for e in evaluaciones)
+            fn = sum(e["fn"] for e in evaluaciones)
+            resultado = Evaluacion.metricas(tp, fp, fn, np.empty(0))
+            conError = [e for e in evaluaciones if e["errorLocalizacionMedio"] is not None]
+            if conError:
+                resultado["errorLocalizacionMedio"] = round(sum(e["errorLocalizacionMedio"] * e["tp"] for e in conError) / max(1, sum(e["tp"] for e in conError)), 3)
+            del resultado["errorLocalizacionMediana"], resultado["errorLocalizacionP95"]
+            return resultado
+        except Exception:
+            raise
+
+def main(argumentos: Union[List[str], None] = None) -> int:
+    parser = argparse.ArgumentParser(description="Evalua los puntos exportados (CSVPuntos.csv) frente a las anotaciones del conjunto de imagenes.")
+    parser.add_argument("--directorio", default="imagenes", help="Directorio del conjunto de imagenes.")
+    parser.add_argument("--radio", type=float, default=RADIO_DEFECTO, help="Distancia maxima de emparejamiento en pixeles.")
+    parser.add_argument("--salida", default=None, help="Ruta del JSON con las evaluaciones.")
+    args = parser.parse_args(argumentos)
+
+    # Importacion local: Dataset usa Evaluacion para leer los puntos anotados
+    from scripts.Dataset import Dataset
+
+    dataset = Dataset(args.directorio)
+    evaluaciones = []
+    for entrada in dataset.cargar():
+        if entrada["puntosExportados"] is None:
+            continue
+        puntosReales = dataset.puntosReales(entrada)
+        if puntosReales is None:
+            print(f"[WARNING] {entrada['ruta']}: sin anotaciones")
+            continue
+        evaluacion = Evaluacion.evaluar(Evaluacion.cargarPuntos(entrada["puntosExportados"]), puntosReales, args.radio)
+        evaluacion["ruta"] = entrada["ruta"]
+        evaluaciones.append(evaluacion)
+        print(f"[INFO] {entrada['ruta']}: TP {evaluacion['tp']} FP {evaluacion['fp']} FN {evaluacion['fn']} precision {evaluacion['precision']:.3f} recall {evaluacion['recall']:.3f}")
+
+    total = Evaluacion.acumular(evaluaciones)
+    print(json.dumps(total, indent=2))
+    if args.salida:
+        with open(args.salida, "w") as archivo:
+            json.dump({"global": total, "imagenes": evaluaciones}, archivo, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
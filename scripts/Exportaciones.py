@@ -0,0 +1,564 @@
+from scripts.ProcesarMascaras import ProcesarMascaras
+from scripts.Evaluacion import Evaluacion
+from matplotlib.colors import to_rgb
+from scipy.ndimage import find_objects
+from typing import Union, List, Tuple, Dict, Callable
+import glob
+import json
+import csv
+import os
+import cv2
+import numpy as np
+import matplotlib.pyplot as plt
+
+# Nombres de los archivos exportados por el procesamiento por lotes
+ARCHIVO_IMAGEN_MASCARAS = "ImagenMascaras.jpg"
+ARCHIVO_IMAGEN_PUNTOS = "ImagenPuntos.jpg"
+ARCHIVO_PUNTOS = "CSVPuntos.csv"
+ARCHIVO_MASCARAS = "CSVMascaras.csv"
+ARCHIVO_HISTOGRAMA = "Histograma.png"
+ARCHIVO_TABLA_MASCARAS = "TablaMascaras"      # Con extension .parquet si pyarrow esta instalado y .npz si no
+ARCHIVO_COCO = "MascarasCOCO.json"
+
+# Categoria de todas las anotaciones del JSON de COCO
+CATEGORIA_COCO = {"id": 1, "name": "rodaballo"}
+
+# Columnas de la tabla de mascaras y su tipo
+COLUMNAS_TABLA_MASCARAS = {
+    "imagen": str, "mascara": np.int32, "cuadrante": np.int16, "area": np.int64,
+    "bbox_x": np.int32, "bbox_y": np.int32, "bbox_w": np.int32, "bbox_h": np.int32,
+    "predicted_iou": np.float32, "stability_score": np.float32, "centroide_x": np.int32, "centroide_y": np.int32,
+}
+
+# Campos del encabezado del CSV de mascaras
+CAMPOS_MASCARAS = ['area', 'bbox', 'predicted_iou', 'point_coords', 'stability_score', 'crop_box']
+
+# Colores de las etiquetas en las imagenes exportadas, los mismos que usa por defecto skimage.color.label2rgb
+COLORES_ETIQUETAS = ('red', 'blue', 'yellow', 'magenta', 'green', 'indigo', 'darkorange', 'cyan', 'pink', 'yellowgreen')
+
+# Tabla de colores BGR en uint8: la posicion 0 es el fondo (negro) y la etiqueta de rango n entre las presentes en la
+# imagen usa la posicion (n - 1) % 10 + 1
+TABLA_COLORES = np.array([(0, 0, 0)] + [np.round(np.array(to_rgb(color))[::-1] * 255) for color in COLORES_ETIQUETAS], dtype=np.uint8)
+
+# Filas de cada bloque en que se recorre la imagen al superponer las etiquetas
+FILAS_BLOQUE = 256
+
+class Exportaciones:
+    """
+    Clase que agrupa las exportaciones de los resultados de la segmentacion, compartidas por la interfaz y por el
+    procesamiento por lotes.
+
+    Todas las escrituras son atomicas: se escribe un archivo temporal en el mismo directorio y se renombra al final, de
+    forma que una interrupcion nunca deja un archivo exportado a medias.
+    """
+
+    @staticmethod
+    def escribirAtomico(ruta: str, escribir: Callable[[str], None]) -> str:
+        """
+        Escribe un archivo a traves de un archivo temporal que se renombra al terminar.
+
+        Args:
+            ruta (str): Ruta final del archivo.
+            escribir (Callable): Funcion que recibe la ruta temporal y escribe en ella. La ruta temporal conserva la
+                extension, para que las funciones que deducen el formato de ella funcionen igual.
+
+        Returns:
+            str: La ruta final del archivo.
+        """
+        base, extension = os.path.splitext(ruta)
+        temporal = f"{base}.{os.getpid()}.tmp{extension}"
+        try:
+            escribir(temporal)
+            os.replace(temporal, ruta)
+            return ruta
+        except Exception:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+
+    @staticmethod
+    def superponerEtiquetas(etiquetas: np.ndarray, imagen: np.ndarray, alpha: float = 0.2) -> np.ndarray:
+        """
+        Superpone las etiquetas sobre la imagen en escala de grises con la misma mezcla que label2rgb (el fondo se
+        oscurece y cada etiqueta se tiñe con su color), pero en aritmetica entera de 8 bits con la tabla de colores y
+        por bloques de filas, sin imagenes intermedias en coma flotante del tamaño de la imagen. Como en label2rgb, cada
+        etiqueta toma el color segun su posicion entre las etiquetas presentes, por lo que los colores coinciden aunque
+        las etiquetas no sean consecutivas.
+
+        Args:
+            etiquetas (np.ndarray o ArrayFragmentado): Imagen de etiquetas.
+            imagen (np.ndarray): Imagen original, en escala de grises o RGB.
+            alpha (float): Opacidad de las etiquetas.
+
+        Returns:
+            np.ndarray: Imagen BGR uint8 lista para codificar con OpenCV.
+        """
+        try:
+            altura, anchura = imagen.shape[:2]
+            pesoEtiquetas = int(round(alpha * 256))
+            coloresPonderados = TABLA_COLORES.astype(np.uint16) * pesoEtiquetas
+            resultado = np.empty((altura, anchura, 3), dtype=np.uint8)
+
+            # Posicion en la tabla de colores de cada etiqueta segun su rango entre las etiquetas presentes
+            presentes = np.unique(np.concatenate([np.unique(np.asarray(etiquetas[y0:y0 + FILAS_BLOQUE])) for y0 in range(0, altura, FILAS_BLOQUE)]))
+            presentes = presentes[presentes > 0]
+            posiciones = np.zeros(int(presentes[-1]) + 1 if len(presentes) else 1, dtype=np.intp)
+            posiciones[presentes] = np.arange(len(presentes)) % (len(TABLA_COLORES) - 1) + 1
+
+            for y0 in range(0, altura, FILAS_BLOQUE):
+                y1 = min(y0 + FILAS_BLOQUE, altura)
+                # Las etiquetas recuperadas de la cache se leen aqui, bloque a bloque, de sus fragmentos
+                bloque = np.asarray(etiquetas[y0:y1])
+                gris = imagen[y0:y1] if imagen.ndim == 2 else cv2.cvtColor(np.ascontiguousarray(imagen[y0:y1]), cv2.COLOR_RGB2GRAY)
+                indices = posiciones[np.maximum(bloque, 0)]
+                mezcla = coloresPonderados[indices]
+                mezcla += (gris.astype(np.uint16) * (256 - pesoEtiquetas) + 128)[:, :, None]
+                np.right_shift(mezcla, 8, out=mezcla)
+                resultado[y0:y1] = mezcla
+            return resultado
+        except Exception:
+            raise
+
+    @staticmethod
+    def imagenEtiquetas(etiquetas: np.ndarray, imagen: np.ndarray, ruta: str, alpha: float = 0.2) -> str:
+        """
+        Exporta la imagen original con las etiquetas superpuestas. Se usa tanto para las mascaras (alpha 0.2) como para
+        los puntos (alpha 0.4).
+
+        Args:
+            etiquetas (np.ndarray o ArrayFragmentado): Imagen de etiquetas de las mascaras o de los centroides.
+            imagen (np.ndarray): Imagen original.
+            ruta (str): Ruta del archivo de imagen.
+            alpha (float): Opacidad de las etiquetas.
+
+        Returns:
+            str: La ruta del archivo.
+        """
+        def escribir(temporal: str) -> None:
+            if not cv2.imwrite(temporal, imagenEtiquetada):
+                raise ValueError(f"No se ha podido escribir la imagen {ruta}")
+
+        try:
+            imagenEtiquetada = Exportaciones.superponerEtiquetas(etiquetas, imagen, alpha)
+            return Exportaciones.escribirAtomico(ruta, escribir)
+        except Exception:
+            raise
+
+    @staticmethod
+    def imagenPuntos(centroides: np.ndarray, imagen: np.ndarray, ruta: str, alpha: float = 0.4) -> str:
+        """
+        Exporta la imagen original con los centroides superpuestos. Los puntos se pintan en este momento, ya que los
+        resultados solo guardan sus coordenadas.
+
+        Args:
+            centroides (np.ndarray): Array (N, 2) con las coordenadas x, y de los centroides.
+            imagen (np.ndarray): Imagen original.
+            ruta (str): Ruta del archivo de imagen.
+            alpha (float): Opacidad de los puntos.
+
+        Returns:
+            str: La ruta del archivo.
+        """
+        try:
+            etiquetas = ProcesarMascaras.pintarCentroides(centroides, imagen.shape[:2], valor=1)
+            return Exportaciones.imagenEtiquetas(etiquetas, imagen, ruta, alpha)
+        except Exception:
+            raise
+
+    @staticmethod
+    def puntosCSV(listaPuntos: Union[np.ndarray, List[Tuple[int, int]]], ruta: str) -> str:
+        """
+        Exporta los centroides a un archivo CSV con cabecera x, y.
+
+        Args:
+            listaPuntos (np.ndarray o list[tuple[int, int]]): Centroides x, y.
+            ruta (str): Ruta del archivo CSV.
+
+        Returns:
+            str: La ruta del archivo.
+        """
+        def escribir(temporal: str) -> None:
+            with open(temporal, 'w', newline='') as csvfile:
+                writer = csv.writer(csvfile)
+                writer.writerow(['x', 'y'])
+                writer.writerows(np.asarray(listaPuntos, dtype=np.int64).reshape(-1, 2).tolist())
+
+        try:
+            return Exportaciones.escribirAtomico(ruta, escribir)
+        except Exception:
+            raise
+
+    @staticmethod
+    def mascarasCSV(listaMascaras: List[Dict[str, any]], ruta: str) -> str:
+        """
+        Exporta las propiedades de las mascaras (sin la segmentacion) a un archivo CSV.
+
+        Args:
+            listaMascaras (list[dict]): Lista de mascaras.
+            ruta (str): Ruta del archivo CSV.
+
+        Returns:
+            str: La ruta del archivo.
+        """
+        def escribir(temporal: str) -> None:
+            with open(temporal, 'w', newline='') as csvfile:
+                writer = csv.DictWriter(csvfile, fieldnames=CAMPOS_MASCARAS, quoting=csv.QUOTE_NONE, escapechar='\\')
+                writer.writeheader()
+                for objeto in listaMascaras:
+                    # Eliminar el campo 'segmentation' del objeto
+                    objetoSinSegmentation = {key: val for key, val in objeto.items() if key != 'segmentation'}
+                    # Convertir listas en strings
+                    objetoStr = {key: str(val).replace('\\', '') if isinstance(val, str) else val for key, val in objetoSinSegmentation.items()}
+                    writer.writerow(objetoStr)
+
+        try:
+            return Exportaciones.escribirAtomico(ruta, escribir)
+        except Exception:
+            raise
+
+    @staticmethod
+    def histograma(listaMascaras: List[Dict[str, any]], numeroRod: int, ruta: str) -> str:
+        """
+        Exporta un histograma de las areas de las mascaras junto con su predicted IoU normalizado.
+
+        Args:
+            listaMascaras (list[dict]): Lista de mascaras procesadas.
+            numeroRod (int): Numero de rodaballos calculado, que decide el tamaño de los marcadores.
+            ruta (str): Ruta del archivo de imagen.
+
+        Returns:
+            str: La ruta del archivo.
+        """
+        try:
+            # Extraer el área y predicted_iou de cada objeto
+            listaAreas = [mascara['area'] for mascara in listaMascaras]
+            listaPredictedIou = [mascara['predicted_iou'] for mascara in listaMascaras]
+
+            # Normalizar los predicted_iou para que estén en el rango [0, 1]
+            maxPredictedIou = max(listaPredictedIou)
+            listaPredictedIouNorm = [score / maxPredictedIou for score in listaPredictedIou]
+
+            # Ordenar las áreas de manera descendente
+            listaAreas = sorted(listaAreas, reverse=True)
+
+            # Generar etiquetas para el eje x
+            etiquetasX = [f"M{i+1}" for i in range(len(listaAreas))]
+
+            # Calcular la línea de tendencia
+            x = np.arange(len(listaAreas))
+            y = np.array(listaAreas)
+            m, b = np.polyfit(x, y, 1)  # Coeficientes de la línea de tendencia
+            lineaTendencia = m * x + b
+
+            # Generar el histograma
+            fig, ax1 = plt.subplots(figsize=(8, 6))
+            ax1.bar(etiquetasX, listaAreas, color='blue', edgecolor='blue')
+            ax1.set_xlabel('Máscaras')
+            ax1.set_ylabel('Área [Pixeles Contenidos]')
+            ax1.set_title('Histograma de áreas de máscaras')
+            ax1.set_xticks([])
+
+            # Trazar la línea de tendencia
+            ax1.plot(x, lineaTendencia, color='red', linestyle='-')
+            ax1.grid(True)
+
+            if numeroRod < 100:
+                tamanoPunto = 4
+                linea = '--'
+            else:
+                tamanoPunto = 1
+                linea = ''
+
+            # Agregar el segundo eje Y
+            ax2 = ax1.twinx()
+            ax2.set_ylabel('Predicted IoU [Normalizado]')
+            ax2.plot(x, listaPredictedIouNorm, color='green', linestyle=linea, marker='o', markersize=tamanoPunto, linewidth=0.5)
+
+            fig.tight_layout()
+            try:
+                return Exportaciones.escribirAtomico(ruta, fig.savefig)
+            finally:
+                # En el procesamiento por lotes se generan muchos histogramas; la figura se cierra para liberar memoria
+                plt.close(fig)
+        except Exception:
+            raise
+
+    @staticmethod
+    def tablaMascaras(listaMascaras: List[Dict[str, any]], listaPuntos: np.ndarray, dimensiones: Tuple[int, int], numCuadrantes: Union[int, None], imagen: str) -> Dict[str, np.ndarray]:
+        """
+        Construye la tabla por columnas de las mascaras de una imagen, con un array tipado por columna en lugar de un
+        diccionario por mascara.
+
+        Args:
+            listaMascaras (list[dict]): Lista de mascaras.
+            listaPuntos (np.ndarray): Array (N, 2) con los centroides x, y de las mascaras, en el mismo orden.
+            dimensiones (tuple[int, int]): Altura y anchura de la imagen.
+            numCuadrantes (int o None): Numero de cuadrantes de la segmentacion. El cuadrante de cada mascara (desde 1)
+                se obtiene de su centroide; sin cuadrantes es 0. Todas las columnas quedan en coordenadas de la imagen
+                completa.
+            imagen (str): Identificador de la imagen, repetido en cada fila para poder unir las tablas de un lote.
+
+        Returns:
+            dict: Array de cada columna de COLUMNAS_TABLA_MASCARAS.
+        """
+        try:
+            n = len(listaMascaras)
+            centroides = np.asarray(listaPuntos, dtype=np.int64).reshape(-1, 2)
+            bbox = np.asarray([mascara["bbox"] for mascara in listaMascaras], dtype=np.float64).reshape(-1, 4)
+            cuadrantes = Evaluacion.cuadrantesPuntos(centroides, dimensiones, numCuadrantes) + 1 if numCuadrantes else np.zeros(n)
+            if numCuadrantes and n:
+                # SAM da la caja en coordenadas de su cuadrante; se lleva a la imagen completa con el origen del cuadrante,
+                # que es el de su centroide porque la mascara no sale del cuadrante
+                raiz = int(np.sqrt(numCuadrantes))
+                fila, columna = np.divmod(cuadrantes.astype(np.int64) - 1, raiz)
+                bbox[:, 0] += columna * (dimensiones[1] // raiz)
+                bbox[:, 1] += fila * (dimensiones[0] // raiz)
+            columnas = {
+                "imagen": np.full(n, imagen),
+                "mascara": np.arange(n),
+                "cuadrante": cuadrantes,
+                "area": [mascara["area"] for mascara in listaMascaras],
+                "bbox_x": bbox[:, 0], "bbox_y": bbox[:, 1], "bbox_w": bbox[:, 2], "bbox_h": bbox[:, 3],
+                "predicted_iou": [mascara.get("predicted_iou", np.nan) for mascara in listaMascaras],
+                "stability_score": [mascara.get("stability_score", np.nan) for mascara in listaMascaras],
+                "centroide_x": centroides[:, 0], "centroide_y": centroides[:, 1],
+            }
+            return {nombre: np.asarray(columnas[nombre], dtype=tipo).reshape(n) for nombre, tipo in COLUMNAS_TABLA_MASCARAS.items()}
+        except Exception:
+            raise
+
+    @staticmethod
+    def tablaMascarasArchivo(tabla: Dict[str, np.ndarray], ruta: str) -> str:
+        """
+        Exporta la tabla de mascaras a Parquet si pyarrow esta instalado o, si no, a un .npz con un array por columna.
+
+        Args:
+            tabla (dict): Tabla devuelta por tablaMascaras.
+            ruta (str): Ruta del archivo sin extension.
+
+        Returns:
+            str: La ruta del archivo, con su extension.
+        """
+        try:
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                return Exportaciones.escribirAtomico(ruta + ".npz", lambda temporal: np.savez(temporal, **tabla))
+            tablaArrow = pyarrow.table({nombre: pyarrow.array(columna) for nombre, columna in tabla.items()})
+            return Exportaciones.escribirAtomico(ruta + ".parquet", lambda temporal: pyarrow.parquet.write_table(tablaArrow, temporal))
+        except Exception:
+            raise
+
+    @staticmethod
+    def leerTablasMascaras(directorio: str) -> Dict[str, np.ndarray]:
+        """
+        Lee y une todas las tablas de mascaras exportadas bajo un directorio, por ejemplo la salida de un lote
+        completo, como una unica tabla. Se puede pasar a pandas con pd.DataFrame(tabla).
+
+        Args:
+            directorio (str): Directorio en el que se buscan las tablas, recursivamente.
+
+        Returns:
+            dict: Array de cada columna con las filas de todas las tablas.
+        """
+        try:
+            partes = []
+            for ruta in sorted(glob.glob(os.path.join(directorio, "**", ARCHIVO_TABLA_MASCARAS + ".*"), recursive=True)):
+                # Los temporales de una escritura en curso o interrumpida no forman parte de la tabla
+                if ".tmp." in os.path.basename(ruta):
+                    continue
+                if ruta.endswith(".npz"):
+                    with np.load(ruta, allow_pickle=False) as datos:
+                        partes.append({nombre: datos[nombre] for nombre in COLUMNAS_TABLA_MASCARAS})
+                elif ruta.endswith(".parquet"):
+                    import pyarrow.parquet
+                    tablaArrow = pyarrow.parquet.read_table(ruta)
+                    partes.append({nombre: tablaArrow.column(nombre).to_numpy() for nombre in COLUMNAS_TABLA_MASCARAS})
+            if not partes:
+                return {nombre: np.zeros(0, dtype=tipo) for nombre, tipo in COLUMNAS_TABLA_MASCARAS.items()}
+            return {nombre: np.concatenate([parte[nombre] for parte in partes]) for nombre in COLUMNAS_TABLA_MASCARAS}
+        except Exception:
+            raise
+
+    @staticmethod
+    def codificarRLE(y0: int, x0: int, recorte: np.ndarray, dimensiones: Tuple[int, int]) -> List[int]:
+        """
+        Obtiene las longitudes de las rachas del RLE de COCO de una mascara a partir de su recorte, sin crear la
+        mascara del tamaño de la imagen completa. Las rachas recorren la imagen por columnas y alternan fondo y mascara,
+        empezando por el fondo.
+
+        Args:
+            y0, x0 (int): Esquina superior izquierda del recorte en la imagen completa.
+            recorte (np.ndarray): Recorte booleano de la mascara.
+            dimensiones (tuple[int, int]): Altura y anchura de la imagen completa.
+
+        Returns:
+            list[int]: Longitudes de las rachas, que suman altura * anchura.
+        """
+        try:
+            altura, anchura = dimensiones
+            alturaRecorte = recorte.shape[0] + 2
+            # Cada columna del recorte lleva un pixel de fondo antes y despues, para que ninguna racha pase de una
+            # columna a la siguiente dentro del recorte
+            columnas = np.zeros((recorte.shape[1], alturaRecorte), dtype=np.int8)
+            columnas[:, 1:-1] = recorte.T
+            cambios = np.diff(columnas.ravel())
+            inicios = np.flatnonzero(cambios == 1) + 1
+            finales = np.flatnonzero(cambios == -1) + 1
+
+            # Posiciones en la imagen completa recorrida por columnas; los finales son exclusivos
+            inicios = (x0 + inicios // alturaRecorte) * altura + y0 + inicios % alturaRecorte - 1
+            finales = (x0 + finales // alturaRecorte) * altura + y0 + finales % alturaRecorte - 1
+
+            # Una racha que llega al borde inferior continua en la siguiente columna si esta empieza en el borde superior
+            continua = finales[:-1] == inicios[1:]
+            inicios = np.concatenate([inicios[:1], inicios[1:][~continua]])
+            finales = np.concatenate([finales[:-1][~continua], finales[-1:]])
+
+            limites = np.concatenate([[0], np.column_stack([inicios, finales]).ravel(), [altura * anchura]])
+            rachas = np.diff(limites).tolist()
+            # Como en COCO, no se añade una racha de fondo vacia al final
+            if len(rachas) > 1 and rachas[-1] == 0:
+                rachas.pop()
+            return rachas
+        except Exception:
+            raise
+
+    @staticmethod
+    def cadenaRLE(rachas: List[int]) -> str:
+        """
+        Comprime las rachas de un RLE en la cadena de texto de COCO (la misma que genera pycocotools): cada racha se
+        guarda como diferencia con la de dos posiciones antes, en grupos de 5 bits por caracter.
+
+        Args:
+            rachas (list[int]): Longitudes de las rachas.
+
+        Returns:
+            str: La cadena del campo counts.
+        """
+        caracteres = []
+        for i, valor in enumerate(rachas):
+            if i > 2:
+                valor -= rachas[i - 2]
+            mas = True
+            while mas:
+                caracter = valor & 0x1f
+                valor >>= 5
+                mas = valor != -1 if caracter & 0x10 else valor != 0
+                if mas:
+                    caracter |= 0x20
+                caracteres.append(chr(caracter + 48))
+        return "".join(caracteres)
+
+    @staticmethod
+    def mascarasCOCO(listaMascaras: List[Dict[str, any]], dimensiones: Tuple[int, int], ruta: str, etiquetas: Union[np.ndarray, None] = None, nombreImagen: str = "", notificarOmitidas: Union[Callable[[int], None], None] = None) -> str:
+        """
+        Exporta las segmentaciones de las mascaras a un JSON de COCO con RLE comprimido, en coordenadas de la imagen
+        completa. Las anotaciones se codifican desde el recorte de cada mascara y se escriben una a una, sin construir
+        el JSON completo en memoria.
+
+        La forma de cada mascara se toma de su segmentacion, de forma que las mascaras solapadas se exportan completas y
+        el area coincide con la del CSV. Si las mascaras no incluyen la segmentacion (resultados de la cache o del
+        proceso de inferencia), se toma de la imagen de etiquetas, en la que la etiqueta n es la mascara n - 1; en ese
+        caso las zonas solapadas pertenecen a una sola mascara, y las mascaras tapadas por completo no se exportan y su
+        numero se pasa a notificarOmitidas.
+
+        Args:
+            listaMascaras (list[dict]): Lista de mascaras.
+            dimensiones (tuple[int, int]): Altura y anchura de la imagen.
+            ruta (str): Ruta del archivo JSON.
+            etiquetas (np.ndarray, ArrayFragmentado o None): Imagen de etiquetas de las mascaras.
+            nombreImagen (str): Nombre de la imagen en el JSON.
+            notificarOmitidas (Callable o None): Funcion que recibe el numero de mascaras que no aparecen en la imagen de
+                etiquetas y no se han exportado, si hay alguna.
+
+        Returns:
+            str: La ruta del archivo.
+        """
+        def recortes():
+            if all("segmentation" in mascara for mascara in listaMascaras):
+                for indice, mascara in enumerate(listaMascaras):
+                    y0, x0, recorte, _ = ProcesarMascaras.recorteMascara(mascara)
+                    yield indice, y0, x0, recorte
+                return
+            if etiquetas is None:
+                raise ValueError("Las mascaras no tienen segmentacion y no hay imagen de etiquetas de la que obtenerla")
+            imagenEtiquetas = np.asarray(etiquetas)
+            omitidas = 0
+            for indice, region in enumerate(find_objects(imagenEtiquetas, max_label=len(listaMascaras))):
+                if region is None:
+                    omitidas += 1
+                    continue
+                yield indice, region[0].start, region[1].start, imagenEtiquetas[region] == indice + 1
+            if omitidas and notificarOmitidas is not None:
+                notificarOmitidas(omitidas)
+
+        def escribir(temporal: str) -> None:
+            altura, anchura = dimensiones
+            with open(temporal, "w") as archivo:
+                imagen = {"id": 1, "file_name": nombreImagen, "height": altura, "width": anchura}
+                archivo.write(f'{{"images": [{json.dumps(imagen)}], "categories": [{json.dumps(CATEGORIA_COCO)}], "annotations": [')
+                for numero, (indice, y0, x0, recorte) in enumerate(recortes()):
+                    mascara = listaMascaras[indice]
+                    anotacion = {
+                        "id": indice + 1, "image_id": 1, "category_id": CATEGORIA_COCO["id"], "iscrowd": 0,
+                        "segmentation": {"size": [altura, anchura], "counts": Exportaciones.cadenaRLE(Exportaciones.codificarRLE(y0, x0, recorte, dimensiones))},
+                        "area": int(np.count_nonzero(recorte)),
+                        "bbox": [int(x0), int(y0), int(recorte.shape[1]), int(recorte.shape[0])],
+                        "score": float(mascara.get("predicted_iou", 1.0)),
+                        "stability_score": float(mascara.get("stability_score", 1.0)),
+                    }
+                    archivo.write(("," if numero else "") + "\n" + json.dumps(anotacion))
+                archivo.write("\n]}\n")
+
+        try:
+            return Exportaciones.escribirAtomico(ruta, escribir)
+        except Exception:
+            raise
+
+    @staticmethod
+    def exportarResultados(resultados: Dict[str, any], imagen: np.ndarray, directorio: str, numCuadrantes: Union[int, None] = None, identificador: Union[str, None] = None, notificarOmitidas: Union[Callable[[int], None], None] = None) -> Dict[str, str]:
+        """
+        Exporta todos los resultados de una segmentacion a un directorio, con los mismos archivos que se pueden
+        exportar desde la interfaz. Se exportan los resultados procesados si existen y, si no, los generados.
+
+        Args:
+            resultados (dict): Resultados de PipelineSegmentacion.ejecutar o de la cache de resultados.
+            imagen (np.ndarray): Imagen original.
+            directorio (str): Directorio de salida.
+            numCuadrantes (int o None): Numero de cuadrantes de la segmentacion, para la columna cuadrante de la tabla.
+            identificador (str o None): Identificador de la imagen en la tabla. Por defecto el nombre del directorio.
+            notificarOmitidas (Callable o None): Funcion que recibe el numero de mascaras que no se han podido exportar
+                al JSON COCO, como en mascarasCOCO.
+
+        Returns:
+            dict: Ruta de cada archivo exportado.
+        """
+        try:
+            os.makedirs(directorio, exist_ok=True)
+            procesado = resultados["listaMascarasProcesadas"] is not None
+            listaMascaras = resultados["listaMascarasProcesadas"] if procesado else resultados["listaMascaras"]
+            listaPuntos = resultados["listaPuntosProcesados"] if procesado else resultados["listaPuntosGenerados"]
+            etiquetasMascaras = resultados["mascarasProcesadas"] if procesado else resultados["mascarasGeneradas"]
+
+            salidas = {
+                "puntos": Exportaciones.puntosCSV(listaPuntos, os.path.join(directorio, ARCHIVO_PUNTOS)),
+                "mascaras": Exportaciones.mascarasCSV(listaMascaras, os.path.join(directorio, ARCHIVO_MASCARAS)),
+            }
+            if listaPuntos is not None:
+                tabla = Exportaciones.tablaMascaras(listaMascaras, listaPuntos, imagen.shape[:2], numCuadrantes, identificador or os.path.basename(os.path.normpath(directorio)))
+                salidas["tablaMascaras"] = Exportaciones.tablaMascarasArchivo(tabla, os.path.join(directorio, ARCHIVO_TABLA_MASCARAS))
+            # Las segmentaciones salen de las mascaras o, si no las incluyen (cache o proceso de inferencia), de las etiquetas
+            if listaMascaras is not None and (etiquetasMascaras is not None or all("segmentation" in mascara for mascara in listaMascaras)):
+                salidas["coco"] = Exportaciones.mascarasCOCO(listaMascaras, imagen.shape[:2], os.path.join(directorio, ARCHIVO_COCO), etiquetasMascaras, identificador or os.path.basename(os.path.normpath(directorio)), notificarOmitidas)
+            if listaPuntos is not None:
+                salidas["imagenPuntos"] = Exportaciones.imagenPuntos(listaPuntos, imagen, os.path.join(directorio, ARCHIVO_IMAGEN_PUNTOS))
+            # La imagen de etiquetas puede faltar si no hubo memoria suficiente para generarla
+            if etiquetasMascaras is not None:
+                salidas["imagenMascaras"] = Exportaciones.imagenEtiquetas(etiquetasMascaras, imagen, os.path.join(directorio, ARCHIVO_IMAGEN_MASCARAS))
+            if procesado and listaMascaras:
+                salidas["histograma"] = Exportaciones.histograma(listaMascaras, resultados["numeroRodCalculado"], os.path.join(directorio, ARCHIVO_HISTOGRAMA))
+            return salidas
+        except Exception:
+            raise
@@ -0,0 +1,264 @@
+from scripts.Configuraciones import Configuraciones
+from scripts.CacheResultados import CacheResultados
+from scripts.ProcesamientoLotes import ProcesamientoLotes, EXTENSIONES_IMAGEN
+from scripts.BaseResultados import BaseResultados
+from scripts.Exportaciones import ARCHIVO_IMAGEN_MASCARAS, ARCHIVO_IMAGEN_PUNTOS, ARCHIVO_HISTOGRAMA
+from typing import Union, List, Dict
+import argparse
+import threading
+import signal
+import queue
+import time
+import sys
+import os
+
+class IngestaCarpetas:
+    """
+    Clase que vigila una o varias carpetas en las que las camaras de los tanques dejan imagenes y las segmenta segun
+    llegan, con un unico modelo cargado durante toda la ejecucion.
+
+    Un hilo recorre las carpetas periodicamente. Una imagen se considera completa cuando su tamaño y su fecha de
+    modificacion no cambian durante el tiempo de estabilidad (y, si es JPEG, termina con el marcador de fin de imagen).
+    Las imagenes cuyo contenido ya se ha procesado se descartan por su huella. Las imagenes completas pasan por una cola
+    acotada a un hilo que las segmenta; si la cola esta llena, las nuevas imagenes esperan en la carpeta hasta que haya
+    sitio, de forma que la memoria no crece aunque las camaras produzcan mas rapido de lo que se procesa.
+
+    El procesamiento y el registro de las imagenes terminadas se delegan en ProcesamientoLotes, por lo que el servicio
+    puede reiniciarse sin volver a procesar lo ya hecho. En modo secuencia cada imagen se segmenta a partir de la
+    ultima imagen terminada de su tanque y camara, siempre que sea anterior a ella.
+    """
+
+    def __init__(self, directorios: List[str], directorioSalida: str, nombreConfiguracion: str, numCuadrantes: Union[int, None] = None, junto: bool = False, intervalo: float = 0.5, estabilidad: float = 1.0, capacidadCola: int = 8, baseResultados: Union[BaseResultados, None] = None, secuencia: bool = False):
+
+        try:
+            self.directorios = directorios
+            self.junto = junto
+            self.intervalo = intervalo
+            self.estabilidad = estabilidad
+            self.lote = ProcesamientoLotes(directorioSalida, nombreConfiguracion, numCuadrantes, baseResultados=baseResultados, secuencia=secuencia)
+            self.cola = queue.Queue(capacidadCola)
+            self.parar = threading.Event()
+            self.hilos = []
+
+            self.candidatas = {}        # Ruta -> (tamaño, modificacion, instante de llegada, instante desde el que no cambia)
+            self.revisadas = {}         # Ruta -> (tamaño, modificacion) de las imagenes ya encoladas o descartadas
+            self.enCurso = set()        # Huellas de las imagenes encoladas y aun no terminadas
+            self.cerrojo = threading.Lock()
+
+            # Huellas de las imagenes ya procesadas, en esta ejecucion y en las anteriores, que mantiene el diario
+            self.huellas = self.lote.diario.huellas
+
+            self.estadisticas = {"procesadas": 0, "duplicadas": 0, "fallidas": 0, "latenciaMedia": 0.0}
+        except Exception:
+            raise
+
+    @staticmethod
+    def estaCompleta(ruta: str) -> bool:
+        """
+        Comprueba que un JPEG termina con el marcador de fin de imagen. El resto de formatos se dan por completos.
+
+        Args:
+            ruta (str): Ruta de la imagen.
+
+        Returns:
+            bool: True si la imagen parece escrita por completo.
+        """
+        try:
+            if not ruta.lower().endswith((".jpg", ".jpeg")):
+                return True
+            with open(ruta, "rb") as archivo:
+                archivo.seek(max(os.path.getsize(ruta) - 16, 0))
+                return b"\xff\xd9" in archivo.read()
+        except OSError:
+            return False
+
+    def explorar(self) -> List[Dict[str, any]]:
+        """
+        Recorre las carpetas vigiladas y devuelve las imagenes nuevas que ya no estan cambiando.
+
+        Args:
+            None
+
+        Returns:
+            list[dict]: Ruta, tamaño, modificacion e instante de llegada de cada imagen lista para procesar.
+        """
+        try:
+            ahora = time.monotonic()
+            listas, vistas = [], set()
+            for directorio in self.directorios:
+                try:
+                    elementos = list(os.scandir(directorio))
+                except FileNotFoundError:
+                    continue
+                for elemento in sorted(elementos, key=lambda e: e.name):
+                    nombre = elemento.name
+                    if not elemento.is_file() or not nombre.lower().endswith(EXTENSIONES_IMAGEN) or nombre.lower().endswith("_manual.jpg") or nombre in (ARCHIVO_IMAGEN_MASCARAS, ARCHIVO_IMAGEN_PUNTOS, ARCHIVO_HISTOGRAMA):
+                        continue
+                    ruta = elemento.path.replace(os.sep, "/")
+                    vistas.add(ruta)
+                    estado = elemento.stat()
+                    firma = (estado.st_size, estado.st_mtime_ns)
+                    if self.revisadas.get(ruta) == firma:
+                        continue
+
+                    # Si el archivo ha cambiado desde la ultima pasada, se reinicia el tiempo de estabilidad
+                    anterior = self.candidatas.get(ruta)
+                    if anterior is None or anterior[:2] != firma:
+                        llegada = anterior[2] if anterior is not None else ahora
+                        self.candidatas[ruta] = (firma[0], firma[1], llegada, ahora)
+                        continue
+                    if firma[0] == 0 or ahora - anterior[3] < self.estabilidad or not IngestaCarpetas.estaCompleta(ruta):
+                        continue
+                    listas.append({"ruta": ruta, "tamaño": firma[0], "modificacion": firma[1], "llegada": anterior[2]})
+
+            # Las imagenes que ya no estan en las carpetas se olvidan, para que la memoria no crezca con el tiempo
+            for ruta in [ruta for ruta in self.revisadas if ruta not in vistas]:
+                del self.revisadas[ruta]
+            for ruta in [ruta for ruta in self.candidatas if ruta not in vistas]:
+                del self.candidatas[ruta]
+            return listas
+        except Exception:
+            raise
+
+    def __salida(self, ruta: str) -> str:
+        """
+        Obtiene la ruta de salida de una imagen: junto a la imagen o dentro del directorio de salida, por carpeta vigilada.
+        """
+        base = os.path.splitext(ruta)[0]
+        if self.junto:
+            return os.path.abspath(base).replace(os.sep, "/")
+        return os.path.join(os.path.basename(os.path.dirname(os.path.abspath(ruta))), os.path.basename(base)).replace(os.sep, "/")
+
+    def __bucleVigilancia(self) -> None:
+        """
+        Bucle del hilo que vigila las carpetas y encola las imagenes listas.
+        """
+        while not self.parar.is_set():
+            try:
+                for imagen in self.explorar():
+                    huella = CacheResultados.huellaArchivo(imagen["ruta"])
+                    with self.cerrojo:
+                        duplicada = huella in self.huellas or huella in self.enCurso
+                    if duplicada:
+                        self.revisadas[imagen["ruta"]] = (imagen["tamaño"], imagen["modificacion"])
+                        self.candidatas.pop(imagen["ruta"], None)
+                        self.estadisticas["duplicadas"] += 1
+                        print(f"[INFO] {imagen['ruta']}: contenido ya procesado, se descarta")
+                        continue
+                    with self.cerrojo:
+                        self.enCurso.add(huella)
+                    try:
+                        # Si la cola esta llena, la imagen se queda como candidata y se vuelve a intentar en la siguiente pasada
+                        self.cola.put_nowait({**imagen, "huella": huella, "salida": self.__salida(imagen["ruta"])})
+                    except queue.Full:
+                        with self.cerrojo:
+                            self.enCurso.discard(huella)
+                        break
+                    self.revisadas[imagen["ruta"]] = (imagen["tamaño"], imagen["modificacion"])
+                    self.candidatas.pop(imagen["ruta"], None)
+            except Exception as e:
+                print(f"[ERROR] Ha ocurrido un error al explorar las carpetas vigiladas: {str(e)}")
+            self.parar.wait(self.intervalo)
+
+    def __bucleProcesamiento(self) -> None:
+        """
+        Bucle del hilo que segmenta las imagenes de la cola con el modelo ya cargado.
+        """
+        while not self.parar.is_set():
+            try:
+                imagen = self.cola.get(timeout=self.intervalo)
+            except queue.Empty:
+                continue
+            try:
+                registro = self.lote.procesarImagen(imagen)
+                registro["huella"] = imagen["huella"]
+                # Anota la imagen y su huella en el diario y elimina sus cuadrantes parciales
+                self.lote.completar(registro)
+                latencia = time.monotonic() - imagen["llegada"]
+                self.estadisticas["procesadas"] += 1
+                self.estadisticas["latenciaMedia"] += (latencia - self.estadisticas["latenciaMedia"]) / self.estadisticas["procesadas"]
+                print(f"[INFO] {imagen['ruta']}: {registro['conteo']} rodaballos, {latencia:.2f} s desde su llegada ({self.cola.qsize()} en cola)")
+            except Exception as e:
+                self.lote.diario.registrar("error", imagen=imagen["ruta"], error=str(e))
+                self.estadisticas["fallidas"] += 1
+                print(f"[ERROR] {imagen['ruta']}: {str(e)}")
+            finally:
+                with self.cerrojo:
+                    self.enCurso.discard(imagen["huella"])
+                self.cola.task_done()
+
+    def iniciar(self) -> None:
+        """
+        Arranca los hilos de vigilancia y de procesamiento.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        try:
+            # El modelo se carga antes de vigilar, para que la primera imagen no espere a su carga
+            self.lote.cargarModelo()
+            self.parar.clear()
+            self.hilos = [
+                threading.Thread(target=self.__bucleVigilancia, name="vigilancia", daemon=True),
+                threading.Thread(target=self.__bucleProcesamiento, name="procesamiento", daemon=True),
+            ]
+            for hilo in self.hilos:
+                hilo.start()
+        except Exception:
+            raise
+
+    def detener(self) -> None:
+        """
+        Detiene los hilos, esperando a que termine la imagen en curso, y cierra el diario.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        try:
+            self.parar.set()
+            for hilo in self.hilos:
+                hilo.join()
+            self.hilos = []
+            self.lote.diario.cerrar()
+        except Exception:
+            raise
+
+def main(argumentos: Union[List[str], None] = None) -> int:
+    parser = argparse.ArgumentParser(description="Servicio de ingesta de TURBOT SAM que segmenta las imagenes que llegan a las carpetas vigiladas.")
+    parser.add_argument("directorios", nargs="+", help="Carpetas a vigilar.")
+    parser.add_argument("--configuracion", required=True, help=f"Nombre de la configuracion ({', '.join(Configuraciones.listar())}) o ruta de un JSON.")
+    parser.add_argument("--salida", default="ingesta", help="Directorio del diario y, salvo con --junto, de los resultados.")
+    parser.add_argument("--junto", action="store_true", help="Escribir los resultados de cada imagen en una carpeta junto a ella.")
+    parser.add_argument("--cuadrantes", type=int, default=None, help="Numero de cuadrantes. Por defecto el de la configuracion.")
+    parser.add_argument("--intervalo", type=float, default=0.5, help="Segundos entre dos recorridos de las carpetas.")
+    parser.add_argument("--estabilidad", type=float, default=1.0, help="Segundos sin cambios para considerar que una imagen esta completa.")
+    parser.add_argument("--cola", type=int, default=8, help="Numero maximo de imagenes en espera de segmentarse.")
+    parser.add_argument("--base-datos", default=None, help="Base de datos SQLite en la que registrar cada imagen, su conteo y sus mascaras.")
+    parser.add_argument("--secuencia", action="store_true", help="Segmentar cada imagen a partir de los centroides de la anterior del mismo tanque y camara.")
+    args = parser.parse_args(argumentos)
+
+    baseResultados = BaseResultados(args.base_datos) if args.base_datos else None
+    ingesta = IngestaCarpetas(args.directorios, args.salida, args.configuracion, args.cuadrantes, args.junto, args.intervalo, args.estabilidad, args.cola, baseResultados, args.secuencia)
+    signal.signal(signal.SIGTERM, lambda *_: ingesta.parar.set())
+    ingesta.iniciar()
+    print(f"[INFO] Vigilando {', '.join(args.directorios)}. Pulse Ctrl+C para detener")
+    try:
+        while not ingesta.parar.wait(1.0):
+            pass
+    except KeyboardInterrupt:
+        pass
+    ingesta.detener()
+    if baseResultados is not None:
+        baseResultados.cerrar()
+    estadisticas = ingesta.estadisticas
+    print(f"[INFO] Ingesta detenida: {estadisticas['procesadas']} procesadas, {estadisticas['duplicadas']} duplicadas, {estadisticas['fallidas']} fallidas, latencia media {estadisticas['latenciaMedia']:.2f} s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
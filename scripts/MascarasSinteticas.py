@@ -0,0 +1,128 @@
+from typing import List, Dict, Tuple
+import math
+import cv2
+import numpy as np
+
+class GeneradorMascarasSinteticas:
+    """
+    Clase que genera mascaras sinteticas con la misma estructura que las que devuelve SamAutomaticMaskGenerator
+    (segmentation, area, bbox, predicted_iou, point_coords, stability_score y crop_box), para medir el postprocesamiento
+    sin necesidad del modelo.
+
+    Cada mascara es una elipse con el tamaño aproximado de un rodaballo, situada dentro de un cuadrante de la imagen con
+    la misma division en cuadrantes que Utils.recortarCuadrantes.
+    """
+
+    def __init__(self, dimensiones: Tuple[int, int] = (1920, 2560), numCuadrantes: int = 16, semilla: int = 0):
+        self.dimensiones = dimensiones
+        self.numCuadrantes = numCuadrantes
+        self.raiz = int(math.sqrt(numCuadrantes))
+        self.alturaCuadrante = dimensiones[0] // self.raiz
+        self.anchuraCuadrante = dimensiones[1] // self.raiz
+        self.generador = np.random.default_rng(semilla)
+
+        # Semiejes de las elipses escalados con la resolucion. A 1920 px de altura un rodaballo mide unos 20-50 px
+        escala = dimensiones[0] / 1920
+        self.semiejeMinimo = max(2, int(round(10 * escala)))
+        self.semiejeMaximo = max(self.semiejeMinimo + 1, int(round(25 * escala)))
+
+    def __generarMascara(self) -> Dict[str, any]:
+        """
+        Genera una mascara eliptica en coordenadas de cuadrante.
+
+        Args:
+            None
+
+        Returns:
+            dict: La mascara con la estructura de SAM.
+        """
+        alturaCuadrante, anchuraCuadrante = self.alturaCuadrante, self.anchuraCuadrante
+        ejes = self.generador.integers(self.semiejeMinimo, self.semiejeMaximo, size=2)
+        ejes = np.minimum(ejes, [max(1, anchuraCuadrante // 2 - 1), max(1, alturaCuadrante // 2 - 1)])
+        radio = int(ejes.max())
+        centroX = int(self.generador.integers(radio, max(radio + 1, anchuraCuadrante - radio)))
+        centroY = int(self.generador.integers(radio, max(radio + 1, alturaCuadrante - radio)))
+        angulo = float(self.generador.uniform(0, 180))
+
+        mascara = np.zeros((alturaCuadrante, anchuraCuadrante), dtype=np.uint8)
+        cv2.ellipse(mascara, (centroX, centroY), (int(ejes[0]), int(ejes[1])), angulo, 0, 360, 1, -1)
+        segmentacion = mascara.view(bool)
+
+        ys, xs = np.nonzero(mascara)
+        x0, y0 = int(xs.min()), int(ys.min())
+        return {
+            "segmentation": segmentacion,
+            "area": int(len(xs)),
+            "bbox": [x0, y0, int(xs.max()) - x0 + 1, int(ys.max()) - y0 + 1],
+            "predicted_iou": float(self.generador.uniform(0.88, 1.0)),
+            "point_coords": [[float(centroX), float(centroY)]],
+            "stability_score": float(self.generador.uniform(0.95, 1.0)),
+            "crop_box": [0, 0, anchuraCuadrante, alturaCuadrante],
+        }
+
+    def generarPorCuadrante(self, numMascaras: int) -> List[List[Dict[str, any]]]:
+        """
+        Genera mascaras repartidas de forma uniforme entre los cuadrantes, con la segmentacion del tamaño del cuadrante
+        como las que recibe ProcesarMascaras.superponerMascaras.
+
+        Args:
+            numMascaras (int): Numero total de mascaras.
+
+        Returns:
+            list[list[dict]]: Lista de mascaras de cada cuadrante.
+        """
+        try:
+            mascarasPorCuadrante = [[] for _ in range(self.raiz * self.raiz)]
+            for i in range(numMascaras):
+                mascarasPorCuadrante[i % len(mascarasPorCuadrante)].append(self.__generarMascara())
+            return mascarasPorCuadrante
+        except Exception:
+            raise
+
+    def aImagenCompleta(self, mascarasPorCuadrante: List[List[Dict[str, any]]]) -> List[Dict[str, any]]:
+        """
+        Copia las mascaras de cada cuadrante en mascaras del tamaño de la imagen completa, equivalentes a la salida de
+        ProcesarMascaras.superponerMascaras pero sin medir su coste.
+
+        Args:
+            mascarasPorCuadrante (list[list[dict]]): Mascaras generadas con generarPorCuadrante.
+
+        Returns:
+            list[dict]: Mascaras en coordenadas de la imagen completa.
+        """
+        try:
+            altura, anchura = self.dimensiones
+            mascaras = []
+            for idx, mascarasCuadrante in enumerate(mascarasPorCuadrante):
+                i, j = divmod(idx, self.raiz)
+                inicioY, inicioX = i * self.alturaCuadrante, j * self.anchuraCuadrante
+                for mascara in mascarasCuadrante:
+                    segmentacion = np.zeros((altura, anchura), dtype=bool)
+                    segmentacion[inicioY:inicioY + self.alturaCuadrante, inicioX:inicioX + self.anchuraCuadrante] = mascara["segmentation"]
+                    mascaras.append(dict(mascara, segmentation=segmentacion))
+            return mascaras
+        except Exception:
+            raise
+
+    def generarImagen(self, mascarasPorCuadrante: List[List[Dict[str, any]]]) -> np.ndarray:
+        """
+        Genera una imagen en escala de grises con fondo oscuro y las mascaras mas claras, para que el filtro de
+        intensidad de ProcesarMascaras.procesarMascaras se comporte como con imagenes reales.
+
+        Args:
+            mascarasPorCuadrante (list[list[dict]]): Mascaras generadas con generarPorCuadrante.
+
+        Returns:
+            np.ndarray: La imagen (altura, anchura) en escala de grises.
+        """
+        try:
+            altura, anchura = self.dimensiones
+            gris = self.generador.integers(0, 20, size=(altura, anchura), dtype=np.uint8)
+            for idx, mascarasCuadrante in enumerate(mascarasPorCuadrante):
+                i, j = divmod(idx, self.raiz)
+                cuadrante = gris[i * self.alturaCuadrante:(i + 1) * self.alturaCuadrante, j * self.anchuraCuadrante:(j + 1) * self.anchuraCuadrante]
+                for mascara in mascarasCuadrante:
+                    cuadrante[mascara["segmentation"]] = self.generador.integers(60, 200)
+            return gris
+        except Exception:
+            raise
@@ -0,0 +1,313 @@
+from scripts.Configuraciones import Configuraciones
+from scripts.ProcesarMascaras import ProcesarMascaras
+from scripts.Perfilador import perfilador
+from scripts.Exportaciones import ARCHIVO_PUNTOS, ARCHIVO_MASCARAS, CAMPOS_MASCARAS
+from typing import Union, List, Tuple, Dict, Iterator
+import argparse
+import tifffile
+import math
+import time
+import csv
+import sys
+import os
+import cv2
+import numpy as np
+
+# Dimensiones de las imagenes de las camaras con las que se ajustaron las configuraciones. El tamaño de los cuadrantes
+# de un mosaico se deduce de ellas para que los rodaballos se vean a la misma escala que en las imagenes sueltas
+DIMENSIONES_REFERENCIA = (1920, 2560)
+
+# Nombre de la imagen de etiquetas del mosaico, que se escribe cuadrante a cuadrante
+ARCHIVO_ETIQUETAS_MOSAICO = "EtiquetasMosaico.tif"
+
+class Mosaico:
+    """
+    Clase que da acceso por ventanas a un TIFF de gran tamaño sin cargarlo entero en memoria.
+
+    Si el TIFF no esta comprimido y sus datos son contiguos, se proyecta en memoria y cada ventana se lee directamente
+    del archivo. Si esta dividido en teselas o tiras comprimidas, cada ventana decodifica solo los segmentos que la
+    cortan. En ambos casos la memoria usada depende del tamaño de la ventana, no del mosaico.
+
+    Argumentos:
+    ruta (str): Ruta del TIFF.
+    """
+
+    def __init__(self, ruta: str):
+
+        try:
+            self.ruta = ruta
+            self.tiff = tifffile.TiffFile(ruta)
+            self.pagina = self.tiff.pages[0]
+            self.altura, self.anchura = self.pagina.shape[:2]
+            if self.pagina.dtype not in (np.uint8, np.uint16):
+                raise ValueError(f"Tipo de datos no soportado en el mosaico: {self.pagina.dtype}")
+            if self.pagina.samplesperpixel not in (1, 3, 4) or (self.pagina.samplesperpixel > 1 and self.pagina.planarconfig != 1):
+                raise ValueError("Solo se soportan mosaicos en escala de grises o RGB con los canales intercalados")
+            self.datos = tifffile.memmap(ruta, mode="r") if self.pagina.is_memmappable else None
+        except Exception:
+            raise
+
+    @property
+    def dimensiones(self) -> Tuple[int, int]:
+        return (self.altura, self.anchura)
+
+    def __leerSegmentos(self, y0: int, y1: int, x0: int, x1: int) -> np.ndarray:
+        """
+        Lee una ventana decodificando solo las teselas o tiras del TIFF que la cortan.
+        """
+        pagina = self.pagina
+        altoSegmento, anchoSegmento = pagina.chunks[:2]
+        filas, columnas = pagina.chunked[:2]
+        ventana = np.empty((y1 - y0, x1 - x0) + pagina.shape[2:], dtype=pagina.dtype)
+        manejador = self.tiff.filehandle
+        for fila in range(y0 // altoSegmento, min(math.ceil(y1 / altoSegmento), filas)):
+            for columna in range(x0 // anchoSegmento, min(math.ceil(x1 / anchoSegmento), columnas)):
+                indice = fila * columnas + columna
+                manejador.seek(pagina.dataoffsets[indice])
+                segmento, (_, _, sy, sx, _), _ = pagina.decode(manejador.read(pagina.databytecounts[indice]), indice)
+                segmento = segmento[0] if pagina.samplesperpixel > 1 else segmento[0, :, :, 0]
+                # Las teselas del borde pueden venir rellenas mas alla del mosaico
+                ay0, ay1 = max(y0, sy), min(y1, sy + segmento.shape[0], self.altura)
+                ax0, ax1 = max(x0, sx), min(x1, sx + segmento.shape[1], self.anchura)
+                ventana[ay0 - y0:ay1 - y0, ax0 - x0:ax1 - x0] = segmento[ay0 - sy:ay1 - sy, ax0 - sx:ax1 - sx]
+        return ventana
+
+    def leerVentana(self, y0: int, y1: int, x0: int, x1: int) -> np.ndarray:
+        """
+        Lee una ventana del mosaico y la devuelve como un plano uint8 en escala de grises, igual que Utils.cargarImagen.
+
+        Args:
+            y0, y1 (int): Filas inicial y final (sin incluir) de la ventana.
+            x0, x1 (int): Columnas inicial y final (sin incluir) de la ventana.
+
+        Returns:
+            np.ndarray: Ventana (y1 - y0, x1 - x0) en escala de grises. Es una copia, independiente del archivo.
+        """
+        try:
+            with perfilador.etapa("leerVentana"):
+                ventana = np.array(self.datos[y0:y1, x0:x1]) if self.datos is not None else self.__leerSegmentos(y0, y1, x0, x1)
+            if ventana.dtype == np.uint16:
+                ventana = (ventana >> 8).astype(np.uint8)
+            if ventana.ndim == 3:
+                ventana = cv2.cvtColor(ventana, cv2.COLOR_RGBA2GRAY if ventana.shape[2] == 4 else cv2.COLOR_RGB2GRAY)
+            return ventana
+        except Exception:
+            raise
+
+    def cerrar(self) -> None:
+        self.datos = None
+        self.tiff.close()
+
+class CuadrantesMosaico:
+    """
+    Clase que representa los cuadrantes de un mosaico como una secuencia que se lee bajo demanda. Se puede pasar a
+    TurbotSAM.generarMascarasPorCuadrante en lugar de la lista de Utils.recortarCuadrantes: cada cuadrante se lee del
+    disco al llegar a el y solo se conserva el ultimo leido, que hace falta despues para el filtro de intensidad.
+
+    Argumentos:
+    mosaico (Mosaico): El mosaico a recorrer.
+    tamaño (tuple[int, int]): Altura y anchura de los cuadrantes. Los del borde derecho e inferior pueden ser menores.
+    """
+
+    def __init__(self, mosaico: Mosaico, tamaño: Tuple[int, int]):
+        self.mosaico = mosaico
+        altura, anchura = mosaico.dimensiones
+        self.ventanas = [(y, min(y + tamaño[0], altura), x, min(x + tamaño[1], anchura)) for y in range(0, altura, tamaño[0]) for x in range(0, anchura, tamaño[1])]
+        self.actual = None
+
+    def __len__(self) -> int:
+        return len(self.ventanas)
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for ventana in self.ventanas:
+            self.actual = None
+            self.actual = self.mosaico.leerVentana(*ventana)
+            yield self.actual
+
+class ProcesamientoMosaico:
+    """
+    Clase que segmenta un mosaico de un tanque completo cuadrante a cuadrante, leyendo cada cuadrante del disco y
+    escribiendo sus resultados antes de pasar al siguiente. El pico de memoria depende del tamaño de los cuadrantes y
+    no del mosaico.
+
+    Los resultados son los mismos archivos CSV de puntos y de mascaras que exporta la interfaz, en coordenadas del
+    mosaico, y una imagen de etiquetas TIFF del tamaño del mosaico proyectada en memoria. Igual que con los cuadrantes
+    de una imagen, las mascaras de cuadrantes vecinos no se fusionan.
+
+    Argumentos:
+    nombreConfiguracion (str): Nombre de la configuracion o ruta de un JSON.
+    numCuadrantes (int o None): Numero de cuadrantes en que la configuracion divide una imagen de la camara. Decide el
+        tamaño de los cuadrantes del mosaico. Por defecto el de la configuracion.
+    """
+
+    def __init__(self, nombreConfiguracion: str, numCuadrantes: Union[int, None] = None):
+
+        try:
+            self.configuracion = Configuraciones.obtener(nombreConfiguracion)
+            if numCuadrantes is not None:
+                self.configuracion["numCuadrantes"] = numCuadrantes
+            self.dimensionesCuadrante = ProcesamientoMosaico.tamañoCuadrante(self.configuracion["numCuadrantes"])
+            self.turbotSam = None
+        except Exception:
+            raise
+
+    @staticmethod
+    def tamañoCuadrante(numCuadrantes: Union[int, None]) -> Tuple[int, int]:
+        """
+        Obtiene el tamaño de los cuadrantes del mosaico: el de los cuadrantes de una imagen de la camara con la misma
+        configuracion.
+
+        Args:
+            numCuadrantes (int o None): Numero de cuadrantes de la configuracion, o None para la imagen completa.
+
+        Returns:
+            tuple[int, int]: Altura y anchura de los cuadrantes.
+        """
+        raiz = int(np.sqrt(numCuadrantes)) if numCuadrantes else 1
+        return (DIMENSIONES_REFERENCIA[0] // raiz, DIMENSIONES_REFERENCIA[1] // raiz)
+
+    def cargarModelo(self):
+        """
+        Carga el modelo la primera vez que hace falta.
+        """
+        if self.turbotSam is None:
+            from scripts.TurbotSAM import TurbotSAM
+            self.turbotSam = TurbotSAM(**self.configuracion["parametros"])
+        return self.turbotSam
+
+    def procesarCuadrante(self, imagen: np.ndarray, mascaras: List[Dict[str, any]]) -> Tuple[Union[np.ndarray, None], List[Dict[str, any]], List[Tuple[int, int]]]:
+        """
+        Obtiene los resultados de un cuadrante en sus propias coordenadas, con el mismo postprocesamiento que
+        PipelineSegmentacion. El tamaño maximo se calcula sobre el area de una imagen de la camara, como en una imagen
+        suelta dividida en cuadrantes.
+
+        Args:
+            imagen (np.ndarray): El cuadrante en escala de grises.
+            mascaras (list[dict]): Mascaras de SAM del cuadrante.
+
+        Returns:
+            tuple: Imagen de etiquetas del cuadrante (o None si no hay mascaras), mascaras finales y array (N, 2) de
+            centroides x, y.
+        """
+        try:
+            if self.configuracion["procesamiento"] and mascaras:
+                params = self.configuracion["paramsProcesamiento"]
+                maxSize = params["max_size"] * DIMENSIONES_REFERENCIA[0] * DIMENSIONES_REFERENCIA[1]
+                with perfilador.etapa("procesarMascaras"):
+                    _, mascaras = ProcesarMascaras.procesarMascaras(np.zeros(imagen.shape, dtype=np.uint16), mascaras, imagen, params["min_size"], maxSize, params["min_intensity"])
+            if not mascaras:
+                return None, [], np.zeros((0, 2), dtype=np.int64)
+            with perfilador.etapa("mostrarLabels"):
+                etiquetas = ProcesarMascaras.mostrarLabels(mascaras)
+            with perfilador.etapa("calcularCentroides"):
+                centroides, _ = ProcesarMascaras.calcularCentroides(mascaras)
+            return etiquetas, mascaras, centroides
+        except Exception:
+            raise
+
+    @staticmethod
+    def desplazarMascara(mascara: Dict[str, any], y0: int, x0: int) -> Dict[str, any]:
+        """
+        Pasa las propiedades de una mascara (sin la segmentacion) de coordenadas del cuadrante a coordenadas del mosaico.
+
+        Args:
+            mascara (dict): Mascara de SAM.
+            y0, x0 (int): Esquina superior izquierda del cuadrante en el mosaico.
+
+        Returns:
+            dict: Las propiedades de la mascara en coordenadas del mosaico.
+        """
+        desplazada = {clave: valor for clave, valor in mascara.items() if clave != "segmentation"}
+        if "bbox" in desplazada:
+            x, y, w, h = desplazada["bbox"]
+            desplazada["bbox"] = [x + x0, y + y0, w, h]
+        if "point_coords" in desplazada:
+            desplazada["point_coords"] = [[px + x0, py + y0] for px, py in desplazada["point_coords"]]
+        if "crop_box" in desplazada:
+            x, y, w, h = desplazada["crop_box"]
+            desplazada["crop_box"] = [x + x0, y + y0, w, h]
+        return desplazada
+
+    def ejecutar(self, ruta: str, directorio: str) -> Dict[str, any]:
+        """
+        Segmenta un mosaico cuadrante a cuadrante y escribe sus resultados en un directorio. Los archivos se escriben
+        con nombres temporales y se renombran al terminar, de forma que una interrupcion no deja resultados a medias.
+
+        Args:
+            ruta (str): Ruta del TIFF del mosaico.
+            directorio (str): Directorio de salida.
+
+        Returns:
+            dict: Dimensiones del mosaico, numero de cuadrantes, conteo total, duracion y ruta de cada archivo.
+        """
+        mosaico = Mosaico(ruta)
+        os.makedirs(directorio, exist_ok=True)
+        salidas = {
+            "puntos": os.path.join(directorio, ARCHIVO_PUNTOS),
+            "mascaras": os.path.join(directorio, ARCHIVO_MASCARAS),
+            "etiquetas": os.path.join(directorio, ARCHIVO_ETIQUETAS_MOSAICO),
+        }
+        temporales = {}
+        for nombre, destino in salidas.items():
+            base, extension = os.path.splitext(destino)
+            temporales[nombre] = f"{base}.{os.getpid()}.tmp{extension}"
+        etiquetas = None
+        try:
+            inicio = time.perf_counter()
+            turbotSam = self.cargarModelo()
+            cuadrantes = CuadrantesMosaico(mosaico, self.dimensionesCuadrante)
+            etiquetas = tifffile.memmap(temporales["etiquetas"], shape=mosaico.dimensiones, dtype=np.uint32, bigtiff=True, photometric="minisblack")
+            conteo = 0
+            with open(temporales["puntos"], "w", newline="") as archivoPuntos, open(temporales["mascaras"], "w", newline="") as archivoMascaras:
+                escritorPuntos = csv.writer(archivoPuntos)
+                escritorPuntos.writerow(["x", "y"])
+                escritorMascaras = csv.DictWriter(archivoMascaras, fieldnames=CAMPOS_MASCARAS, quoting=csv.QUOTE_NONE, escapechar="\\", extrasaction="ignore")
+                escritorMascaras.writeheader()
+
+                for _, mascarasPorCuadrante, numero in turbotSam.generarMascarasPorCuadrante(cuadrantes, self.configuracion["procesamiento"], acumular=False):
+                    y0, y1, x0, x1 = cuadrantes.ventanas[numero - 1]
+                    etiquetasCuadrante, mascaras, centroides = self.procesarCuadrante(cuadrantes.actual, mascarasPorCuadrante[-1])
+                    if etiquetasCuadrante is not None:
+                        ocupadas = etiquetasCuadrante > 0
+                        etiquetas[y0:y1, x0:x1][ocupadas] = etiquetasCuadrante[ocupadas] + conteo
+                    escritorPuntos.writerows((centroides + (x0, y0)).tolist())
+                    escritorMascaras.writerows(ProcesamientoMosaico.desplazarMascara(mascara, y0, x0) for mascara in mascaras)
+                    conteo += len(mascaras)
+                    etiquetas.flush()
+                    print(f"[INFO] Cuadrante {numero}/{len(cuadrantes)}: {len(mascaras)} rodaballos ({conteo} en total)")
+
+            etiquetas.flush()
+            del etiquetas
+            etiquetas = None
+            for nombre, destino in salidas.items():
+                os.replace(temporales[nombre], destino)
+            return {"dimensiones": list(mosaico.dimensiones), "cuadrantes": len(cuadrantes), "conteo": conteo, "duracion": round(time.perf_counter() - inicio, 4), "salidas": salidas}
+        except Exception:
+            etiquetas = None
+            for temporal in temporales.values():
+                if os.path.exists(temporal):
+                    os.remove(temporal)
+            raise
+        finally:
+            mosaico.cerrar()
+
+def main(argumentos: Union[List[str], None] = None) -> int:
+    parser = argparse.ArgumentParser(description="Segmentacion por cuadrantes de mosaicos TIFF de TURBOT SAM, sin cargarlos en memoria.")
+    parser.add_argument("mosaico", help="Ruta del TIFF del mosaico.")
+    parser.add_argument("--configuracion", required=True, help=f"Nombre de la configuracion ({', '.join(Configuraciones.listar())}) o ruta de un JSON.")
+    parser.add_argument("--salida", required=True, help="Directorio de salida.")
+    parser.add_argument("--cuadrantes", type=int, default=None, help="Numero de cuadrantes en que la configuracion divide una imagen de la camara. Por defecto el de la configuracion.")
+    args = parser.parse_args(argumentos)
+
+    try:
+        procesamiento = ProcesamientoMosaico(args.configuracion, args.cuadrantes)
+        resumen = procesamiento.ejecutar(args.mosaico, args.salida)
+    except Exception as e:
+        print(f"[ERROR] Ha ocurrido un error al procesar el mosaico: {str(e)}")
+        return 1
+    altura, anchura = resumen["dimensiones"]
+    print(f"[INFO] Mosaico de {anchura}x{altura} procesado en {resumen['cuadrantes']} cuadrantes: {resumen['conteo']} rodaballos en {resumen['duracion']:.1f} s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,26 @@
-from qtpy.QtWidgets import QScrollArea, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QFileDialog, QCheckBox, QComboBox, QLabel, QProgressBar, QTextEdit, QDoubleSpinBox, QSpinBox, QGroupBox
+from qtpy.QtWidgets import QScrollArea, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QFileDialog, QCheckBox, QComboBox, QLabel, QProgressBar, QDoubleSpinBox, QSpinBox, QGroupBox
 from PyQt5.QtCore import  QTimer
-from typing import Union, List, Tuple
+from typing import Union, List, Tuple, Dict
 from scripts.Utils import Utils
-from scripts.TurbotSAM import TurbotSAM
 from scripts.ProcesarMascaras import ProcesarMascaras
-from skimage.color import label2rgb
+from scripts.TrabajadorInferencia import TrabajadorInferencia, compartirArray
+from scripts.PlanificadorTrabajos import PlanificadorTrabajos
+from scripts.BusEventos import BusEventos, CuadroSalida, Evento
+from scripts.Perfilador import Perfilador, perfilador
+from scripts.Configuraciones import Configuraciones
+from scripts.CacheResultados import CacheResultados
+from scripts.AlmacenFragmentado import AlmacenFragmentado
+from scripts.Exportaciones import Exportaciones
 import napari
-import torch
-import cv2
-import csv
 import threading
+import queue
+import time
+import torch
+import os
 import numpy as np
-import matplotlib.pyplot as plt
+
+# Factor de reduccion de la vista previa que se muestra mientras se carga la imagen completa
+FACTOR_VISTA_PREVIA = 4
 
 class NapariSAM:
     """
@@ -111,6 +120,14 @@ class NapariSAM:
             self.chkNoZoom = QCheckBox("Imagen Sin Zoom")
             self.cargarLayout.addWidget(self.chkNoZoom)
             self.chkNoZoom.stateChanged.connect(self.__toggleNoZoom)
+            
+            # Seleccionar una configuracion guardada, predefinida o generada por el autoajuste
+            self.configuracionCombo = QComboBox()
+            self.configuracionCombo.setToolTip("Selecciona una configuración guardada para establecer los parámetros de segmentación, los cuadrantes y el postprocesamiento. Las configuraciones auto_* se generan con python -m scripts.Autoajuste.")
+            self.configuracionCombo.addItem("Configuración manual")
+            self.configuracionCombo.addItems(Configuraciones.listar())
+            self.cargarLayout.addWidget(self.configuracionCombo)
+            self.configuracionCombo.currentIndexChanged.connect(self.__aplicarConfiguracion)
         except Exception as e:
             self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error durante el proceso de carga de imagen: {str(e)}")
             
@@ -326,12 +343,24 @@ class NapariSAM:
             # Botón para iniciar la segmentacion
             self.btnSegmentacion = QPushButton("INICIAR SEGMENTACIÓN")
             self.segmentacionLayout.addWidget(self.btnSegmentacion)
-            self.btnSegmentacion.clicked.connect(self.__iniciarSegmentacionThread)
+            self.btnSegmentacion.clicked.connect(self.__iniciarSegmentacionTrabajador)
+            
+            # Botón para cancelar la segmentacion en curso
+            self.btnCancelar = QPushButton("CANCELAR SEGMENTACIÓN")
+            self.btnCancelar.setToolTip("Cancela la segmentación en curso y las pendientes. La segmentación se detiene al terminar el cuadrante o el lote de puntos que se está procesando")
+            self.segmentacionLayout.addWidget(self.btnCancelar)
+            self.btnCancelar.clicked.connect(self.__cancelarSegmentacion)
             
             # Inicializar la barra de progreso
             self.progreso = QProgressBar()
             self.segmentacionLayout.addWidget(self.progreso)
             
+            # Opcion de registrar los tiempos y la memoria de cada etapa
+            self.chkPerfilado = QCheckBox("Activar perfilado")
+            self.chkPerfilado.setToolTip("Registra el tiempo de reloj, el tiempo de CPU y el pico de memoria de cada etapa (carga, cuadrantes, codificador, decodificador, NMS, superposición, etiquetas, postprocesamiento y centroides). Al terminar cada segmentación se guarda en la carpeta 'perfiles' una traza para chrome://tracing (.json) y una tabla resumen (.txt)")
+            self.segmentacionLayout.addWidget(self.chkPerfilado)
+            self.chkPerfilado.stateChanged.connect(self.__togglePerfilado)
+            
             # Comparacion de resultados con algun valor previo
             comparacionLayout = QHBoxLayout()
             comparacionName = "Número de Rodaballos a Comparar"  
@@ -370,8 +399,8 @@ class NapariSAM:
             self.cuadroLayout = QVBoxLayout()
             self.cuadroGroupbox.setLayout(self.cuadroLayout)
             
-            # Cuadro de texto para mostrar logs
-            self.log = QTextEdit()
+            # Cuadro de texto para mostrar logs, con un numero maximo de lineas
+            self.log = CuadroSalida()
             self.log.append('<div style="text-align: left; font-weight: bold; font-size: 10pt;"><u>TURBOT SAM<br></u><br></div>')
             self.cuadroLayout.addWidget(self.log)
             
@@ -426,6 +455,12 @@ class NapariSAM:
             self.btnExpMascarasCSV.setToolTip(expMascarasText)
             self.exportacionesLayout.addWidget(self.btnExpMascarasCSV)
             self.btnExpMascarasCSV.clicked.connect(self.__exportarMascarasCSV)
+
+            # Boton para exportar las segmentaciones de las mascaras en formato COCO
+            self.btnExpMascarasCOCO = QPushButton("Exportar Mascaras COCO")
+            self.btnExpMascarasCOCO.setToolTip("Exporta la forma de cada máscara como RLE comprimido en un JSON con formato COCO, junto con su área, caja envolvente, predicted IoU y stability score (si se ha elegido la opcion de postprocesamiento se exportará el resultado de salida del mismo sino exportará el resultado generado por SAM)")
+            self.exportacionesLayout.addWidget(self.btnExpMascarasCOCO)
+            self.btnExpMascarasCOCO.clicked.connect(self.__exportarMascarasCOCO)
             
             # Boton para exportar la imagen con puntos
             self.btnExpPuntos = QPushButton("Exportar Imagen Puntos")
@@ -466,12 +501,12 @@ class NapariSAM:
             self.imagenZoom = True                 # Variable para almacenar la seleccion de zoom
             self.mascarasGeneradas = None          # Variable para almacenar las mascaras generadas
             self.mascarasGeneradasAux = None       # Variable para almacenar las mascaras generadas como copia para exportarlo 
-            self.puntosGenerados = None            # Variable para almacenar los puntos generados
-            self.puntosGeneradosAux = None         # Variable para almacenar los puntos generados como copia para exportarlos
+            self.puntosGenerados = None            # Variable para almacenar las propiedades de los puntos generados
+            self.puntosGeneradosAux = None         # Variable para almacenar las propiedades de los puntos generados como copia para exportarlos
             self.mascarasProcesadas = None         # Variable para almacenar las mascaras generadas
             self.mascarasProcesadasAux = None      # Variable para almacenar las mascaras procesadas como copia para exportarlo
-            self.puntosProcesados = None           # Variable para almacenar los puntos procesados
-            self.puntosProcesadosAux = None        # Variable para almacenar los puntos procesados como copia para exportarlos
+            self.puntosProcesados = None           # Variable para almacenar las propiedades de los puntos procesados
+            self.puntosProcesadosAux = None        # Variable para almacenar las propiedades de los puntos procesados como copia para exportarlos
             self.porcentajeProgreso = 0            # Variable para almacenar el porcentaje de progreso de la segmentacion
             self.startTime = None                  # Variable para almacenar el tiempo transcurrido
             self.procesamiento = False             # Variable para almacenar la seleccion de postprocesamiento
@@ -479,22 +514,110 @@ class NapariSAM:
             self.listaPuntosProcesados = None      # Variable que almacena la lista de las posiciones de los puntos de las mascaras procesadas
             self.listaMascaras = None              # Variable que almacena la lista con informacion de las mascaras generadas
             self.listaMascarasProcesadas = None    # Variable que almacena la lista con informacion de las mascaras procesadas
+            self.perfilado = False                 # Variable para almacenar la seleccion de perfilado
+            self.eventosCarga = []                 # Variable que almacena las etapas de carga de la imagen registradas por el perfilador
+            self.memoriaImagen = None              # Variable que almacena el bloque de memoria compartida con la imagen cargada
+            self.idTrabajoMostrado = None          # Trabajo cuyos resultados, en memoria compartida, se estan mostrando
+            self.descriptorImagen = None           # Variable que almacena el descriptor de la imagen en memoria compartida
+            self.huellaImagen = None               # Variable que almacena la huella del contenido de la imagen cargada
+            self.idCarga = 0                       # Identificador de la ultima carga de imagen solicitada
+            self.cargando = False                  # Indica si la imagen de resolucion completa aun se esta cargando
+            self.capaVistaPrevia = None            # Capa del visor con la vista previa de la imagen que se esta cargando
+            self.colaCargas = queue.Queue()        # Imagenes de resolucion completa cargadas en segundo plano
+            self.cacheResultados = CacheResultados()  # Cache en disco de los resultados de segmentacion ya calculados
+            
+            # Bus de eventos que entrega el progreso y los mensajes de la segmentacion agrupados en el hilo de la interfaz
+            self.bus = BusEventos()
+            self.bus.lineasPublicadas.connect(self.log.agregarLineas)
+            self.bus.progresoActualizado.connect(self.__actualizarBarraProgreso)
+            
+            # Arrancar el proceso de inferencia, que carga el modelo una unica vez, y la cola de trabajos
+            self.trabajador = TrabajadorInferencia(self.__obtenerParametros())
+            self.planificador = PlanificadorTrabajos(self.trabajador)
+            
+            # Las capas del visor declaran los bloques de memoria compartida que muestran, para no cerrarlos mientras existan
+            self.viewer.layers.events.inserted.connect(self.__capaInsertada)
+            self.viewer.layers.events.removed.connect(self.__capaEliminada)
             
             # Crear un temporizador para llamar a __cargarMascaras periodicamente
             self.timer = QTimer()
             self.timer.timeout.connect(self.__cargarMascaras)
             self.timer.start(1000)                 # Llama a "__cargarMascaras" cada 1000 milisegundos (1 segundo)
+            
+            # Crear un temporizador para recoger los eventos del proceso de inferencia
+            self.timerTrabajador = QTimer()
+            self.timerTrabajador.timeout.connect(self.__procesarEventosTrabajador)
+            self.timerTrabajador.timeout.connect(self.__procesarCargas)
+            self.timerTrabajador.start(100)        # Llama a "__procesarEventosTrabajador" cada 100 milisegundos
         except Exception as e:
             self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error durante el proceso de inicializacion de variables: {str(e)}")
         
     # Funciones para el proceso de carga
     
+    def __actualizarMemoriasInterfaz(self) -> None:
+        """
+        Declara los arrays en memoria compartida que mantienen los atributos de la interfaz (la imagen cargada y las
+        imagenes de etiquetas para mostrar y exportar). Los bloques que dejan de usarse se cierran si tampoco los usa
+        ninguna capa ni ningun trabajo.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self.planificador.registroMemorias.asignar("interfaz", [self.imagenGrises, self.imagenCargada, self.mascarasGeneradas, self.mascarasGeneradasAux, self.mascarasProcesadas, self.mascarasProcesadasAux])
+
+    def __capaInsertada(self, evento) -> None:
+        """
+        Declara los arrays en memoria compartida que muestra una capa nueva del visor.
+
+        Args:
+            evento: Evento de napari con la capa en value.
+
+        Returns:
+            None
+        """
+        capa = evento.value
+        datos = list(capa.data) if getattr(capa, "multiscale", False) else [capa.data]
+        self.planificador.registroMemorias.asignar(("capa", id(capa)), datos)
+
+    def __capaEliminada(self, evento) -> None:
+        """
+        Suelta los bloques de memoria compartida de una capa eliminada del visor, que se cierran si ya no los usa nadie.
+
+        Args:
+            evento: Evento de napari con la capa en value.
+
+        Returns:
+            None
+        """
+        self.planificador.registroMemorias.asignar(("capa", id(evento.value)), [])
+
+    def __liberarTrabajo(self, idTrabajo: Union[int, None]) -> None:
+        """
+        Libera los resultados de un trabajo que ya no se muestran. Sus bloques de memoria compartida se cierran cuando
+        tampoco los usa ninguna capa del visor ni los atributos de la interfaz.
+
+        Args:
+            idTrabajo (int o None): Identificador del trabajo.
+
+        Returns:
+            None
+        """
+        if idTrabajo is None:
+            return
+        self.planificador.liberarResultados(idTrabajo)
+
     def __cargarImagen(self, filename: str) -> None:
         """
         Carga una imagen desde el archivo especificado.
 
-        Esta funcion carga una imagen desde el archivo especificado y realiza algunas
-        operaciones como convertir la imagen a escala de grises y abrir la imagen en un visor.
+        El visor muestra al instante una vista previa decodificada a resolucion reducida. La imagen completa se decodifica
+        en segundo plano una sola vez, directamente en escala de grises, y se copia a memoria compartida; al terminar,
+        __procesarCargas sustituye la vista previa por una piramide multiescala cuyo nivel de resolucion completa es ese
+        mismo bloque. El visor, el proceso de inferencia, el postprocesamiento y las exportaciones usan el plano sin
+        copiarlo.
 
         Args:
             filename (str): La ruta del archivo de la imagen.
@@ -503,14 +626,104 @@ class NapariSAM:
             None
         """
         try:
-            self.imagenCargada = cv2.imread(filename)
-            self.dimensionesImagenCargada = Utils.obtenerDimensionesImagen(self.imagenCargada)
-            self.imagenGrises = Utils.convertRGB(self.imagenCargada)
-            self.viewer.open(filename)
-            self.log.append("<span style='color: green;'>[INFO]</span> Imagen cargada")
+            perfilador.reiniciar()
+            self.idCarga += 1
+            self.cargando = True
+            
+            # Hasta que termine la carga no se puede segmentar ni exportar sobre la imagen anterior
+            self.imagenCargada = self.imagenGrises = None
+            self.__actualizarMemoriasInterfaz()
+            with perfilador.etapa("vistaPrevia"):
+                vistaPrevia = Utils.cargarVistaPrevia(filename, FACTOR_VISTA_PREVIA)
+            self.capaVistaPrevia = self.viewer.add_image(vistaPrevia, name=os.path.splitext(os.path.basename(filename))[0], scale=(FACTOR_VISTA_PREVIA, FACTOR_VISTA_PREVIA))
+            
+            threading.Thread(target=self.__decodificarImagen, args=(filename, self.idCarga), name="cargaImagen", daemon=True).start()
+            self.log.append("<span style='color: green;'>[INFO]</span> Cargando la imagen a resolución completa...")
         except Exception as e:
+            self.cargando = False
             self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al cargar la imagen: {str(e)}")
 
+    def __decodificarImagen(self, filename: str, idCarga: int) -> None:
+        """
+        Decodifica la imagen completa, la copia a memoria compartida y construye la piramide del visor. Se ejecuta en
+        un hilo aparte y entrega el resultado, o el error, por colaCargas.
+
+        Args:
+            filename (str): La ruta del archivo de la imagen.
+            idCarga (int): Identificador de la carga, para descartar las cargas que ya se han sustituido por otra.
+
+        Returns:
+            None
+        """
+        try:
+            with perfilador.etapa("cargarImagen"):
+                imagen = Utils.cargarImagen(filename)
+            with perfilador.etapa("compartirImagen"):
+                memoria, descriptor = compartirArray(imagen)
+            del imagen
+            imagenGrises = np.ndarray(descriptor["forma"], dtype=np.dtype(descriptor["dtype"]), buffer=memoria.buf)
+            with perfilador.etapa("huellaImagen"):
+                huella = CacheResultados.huellaImagen(imagenGrises)
+            with perfilador.etapa("piramideImagen"):
+                piramide = Utils.construirPiramide(imagenGrises)
+            self.colaCargas.put({"idCarga": idCarga, "nombre": os.path.splitext(os.path.basename(filename))[0], "memoria": memoria,
+                                 "descriptor": descriptor, "imagen": imagenGrises, "huella": huella, "piramide": piramide})
+        except Exception as e:
+            self.colaCargas.put({"idCarga": idCarga, "error": str(e)})
+
+    def __procesarCargas(self) -> None:
+        """
+        Recoge en el hilo de la interfaz las imagenes cargadas en segundo plano y sustituye la vista previa por la
+        piramide multiescala. Las cargas sustituidas por otra posterior se descartan.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        try:
+            while True:
+                try:
+                    carga = self.colaCargas.get_nowait()
+                except queue.Empty:
+                    return
+                
+                if carga["idCarga"] != self.idCarga:
+                    # La carga no llego a mostrarse: sus arrays solo estan en la propia carga y el bloque se cierra ya
+                    if "memoria" in carga:
+                        memoria = carga["memoria"]
+                        carga.clear()
+                        memoria.unlink()
+                        memoria.close()
+                    continue
+                
+                self.cargando = False
+                if self.capaVistaPrevia is not None and self.capaVistaPrevia in self.viewer.layers:
+                    self.viewer.layers.remove(self.capaVistaPrevia)
+                self.capaVistaPrevia = None
+                if "error" in carga:
+                    self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al cargar la imagen: {carga['error']}")
+                    continue
+                
+                # El bloque anterior se desvincula ya, pero solo se cierra cuando ninguna capa del visor apunta a el
+                if self.memoriaImagen is not None:
+                    self.memoriaImagen.unlink()
+                self.memoriaImagen, self.descriptorImagen = carga["memoria"], carga["descriptor"]
+                self.planificador.registroMemorias.añadir(carga["memoria"], carga["imagen"])
+                self.imagenGrises = self.imagenCargada = carga["imagen"]
+                self.__actualizarMemoriasInterfaz()
+                self.huellaImagen = carga["huella"]
+                self.dimensionesImagenCargada = Utils.obtenerDimensionesImagen(self.imagenGrises)
+                
+                with perfilador.etapa("abrirImagenVisor"):
+                    piramide = carga["piramide"]
+                    self.viewer.add_image(piramide if len(piramide) > 1 else piramide[0], name=carga["nombre"], multiscale=len(piramide) > 1)
+                self.eventosCarga = perfilador.eventos()
+                self.log.append("<span style='color: green;'>[INFO]</span> Imagen cargada")
+        except Exception as e:
+            self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al mostrar la imagen cargada: {str(e)}")
+
     def __cargarImagenWidget(self) -> None:
         """
         Abre un cuadro de dialogo para seleccionar una imagen y la carga.
@@ -568,28 +781,13 @@ class NapariSAM:
                 self.chkNoZoom.setChecked(False)
                 self.log.append("<span style='color: green;'>[INFO]</span> Imagen CON zoom seleccionada")
                 
-                self.params = [
-                ("points_per_side", 64),
-                ("points_per_batch", 64),
-                ("pred_iou_thresh", 0.88),
-                ("stability_score_thresh", 0.95),
-                ("stability_score_offset", 1),
-                ("box_nms_thresh", 0.2),
-                ("crop_n_layers", 0),
-                ("crop_nms_thresh", 0.3),
-                ("crop_overlap_ratio", 0.5),
-                ("crop_n_points_downscale_factor", 2),
-                ("min_mask_region_area", 0),
-                ]
+                configuracion = Configuraciones.obtener("conZoom")
+                self.params = list(configuracion["parametros"].items())
             
                 self.__actualizarParametros(self.params)
                 self.log.append("<span style='color: green;'>[INFO]</span> Parametros de segmentación actualizados")
                 
-                self.processParams = [
-                ("min_size", 100),
-                ("max_size", 0.0015),
-                ("min_intensity", 10),
-                ]
+                self.processParams = list(configuracion["paramsProcesamiento"].items())
                 
                 self.__actualizarParametrosProcesamiento(self.processParams)
                 self.log.append("<span style='color: green;'>[INFO]</span> Parametros de postprocesamiento actualizados")
@@ -615,34 +813,52 @@ class NapariSAM:
                 self.chkZoom.setChecked(False)
                 self.log.append("<span style='color: green;'>[INFO]</span> Imagen SIN zoom seleccionada")
                 
-                self.params = [
-                ("points_per_side", 64),
-                ("points_per_batch", 64),
-                ("pred_iou_thresh", 0.88),
-                ("stability_score_thresh", 0.95),
-                ("stability_score_offset", 1),
-                ("box_nms_thresh", 0.2),
-                ("crop_n_layers", 0),
-                ("crop_nms_thresh", 0.3),
-                ("crop_overlap_ratio", 0.5),
-                ("crop_n_points_downscale_factor", 2),
-                ("min_mask_region_area", 0),
-                ]
+                configuracion = Configuraciones.obtener("sinZoom")
+                self.params = list(configuracion["parametros"].items())
             
                 self.__actualizarParametros(self.params)
                 self.log.append("<span style='color: green;'>[INFO]</span> Parametros de segmentación actualizados")
                 
-                self.processParams = [
-                ("min_size", 50),
-                ("max_size", 0.0005),
-                ("min_intensity", 10),
-                ]
+                self.processParams = list(configuracion["paramsProcesamiento"].items())
                 
                 self.__actualizarParametrosProcesamiento(self.processParams)
                 self.log.append("<span style='color: green;'>[INFO]</span> Parametros de postprocesamiento actualizados") 
         except Exception as e:
             self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al cambiar el estado a SIN Zoom: {str(e)}")
     
+    def __aplicarConfiguracion(self, index: int) -> None:
+        """
+        Aplica una configuracion guardada a los parametros de segmentacion, los cuadrantes y el postprocesamiento.
+
+        Esta funcion se activa cuando se selecciona una configuracion en el ComboBox de configuraciones.
+
+        Args:
+            index (int): El indice seleccionado en el ComboBox de configuraciones.
+
+        Returns:
+            None
+        """
+        try:
+            if index <= 0:
+                return
+            nombre = self.configuracionCombo.currentText()
+            configuracion = Configuraciones.obtener(nombre)
+            
+            self.params = list(configuracion["parametros"].items())
+            self.__actualizarParametros(self.params)
+            
+            self.processParams = list(configuracion["paramsProcesamiento"].items())
+            self.__actualizarParametrosProcesamiento(self.processParams)
+            self.chkProcesamiento.setChecked(configuracion["procesamiento"])
+            
+            numCuadrantes = configuracion["numCuadrantes"]
+            self.cuadrantesCombo.setCurrentIndex(self.cuadrantesCombo.findText(str(numCuadrantes)) if numCuadrantes is not None else 0)
+            self.numCuadrantes = numCuadrantes
+            
+            self.log.append(f"<span style='color: green;'>[INFO]</span> Configuración '{nombre}' aplicada")
+        except Exception as e:
+            self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al aplicar la configuración: {str(e)}")
+    
     # Funciones para el proceso de seleccion de cuadrantes
     
     def __actualizarSectores(self, state: int) -> None:
@@ -746,6 +962,32 @@ class NapariSAM:
         except Exception as e:
             self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al cambiar el estado de la opción de Post Procesamiento: {str(e)}")
     
+    def __togglePerfilado(self, state: int) -> None:
+        """
+        Activa o desactiva el perfilado de la segmentacion.
+
+        Esta funcion se activa cuando se cambia el estado de la opcion de perfilado. Mientras esta activa se registran
+        las etapas de carga de imagen en este proceso y las etapas de segmentacion en el proceso de inferencia.
+
+        Args:
+            state (int): El estado de la opción de perfilado.
+
+        Returns:
+            None
+        """
+        try:
+            if state == 2:
+                self.perfilado = True
+                perfilador.activar()
+                self.log.append("<span style='color: green;'>[INFO]</span> Perfilado activado")
+            else:
+                self.perfilado = False
+                perfilador.desactivar()
+                self.eventosCarga = []
+                self.log.append("<span style='color: green;'>[INFO]</span> Perfilado desactivado")
+        except Exception as e:
+            self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al cambiar el estado de la opción de perfilado: {str(e)}")
+    
     def __actualizarParametrosProcesamiento(self, parametros: List[Tuple[str, Union[int, float]]]) -> None:
         """
         Actualiza los parametros de postprocesamiento en la interfaz grafica.
@@ -806,15 +1048,15 @@ class NapariSAM:
             self.numeroComparacion = self.comparacion.value()
             
             if self.numeroComparacion == 0:
-                self.log.append("<span style='color: green;'>[INFO]</span> No se ha establecido ningún número de rodaballos a comparar")
-                self.log.append("<span style='color: green;'>[INFO]</span> El numero estimado de rodaballos calculados es: " + str(self.numeroRodCalculado) + "<br>")
+                self.bus.publicar(Evento("INFO", "No se ha establecido ningún número de rodaballos a comparar"))
+                self.bus.publicar(Evento("INFO", "El numero estimado de rodaballos calculados es: " + str(self.numeroRodCalculado) + "<br>"))
             else:
-                self.log.append("<span style='color: green;'>[INFO]</span> Se ha establecido la comparación de rodaballos")
+                self.bus.publicar(Evento("INFO", "Se ha establecido la comparación de rodaballos"))
                 self.errorAbsoluto, self.errorRelativo = Utils.calcularErrores(self.numeroComparacion,self.numeroRodCalculado)
-                self.log.append("<span style='color: green;'>[INFO]</span> El numero de rodaballos a comparar es: " + str(self.numeroComparacion))
-                self.log.append("<span style='color: green;'>[INFO]</span> El numero estimado de rodaballos calculados es: " + str(self.numeroRodCalculado))
-                self.log.append("<span style='color: green;'>[INFO]</span> El error absoluto cometido es de " + str(self.errorAbsoluto) + " rodaballos")
-                self.log.append("<span style='color: green;'>[INFO]</span> El error relativo cometido es de " + str(self.errorRelativo) + "%<br>")    
+                self.bus.publicar(Evento("INFO", "El numero de rodaballos a comparar es: " + str(self.numeroComparacion)))
+                self.bus.publicar(Evento("INFO", "El numero estimado de rodaballos calculados es: " + str(self.numeroRodCalculado)))
+                self.bus.publicar(Evento("INFO", "El error absoluto cometido es de " + str(self.errorAbsoluto) + " rodaballos"))
+                self.bus.publicar(Evento("INFO", "El error relativo cometido es de " + str(self.errorRelativo) + "%<br>"))
         except Exception as e:
             self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al mostrar información en el cuadro de texto: {str(e)}")
             
@@ -835,10 +1077,7 @@ class NapariSAM:
         """
         try:
             if self.mascarasProcesadasAux is not None or self.mascarasGeneradasAux is not None:
-                if self.procesamiento == True:
-                    self.imagenMascaras = label2rgb(self.mascarasProcesadasAux, self.imagenCargada, alpha=0.2)
-                else:
-                    self.imagenMascaras = label2rgb(self.mascarasGeneradasAux, self.imagenCargada, alpha=0.2)
+                etiquetas = self.mascarasProcesadasAux if self.procesamiento == True else self.mascarasGeneradasAux
                     
                 # Abrir el diálogo de archivo para seleccionar la ubicación de guardado
                 opciones, _ = QFileDialog.getSaveFileName(None, "Guardar Imagen", "", "JPEG Files (*.jpg);;PNG Files (*.png);;All Files (*)")
@@ -846,7 +1085,7 @@ class NapariSAM:
                 if opciones:
                     
                     # Guardar la imagen resultante en la ruta seleccionada
-                    plt.imsave(opciones, self.imagenMascaras)
+                    Exportaciones.imagenEtiquetas(etiquetas, self.imagenCargada, opciones, alpha=0.2)
                     self.log.append("<span style='color: green;'>[INFO]</span> Imagen con mascaras alamacenada correctamente.")
                     
                 else:
@@ -873,10 +1112,7 @@ class NapariSAM:
         try:
             if self.puntosProcesadosAux is not None or self.puntosGeneradosAux is not None:
                 
-                if self.procesamiento == True:
-                    self.imagenPuntos = label2rgb(self.puntosProcesadosAux,image = self.imagenCargada, alpha = 0.4)
-                else:
-                    self.imagenPuntos = label2rgb(self.puntosGeneradosAux, image = self.imagenCargada, alpha = 0.4)
+                listaPuntos = self.listaPuntosProcesados if self.procesamiento == True else self.listaPuntosGenerados
                     
                 # Abrir el diálogo de archivo para seleccionar la ubicación de guardado
                 opciones, _ = QFileDialog.getSaveFileName(None, "Guardar Imagen", "", "JPEG Files (*.jpg);;PNG Files (*.png);;All Files (*)")
@@ -884,7 +1120,7 @@ class NapariSAM:
                 if opciones:
                     
                     # Guardar la imagen resultante en la ruta seleccionada
-                    plt.imsave(opciones, self.imagenPuntos)
+                    Exportaciones.imagenPuntos(listaPuntos, self.imagenCargada, opciones)
                     self.log.append("<span style='color: green;'>[INFO]</span> Imagen con puntos alamacenada correctamente.")
                     
                 else:
@@ -921,16 +1157,7 @@ class NapariSAM:
                 if opciones:
 
                     # Escribe los puntos en el archivo CSV
-                    with open(opciones, 'w', newline='') as csvfile:
-                        # Definir el escritor CSV
-                        writer = csv.writer(csvfile)
-                        
-                        # Escribir la cabecera
-                        writer.writerow(['x', 'y'])
-                        
-                        # Escribir cada conjunto de coordenadas en una fila
-                        for punto in listaPuntos:
-                            writer.writerow(punto)
+                    Exportaciones.puntosCSV(listaPuntos, opciones)
                             
                     self.log.append("<span style='color: green;'>[INFO]</span> CSV con puntos alamacenado correctamente.")
                     
@@ -966,19 +1193,8 @@ class NapariSAM:
                 # Si se selecciona un nombre de archivo, escribe los puntos en el archivo CSV
                 if opciones:
 
-                    # Campos del encabezado del archivo CSV
-                    encabezado = ['area', 'bbox', 'predicted_iou', 'point_coords', 'stability_score', 'crop_box']
-
                     # Escribir los datos en el archivo CSV
-                    with open(opciones, 'w', newline='') as csvfile:
-                        writer = csv.DictWriter(csvfile, fieldnames=encabezado, quoting = csv.QUOTE_NONE, escapechar='\\')
-                        writer.writeheader()
-                        for objeto in listaMascaras:
-                            # Eliminar el campo 'segmentation' del objeto
-                            objetoSinSegmentation = {key: val for key, val in objeto.items() if key != 'segmentation'}
-                            # Convertir listas en strings
-                            objetoStr = {key: str(val).replace('\\', '') if isinstance(val, str) else val for key, val in objetoSinSegmentation.items()}
-                            writer.writerow(objetoStr)
+                    Exportaciones.mascarasCSV(listaMascaras, opciones)
                             
                     self.log.append("<span style='color: green;'>[INFO]</span> CSV con mascaras alamacenado correctamente.")
                     
@@ -990,6 +1206,43 @@ class NapariSAM:
         except Exception as e:
             self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al exportar el archivo CSV con la información de las máscaras: {str(e)}")
                 
+    def __exportarMascarasCOCO(self) -> None:
+        """
+        Exporta las segmentaciones de las mascaras generadas o procesadas a un JSON con formato COCO.
+
+        La forma de cada mascara se obtiene de la imagen de etiquetas. Abre un cuadro de dialogo para seleccionar el
+        directorio y el nombre del archivo a almacenar.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        try:
+            if self.mascarasProcesadasAux is not None or self.mascarasGeneradasAux is not None:
+
+                listaMascaras = self.listaMascarasProcesadas if self.procesamiento else self.listaMascaras
+                etiquetas = self.mascarasProcesadasAux if self.procesamiento else self.mascarasGeneradasAux
+
+                # Abre un cuadro de diálogo para seleccionar el directorio y el nombre del archivo
+                opciones, _ = QFileDialog.getSaveFileName(None, 'Guardar archivo JSON', '', 'Archivos JSON (*.json)')
+
+                if opciones:
+                    notificarOmitidas = lambda omitidas: self.log.append(f"<span style='color: yellow;'>[WARNING]</span> {omitidas} mascaras no aparecen en la imagen de etiquetas y no se han exportado al JSON COCO.")
+                    Exportaciones.mascarasCOCO(listaMascaras, self.imagenCargada.shape[:2], opciones, etiquetas, notificarOmitidas=notificarOmitidas)
+                    if not all("segmentation" in mascara for mascara in listaMascaras):
+                        self.log.append("<span style='color: yellow;'>[WARNING]</span> Las mascaras no incluyen la segmentacion: las formas del JSON COCO se han tomado de la imagen de etiquetas y no incluyen las zonas solapadas.")
+                    self.log.append("<span style='color: green;'>[INFO]</span> JSON COCO con mascaras alamacenado correctamente.")
+
+                else:
+                    self.log.append("<span style='color: yellow;'>[WARNING]</span> No se seleccionó ninguna ubicación para guardar el JSON.")
+
+            else:
+                self.log.append("<span style='color: yellow;'>[WARNING]</span> Por favor, inicie un proceso de segmentación antes de exportar los resultados")
+        except Exception as e:
+            self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al exportar el JSON COCO con las máscaras: {str(e)}")
+
     def __exportarHistograma(self) -> None:
         """
         Exporta un histograma de las areas de las mascaras procesadas junto con sus stability scores.
@@ -1007,64 +1260,13 @@ class NapariSAM:
             if self.puntosProcesadosAux is not None:
                 
                 listaMascaras = self.listaMascarasProcesadas
-
-                # Extraer el área y predicted_iou de cada objeto
-                listaAreas = [mascara['area'] for mascara in listaMascaras]
-                listaPredictedIou = [mascara['predicted_iou'] for mascara in listaMascaras]
-
-                # Normalizar los predicted_iou para que estén en el rango [0, 1]
-                maxPredictedIou= max(listaPredictedIou)
-                listaPredictedIouNorm = [score / maxPredictedIou for score in listaPredictedIou]
-
-                # Ordenar las áreas de manera descendente
-                listaAreas = sorted(listaAreas, reverse=True)
-
-                # Generar etiquetas para el eje x
-                etiquetasX = [f"M{i+1}" for i in range(len(listaAreas))]
                 
                 # Abre un cuadro de diálogo para seleccionar el directorio y el nombre del archivo
                 opciones, _ = QFileDialog.getSaveFileName(None, 'Guardar Histograma', '', 'Archivos de imagen (*.png)')
                 
-                # Si se selecciona un nombre de archivo, escribe los puntos en el archivo CSV
+                # Si se selecciona un nombre de archivo, genera el histograma y lo guarda
                 if opciones:
-
-                    # Calcular la línea de tendencia
-                    x = np.arange(len(listaAreas))
-                    y = np.array(listaAreas)
-                    m, b = np.polyfit(x, y, 1)  # Coeficientes de la línea de tendencia
-                    lineaTendencia = m * x + b
-                    
-                    
-                    # Generar el histograma y guardarlo como imagen en la ubicación seleccionada
-                    fig, ax1 = plt.subplots(figsize=(8, 6))
-                    ax1.bar(etiquetasX, listaAreas, color='blue', edgecolor='blue')
-                    ax1.set_xlabel('Máscaras')
-                    ax1.set_ylabel('Área [Pixeles Contenidos]')
-                    ax1.set_title('Histograma de áreas de máscaras')  # Título en negrita
-                    ax1.set_xticks([])  
-
-                    # Trazar la línea de tendencia
-                    ax1.plot(x, lineaTendencia, color='red', linestyle='-')
-                    ax1.grid(True)
-
-                    if self.numeroRodCalculado < 100:
-                        tamanoPunto = 4
-                        linea = '--'
-                    else:
-                        tamanoPunto = 1
-                        linea = ''
-                        
-                    # Agregar el segundo eje Y
-                    ax2 = ax1.twinx()  
-                    ax2.set_ylabel('Predicted IoU [Normalizado]')
-                    ax2.plot(x, listaPredictedIouNorm, color='green', linestyle = linea, marker='o', markersize= tamanoPunto, linewidth=0.5)
-
-                    fig.tight_layout()
-                    plt.savefig(opciones)
-                    
-                    
-                    plt.tight_layout()
-                    plt.savefig(opciones)
+                    Exportaciones.histograma(listaMascaras, self.numeroRodCalculado, opciones)
                             
                     self.log.append("<span style='color: green;'>[INFO]</span> Histograma alamacenado correctamente.")
                     
@@ -1078,12 +1280,25 @@ class NapariSAM:
     
     # Funciones para el proceso de segmentacion
     
-    def __iniciarSegmentacionThread(self) -> None:
+    def __obtenerParametros(self) -> Dict[str, Union[int, float]]:
         """
-        Inicia la segmentacion en un hilo separado.
+        Obtiene los parametros de segmentacion seleccionados en la interfaz.
+
+        Args:
+            None
 
-        Esta funcion inicia el proceso de segmentacion en un hilo separado para evitar bloquear la interfaz
-        de usuario mientras se realiza la segmentacion.
+        Returns:
+            dict: Diccionario con el nombre y el valor de cada parametro de segmentacion.
+        """
+        return {paramName: inputWidget.value() for paramName, inputWidget in self.paramsInputs.items()}
+
+    def __iniciarSegmentacionTrabajador(self) -> None:
+        """
+        Envia la segmentacion a la cola de trabajos del proceso de inferencia.
+
+        Esta funcion recoge los parametros seleccionados y encola un trabajo de segmentacion, de forma que la interfaz
+        de usuario no se bloquea mientras se realiza la segmentacion. Si ya hay una segmentacion en curso con los mismos
+        parametros no se lanza otra; si los parametros han cambiado, la anterior se cancela y se sustituye.
 
         Args:
             None
@@ -1091,35 +1306,83 @@ class NapariSAM:
         Returns:
             None
         """
+        if self.cargando:
+            self.log.append("<span style='color: yellow;'>[WARNING]</span> La imagen aún se está cargando, espere a que termine para iniciar el proceso de segmentación.")
+            return
+        if self.imagenCargada is None:
+            self.log.append("<span style='color: yellow;'>[WARNING]</span> Por favor, cargue una imagen antes de iniciar el proceso de segmentación.")
+            return
+        
         try:
-            thread = threading.Thread(target=self.__iniciarSegmentacion)
-            thread.start()
+            # Compruebo si se han seleccionado cuadrantes
+            indice = self.cuadrantesCombo.currentIndex()
+            numCuadrantes = int(self.cuadrantesCombo.currentText()) if indice > 0 else None
+            
+            configuracion = {
+                "imagen": self.descriptorImagen,
+                "parametros": self.__obtenerParametros(),
+                "numCuadrantes": numCuadrantes,
+                "procesamiento": self.procesamiento,
+                "paramsProcesamiento": {processName: inputWidget.value() for processName, inputWidget in self.processInputs.items()},
+                "perfil": self.perfilado,
+            }
+            
+            # Si la misma imagen ya se segmento con los mismos parametros, los resultados se leen de la cache
+            claveCache = self.cacheResultados.clave(self.huellaImagen, configuracion["parametros"], numCuadrantes, self.procesamiento, configuracion["paramsProcesamiento"])
+            resultados = self.cacheResultados.obtener(claveCache)
+            if resultados is not None:
+                if self.planificador.hayTrabajos():
+                    self.planificador.cancelar()
+                self.__aplicarResultados(resultados)
+                self.bus.publicar(Evento("INFO", "Resultados de la segmentación recuperados de la caché.", porcentaje=100))
+                self.__mostrarResultados()
+                # Los resultados de la cache sustituyen a los del ultimo trabajo mostrado
+                self.__liberarTrabajo(self.idTrabajoMostrado)
+                self.idTrabajoMostrado = None
+                return
+            configuracion["claveCache"] = claveCache
+            
+            hayAnterior = self.planificador.hayTrabajos()
+            idTrabajo, nuevo = self.planificador.enviar(configuracion)
+            
+            if not nuevo:
+                self.log.append(f"<span style='color: yellow;'>[WARNING]</span> Ya hay una segmentación en curso con los mismos parámetros (trabajo {idTrabajo})")
+                return
+            
+            if hayAnterior:
+                self.log.append("<span style='color: yellow;'>[WARNING]</span> Los parámetros han cambiado. Se cancela la segmentación anterior")
+            
+            # Actualizo la barra de estado
+            self.porcentajeProgreso = 0
+            self.bus.publicar(Evento("INFO", f"Procesamiento Activado (trabajo {idTrabajo}).", porcentaje=self.porcentajeProgreso, idTrabajo=idTrabajo))
         except Exception as e:
-            self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al generar un hilo: {str(e)}")
-        
-    def __actualizarBarraProgreso(self, porcentaje: float) -> None:
+            self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al enviar la segmentación al proceso de inferencia: {str(e)}")
+    
+    def __cancelarSegmentacion(self) -> None:
         """
-        Actualiza el valor de la barra de progreso.
-
-        Esta función actualiza el valor de la barra de progreso con el porcentaje proporcionado.
+        Cancela la segmentacion en curso y las pendientes.
 
         Args:
-            porcentaje (float): El porcentaje de progreso.
+            None
 
         Returns:
             None
         """
         try:
-            self.progreso.setValue(round(porcentaje))   
+            cancelados = self.planificador.cancelar()
+            if cancelados:
+                self.log.append("<span style='color: yellow;'>[WARNING]</span> Cancelación solicitada para los trabajos: " + ", ".join(str(idTrabajo) for idTrabajo in cancelados))
+            else:
+                self.log.append("<span style='color: green;'>[INFO]</span> No hay ninguna segmentación en curso")
         except Exception as e:
-            self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al establecer el valor del porcentaje de progreso: {str(e)}")
-        
-    def __iniciarSegmentacion(self) -> None:
+            self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al cancelar la segmentación: {str(e)}")
+    
+    def __procesarEventosTrabajador(self) -> None:
         """
-        Inicia el proceso de segmentacion.
+        Recoge los eventos enviados por el proceso de inferencia y actualiza la interfaz.
 
-        Esta funcion inicia el proceso de segmentacion de SAM, comprueba si se ha seleccionado la opcion de
-        postprocesamiento y lo ejecuta en tal caso, mostrando los resultados pertinentes.
+        Esta funcion se ejecuta periodicamente en el hilo de la interfaz. Muestra los mensajes de progreso del trabajo
+        vigente, recoge los resultados de la segmentacion y avisa si el proceso de inferencia ha caido.
 
         Args:
             None
@@ -1127,158 +1390,121 @@ class NapariSAM:
         Returns:
             None
         """
-        if self.imagenCargada is not None:
-            try:
-                # Actualizo la barra de estado
-                self.porcentajeProgreso = 0
-                self.log.append(f"<br><span style='color: green;'>[INFO]</span> Procesamiento Activado. Progreso: {self.porcentajeProgreso:.2f}%")
+        try:
+            for evento in self.planificador.recibirEventos():
+                tipo, idTrabajo = evento[0], evento[1]
                 
+                if tipo == "listo":
+                    self.bus.publicar(Evento("INFO", f"Modelo cargado en el proceso de inferencia ({evento[2]})."))
                 
-                # Obtener los parametros seleccionados
-                points_per_side = self.paramsInputs["points_per_side"].value()
-                points_per_batch = self.paramsInputs["points_per_batch"].value()
-                pred_iou_thresh = self.paramsInputs["pred_iou_thresh"].value()
-                stability_score_thresh = self.paramsInputs["stability_score_thresh"].value()
-                stability_score_offset = self.paramsInputs["stability_score_offset"].value()
-                box_nms_thresh = self.paramsInputs["box_nms_thresh"].value()
-                crop_n_layers = self.paramsInputs["crop_n_layers"].value()
-                crop_nms_thresh = self.paramsInputs["crop_nms_thresh"].value()
-                crop_overlap_ratio = self.paramsInputs["crop_overlap_ratio"].value()
-                crop_n_points_downscale_factor = self.paramsInputs["crop_n_points_downscale_factor"].value()
-                min_mask_region_area = self.paramsInputs["min_mask_region_area"].value()
+                elif tipo == "log":
+                    # Los mensajes de trabajos cancelados o sustituidos no se muestran
+                    trabajo = self.planificador.obtenerTrabajo(idTrabajo)
+                    if trabajo is None or trabajo.estado == "cancelado":
+                        continue
+                    if evento[2]["porcentaje"] is not None:
+                        self.porcentajeProgreso = evento[2]["porcentaje"]
+                    self.bus.publicar(Evento(idTrabajo=idTrabajo, **evento[2]))
                 
-                # Crear una instancia de TurbotSAM con los parámetros seleccionados
-                turbotSam = TurbotSAM(
-                    points_per_side=points_per_side,
-                    points_per_batch=points_per_batch,
-                    pred_iou_thresh=pred_iou_thresh,
-                    stability_score_thresh=stability_score_thresh,
-                    stability_score_offset=stability_score_offset,
-                    box_nms_thresh=box_nms_thresh,
-                    crop_n_layers=crop_n_layers,
-                    crop_nms_thresh=crop_nms_thresh,
-                    crop_overlap_ratio=crop_overlap_ratio,
-                    crop_n_points_downscale_factor=crop_n_points_downscale_factor,
-                    min_mask_region_area=min_mask_region_area
-                )
+                elif tipo == "resultado":
+                    self.__recibirResultados(idTrabajo)
                 
-                # Compruebo si se han seleccionado cuadrantes
-                indice = self.cuadrantesCombo.currentIndex()
+                elif tipo == "cancelado":
+                    self.bus.publicar(Evento("WARNING", f"Segmentación cancelada (trabajo {idTrabajo})", idTrabajo=idTrabajo))
+                    self.__liberarTrabajo(idTrabajo)
                 
-                if indice == 0:
-                    try:
-                        mascaras = turbotSam.generarMascaras(self.imagenGrises)
-                        
-                        self.listaMascaras = mascaras
-                        
-                        self.porcentajeProgreso = 90 if not self.procesamiento else 50
-                        self.log.append(f"<span style='color: green;'>[INFO]</span> Mascaras generadas correctamente. Progreso: {self.porcentajeProgreso:.2f}%")
-                        
-                    except Exception as e:
-                        self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al generar las máscaras para la imagen sin cuadrantes: {str(e)}")
-                    
-                else:
-                    
-                    # Generamos los cuadrantes
-                    try:
-                        cuadrantes = Utils.recortarCuadrantes(self.imagenGrises, self.numCuadrantes)
-                        
-                    except Exception as e:
-                        self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al recortar los cuadrantes de la imagen para procesarlos: {str(e)}")
+                elif tipo == "error":
+                    self.bus.publicar(Evento("ERROR", f"Ha ocurrido un error en el proceso de segmentación: {evento[2]}", idTrabajo=idTrabajo))
                 
-                    # Recuperamos la lista con las mascaras y el porcentaje de progreso en cada iteracion
-                    try:
-                        for porcentaje, mascarasPorCuadrante, cuadranteProcesado in turbotSam.generarMascarasPorCuadrante(cuadrantes, self.procesamiento):
-                            self.porcentajeProgreso = porcentaje
-                            self.log.append(f"<span style='color: green;'>[INFO]</span> Mascaras generadas para el Cuadrante {cuadranteProcesado}. Progreso: {self.porcentajeProgreso:.2f}%")
-                            
-                        self.log.append(f"<span style='color: green;'>[INFO]</span> Mascaras generadas correctamente para todos los cuadrantes") 
-                    except Exception as e:
-                        self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al generar las máscaras para la imagen con cuadrantes: {str(e)}")
-                    
-                    # Generar la imagen con todas las máscaras superpuestas por cuadrantes
-                    try:
-                        mascaras = ProcesarMascaras.superponerMascaras(mascarasPorCuadrante, self.dimensionesImagenCargada)
-                        self.listaMascaras = mascaras
-                    except Exception as e:
-                        self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al superponer las mascaras de los cuadrantes en una misma imagen: {str(e)}")
-                try:
-                    samImg = ProcesarMascaras.mostrarLabels(mascaras)
-                    self.mascarasGeneradas = samImg
-                    self.mascarasGeneradasAux = samImg
-                except MemoryError as e:
-                        self.log.append(f"<span style='color: yellow;'>[WARNING]</span> Debido a la cantidad de máscaras procesadas no se pudo asignar memoria suficiente para generar la imagen de segmentación de máscaras. Se generarán sólo los centros de máscaras: {str(e)}")
-                except Exception as e:
-                    self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al generar la imagen de etiquetas para las máscaras generadas por SAM: {str(e)}")
-                
-                
-                # Genero los puntos de lo que genera SAM
-                try:
-                    self.log.append(f"<span style='color: green;'>[INFO]</span> Generando centroides para las mascaras generadas. Progreso: {self.porcentajeProgreso:.2f}%")
-                    labels_points_sam, self.listaPuntosGenerados = ProcesarMascaras.pintarCentroidesMascaras(mascaras)
-                    self.puntosGenerados = labels_points_sam
-                    self.puntosGeneradosAux = labels_points_sam
-                    
-                    self.porcentajeProgreso = 100 if not self.procesamiento else 60
-                    self.log.append(f"<span style='color: green;'>[INFO]</span> Centroides de las mascaras generados correctamente. Progreso: {self.porcentajeProgreso:.2f}%")
-                except Exception as e:
-                    self.log.append(f"<span style='color: red;'>[ERROR]</span>  Ha ocurrido un error al generar los centroides de las máscaras generadas por SAM: {str(e)}")
-                
-                # Se inicia el post procesamiento si es necesario
-                if self.procesamiento == True:
-                    try:
-                        self.log.append(f"<br><span style='color: green;'>[INFO]</span> Iniciando Post Procesamiento. Progreso: {self.porcentajeProgreso:.2f}%")
-                        
-                        # Obtener los parametros de postprocesamiento
-                        min_size = self.processInputs["min_size"].value()
-                        max_size = self.processInputs["max_size"].value()
-                        min_intensity = self.processInputs["min_intensity"].value()
-                    
-                        # Calcular la imagen promediada en escala de grises a partir de los resultados. Obtenemos la imagen con las mascaras filtrada
-                        temp = np.mean(self.imagenGrises, axis=2)
-                        
-                        #Ejecutamos la función de post procesamiento
-                        labelsProcesados = np.zeros(self.imagenGrises.shape[:2], dtype=np.uint16)
-                        labelsProcesados, mascarasProcesadas = ProcesarMascaras.procesarMascaras(labelsProcesados, mascaras, temp, min_size, max_size*self.imagenGrises.shape[0]*self.imagenGrises.shape[1], min_intensity)
-                        self.listaMascarasProcesadas = mascarasProcesadas
-                        self.porcentajeProgreso = 90
-                        self.log.append(f"<span style='color: green;'>[INFO]</span> Mascaras de postprocesamiento filtradas. Progreso: {self.porcentajeProgreso:.2f}%")
-                    except Exception as e:
-                        self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al procesar las mascaras en las funcion de post procesamiento: {str(e)}")
-                    
-                    #Obtenemos las mascaras y el numero
-                    try:
-                        self.numeroRodCalculado = len(mascarasProcesadas)
-                        mascarasImg = ProcesarMascaras.mostrarLabels(mascarasProcesadas)
-                        self.mascarasProcesadas = mascarasImg
-                        self.mascarasProcesadasAux = mascarasImg
-                    except MemoryError as e:
-                        self.log.append(f"<span style='color: yellow;'>[WARNING]</span> Debido a la cantidad de máscaras procesadas no se pudo asignar memoria suficiente para generar la imagen de segmentación de máscaras. Se generarán sólo los centros de máscaras: {str(e)}")
-                        
-                    except Exception as e:
-                        self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al generar la imagen de etiquetas para las máscaras procesadas: {str(e)}")
-                    
-                    # Obtenemos los puntos
-                    try:
-                        self.log.append(f"<span style='color: green;'>[INFO]</span> Generando centroides para las mascaras procesadas. Progreso: {self.porcentajeProgreso:.2f}%")
-                        labelsPuntosProcesados, self.listaPuntosProcesados = ProcesarMascaras.pintarCentroidesMascaras(mascarasProcesadas)
-                        self.puntosProcesados = labelsPuntosProcesados
-                        self.puntosProcesadosAux = labelsPuntosProcesados
-                        self.porcentajeProgreso = 100
-                        self.log.append(f"<span style='color: green;'>[INFO]</span> Centroides de las mascaras postprocesadas establecidos. Progreso: {self.porcentajeProgreso:.2f}%")
-                    except Exception as e:
-                        self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al generar los centroides de las máscaras procesadas: {str(e)}")
-                else:
-                    self.numeroRodCalculado = len(mascaras)
-                    
-                self.log.append(f"<span style='color: green;'>[INFO]</span> Procesamiento de Segmentación finalizado.<br>")
-                
-                self.__mostrarResultados()
-            except Exception as e:
-                self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error en el proceso de segmentación: {str(e)}")
-        else:
-            self.log.append("<span style='color: yellow;'>[WARNING]</span> Por favor, cargue una imagen antes de iniciar el proceso de segmentación.")  
-               
+                elif tipo == "caido":
+                    self.bus.publicar(Evento("ERROR", f"El proceso de inferencia se ha detenido inesperadamente durante el trabajo {idTrabajo}. Se ha reiniciado", idTrabajo=idTrabajo))
+        except Exception as e:
+            self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al recoger los eventos del proceso de inferencia: {str(e)}")
+    
+    def __recibirResultados(self, idTrabajo: int) -> None:
+        """
+        Almacena los resultados de una segmentacion finalizada y muestra el resumen.
+
+        Args:
+            idTrabajo (int): Identificador del trabajo.
+
+        Returns:
+            None
+        """
+        try:
+            trabajo = self.planificador.obtenerTrabajo(idTrabajo)
+            
+            # Los resultados de un trabajo cancelado no se muestran y sus bloques se cierran
+            if trabajo is None or trabajo.estado != "finalizado":
+                self.__liberarTrabajo(idTrabajo)
+                return
+            resultados = trabajo.resultados
+            self.__aplicarResultados(resultados)
+            self.bus.publicar(Evento("INFO", f"Procesamiento de Segmentación finalizado (trabajo {idTrabajo}).", idTrabajo=idTrabajo))
+            
+            # Guardar los resultados en la cache sin bloquear la interfaz
+            self.cacheResultados.guardarEnSegundoPlano(trabajo.configuracion["claveCache"], resultados)
+            
+            if resultados["perfil"] is not None:
+                nombrePerfil = time.strftime("perfil_%Y%m%d_%H%M%S") + f"_trabajo{idTrabajo}"
+                rutaPerfil = Perfilador.guardar(self.eventosCarga + resultados["perfil"], "perfiles", nombrePerfil)
+                self.bus.publicar(Evento("INFO", f"Perfil de la segmentación guardado en {rutaPerfil}"))
+            
+            self.__mostrarResultados()
+            # Los resultados nuevos sustituyen a los del trabajo mostrado hasta ahora
+            anterior, self.idTrabajoMostrado = self.idTrabajoMostrado, idTrabajo
+            self.__liberarTrabajo(anterior)
+        except Exception as e:
+            self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al recibir los resultados de la segmentación: {str(e)}")
+    
+    def __aplicarResultados(self, resultados: Dict[str, any]) -> None:
+        """
+        Almacena los resultados de una segmentacion, calculados o recuperados de la cache, para mostrarlos y exportarlos.
+
+        Args:
+            resultados (dict): Resultados de la segmentacion.
+
+        Returns:
+            None
+        """
+        try:
+            self.listaMascaras = resultados["listaMascaras"]
+            self.mascarasGeneradas = resultados["mascarasGeneradas"]
+            self.mascarasGeneradasAux = resultados["mascarasGeneradas"]
+            self.puntosGenerados = resultados["puntosGenerados"]
+            self.puntosGeneradosAux = resultados["puntosGenerados"]
+            self.listaPuntosGenerados = resultados["listaPuntosGenerados"]
+            
+            if resultados["listaMascarasProcesadas"] is not None:
+                self.listaMascarasProcesadas = resultados["listaMascarasProcesadas"]
+                self.mascarasProcesadas = resultados["mascarasProcesadas"]
+                self.mascarasProcesadasAux = resultados["mascarasProcesadas"]
+                self.puntosProcesados = resultados["puntosProcesados"]
+                self.puntosProcesadosAux = resultados["puntosProcesados"]
+                self.listaPuntosProcesados = resultados["listaPuntosProcesados"]
+            
+            self.numeroRodCalculado = resultados["numeroRodCalculado"]
+            self.__actualizarMemoriasInterfaz()
+        except Exception:
+            raise
+        
+    def __actualizarBarraProgreso(self, porcentaje: float) -> None:
+        """
+        Actualiza el valor de la barra de progreso.
+
+        Esta función actualiza el valor de la barra de progreso con el porcentaje proporcionado.
+
+        Args:
+            porcentaje (float): El porcentaje de progreso.
+
+        Returns:
+            None
+        """
+        try:
+            self.progreso.setValue(round(porcentaje))   
+        except Exception as e:
+            self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al establecer el valor del porcentaje de progreso: {str(e)}")
+        
     # Funciones de procesado
     
     def __cargarMascaras(self) -> None:
@@ -1286,7 +1512,7 @@ class NapariSAM:
         Carga las mascaras generadas o los puntos segun la disponibilidad.
 
         Esta funcion carga las mascaras generadas por SAM o los puntos generados segun su disponibilidad
-        en la interfaz grafica. Ademas se encarga de comprobar y actualizar la barra de progreso
+        en la interfaz grafica. La barra de progreso se actualiza desde el bus de eventos
 
         Args:
             None
@@ -1300,7 +1526,7 @@ class NapariSAM:
                 self.mascarasGeneradas  = None
             
             elif self.puntosGenerados is not None:
-                self.__agregarLabel(self.puntosGenerados, "Centros de Mascaras SAM")
+                self.__agregarPuntos(self.listaPuntosGenerados, self.puntosGenerados, "Centros de Mascaras SAM")
                 self.puntosGenerados  = None
                 
             elif self.mascarasProcesadas is not None:
@@ -1308,13 +1534,11 @@ class NapariSAM:
                 self.mascarasProcesadas  = None
                 
             elif self.puntosProcesados is not None:
-                self.__agregarLabel(self.puntosProcesados, "Centros de Mascaras Post Procesamiento")
+                self.__agregarPuntos(self.listaPuntosProcesados, self.puntosProcesados, "Centros de Mascaras Post Procesamiento")
                 self.puntosProcesados  = None
 
             else:
                 pass
-            
-            self.__actualizarBarraProgreso(self.porcentajeProgreso)
         except Exception as e:
             self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al agregar las mascaras o puntos generados/procesados al visor: {str(e)}")
             
@@ -1340,10 +1564,28 @@ class NapariSAM:
             titulo: El título del label que se mostrara en el visor.
         """
         try:
-            self.viewer.add_labels(label, name=titulo)
+            # Las etiquetas recuperadas de la cache se muestran como piramide y solo se leen los fragmentos visibles
+            self.viewer.add_labels(name=titulo, **AlmacenFragmentado.paraVisor(label))
         except Exception as e:
             self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al añadir la imagen de etiquetas: {str(e)}")
 
+    def __agregarPuntos(self, centroides: np.ndarray, propiedades: Dict[str, np.ndarray], titulo: str) -> None:
+        """
+        Agrega los centroides al visor de Napari como una capa de puntos, con el area, el predicted IoU y el stability
+        score de cada mascara como propiedades de su punto.
+
+        Args:
+            centroides: Array (N, 2) con las coordenadas x, y de los centroides.
+            propiedades: Diccionario con un array de N valores por propiedad.
+            titulo: El título de la capa que se mostrara en el visor.
+        """
+        try:
+            # Napari ordena las coordenadas como fila, columna
+            coordenadas = np.asarray(centroides, dtype=np.float64).reshape(-1, 2)[:, ::-1]
+            self.viewer.add_points(coordenadas, name=titulo, features=propiedades, size=7, face_color="white", edge_width=0)
+        except Exception as e:
+            self.log.append(f"<span style='color: red;'>[ERROR]</span> Ha ocurrido un error al añadir los centroides: {str(e)}")
+
     # Funcion de arranque
     
     def run(self) -> None:
@@ -1358,4 +1600,21 @@ class NapariSAM:
         Returns:
             None
         """
-        napari.run()
\ No newline at end of file
+        try:
+            napari.run()
+        finally:
+            self.trabajador.detener()
+            # Las vistas de la imagen se sueltan antes de cerrar los bloques de memoria compartida
+            self.imagenCargada = self.imagenGrises = None
+            self.mascarasGeneradas = self.mascarasProcesadas = None
+            self.mascarasGeneradasAux = self.mascarasProcesadasAux = None
+            self.__actualizarMemoriasInterfaz()
+            self.__liberarTrabajo(self.idTrabajoMostrado)
+            self.idTrabajoMostrado = None
+            # Las cargas que terminaron despues de cerrar el visor no llegan a mostrarse
+            self.idCarga += 1
+            self.__procesarCargas()
+            # Los bloques que aun muestran las capas del visor se liberan al terminar el proceso
+            if self.memoriaImagen is not None:
+                self.memoriaImagen.unlink()
+                self.memoriaImagen = None
\ No newline at end of file
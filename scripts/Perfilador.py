@@ -0,0 +1,268 @@
+from typing import List, Dict
+import contextlib
+import threading
+import tracemalloc
+import json
+import time
+import os
+
+class _EtapaMedida:
+    """
+    Contexto que mide una etapa: tiempo de reloj, tiempo de CPU del proceso y pico de memoria reservada por Python y
+    NumPy durante la etapa (incluidas sus etapas anidadas). El pico solo se mide en las etapas del hilo principal.
+    """
+
+    __slots__ = ("perfilador", "nombre", "argumentos", "inicio", "inicioCpu", "memoriaInicio", "picoHijos", "medirMemoria")
+
+    def __init__(self, perfilador: "Perfilador", nombre: str, argumentos: Dict[str, any]):
+        self.perfilador = perfilador
+        self.nombre = nombre
+        self.argumentos = argumentos
+        self.memoriaInicio = 0
+        self.picoHijos = 0
+        # tracemalloc es comun a todo el proceso: si otros hilos reiniciaran el pico, las medidas se mezclarian
+        self.medirMemoria = perfilador.medirMemoria and threading.current_thread() is threading.main_thread()
+
+    def __enter__(self):
+        pila = self.perfilador._pila()
+        if self.medirMemoria:
+            actual, pico = tracemalloc.get_traced_memory()
+            # El pico alcanzado hasta ahora por la etapa padre se conserva antes de reiniciarlo
+            if pila:
+                pila[-1].picoHijos = max(pila[-1].picoHijos, pico)
+            tracemalloc.reset_peak()
+            self.memoriaInicio = actual
+        pila.append(self)
+        self.inicioCpu = time.process_time()
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *excepcion):
+        fin = time.perf_counter()
+        finCpu = time.process_time()
+        pila = self.perfilador._pila()
+        pila.pop()
+
+        argumentos = dict(self.argumentos)
+        argumentos["cpu_ms"] = round((finCpu - self.inicioCpu) * 1000, 3)
+        if self.medirMemoria:
+            _, pico = tracemalloc.get_traced_memory()
+            pico = max(pico, self.picoHijos)
+            if pila:
+                pila[-1].picoHijos = max(pila[-1].picoHijos, pico)
+            tracemalloc.reset_peak()
+            argumentos["pico_mb"] = round(max(pico - self.memoriaInicio, 0) / 2**20, 3)
+
+        self.perfilador._registrar(self.nombre, self.inicio, fin, argumentos)
+        return False
+
+class Perfilador:
+    """
+    Clase que registra el tiempo de reloj, el tiempo de CPU y el pico de memoria de cada etapa del proceso de
+    segmentacion y los exporta como traza de Chrome (chrome://tracing o Perfetto) o como tabla resumen.
+
+    Mientras esta desactivado, etapa() devuelve siempre el mismo contexto vacio, por lo que la instrumentacion no tiene
+    un coste apreciable. El pico de memoria se mide con tracemalloc, que solo se arranca al activar el perfilador, y
+    requiere Python 3.9 o superior; en versiones anteriores no se registra. tracemalloc mide todo el proceso, por lo que
+    el pico solo se registra en las etapas del hilo principal e incluye lo que reserven a la vez otros hilos (por
+    ejemplo las demas etapas de CadenaEtapas o la carga de imagenes en segundo plano). El tiempo de CPU es tambien el
+    de todo el proceso.
+    """
+
+    _NULO = contextlib.nullcontext()
+
+    def __init__(self, activo: bool = False):
+        self.activo = False
+        self.medirMemoria = False
+        self.iniciaTracemalloc = False  # Indica si tracemalloc lo arranco el perfilador y debe detenerlo al desactivarse
+        self.eventosRegistrados = []
+        self.cerrojo = threading.Lock()
+        self.local = threading.local()
+
+        # Referencia para convertir perf_counter en microsegundos de epoca comparables entre procesos
+        self.origenEpoca = time.time()
+        self.origenContador = time.perf_counter()
+
+        if activo:
+            self.activar()
+
+    def activar(self) -> None:
+        """
+        Activa el registro de etapas.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self.medirMemoria = hasattr(tracemalloc, "reset_peak")
+        if self.medirMemoria and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.iniciaTracemalloc = True
+        self.activo = True
+
+    def desactivar(self) -> None:
+        """
+        Desactiva el registro de etapas y detiene tracemalloc si lo arranco el perfilador.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self.activo = False
+        if self.iniciaTracemalloc and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.iniciaTracemalloc = False
+        self.medirMemoria = False
+
+    def reiniciar(self) -> None:
+        """
+        Descarta las etapas registradas.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self.cerrojo:
+            self.eventosRegistrados = []
+
+    def etapa(self, nombre: str, **argumentos):
+        """
+        Devuelve un contexto que mide la etapa indicada.
+
+        Args:
+            nombre (str): Nombre de la etapa.
+            **argumentos: Datos adicionales de la etapa (por ejemplo el cuadrante) que se guardan con la medida.
+
+        Returns:
+            Contexto que registra la etapa al salir, o un contexto vacio si el perfilador esta desactivado.
+        """
+        if not self.activo:
+            return Perfilador._NULO
+        return _EtapaMedida(self, nombre, argumentos)
+
+    def eventos(self) -> List[Dict[str, any]]:
+        """
+        Obtiene las etapas registradas en formato de evento de traza de Chrome.
+
+        Args:
+            None
+
+        Returns:
+            list[dict]: Eventos registrados.
+        """
+        with self.cerrojo:
+            return list(self.eventosRegistrados)
+
+    def _pila(self) -> list:
+        pila = getattr(self.local, "pila", None)
+        if pila is None:
+            pila = self.local.pila = []
+        return pila
+
+    def _registrar(self, nombre: str, inicio: float, fin: float, argumentos: Dict[str, any]) -> None:
+        evento = {
+            "name": nombre,
+            "ph": "X",
+            "ts": round((self.origenEpoca + inicio - self.origenContador) * 1e6, 1),
+            "dur": round((fin - inicio) * 1e6, 1),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": argumentos,
+        }
+        with self.cerrojo:
+            self.eventosRegistrados.append(evento)
+
+    @staticmethod
+    def exportarTrazaChrome(eventos: List[Dict[str, any]], ruta: str) -> None:
+        """
+        Guarda los eventos como traza de Chrome en formato JSON.
+
+        Args:
+            eventos (list[dict]): Eventos registrados, que pueden provenir de varios procesos.
+            ruta (str): Ruta del archivo JSON.
+
+        Returns:
+            None
+        """
+        try:
+            with open(ruta, "w") as archivo:
+                json.dump({"traceEvents": eventos, "displayTimeUnit": "ms"}, archivo)
+        except Exception:
+            raise
+
+    @staticmethod
+    def resumen(eventos: List[Dict[str, any]]) -> str:
+        """
+        Genera una tabla con el numero de llamadas, el tiempo total, el tiempo propio (sin contar etapas anidadas), el
+        tiempo de CPU y el mayor pico de memoria de cada etapa.
+
+        Args:
+            eventos (list[dict]): Eventos registrados.
+
+        Returns:
+            str: La tabla resumen ordenada por tiempo propio.
+        """
+        try:
+            # Tiempo propio: se resta a cada etapa la duracion de sus etapas hijas directas en el mismo hilo
+            propio = [evento["dur"] for evento in eventos]
+            orden = sorted(range(len(eventos)), key=lambda i: (eventos[i]["pid"], eventos[i]["tid"], eventos[i]["ts"], -eventos[i]["dur"]))
+            pila = []
+            for i in orden:
+                evento = eventos[i]
+                if pila and (eventos[pila[-1]]["pid"], eventos[pila[-1]]["tid"]) != (evento["pid"], evento["tid"]):
+                    pila = []
+                while pila and evento["ts"] >= eventos[pila[-1]]["ts"] + eventos[pila[-1]]["dur"]:
+                    pila.pop()
+                if pila:
+                    propio[pila[-1]] -= evento["dur"]
+                pila.append(i)
+
+            etapas = {}
+            for evento, tiempoPropio in zip(eventos, propio):
+                fila = etapas.setdefault(evento["name"], [0, 0.0, 0.0, 0.0, None])
+                fila[0] += 1
+                fila[1] += evento["dur"] / 1000
+                fila[2] += tiempoPropio / 1000
+                fila[3] += evento["args"].get("cpu_ms", 0.0)
+                if "pico_mb" in evento["args"]:
+                    fila[4] = max(fila[4] or 0.0, evento["args"]["pico_mb"])
+
+            lineas = [f"{'Etapa':<28}{'Llamadas':>10}{'Total [ms]':>14}{'Propio [ms]':>14}{'CPU [ms]':>14}{'Pico [MB]':>12}"]
+            for nombre, (llamadas, total, tiempoPropio, cpu, pico) in sorted(etapas.items(), key=lambda x: -x[1][2]):
+                textoPico = f"{pico:.1f}" if pico is not None else "-"
+                lineas.append(f"{nombre:<28}{llamadas:>10}{total:>14.1f}{tiempoPropio:>14.1f}{cpu:>14.1f}{textoPico:>12}")
+            return "\n".join(lineas)
+        except Exception:
+            raise
+
+    @staticmethod
+    def guardar(eventos: List[Dict[str, any]], directorio: str, nombre: str) -> str:
+        """
+        Guarda la traza de Chrome (<nombre>.json) y la tabla resumen (<nombre>.txt) de una ejecucion.
+
+        Args:
+            eventos (list[dict]): Eventos registrados.
+            directorio (str): Directorio donde se guardan los archivos.
+            nombre (str): Nombre base de los archivos.
+
+        Returns:
+            str: Ruta de la traza de Chrome.
+        """
+        try:
+            os.makedirs(directorio, exist_ok=True)
+            rutaTraza = os.path.join(directorio, nombre + ".json")
+            Perfilador.exportarTrazaChrome(eventos, rutaTraza)
+            with open(os.path.join(directorio, nombre + ".txt"), "w") as archivo:
+                archivo.write(Perfilador.resumen(eventos) + "\n")
+            return rutaTraza
+        except Exception:
+            raise
+
+# Perfilador del proceso. Se activa con la variable de entorno TURBOTSAM_PERFIL=1 o desde la interfaz
+perfilador = Perfilador(activo=os.environ.get("TURBOTSAM_PERFIL") == "1")
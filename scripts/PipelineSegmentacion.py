@@ -0,0 +1,303 @@
+from scripts.Utils import Utils
+from scripts.TurbotSAM import TurbotSAM, SegmentacionCancelada
+from scripts.ProcesarMascaras import ProcesarMascaras
+from scripts.Perfilador import perfilador
+from scripts.AlmacenMascaras import AlmacenMascaras, PRESUPUESTO_MASCARAS_MB
+from typing import Union, List, Dict, Callable
+import numpy as np
+import cv2
+
+# Diferencia de intensidad, tras suavizar, a partir de la cual una zona ha cambiado respecto a la imagen anterior de la
+# secuencia, y margen en pixeles que se añade alrededor de los cambios
+UMBRAL_CAMBIO = 25
+MARGEN_CAMBIO = 15
+
+class PipelineSegmentacion:
+    """
+    Clase que ejecuta el proceso completo de segmentacion (SAM, superposicion de cuadrantes, etiquetas, centroides
+    y postprocesamiento) sin depender de la interfaz grafica, de forma que pueda lanzarse desde Napari, desde un
+    proceso trabajador o desde un script sin interfaz.
+    """
+
+    @staticmethod
+    def generarMascaras(turbotSam: TurbotSAM, imagen: np.ndarray, numCuadrantes: Union[int, None], procesamiento: bool, notificar: Callable[..., None], comprobarCancelacion: Union[Callable[[], None], None] = None, mascarasPrevias: Union[Dict[int, List[Dict[str, any]]], None] = None, guardarCuadrante: Union[Callable[[int, List[Dict[str, any]]], None], None] = None, presupuestoMB: Union[float, None] = None, semilla: Union[Dict[str, np.ndarray], None] = None) -> List[Dict[str, any]]:
+        """
+        Genera las mascaras de SAM para toda la imagen, recortandola en cuadrantes si se ha indicado.
+
+        Las segmentaciones se pasan a un AlmacenMascaras segun se generan, por lo que la memoria que ocupan no crece con
+        el numero de mascaras mas alla del presupuesto.
+
+        Con una semilla de la imagen anterior de la misma secuencia, cada cuadrante se segmenta con los centroides que
+        caen en el y con los puntos de la cuadricula de las zonas sin resolver (ver coberturaSemilla), en lugar de con
+        la cuadricula completa.
+
+        Args:
+            turbotSam (TurbotSAM): Instancia de TurbotSAM con el modelo cargado.
+            imagen (np.ndarray): La imagen en escala de grises (un plano uint8) o RGB.
+            numCuadrantes (int o None): Numero de cuadrantes o None para procesar la imagen completa.
+            procesamiento (bool): Indica si despues se realizara postprocesamiento.
+            notificar (Callable): Funcion que recibe el nivel, el mensaje, el porcentaje de progreso y, como argumentos
+                con nombre, la etapa y el cuadrante.
+            comprobarCancelacion (Callable o None): Funcion que lanza SegmentacionCancelada si se ha cancelado la segmentacion.
+            mascarasPrevias (dict o None): Mascaras de los cuadrantes ya segmentados en una ejecucion anterior, por
+                numero de cuadrante (desde 1).
+            guardarCuadrante (Callable o None): Funcion que recibe el numero de cuadrante y sus mascaras cada vez que
+                termina la segmentacion de un cuadrante nuevo.
+            presupuestoMB (float o None): Memoria maxima de las segmentaciones. Por defecto PRESUPUESTO_MASCARAS_MB.
+            semilla (dict o None): Centroides, cobertura e imagen de la imagen anterior, como los devuelve
+                semillaResultados. Se ignora si la imagen anterior tenia otras dimensiones.
+
+        Returns:
+            list[MascaraAlmacenada]: Lista de mascaras en coordenadas de la imagen original.
+        """
+        dimensiones = Utils.obtenerDimensionesImagen(imagen)
+        almacen = AlmacenMascaras(dimensiones, presupuestoMB if presupuestoMB is not None else PRESUPUESTO_MASCARAS_MB)
+        cobertura = None
+        if semilla is not None and semilla["cobertura"].shape == tuple(dimensiones):
+            with perfilador.etapa("coberturaSemilla"):
+                cobertura = PipelineSegmentacion.coberturaSemilla(semilla, imagen)
+        if numCuadrantes is None:
+            try:
+                puntos = turbotSam.puntosSemilla(semilla["centroides"], cobertura) if cobertura is not None else None
+                mascaras = turbotSam.generarMascaras(imagen, comprobarCancelacion, puntos)
+                with perfilador.etapa("almacenarMascaras"):
+                    mascaras = almacen.añadirMascaras(mascaras)
+                notificar("INFO", "Mascaras generadas correctamente.", 90 if not procesamiento else 50, etapa="generacion")
+                return mascaras
+            except SegmentacionCancelada:
+                raise
+            except Exception as e:
+                notificar("ERROR", f"Ha ocurrido un error al generar las máscaras para la imagen sin cuadrantes: {str(e)}", None, etapa="generacion")
+                raise
+
+        # Generamos los cuadrantes
+        try:
+            with perfilador.etapa("recortarCuadrantes"):
+                cuadrantes = Utils.recortarCuadrantes(imagen, numCuadrantes)
+        except Exception as e:
+            notificar("ERROR", f"Ha ocurrido un error al recortar los cuadrantes de la imagen para procesarlos: {str(e)}", None, etapa="cuadrantes")
+            raise
+
+        # Recuperamos la lista con las mascaras y el porcentaje de progreso en cada iteracion. Las mascaras de cada cuadrante
+        # se llevan al almacen en coordenadas de la imagen completa, sin crear una imagen completa por mascara
+        try:
+            raiz = int(np.sqrt(numCuadrantes))
+            alturaCuadrante, anchuraCuadrante = dimensiones[0] // raiz, dimensiones[1] // raiz
+            puntosPorCuadrante = None
+            if cobertura is not None:
+                # Cada cuadrante recibe los centroides que caen en el, en sus propias coordenadas
+                puntosPorCuadrante = {}
+                centroides = semilla["centroides"]
+                fila, columna = centroides[:, 1] // alturaCuadrante, centroides[:, 0] // anchuraCuadrante
+                for numero in range(1, raiz * raiz + 1):
+                    i, j = divmod(numero - 1, raiz)
+                    desplazamiento = np.array([j * anchuraCuadrante, i * alturaCuadrante])
+                    coberturaCuadrante = cobertura[i * alturaCuadrante:(i + 1) * alturaCuadrante, j * anchuraCuadrante:(j + 1) * anchuraCuadrante]
+                    puntosPorCuadrante[numero] = turbotSam.puntosSemilla(centroides[(fila == i) & (columna == j)] - desplazamiento, coberturaCuadrante)
+            for porcentaje, mascarasPorCuadrante, cuadranteProcesado in turbotSam.generarMascarasPorCuadrante(cuadrantes, procesamiento, comprobarCancelacion, mascarasPrevias, puntosPorCuadrante=puntosPorCuadrante):
+                recuperado = mascarasPrevias is not None and cuadranteProcesado in mascarasPrevias
+                if not recuperado and guardarCuadrante is not None:
+                    guardarCuadrante(cuadranteProcesado, mascarasPorCuadrante[-1])
+                i, j = divmod(cuadranteProcesado - 1, raiz)
+                with perfilador.etapa("almacenarMascaras", cuadrante=cuadranteProcesado):
+                    mascarasPorCuadrante[-1] = almacen.añadirMascaras(mascarasPorCuadrante[-1], (i * alturaCuadrante, j * anchuraCuadrante))
+                if recuperado:
+                    notificar("INFO", f"Mascaras recuperadas para el Cuadrante {cuadranteProcesado}.", porcentaje, etapa="generacion", cuadrante=cuadranteProcesado)
+                    continue
+                notificar("INFO", f"Mascaras generadas para el Cuadrante {cuadranteProcesado}.", porcentaje, etapa="generacion", cuadrante=cuadranteProcesado)
+            notificar("INFO", "Mascaras generadas correctamente para todos los cuadrantes", None, etapa="generacion")
+        except SegmentacionCancelada:
+            raise
+        except Exception as e:
+            notificar("ERROR", f"Ha ocurrido un error al generar las máscaras para la imagen con cuadrantes: {str(e)}", None, etapa="generacion")
+            raise
+
+        # Las mascaras de todos los cuadrantes ya estan en coordenadas de la imagen completa
+        return [mascara for mascaras in mascarasPorCuadrante for mascara in mascaras]
+
+    @staticmethod
+    def ejecutar(turbotSam: TurbotSAM, imagen: np.ndarray, numCuadrantes: Union[int, None], procesamiento: bool, paramsProcesamiento: Dict[str, Union[int, float]], notificar: Union[Callable[..., None], None] = None, comprobarCancelacion: Union[Callable[[], None], None] = None, mascarasPrevias: Union[Dict[int, List[Dict[str, any]]], None] = None, guardarCuadrante: Union[Callable[[int, List[Dict[str, any]]], None], None] = None, presupuestoMB: Union[float, None] = None, semilla: Union[Dict[str, np.ndarray], None] = None) -> Dict[str, any]:
+        """
+        Ejecuta la segmentacion completa de una imagen.
+
+        Args:
+            turbotSam (TurbotSAM): Instancia de TurbotSAM con el modelo cargado.
+            imagen (np.ndarray): La imagen en escala de grises (un plano uint8) o RGB.
+            numCuadrantes (int o None): Numero de cuadrantes o None para procesar la imagen completa.
+            procesamiento (bool): Indica si se realiza el postprocesamiento.
+            paramsProcesamiento (dict): Parametros de postprocesamiento (min_size, max_size, min_intensity).
+            notificar (Callable o None): Funcion que recibe el nivel, el mensaje, el porcentaje de progreso y, como
+                argumentos con nombre, la etapa y el cuadrante.
+            comprobarCancelacion (Callable o None): Funcion que lanza SegmentacionCancelada si se ha cancelado la
+                segmentacion. Se comprueba entre cuadrantes, entre lotes de puntos y entre etapas.
+            mascarasPrevias (dict o None): Mascaras de los cuadrantes ya segmentados, para reanudar una segmentacion.
+            guardarCuadrante (Callable o None): Funcion que recibe cada cuadrante segmentado y sus mascaras.
+            presupuestoMB (float o None): Memoria maxima de las segmentaciones de las mascaras.
+            semilla (dict o None): Centroides, cobertura e imagen de la imagen anterior de la misma secuencia.
+
+        Returns:
+            dict: Resultados de la segmentacion. Contiene las imagenes de etiquetas, las listas de mascaras, los
+            centroides como arrays (N, 2) de x, y con las propiedades de cada punto (generados y procesados) y el numero
+            de rodaballos calculado.
+        """
+        if notificar is None:
+            notificar = lambda nivel, mensaje, porcentaje, **kwargs: None
+        if comprobarCancelacion is None:
+            comprobarCancelacion = lambda: None
+
+        mascaras = PipelineSegmentacion.generarMascaras(turbotSam, imagen, numCuadrantes, procesamiento, notificar, comprobarCancelacion, mascarasPrevias, guardarCuadrante, presupuestoMB, semilla)
+        comprobarCancelacion()
+        return PipelineSegmentacion.procesarResultados(imagen, mascaras, procesamiento, paramsProcesamiento, notificar, comprobarCancelacion)
+
+    @staticmethod
+    def procesarResultados(imagen: np.ndarray, mascaras: List[Dict[str, any]], procesamiento: bool, paramsProcesamiento: Dict[str, Union[int, float]], notificar: Union[Callable[..., None], None] = None, comprobarCancelacion: Union[Callable[[], None], None] = None) -> Dict[str, any]:
+        """
+        Obtiene los resultados de la segmentacion a partir de las mascaras de SAM: imagenes de etiquetas, centroides y,
+        si se indica, el postprocesamiento. No usa el modelo, por lo que puede ejecutarse en otro hilo mientras el
+        modelo segmenta la siguiente imagen.
+
+        Args:
+            imagen (np.ndarray): La imagen en escala de grises (un plano uint8) o RGB.
+            mascaras (list[dict]): Mascaras de SAM en coordenadas de la imagen original.
+            procesamiento (bool): Indica si se realiza el postprocesamiento.
+            paramsProcesamiento (dict): Parametros de postprocesamiento (min_size, max_size, min_intensity).
+            notificar (Callable o None): Funcion que recibe el nivel, el mensaje, el porcentaje de progreso y, como
+                argumentos con nombre, la etapa y el cuadrante.
+            comprobarCancelacion (Callable o None): Funcion que lanza SegmentacionCancelada si se ha cancelado la
+                segmentacion.
+
+        Returns:
+            dict: Resultados de la segmentacion, con las mismas claves que ejecutar.
+        """
+        if notificar is None:
+            notificar = lambda nivel, mensaje, porcentaje, **kwargs: None
+        if comprobarCancelacion is None:
+            comprobarCancelacion = lambda: None
+
+        resultados = {
+            "mascarasGeneradas": None,
+            "listaMascaras": mascaras,
+            "puntosGenerados": None,
+            "listaPuntosGenerados": None,
+            "mascarasProcesadas": None,
+            "listaMascarasProcesadas": None,
+            "puntosProcesados": None,
+            "listaPuntosProcesados": None,
+            "numeroRodCalculado": None,
+        }
+
+        try:
+            with perfilador.etapa("mostrarLabels"):
+                resultados["mascarasGeneradas"] = ProcesarMascaras.mostrarLabels(mascaras)
+        except MemoryError as e:
+            notificar("WARNING", f"Debido a la cantidad de máscaras procesadas no se pudo asignar memoria suficiente para generar la imagen de segmentación de máscaras. Se generarán sólo los centros de máscaras: {str(e)}", None, etapa="etiquetas")
+        except Exception as e:
+            notificar("ERROR", f"Ha ocurrido un error al generar la imagen de etiquetas para las máscaras generadas por SAM: {str(e)}", None, etapa="etiquetas")
+
+        # Genero los puntos de lo que genera SAM
+        try:
+            notificar("INFO", "Generando centroides para las mascaras generadas.", None, etapa="centroides")
+            with perfilador.etapa("calcularCentroides"):
+                resultados["listaPuntosGenerados"], resultados["puntosGenerados"] = ProcesarMascaras.calcularCentroides(mascaras)
+            notificar("INFO", "Centroides de las mascaras generados correctamente.", 100 if not procesamiento else 60, etapa="centroides")
+        except Exception as e:
+            notificar("ERROR", f"Ha ocurrido un error al generar los centroides de las máscaras generadas por SAM: {str(e)}", None, etapa="centroides")
+            raise
+
+        if not procesamiento:
+            resultados["numeroRodCalculado"] = len(mascaras)
+            return resultados
+
+        # Se inicia el post procesamiento
+        comprobarCancelacion()
+        try:
+            notificar("INFO", "Iniciando Post Procesamiento.", None, etapa="postprocesamiento")
+
+            # La imagen en escala de grises se usa directamente; solo las imagenes de tres canales se promedian
+            with perfilador.etapa("imagenPromediada"):
+                temp = imagen if imagen.ndim == 2 else np.mean(imagen, axis=2)
+
+            labelsProcesados = np.zeros(imagen.shape[:2], dtype=np.uint16)
+            maxSize = paramsProcesamiento["max_size"] * imagen.shape[0] * imagen.shape[1]
+            with perfilador.etapa("procesarMascaras"):
+                labelsProcesados, mascarasProcesadas = ProcesarMascaras.procesarMascaras(labelsProcesados, mascaras, temp, paramsProcesamiento["min_size"], maxSize, paramsProcesamiento["min_intensity"])
+            resultados["listaMascarasProcesadas"] = mascarasProcesadas
+            notificar("INFO", "Mascaras de postprocesamiento filtradas.", 90, etapa="postprocesamiento")
+        except Exception as e:
+            notificar("ERROR", f"Ha ocurrido un error al procesar las mascaras en las funcion de post procesamiento: {str(e)}", None, etapa="postprocesamiento")
+            raise
+
+        #Obtenemos las mascaras y el numero
+        resultados["numeroRodCalculado"] = len(mascarasProcesadas)
+        try:
+            with perfilador.etapa("mostrarLabels"):
+                resultados["mascarasProcesadas"] = ProcesarMascaras.mostrarLabels(mascarasProcesadas)
+        except MemoryError as e:
+            notificar("WARNING", f"Debido a la cantidad de máscaras procesadas no se pudo asignar memoria suficiente para generar la imagen de segmentación de máscaras. Se generarán sólo los centros de máscaras: {str(e)}", None, etapa="etiquetas")
+        except Exception as e:
+            notificar("ERROR", f"Ha ocurrido un error al generar la imagen de etiquetas para las máscaras procesadas: {str(e)}", None, etapa="etiquetas")
+
+        # Obtenemos los puntos
+        try:
+            notificar("INFO", "Generando centroides para las mascaras procesadas.", None, etapa="centroides")
+            with perfilador.etapa("calcularCentroides"):
+                resultados["listaPuntosProcesados"], resultados["puntosProcesados"] = ProcesarMascaras.calcularCentroides(mascarasProcesadas)
+            notificar("INFO", "Centroides de las mascaras postprocesadas establecidos.", 100, etapa="centroides")
+        except Exception as e:
+            notificar("ERROR", f"Ha ocurrido un error al generar los centroides de las máscaras procesadas: {str(e)}", None, etapa="centroides")
+            raise
+
+        return resultados
+
+    @staticmethod
+    def semillaResultados(resultados: Dict[str, any], imagen: Union[np.ndarray, None] = None) -> Union[Dict[str, np.ndarray], None]:
+        """
+        Obtiene la semilla con la que segmentar la imagen siguiente de la misma secuencia a partir de los resultados de
+        una imagen: los centroides de las mascaras aceptadas por el postprocesamiento, la zona que cubren y la imagen.
+
+        Args:
+            resultados (dict): Resultados de la segmentacion, como los devuelve ejecutar o la cache de resultados.
+            imagen (np.ndarray o None): La imagen segmentada, para detectar los cambios en la siguiente.
+
+        Returns:
+            dict o None: Centroides (N, 2) x, y, cobertura booleana del tamaño de la imagen e imagen en escala de grises,
+            o None si no hubo postprocesamiento. Sin el, las mascaras incluyen el fondo y cubririan toda la imagen.
+        """
+        try:
+            if resultados["listaPuntosProcesados"] is None or resultados["mascarasProcesadas"] is None:
+                return None
+            if imagen is not None and imagen.ndim == 3:
+                imagen = np.mean(imagen, axis=2).astype(np.uint8)
+            return {
+                "centroides": np.asarray(resultados["listaPuntosProcesados"], dtype=np.int64).reshape(-1, 2),
+                "cobertura": np.asarray(resultados["mascarasProcesadas"]) > 0,
+                "imagen": imagen,
+            }
+        except Exception:
+            raise
+
+    @staticmethod
+    def coberturaSemilla(semilla: Dict[str, np.ndarray], imagen: np.ndarray) -> np.ndarray:
+        """
+        Obtiene las zonas de una imagen que ya estan resueltas por la imagen anterior de su secuencia y que no hace falta
+        volver a muestrear con la cuadricula: las que cubrian sus mascaras aceptadas, porque cada rodaballo tiene ya su
+        centroide como punto, y las que no han cambiado, porque no tenian ningun rodaballo y siguen igual. La cuadricula
+        solo se usa en las zonas libres que han cambiado, donde puede haber entrado un rodaballo.
+
+        Args:
+            semilla (dict): Semilla de la imagen anterior, como la devuelve semillaResultados.
+            imagen (np.ndarray): La imagen a segmentar, con las mismas dimensiones.
+
+        Returns:
+            np.ndarray: Imagen booleana con las zonas resueltas.
+        """
+        try:
+            if semilla.get("imagen") is None:
+                return semilla["cobertura"]
+            actual = imagen if imagen.ndim == 2 else np.mean(imagen, axis=2).astype(np.uint8)
+            diferencia = cv2.absdiff(cv2.blur(actual, (5, 5)), cv2.blur(semilla["imagen"], (5, 5)))
+            nucleo = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * MARGEN_CAMBIO + 1, 2 * MARGEN_CAMBIO + 1))
+            cambios = cv2.dilate((diferencia > UMBRAL_CAMBIO).astype(np.uint8), nucleo) > 0
+            return semilla["cobertura"] | ~cambios
+        except Exception:
+            raise
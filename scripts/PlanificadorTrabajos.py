@@ -0,0 +1,337 @@
+from scripts.TrabajadorInferencia import TrabajadorInferencia, CLAVES_IMAGENES
+from typing import Union, List, Tuple, Dict, Hashable, Iterable
+from collections import deque
+from multiprocessing import shared_memory
+import numpy as np
+
+class RegistroMemorias:
+    """
+    Clase que lleva la cuenta de los usuarios de cada bloque de memoria compartida (los resultados de un trabajo, las
+    capas del visor, los atributos de la interfaz...) y cierra cada bloque en cuanto lo suelta su ultimo usuario.
+
+    Los arrays creados sobre un bloque no impiden que se cierre y quedarian apuntando a memoria liberada, por lo que
+    cada usuario declara con asignar los arrays que mantiene y el bloque de cada array se localiza por su direccion.
+    """
+
+    def __init__(self):
+        self.bloques = {}       # Nombre -> (bloque, direccion inicial, direccion final)
+        self.usuarios = {}      # Nombre del bloque -> usuarios que tienen arrays sobre el
+        self.usos = {}          # Usuario -> nombres de los bloques que usa
+
+    def añadir(self, memoria: shared_memory.SharedMemory, array: np.ndarray) -> None:
+        """
+        Registra un bloque de memoria compartida a partir del array que ocupa su contenido. El bloque queda sin
+        usuarios hasta que alguno lo declare con asignar.
+
+        Args:
+            memoria (SharedMemory): El bloque.
+            array (np.ndarray): Array creado sobre el inicio del bloque.
+
+        Returns:
+            None
+        """
+        inicio = array.__array_interface__["data"][0]
+        self.bloques[memoria.name] = (memoria, inicio, inicio + memoria.size)
+        self.usuarios.setdefault(memoria.name, set())
+
+    def bloquesDe(self, arrays: Iterable[any]) -> set:
+        """
+        Obtiene los bloques registrados que contienen alguno de los arrays. Los objetos que no son arrays de numpy
+        (arrays de dask, arrays fragmentados...) se ignoran.
+
+        Args:
+            arrays (Iterable): Arrays o vistas.
+
+        Returns:
+            set[str]: Nombres de los bloques.
+        """
+        nombres = set()
+        for array in arrays:
+            if not isinstance(array, np.ndarray) or array.size == 0:
+                continue
+            direccion = array.__array_interface__["data"][0]
+            for nombre, (_, inicio, fin) in self.bloques.items():
+                if inicio <= direccion < fin:
+                    nombres.add(nombre)
+                    break
+        return nombres
+
+    def asignar(self, usuario: Hashable, arrays: Iterable[any]) -> None:
+        """
+        Declara los arrays que mantiene un usuario, sustituyendo a los que mantenia antes, y cierra los bloques que se
+        quedan sin usuarios. Con una lista vacia el usuario suelta todos sus bloques.
+
+        Args:
+            usuario (Hashable): Identificador del usuario, por ejemplo ('capa', id(capa)).
+            arrays (Iterable): Arrays que mantiene el usuario.
+
+        Returns:
+            None
+        """
+        nuevos = self.bloquesDe(arrays)
+        anteriores = self.usos.pop(usuario, set())
+        if nuevos:
+            self.usos[usuario] = nuevos
+        for nombre in nuevos:
+            self.usuarios[nombre].add(usuario)
+        for nombre in anteriores - nuevos:
+            self.usuarios[nombre].discard(usuario)
+            if not self.usuarios[nombre]:
+                self.cerrar(nombre)
+
+    def cerrar(self, nombre: str) -> None:
+        """
+        Cierra un bloque y lo olvida. Solo debe llamarse cuando ningun array apunta ya a el.
+
+        Args:
+            nombre (str): Nombre del bloque.
+
+        Returns:
+            None
+        """
+        memoria = self.bloques.pop(nombre)[0]
+        self.usuarios.pop(nombre, None)
+        memoria.close()
+
+class Trabajo:
+    """
+    Clase que representa un trabajo de segmentacion enviado al planificador.
+
+    Argumentos:
+    idTrabajo (int): Identificador unico del trabajo.
+    configuracion (dict): Imagen, parametros de segmentacion, cuadrantes y parametros de postprocesamiento del trabajo.
+    estado (str): 'pendiente', 'en curso', 'finalizado', 'cancelado' o 'error'.
+    resultados (dict o None): Resultados del trabajo una vez finalizado. Sus imagenes estan en bloques de memoria
+        compartida que el planificador registra con el trabajo como usuario.
+    """
+
+    def __init__(self, idTrabajo: int, configuracion: Dict[str, any]):
+        self.idTrabajo = idTrabajo
+        self.configuracion = configuracion
+        self.estado = "pendiente"
+        self.resultados = None
+
+class PlanificadorTrabajos:
+    """
+    Clase que gestiona la cola de trabajos de segmentacion que se envian al proceso de inferencia.
+
+    Cada trabajo recibe un identificador y su propio espacio de resultados. Solo hay un trabajo en curso a la vez en el
+    proceso de inferencia; el resto esperan en la cola. Un trabajo nuevo con una configuracion distinta sustituye a los
+    anteriores: se cancela el que esta en curso y se descartan los pendientes. La cancelacion es cooperativa y el
+    proceso de inferencia la comprueba entre cuadrantes, entre lotes de puntos y entre etapas.
+    """
+
+    def __init__(self, trabajador: TrabajadorInferencia):
+
+        try:
+            self.trabajador = trabajador
+            self.trabajos = {}              # Espacio de resultados de cada trabajo por identificador
+            self.pendientes = deque()       # Trabajos a la espera de enviarse al proceso de inferencia
+            self.enCurso = None             # Trabajo que se esta ejecutando en el proceso de inferencia
+            self.ultimoId = 0
+            self.registroMemorias = RegistroMemorias()   # Usuarios de los bloques con las imagenes de los resultados
+        except Exception:
+            raise
+
+    def enviar(self, configuracion: Dict[str, any], sustituir: bool = True) -> Tuple[int, bool]:
+        """
+        Encola un trabajo de segmentacion.
+
+        Si la configuracion coincide con la del ultimo trabajo activo no se crea un trabajo nuevo. Si es distinta y
+        sustituir es True, se cancelan el trabajo en curso y los pendientes.
+
+        Args:
+            configuracion (dict): Configuracion del trabajo (imagen, parametros, numCuadrantes, procesamiento, paramsProcesamiento
+                y, opcionalmente, perfil).
+            sustituir (bool): Indica si el trabajo nuevo sustituye a los anteriores.
+
+        Returns:
+            Tuple[int, bool]: Identificador del trabajo y si se ha creado un trabajo nuevo.
+        """
+        try:
+            ultimo = self.pendientes[-1] if self.pendientes else self.enCurso
+            if ultimo is not None and ultimo.estado != "cancelado" and ultimo.configuracion == configuracion:
+                return ultimo.idTrabajo, False
+
+            if sustituir:
+                self.cancelar()
+
+            self.ultimoId += 1
+            trabajo = Trabajo(self.ultimoId, configuracion)
+            self.trabajos[trabajo.idTrabajo] = trabajo
+            self.pendientes.append(trabajo)
+            self.__despachar()
+            return trabajo.idTrabajo, True
+        except Exception:
+            raise
+
+    def cancelar(self, idTrabajo: Union[int, None] = None) -> List[int]:
+        """
+        Cancela un trabajo concreto o, si no se indica, el trabajo en curso y todos los pendientes.
+
+        Args:
+            idTrabajo (int o None): Identificador del trabajo a cancelar.
+
+        Returns:
+            list[int]: Identificadores de los trabajos cancelados.
+        """
+        try:
+            cancelados = []
+            for trabajo in list(self.pendientes):
+                if idTrabajo is None or trabajo.idTrabajo == idTrabajo:
+                    self.pendientes.remove(trabajo)
+                    trabajo.estado = "cancelado"
+                    cancelados.append(trabajo.idTrabajo)
+
+            if self.enCurso is not None and (idTrabajo is None or self.enCurso.idTrabajo == idTrabajo) and self.enCurso.estado != "cancelado":
+                # El proceso de inferencia lo detendra en el siguiente punto de comprobacion
+                self.enCurso.estado = "cancelado"
+                self.trabajador.cancelar(self.enCurso.idTrabajo)
+                cancelados.append(self.enCurso.idTrabajo)
+            return cancelados
+        except Exception:
+            raise
+
+    def idVigente(self) -> Union[int, None]:
+        """
+        Obtiene el identificador del ultimo trabajo que no ha sido cancelado ni sustituido.
+
+        Args:
+            None
+
+        Returns:
+            int o None: Identificador del trabajo vigente.
+        """
+        if self.pendientes:
+            return self.pendientes[-1].idTrabajo
+        if self.enCurso is not None and self.enCurso.estado == "en curso":
+            return self.enCurso.idTrabajo
+        return None
+
+    def hayTrabajos(self) -> bool:
+        """
+        Indica si hay algun trabajo en curso o pendiente.
+
+        Args:
+            None
+
+        Returns:
+            bool: True si hay trabajos por terminar.
+        """
+        return self.enCurso is not None or len(self.pendientes) > 0
+
+    def obtenerTrabajo(self, idTrabajo: int) -> Union[Trabajo, None]:
+        """
+        Obtiene un trabajo, y con el su espacio de resultados, a partir de su identificador.
+
+        Args:
+            idTrabajo (int): Identificador del trabajo.
+
+        Returns:
+            Trabajo o None: El trabajo solicitado.
+        """
+        return self.trabajos.get(idTrabajo)
+
+    def recibirEventos(self) -> List[tuple]:
+        """
+        Recoge los eventos del proceso de inferencia, actualiza el estado de los trabajos y envia el siguiente trabajo
+        pendiente cuando el proceso queda libre. Detecta tambien si el proceso de inferencia ha caido.
+
+        Args:
+            None
+
+        Returns:
+            list[tuple]: Eventos recibidos (tipo, idTrabajo, ...). Se añade el evento ('caido', idTrabajo) si el proceso
+            de inferencia se ha detenido con un trabajo en curso.
+        """
+        try:
+            eventos = self.trabajador.recibirEventos()
+            for evento in eventos:
+                tipo, idTrabajo = evento[0], evento[1]
+                trabajo = self.trabajos.get(idTrabajo)
+
+                if tipo == "resultado" and trabajo is not None:
+                    self.__adjuntar(idTrabajo, evento[2])
+                    trabajo.resultados = evento[2]
+                    if trabajo.estado != "cancelado":
+                        trabajo.estado = "finalizado"
+                elif tipo == "resultado":
+                    # Resultado tardio de un trabajo ya liberado: se adjunta para que el trabajador suelte sus bloques
+                    # y se cierra sin mostrarse
+                    self.__adjuntar(idTrabajo, evento[2])
+                    evento[2].clear()
+                    self.registroMemorias.asignar(("trabajo", idTrabajo), [])
+                elif tipo == "cancelado" and trabajo is not None:
+                    trabajo.estado = "cancelado"
+                elif tipo == "error" and trabajo is not None:
+                    trabajo.estado = "error"
+
+                if tipo in ("resultado", "cancelado", "error") and self.enCurso is not None and self.enCurso.idTrabajo == idTrabajo:
+                    self.enCurso = None
+
+            if self.enCurso is not None and not self.trabajador.estaVivo():
+                self.enCurso.estado = "error"
+                eventos.append(("caido", self.enCurso.idTrabajo))
+                self.enCurso = None
+                self.trabajador.reiniciar()
+
+            self.__despachar()
+            return eventos
+        except Exception:
+            raise
+
+    def __adjuntar(self, idTrabajo: int, resultados: Dict[str, any]) -> None:
+        """
+        Adjunta los bloques de las imagenes de unos resultados y los registra con el trabajo como usuario.
+        """
+        memorias = self.trabajador.adjuntarResultados(idTrabajo, resultados)
+        arrays = [resultados[clave] for clave in CLAVES_IMAGENES if resultados[clave] is not None]
+        for memoria, array in zip(memorias, arrays):
+            self.registroMemorias.añadir(memoria, array)
+        self.registroMemorias.asignar(("trabajo", idTrabajo), arrays)
+
+    def liberarResultados(self, idTrabajo: int) -> None:
+        """
+        Elimina el espacio de resultados de un trabajo terminado. Sus bloques de memoria compartida se cierran en
+        cuanto no los usa ningun otro usuario (por ejemplo una capa del visor).
+
+        Args:
+            idTrabajo (int): Identificador del trabajo.
+
+        Returns:
+            None
+        """
+        try:
+            trabajo = self.trabajos.get(idTrabajo)
+            if trabajo is None or trabajo is self.enCurso or trabajo in self.pendientes:
+                return
+            del self.trabajos[idTrabajo]
+            # Los arrays del trabajo se sueltan antes de cerrar los bloques que los contienen
+            trabajo.resultados = None
+            self.registroMemorias.asignar(("trabajo", idTrabajo), [])
+        except Exception:
+            raise
+
+    def __despachar(self) -> None:
+        """
+        Envia el siguiente trabajo pendiente al proceso de inferencia si esta libre.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        try:
+            if self.enCurso is not None or not self.pendientes:
+                return
+            if not self.trabajador.estaVivo():
+                self.trabajador.reiniciar()
+
+            trabajo = self.pendientes.popleft()
+            trabajo.estado = "en curso"
+            self.enCurso = trabajo
+            configuracion = trabajo.configuracion
+            self.trabajador.enviar(trabajo.idTrabajo, configuracion["imagen"], configuracion["parametros"], configuracion["numCuadrantes"], configuracion["procesamiento"], configuracion["paramsProcesamiento"], configuracion.get("perfil", False))
+        except Exception:
+            raise
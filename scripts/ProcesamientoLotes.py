@@ -0,0 +1,714 @@
+from scripts.Utils import Utils
+from scripts.Configuraciones import Configuraciones
+from scripts.CacheResultados import CacheResultados
+from scripts.BaseResultados import BaseResultados
+from scripts.Dataset import Dataset
+from scripts.Etapas import Etapa, CadenaEtapas
+from scripts.Exportaciones import Exportaciones, ARCHIVO_IMAGEN_MASCARAS, ARCHIVO_IMAGEN_PUNTOS, ARCHIVO_HISTOGRAMA
+from typing import Union, List, Dict, Tuple
+import argparse
+import datetime
+import threading
+import shutil
+import json
+import glob
+import time
+import sys
+import os
+import numpy as np
+
+# Nombre del diario dentro del directorio de salida
+NOMBRE_DIARIO = "diario.jsonl"
+
+# Directorio de los resultados parciales por cuadrante dentro del directorio de salida
+DIRECTORIO_PARCIALES = ".parciales"
+
+# Extensiones de imagen que se procesan al recorrer un directorio
+EXTENSIONES_IMAGEN = (".jpg", ".jpeg", ".png", ".tif", ".tiff")
+
+# Segundos maximos entre el inicio de dos capturas de la misma secuencia para que la anterior sirva de semilla a la
+# siguiente. Con mas separacion los rodaballos se han movido y la imagen se segmenta con la cuadricula completa
+SEPARACION_MAXIMA_SECUENCIA = 1800
+
+# Numero maximo de imagenes seguidas de una serie que se segmentan a partir de la anterior. La siguiente se segmenta con
+# la cuadricula completa, de forma que un rodaballo que no se detecto no se pierde en el resto de la serie
+CADENA_MAXIMA_SECUENCIA = 12
+
+# Segundos maximos que la inferencia espera la semilla de la imagen anterior. Pasado ese tiempo la imagen se segmenta
+# con la cuadricula completa en lugar de bloquear el lote
+ESPERA_MAXIMA_SEMILLA = 600
+
+class DiarioLote:
+    """
+    Clase que mantiene el diario de escritura anticipada de un procesamiento por lotes.
+
+    El diario es un archivo JSON Lines al que solo se añaden registros y que se sincroniza con el disco tras cada uno,
+    de forma que tras una caida contiene todo lo terminado hasta ese momento. Si la ultima linea quedo escrita a medias se
+    descarta al abrirlo.
+
+    En memoria no se guardan los registros sino solo lo necesario para reanudar y descartar duplicados: la configuracion
+    de inicio, lo imprescindible del ultimo registro 'completada' de cada imagen, las huellas de las imagenes terminadas y
+    los cuadrantes de las imagenes aun sin terminar, indexados por clave. Asi la memoria y el coste de cada consulta no
+    crecen con los registros de un servicio que funciona durante dias.
+    """
+
+    def __init__(self, ruta: str):
+
+        try:
+            self.ruta = ruta
+            self.configuracionInicio = None
+            self.terminadas = {}        # Ruta -> imagen, clave, tamaño, modificacion y salidas de su ultima terminacion
+            self.huellas = set()        # Huellas de las imagenes terminadas que la anotaron
+            self.parciales = {}         # Clave -> archivo parcial de cada cuadrante de las imagenes sin terminar
+            self.cerrojo = threading.Lock()
+            if os.path.isfile(ruta):
+                with open(ruta, "rb") as archivo:
+                    contenido = archivo.read()
+                valido = contenido[:contenido.rfind(b"\n") + 1]
+                for linea in valido.splitlines():
+                    self.__indexar(json.loads(linea))
+                if len(valido) != len(contenido):
+                    with open(ruta, "r+b") as archivo:
+                        archivo.truncate(len(valido))
+            self.archivo = open(ruta, "a")
+        except Exception:
+            raise
+
+    def registrar(self, tipo: str, **datos) -> None:
+        """
+        Añade un registro al diario y lo sincroniza con el disco.
+
+        Args:
+            tipo (str): Tipo de registro: 'inicio', 'cuadrante', 'completada' o 'error'.
+            **datos: Datos del registro.
+
+        Returns:
+            None
+        """
+        try:
+            registro = {"tipo": tipo, "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"), **datos}
+            # Con el procesamiento por etapas registran a la vez la inferencia (cuadrantes) y la exportacion
+            with self.cerrojo:
+                self.archivo.write(json.dumps(registro) + "\n")
+                self.archivo.flush()
+                os.fsync(self.archivo.fileno())
+                self.__indexar(registro)
+        except Exception:
+            raise
+
+    def __indexar(self, registro: Dict[str, any]) -> None:
+        """
+        Incorpora un registro a los indices en memoria. Los cuadrantes de una imagen se olvidan al terminarla.
+        """
+        tipo = registro["tipo"]
+        if tipo == "inicio":
+            if self.configuracionInicio is None:
+                self.configuracionInicio = registro["configuracion"]
+        elif tipo == "cuadrante":
+            self.parciales.setdefault(registro["clave"], {})[registro["cuadrante"]] = registro["archivo"]
+        elif tipo == "completada":
+            self.terminadas[registro["imagen"]] = {campo: registro[campo] for campo in ("imagen", "clave", "tamaño", "modificacion", "salidas") if campo in registro}
+            self.parciales.pop(registro.get("clave"), None)
+            if "huella" in registro:
+                self.huellas.add(registro["huella"])
+
+    def configuracion(self) -> Union[Dict[str, any], None]:
+        """
+        Obtiene la configuracion con la que se inicio el lote.
+
+        Returns:
+            dict o None: La configuracion del primer registro de inicio, o None si el diario esta vacio.
+        """
+        return self.configuracionInicio
+
+    def completadas(self) -> Dict[str, Dict[str, any]]:
+        """
+        Obtiene las imagenes terminadas.
+
+        Returns:
+            dict: Ruta, clave, tamaño, modificacion y salidas del ultimo registro 'completada' de cada imagen, por ruta.
+        """
+        with self.cerrojo:
+            return dict(self.terminadas)
+
+    def cuadrantes(self, clave: str) -> Dict[int, str]:
+        """
+        Obtiene los cuadrantes ya segmentados de una imagen.
+
+        Args:
+            clave (str): Clave de la segmentacion de la imagen en la cache de resultados.
+
+        Returns:
+            dict: Ruta del archivo parcial de cada cuadrante, por numero de cuadrante.
+        """
+        with self.cerrojo:
+            return dict(self.parciales.get(clave, {}))
+
+    def cerrar(self) -> None:
+        self.archivo.close()
+
+class ProcesamientoLotes:
+    """
+    Clase que segmenta un lote de imagenes sin interfaz y exporta sus resultados, pudiendo reanudarse tras una caida.
+
+    Cada cuadrante segmentado se guarda en un archivo parcial y se anota en el diario, y cada imagen terminada se anota
+    junto con sus archivos exportados, que se escriben de forma atomica. Al volver a lanzar el mismo lote se saltan las
+    imagenes terminadas y, en la imagen que se interrumpio, solo se segmentan los cuadrantes que faltaban. Los resultados
+    completos se guardan ademas en la cache de resultados, que comparten la interfaz y el resto de herramientas.
+
+    En modo secuencia las imagenes se ordenan por fecha de captura y cada imagen se segmenta a partir de la anterior
+    del mismo tanque y camara: los centroides aceptados en ella se usan como puntos de SAM y la cuadricula solo se
+    muestrea en las zonas fuera de sus mascaras que han cambiado, por lo que el decodificador procesa muchos menos
+    puntos por imagen.
+    """
+
+    def __init__(self, directorioSalida: str, nombreConfiguracion: str, numCuadrantes: Union[int, None] = None, usarCache: bool = True, cacheResultados: Union[CacheResultados, None] = None, presupuestoMascarasMB: Union[float, None] = None, baseResultados: Union[BaseResultados, None] = None, secuencia: bool = False):
+
+        try:
+            self.directorioSalida = directorioSalida
+            self.secuencia = secuencia
+            self.semillas = {}          # Serie (linea, tanque, camara) -> semilla de su ultima imagen segmentada
+            self.anteriores = {}        # Ruta -> ruta de la imagen anterior de su serie en el lote
+            self.listas = {}            # Ruta -> evento que se activa cuando su semilla esta publicada o ha fallado
+            self.cerrojoSemillas = threading.Lock()
+            self.presupuestoMascarasMB = presupuestoMascarasMB
+            self.baseResultados = baseResultados
+            self.configuracion = Configuraciones.obtener(nombreConfiguracion)
+            self.configuracion["nombre"] = nombreConfiguracion
+            if numCuadrantes is not None:
+                self.configuracion["numCuadrantes"] = numCuadrantes
+            # La cache tambien calcula la clave de cada imagen, que identifica sus resultados parciales
+            self.usarCache = usarCache
+            self.cacheResultados = cacheResultados or CacheResultados()
+            self.turbotSam = None
+            os.makedirs(os.path.join(directorioSalida, DIRECTORIO_PARCIALES), exist_ok=True)
+
+            # Un mismo directorio de salida solo puede reanudarse con la configuracion con la que se creo
+            self.diario = DiarioLote(os.path.join(directorioSalida, NOMBRE_DIARIO))
+            anterior = self.diario.configuracion()
+            if anterior is None:
+                self.diario.registrar("inicio", configuracion=self.configuracion)
+            elif {k: v for k, v in anterior.items() if k != "nombre"} != {k: v for k, v in json.loads(json.dumps(self.configuracion)).items() if k != "nombre"}:
+                raise ValueError(f"El directorio {directorioSalida} contiene un lote con otra configuracion. Use otro directorio de salida")
+            else:
+                self.diario.registrar("inicio", configuracion=self.configuracion, reanudacion=True)
+
+            # La ejecucion de la base de resultados se identifica por el directorio de salida, como el diario
+            self.idEjecucion = baseResultados.iniciarEjecucion(directorioSalida, self.configuracion) if baseResultados is not None else None
+        except Exception:
+            raise
+
+    @staticmethod
+    def listarImagenes(entradas: List[str]) -> List[Dict[str, str]]:
+        """
+        Obtiene las imagenes a procesar a partir de archivos, directorios (recorridos recursivamente) o patrones glob.
+
+        Args:
+            entradas (list[str]): Rutas o patrones.
+
+        Returns:
+            list[dict]: Para cada imagen, su ruta y su ruta relativa de salida, sin duplicados y en orden.
+        """
+        try:
+            imagenes, vistas = [], set()
+            for entrada in entradas:
+                if os.path.isdir(entrada):
+                    rutas = [(os.path.join(raiz, nombre), entrada) for raiz, _, nombres in os.walk(entrada) for nombre in nombres]
+                else:
+                    rutas = [(ruta, os.path.dirname(ruta)) for ruta in glob.glob(entrada)]
+                for ruta, base in sorted(rutas):
+                    # Se omiten las imagenes anotadas a mano y las exportadas por una segmentacion anterior
+                    nombre = os.path.basename(ruta)
+                    if not nombre.lower().endswith(EXTENSIONES_IMAGEN) or nombre.lower().endswith("_manual.jpg") or nombre in (ARCHIVO_IMAGEN_MASCARAS, ARCHIVO_IMAGEN_PUNTOS, ARCHIVO_HISTOGRAMA):
+                        continue
+                    absoluta = os.path.abspath(ruta)
+                    if absoluta in vistas:
+                        continue
+                    vistas.add(absoluta)
+                    # La salida reproduce la estructura de carpetas de la entrada, para que no coincidan nombres
+                    relativa = os.path.splitext(os.path.relpath(ruta, base))[0]
+                    imagenes.append({"ruta": ruta.replace(os.sep, "/"), "salida": relativa.replace(os.sep, "/")})
+            return imagenes
+        except Exception:
+            raise
+
+    @staticmethod
+    def serieImagen(ruta: str) -> Union[Tuple[Tuple[int, int, int], datetime.datetime, int], None]:
+        """
+        Obtiene la serie temporal a la que pertenece una imagen a partir de su nombre.
+
+        Args:
+            ruta (str): Ruta de la imagen.
+
+        Returns:
+            tuple o None: Serie (linea, tanque, camara), fecha de inicio de la captura y fotograma, o None si el nombre
+            no sigue el patron de las capturas.
+        """
+        try:
+            datos = Dataset.parsearNombre(ruta)
+            if not datos:
+                return None
+            camara = datos["camara"] if datos["camara"] is not None else -1
+            return (datos["linea"], datos["tanque"], camara), datetime.datetime.fromisoformat(datos["inicio"]), datos["fotograma"]
+        except Exception:
+            raise
+
+    @staticmethod
+    def ordenarSecuencia(imagenes: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        Ordena las imagenes para el modo secuencia: dentro de cada tanque y camara por fecha de captura y fotograma. Las
+        series se intercalan por fecha, de forma que con etapas la inferencia de un tanque se solapa con el
+        postprocesamiento de otro. Las imagenes cuyo nombre no sigue el patron van al final en su orden.
+
+        Args:
+            imagenes (list[dict]): Imagenes como las devuelve listarImagenes.
+
+        Returns:
+            list[dict]: Las mismas imagenes ordenadas.
+        """
+        try:
+            series = [(ProcesamientoLotes.serieImagen(imagen["ruta"]), imagen) for imagen in imagenes]
+            ordenadas = sorted((elemento for elemento in series if elemento[0] is not None), key=lambda elemento: (elemento[0][1], elemento[0][2], elemento[0][0]))
+            return [imagen for _, imagen in ordenadas] + [imagen for serie, imagen in series if serie is None]
+        except Exception:
+            raise
+
+    def esperarSemilla(self, imagen: Dict[str, str]) -> Union[Dict[str, np.ndarray], None]:
+        """
+        Obtiene la semilla de una imagen en modo secuencia, esperando a que termine el postprocesamiento de la imagen
+        anterior de su serie si esta en el mismo lote.
+
+        Args:
+            imagen (dict): Imagen como las devuelve listarImagenes.
+
+        Returns:
+            dict o None: Centroides, cobertura e imagen de la imagen anterior, o None si no la hay, es posterior, esta
+            demasiado separada en el tiempo o toca segmentar la serie con la cuadricula completa.
+        """
+        try:
+            serie = ProcesamientoLotes.serieImagen(imagen["ruta"])
+            if serie is None:
+                return None
+            anterior = self.anteriores.get(imagen["ruta"])
+            if anterior is not None and not self.listas[anterior].wait(ESPERA_MAXIMA_SEMILLA):
+                print(f"[INFO] {imagen['ruta']}: la imagen anterior de su serie no ha terminado a tiempo; se segmenta con la cuadricula completa")
+                return None
+            with self.cerrojoSemillas:
+                semilla = self.semillas.get(serie[0])
+            if semilla is None or semilla["cadena"] >= CADENA_MAXIMA_SECUENCIA:
+                return None
+            if not 0 <= (serie[1] - semilla["captura"]).total_seconds() <= SEPARACION_MAXIMA_SECUENCIA:
+                return None
+            return semilla
+        except Exception:
+            raise
+
+    def publicarSemilla(self, elemento: Dict[str, any]) -> None:
+        """
+        Guarda la semilla de una imagen segmentada para la siguiente de su serie y despierta a la inferencia si la
+        esperaba.
+
+        Args:
+            elemento (dict): Elemento devuelto por postprocesar, con los resultados de la imagen.
+
+        Returns:
+            None
+        """
+        from scripts.PipelineSegmentacion import PipelineSegmentacion
+
+        ruta = elemento["imagen"]["ruta"]
+        try:
+            serie = ProcesamientoLotes.serieImagen(ruta)
+            semilla = PipelineSegmentacion.semillaResultados(elemento["resultados"], elemento["imagenGrises"]) if serie is not None else None
+            if semilla is not None:
+                with self.cerrojoSemillas:
+                    anterior = self.semillas.get(serie[0])
+                    if anterior is None or anterior["captura"] <= serie[1]:
+                        # Las imagenes segmentadas con la cuadricula completa empiezan una nueva cadena
+                        cadena = anterior["cadena"] + 1 if anterior is not None and elemento["origen"] == "secuencia" else 0
+                        self.semillas[serie[0]] = {"captura": serie[1], "cadena": cadena, **semilla}
+        finally:
+            if ruta in self.listas:
+                self.listas[ruta].set()
+
+    @staticmethod
+    def guardarCuadrante(ruta: str, mascaras: List[Dict[str, any]]) -> None:
+        """
+        Guarda las mascaras de un cuadrante de forma atomica. Las segmentaciones se empaquetan a un bit por pixel.
+
+        Args:
+            ruta (str): Ruta del archivo .npz.
+            mascaras (list[dict]): Mascaras del cuadrante generadas por SAM.
+
+        Returns:
+            None
+        """
+        try:
+            arrays = {"n": np.array(len(mascaras))}
+            if mascaras:
+                segmentaciones = np.stack([mascara["segmentation"] for mascara in mascaras])
+                arrays["forma"] = np.array(segmentaciones.shape)
+                arrays["segmentation"] = np.packbits(segmentaciones, axis=None)
+                for columna in mascaras[0]:
+                    if columna != "segmentation" and all(columna in mascara for mascara in mascaras):
+                        arrays[columna] = np.asarray([mascara[columna] for mascara in mascaras])
+            temporal = ruta + ".tmp"
+            with open(temporal, "wb") as archivo:
+                np.savez_compressed(archivo, **arrays)
+                archivo.flush()
+                os.fsync(archivo.fileno())
+            os.replace(temporal, ruta)
+        except Exception:
+            raise
+
+    @staticmethod
+    def cargarCuadrante(ruta: str) -> List[Dict[str, any]]:
+        """
+        Carga las mascaras de un cuadrante guardadas con guardarCuadrante.
+
+        Args:
+            ruta (str): Ruta del archivo .npz.
+
+        Returns:
+            list[dict]: Mascaras del cuadrante con el mismo formato que las genera SAM.
+        """
+        try:
+            with np.load(ruta, allow_pickle=False) as datos:
+                n = int(datos["n"])
+                if n == 0:
+                    return []
+                forma = tuple(datos["forma"])
+                segmentaciones = np.unpackbits(datos["segmentation"], count=int(np.prod(forma))).reshape(forma).astype(bool)
+                columnas = {nombre: datos[nombre].tolist() for nombre in datos.files if nombre not in ("n", "forma", "segmentation")}
+            return [{"segmentation": segmentaciones[i], **{columna: valores[i] for columna, valores in columnas.items()}} for i in range(n)]
+        except Exception:
+            raise
+
+    def cargarModelo(self):
+        """
+        Carga el modelo la primera vez que hace falta, de forma que un lote resuelto por completo con la cache no lo cargue.
+        """
+        if self.turbotSam is None:
+            from scripts.TurbotSAM import TurbotSAM
+            self.turbotSam = TurbotSAM(**self.configuracion["parametros"])
+        return self.turbotSam
+
+    def cargarImagen(self, imagen: Dict[str, str]) -> Dict[str, any]:
+        """
+        Primera etapa: lee la imagen, la convierte a escala de grises, calcula su clave y consulta la cache de resultados.
+
+        Args:
+            imagen (dict): Ruta de la imagen y ruta relativa de salida, como las devuelve listarImagenes.
+
+        Returns:
+            dict: Elemento que recorre las etapas, con la imagen, su clave y los resultados si estaban en la cache.
+        """
+        try:
+            inicio = time.perf_counter()
+            # Un unico plano en escala de grises sirve para la segmentacion, el postprocesamiento y las exportaciones
+            imagenGrises = Utils.cargarImagen(imagen["ruta"])
+            imagenCargada = imagenGrises
+
+            configuracion = self.configuracion
+            clave = self.cacheResultados.clave(CacheResultados.huellaImagen(imagenGrises), configuracion["parametros"], configuracion["numCuadrantes"], configuracion["procesamiento"], configuracion["paramsProcesamiento"], self.secuencia)
+            resultados = self.cacheResultados.obtener(clave) if self.usarCache else None
+            return {
+                "imagen": imagen,
+                "inicio": inicio,
+                "imagenCargada": imagenCargada,
+                "imagenGrises": imagenGrises,
+                "clave": clave,
+                "mascaras": None,
+                "resultados": resultados,
+                "origen": "cache" if resultados is not None else "segmentacion",
+            }
+        except Exception:
+            raise
+
+    def inferir(self, elemento: Dict[str, any]) -> Dict[str, any]:
+        """
+        Segunda etapa: genera las mascaras de SAM, reanudando desde los cuadrantes ya segmentados. Es la unica etapa que
+        usa el modelo.
+
+        Args:
+            elemento (dict): Elemento devuelto por cargarImagen.
+
+        Returns:
+            dict: El elemento con las mascaras generadas.
+        """
+        from scripts.PipelineSegmentacion import PipelineSegmentacion
+
+        try:
+            if elemento["resultados"] is not None:
+                return elemento
+            imagen, clave = elemento["imagen"], elemento["clave"]
+            semilla = self.esperarSemilla(imagen) if self.secuencia else None
+            if semilla is not None:
+                elemento["origen"] = "secuencia"
+
+            # Cuadrantes segmentados antes de la interrupcion, anotados en el diario y presentes en disco
+            mascarasPrevias = {}
+            for cuadrante, archivo in self.diario.cuadrantes(clave).items():
+                rutaParcial = os.path.join(self.directorioSalida, archivo)
+                if os.path.isfile(rutaParcial):
+                    mascarasPrevias[int(cuadrante)] = ProcesamientoLotes.cargarCuadrante(rutaParcial)
+            if mascarasPrevias:
+                print(f"[INFO] {imagen['ruta']}: se reanuda con {len(mascarasPrevias)} cuadrantes ya segmentados")
+                elemento["origen"] = "reanudacion"
+
+            directorioParcial = os.path.join(DIRECTORIO_PARCIALES, clave)
+            os.makedirs(os.path.join(self.directorioSalida, directorioParcial), exist_ok=True)
+
+            def guardarCuadrante(cuadrante: int, mascaras: List[Dict[str, any]]) -> None:
+                archivo = os.path.join(directorioParcial, f"cuadrante_{cuadrante}.npz").replace(os.sep, "/")
+                ProcesamientoLotes.guardarCuadrante(os.path.join(self.directorioSalida, archivo), mascaras)
+                self.diario.registrar("cuadrante", imagen=imagen["ruta"], clave=clave, cuadrante=cuadrante, archivo=archivo)
+
+            configuracion = self.configuracion
+            notificar = lambda nivel, mensaje, porcentaje, **kwargs: None
+            elemento["mascaras"] = PipelineSegmentacion.generarMascaras(self.cargarModelo(), elemento["imagenGrises"], configuracion["numCuadrantes"], configuracion["procesamiento"], notificar, None, mascarasPrevias, guardarCuadrante, self.presupuestoMascarasMB, semilla)
+            return elemento
+        except Exception:
+            raise
+
+    def postprocesar(self, elemento: Dict[str, any]) -> Dict[str, any]:
+        """
+        Tercera etapa: obtiene las etiquetas, los centroides y el postprocesamiento a partir de las mascaras y guarda los
+        resultados en la cache.
+
+        Args:
+            elemento (dict): Elemento devuelto por inferir.
+
+        Returns:
+            dict: El elemento con los resultados de la segmentacion.
+        """
+        from scripts.PipelineSegmentacion import PipelineSegmentacion
+
+        try:
+            if elemento["resultados"] is None:
+                configuracion = self.configuracion
+                elemento["resultados"] = PipelineSegmentacion.procesarResultados(elemento["imagenGrises"], elemento.pop("mascaras"), configuracion["procesamiento"], configuracion["paramsProcesamiento"])
+                if self.usarCache:
+                    self.cacheResultados.guardar(elemento["clave"], elemento["resultados"])
+            if self.secuencia:
+                self.publicarSemilla(elemento)
+            return elemento
+        except Exception:
+            raise
+
+    def exportar(self, elemento: Dict[str, any]) -> Dict[str, any]:
+        """
+        Cuarta etapa: exporta los resultados de la imagen.
+
+        Args:
+            elemento (dict): Elemento devuelto por postprocesar.
+
+        Returns:
+            dict: Datos del registro 'completada' de la imagen.
+        """
+        try:
+            imagen, resultados = elemento["imagen"], elemento["resultados"]
+            notificarOmitidas = lambda omitidas: print(f"[WARNING] {imagen['ruta']}: {omitidas} mascaras no aparecen en la imagen de etiquetas y no se han exportado a COCO")
+            salidas = Exportaciones.exportarResultados(resultados, elemento["imagenCargada"], os.path.join(self.directorioSalida, imagen["salida"]), self.configuracion["numCuadrantes"], imagen["salida"], notificarOmitidas)
+            estado = os.stat(imagen["ruta"])
+            registro = {
+                "imagen": imagen["ruta"],
+                "clave": elemento["clave"],
+                "tamaño": estado.st_size,
+                "modificacion": estado.st_mtime_ns,
+                "conteo": resultados["numeroRodCalculado"],
+                "origen": elemento["origen"],
+                "latencia": round(time.perf_counter() - elemento["inicio"], 4),
+                "salidas": {nombre: os.path.relpath(ruta, self.directorioSalida).replace(os.sep, "/") for nombre, ruta in salidas.items()},
+            }
+            if self.baseResultados is not None:
+                procesado = resultados["listaMascarasProcesadas"] is not None
+                tabla = Exportaciones.tablaMascaras(
+                    resultados["listaMascarasProcesadas"] if procesado else resultados["listaMascaras"],
+                    resultados["listaPuntosProcesados"] if procesado else resultados["listaPuntosGenerados"],
+                    elemento["imagenCargada"].shape[:2], self.configuracion["numCuadrantes"], imagen["salida"],
+                )
+                self.baseResultados.registrarImagen(self.idEjecucion, imagen["ruta"], self.configuracion, registro, tabla)
+            return registro
+        except Exception:
+            raise
+
+    def procesarImagen(self, imagen: Dict[str, str]) -> Dict[str, any]:
+        """
+        Segmenta una imagen, reanudando desde sus cuadrantes ya segmentados, y exporta sus resultados, pasando por todas
+        las etapas una detras de otra.
+
+        Args:
+            imagen (dict): Ruta de la imagen y ruta relativa de salida, como las devuelve listarImagenes.
+
+        Returns:
+            dict: Datos del registro 'completada' de la imagen.
+        """
+        try:
+            return self.exportar(self.postprocesar(self.inferir(self.cargarImagen(imagen))))
+        except Exception:
+            raise
+
+    def __terminada(self, imagen: Dict[str, str], completadas: Dict[str, Dict[str, any]]) -> bool:
+        """
+        Indica si una imagen ya se termino en una ejecucion anterior: esta anotada en el diario, no ha cambiado desde
+        entonces y sus archivos exportados siguen existiendo.
+        """
+        registro = completadas.get(imagen["ruta"])
+        if registro is None or not os.path.isfile(imagen["ruta"]):
+            return False
+        estado = os.stat(imagen["ruta"])
+        if (estado.st_size, estado.st_mtime_ns) != (registro["tamaño"], registro["modificacion"]):
+            return False
+        return all(os.path.isfile(os.path.join(self.directorioSalida, ruta)) for ruta in registro["salidas"].values())
+
+    def completar(self, registro: Dict[str, any]) -> None:
+        """
+        Anota una imagen terminada en el diario y elimina sus resultados parciales.
+
+        Args:
+            registro (dict): Datos del registro 'completada' de la imagen, como los devuelve exportar.
+
+        Returns:
+            None
+        """
+        try:
+            self.diario.registrar("completada", **registro)
+            # Los resultados parciales ya no hacen falta una vez anotada la imagen como terminada
+            shutil.rmtree(os.path.join(self.directorioSalida, DIRECTORIO_PARCIALES, registro["clave"]), ignore_errors=True)
+        except Exception:
+            raise
+
+    def __completar(self, registro: Dict[str, any], resumen: Dict[str, any], total: int) -> None:
+        """
+        Anota una imagen terminada y la cuenta en el resumen del lote.
+        """
+        self.completar(registro)
+        resumen["procesadas"] += 1
+        print(f"[INFO] ({resumen['procesadas'] + resumen['fallidas']}/{total}) {registro['imagen']}: {registro['conteo']} rodaballos, {registro['latencia']:.2f} s ({registro['origen']})")
+
+    def __fallar(self, ruta: str, error: Exception, resumen: Dict[str, any], total: int) -> None:
+        """
+        Anota en el diario una imagen que no se ha podido procesar.
+        """
+        self.diario.registrar("error", imagen=ruta, error=str(error))
+        # La imagen siguiente de su serie no debe quedarse esperando su semilla
+        if ruta in self.listas:
+            self.listas[ruta].set()
+        resumen["fallidas"] += 1
+        print(f"[ERROR] ({resumen['procesadas'] + resumen['fallidas']}/{total}) {ruta}: {str(error)}")
+
+    def ejecutar(self, imagenes: List[Dict[str, str]], hilos: Union[Dict[str, int], None] = None) -> Dict[str, any]:
+        """
+        Procesa un lote de imagenes, saltando las ya terminadas.
+
+        Si se indican hilos, las imagenes pasan por una cadena de etapas (carga, inferencia, postprocesamiento y
+        exportacion) con colas acotadas entre ellas, de forma que la lectura, el postprocesamiento y la escritura de
+        unas imagenes se solapan con la inferencia de otras. La inferencia siempre tiene un unico hilo, porque usa el
+        modelo.
+
+        Args:
+            imagenes (list[dict]): Imagenes a procesar, como las devuelve listarImagenes.
+            hilos (dict o None): Numero de hilos de las etapas 'carga', 'postprocesamiento' y 'exportacion'. Si es None
+                las imagenes se procesan una detras de otra.
+
+        En modo secuencia las imagenes se procesan en el orden de ordenarSecuencia y se cargan con un unico hilo, para
+        que lleguen a la inferencia en ese orden.
+
+        Returns:
+            dict: Numero de imagenes procesadas, saltadas y fallidas, la duracion del lote y, con etapas, sus metricas
+            de ocupacion.
+        """
+        try:
+            if self.secuencia:
+                imagenes = ProcesamientoLotes.ordenarSecuencia(imagenes)
+            completadas = self.diario.completadas()
+            pendientes = [imagen for imagen in imagenes if not self.__terminada(imagen, completadas)]
+            if self.secuencia:
+                ultimas = {}
+                for imagen in pendientes:
+                    serie = ProcesamientoLotes.serieImagen(imagen["ruta"])
+                    if serie is None:
+                        continue
+                    if serie[0] in ultimas:
+                        self.anteriores[imagen["ruta"]] = ultimas[serie[0]]
+                    ultimas[serie[0]] = imagen["ruta"]
+                    self.listas[imagen["ruta"]] = threading.Event()
+            resumen = {"procesadas": 0, "saltadas": len(imagenes) - len(pendientes), "fallidas": 0}
+            inicio = time.perf_counter()
+
+            if hilos is None:
+                for imagen in pendientes:
+                    try:
+                        self.__completar(self.procesarImagen(imagen), resumen, len(pendientes))
+                    except Exception as e:
+                        self.__fallar(imagen["ruta"], e, resumen, len(pendientes))
+            else:
+                # El modelo se carga antes de arrancar las etapas para que su carga no cuente como ocupacion
+                if pendientes:
+                    self.cargarModelo()
+                cerrojo = threading.Lock()
+
+                def completar(elemento: Dict[str, any]) -> None:
+                    registro = self.exportar(elemento)
+                    with cerrojo:
+                        self.__completar(registro, resumen, len(pendientes))
+
+                def fallar(etapa: str, elemento: Dict[str, any], error: Exception) -> None:
+                    with cerrojo:
+                        self.__fallar(elemento["imagen"]["ruta"] if "imagen" in elemento else elemento["ruta"], error, resumen, len(pendientes))
+
+                # En modo secuencia las imagenes deben llegar a la inferencia en orden, porque cada una espera la semilla
+                # de la anterior de su serie: con varios cargadores una imagen podria adelantar a la que espera
+                cargadores = 1 if self.secuencia else hilos.get("carga", 2)
+                cadena = CadenaEtapas([
+                    Etapa("carga", self.cargarImagen, cargadores),
+                    Etapa("inferencia", self.inferir, 1),
+                    Etapa("postprocesamiento", self.postprocesar, hilos.get("postprocesamiento", 2)),
+                    Etapa("exportacion", completar, hilos.get("exportacion", 1)),
+                ], fallar)
+                resumen["etapas"] = cadena.ejecutar(pendientes)
+
+            resumen["duracion"] = round(time.perf_counter() - inicio, 4)
+            return resumen
+        except Exception:
+            raise
+        finally:
+            self.diario.cerrar()
+
+def main(argumentos: Union[List[str], None] = None) -> int:
+    parser = argparse.ArgumentParser(description="Procesamiento por lotes reanudable de TURBOT SAM.")
+    parser.add_argument("entradas", nargs="+", help="Imagenes, directorios o patrones glob a procesar.")
+    parser.add_argument("--configuracion", required=True, help=f"Nombre de la configuracion ({', '.join(Configuraciones.listar())}) o ruta de un JSON.")
+    parser.add_argument("--salida", required=True, help="Directorio de salida. Si ya contiene un lote con la misma configuracion, se reanuda.")
+    parser.add_argument("--cuadrantes", type=int, default=None, help="Numero de cuadrantes. Por defecto el de la configuracion.")
+    parser.add_argument("--sin-cache", action="store_true", help="No leer ni guardar resultados en la cache de resultados.")
+    parser.add_argument("--secuencial", action="store_true", help="Procesar cada imagen de principio a fin antes de empezar la siguiente.")
+    parser.add_argument("--secuencia", action="store_true", help="Ordenar las imagenes por tanque y fecha de captura y segmentar cada una a partir de los centroides de la anterior.")
+    parser.add_argument("--cargadores", type=int, default=2, help="Hilos que leen y convierten las imagenes.")
+    parser.add_argument("--postprocesadores", type=int, default=2, help="Hilos que obtienen etiquetas, centroides y postprocesamiento.")
+    parser.add_argument("--base-datos", default=None, help="Base de datos SQLite en la que registrar cada imagen, su conteo y sus mascaras.")
+    parser.add_argument("--presupuesto-mascaras", type=float, default=None, help="Memoria maxima, en MB, de las segmentaciones de las mascaras de cada imagen; el resto se guarda en disco.")
+    parser.add_argument("--escritores", type=int, default=1, help="Hilos que exportan los resultados.")
+    args = parser.parse_args(argumentos)
+
+    imagenes = ProcesamientoLotes.listarImagenes(args.entradas)
+    if not imagenes:
+        print("[ERROR] No se han encontrado imagenes")
+        return 1
+
+    baseResultados = BaseResultados(args.base_datos) if args.base_datos else None
+    lote = ProcesamientoLotes(args.salida, args.configuracion, args.cuadrantes, usarCache=not args.sin_cache, presupuestoMascarasMB=args.presupuesto_mascaras, baseResultados=baseResultados, secuencia=args.secuencia)
+    hilos = None if args.secuencial else {"carga": args.cargadores, "postprocesamiento": args.postprocesadores, "exportacion": args.escritores}
+    try:
+        resumen = lote.ejecutar(imagenes, hilos)
+    finally:
+        if baseResultados is not None:
+            baseResultados.cerrar()
+    print(f"[INFO] Lote terminado: {resumen['procesadas']} procesadas, {resumen['saltadas']} ya terminadas, {resumen['fallidas']} fallidas en {resumen['duracion']:.1f} s")
+    if "etapas" in resumen:
+        print(CadenaEtapas.formatearMetricas(resumen["etapas"]))
+    return 1 if resumen["fallidas"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,14 @@
 from skimage import morphology
 from scipy.ndimage import center_of_mass
+from scripts.AlmacenMascaras import MascaraAlmacenada
 import numpy as np
 from typing import Tuple, List, Dict
 import matplotlib.pyplot as plt
 import cv2
 
+# Propiedades de las mascaras que acompañan a cada centroide
+PROPIEDADES_CENTROIDES = ("area", "predicted_iou", "stability_score")
+
 class ProcesarMascaras:
     """
     Clase que proporciona metodos para procesar y visualizar mascaras (segmentaciones) en imagenes
@@ -45,14 +49,50 @@ class ProcesarMascaras:
         except Exception:
             raise
     
+    @staticmethod
+    def recorteMascara(mascara: Dict[str, any], margen: int = 0) -> Tuple[int, int, np.ndarray, Tuple[int, int]]:
+        """
+        Obtiene el recorte de la caja envolvente de una mascara, de forma que las operaciones sobre mascaras trabajen
+        solo con la zona que ocupan. Las mascaras de un AlmacenMascaras ya estan guardadas recortadas.
+
+        Args:
+            mascara (dict): Mascara de SAM o MascaraAlmacenada.
+            margen (int): Pixeles en blanco que se añaden alrededor de la caja, sin salir de la imagen.
+
+        Returns:
+            tuple: Fila y columna de la esquina del recorte en la imagen, el recorte booleano (una copia que se puede
+            modificar) y las dimensiones de la imagen completa.
+        """
+        try:
+            if isinstance(mascara, MascaraAlmacenada):
+                y0, x0, recorte = mascara.recorte()
+                dimensiones = mascara.dimensiones
+            else:
+                segmentacion = np.asarray(mascara['segmentation'], dtype=bool)
+                dimensiones = segmentacion.shape
+                filas, columnas = np.flatnonzero(segmentacion.any(axis=1)), np.flatnonzero(segmentacion.any(axis=0))
+                if filas.size == 0:
+                    return 0, 0, np.zeros((0, 0), dtype=bool), dimensiones
+                y0, x0 = int(filas[0]), int(columnas[0])
+                recorte = segmentacion[y0:filas[-1] + 1, x0:columnas[-1] + 1]
+
+            if margen == 0 or recorte.size == 0:
+                return y0, x0, recorte.copy(), dimensiones
+            nuevoY0, nuevoX0 = max(y0 - margen, 0), max(x0 - margen, 0)
+            nuevoY1, nuevoX1 = min(y0 + recorte.shape[0] + margen, dimensiones[0]), min(x0 + recorte.shape[1] + margen, dimensiones[1])
+            ampliado = np.zeros((nuevoY1 - nuevoY0, nuevoX1 - nuevoX0), dtype=bool)
+            ampliado[y0 - nuevoY0:y0 - nuevoY0 + recorte.shape[0], x0 - nuevoX0:x0 - nuevoX0 + recorte.shape[1]] = recorte
+            return nuevoY0, nuevoX0, ampliado, dimensiones
+        except Exception:
+            raise
+
     @staticmethod
     def mostrarLabels(mascaras: List[Dict[str, any]]) -> np.ndarray:
         """
         Toma una lista de mascaras y genera una matriz de etiquetas donde cada region segmentada tiene un valor unico de etiqueta.
 
-        Recorre todas las mascaras y convierte las coordenadas de los segmentos en mascaras binarias.
-        Luego, combina todas estas mascaras en una sola matriz de etiquetas asignando valores de etiqueta unicos a cada region segmentada.
-        Finalmente, devuelve la matriz de etiquetas resultante que representa todas las regiones segmentadas de las mascaras.
+        Recorre todas las mascaras y pinta cada una, con un valor de etiqueta unico, directamente en la matriz de etiquetas
+        y solo en la zona de su caja envolvente, sin crear una imagen intermedia por mascara.
 
         Args:
             mascaras (list): Lista de mascaras.
@@ -64,27 +104,12 @@ class ProcesarMascaras:
             if len(mascaras) == 0:
                 return None
 
-            # Crear una lista para almacenar las máscaras
-            listaMascaras = []
-
-            # Recorrer todas las mascaras
-            for ann in mascaras:
-                # Obtener las coordenadas de los segmentos
-                segmentation = ann['segmentation']
-
-                # Crear una matriz de ceros para la máscara
-                mascara = np.zeros((segmentation.shape[0], segmentation.shape[1]), dtype=np.uint8)
-
-                # Establecer los píxeles correspondientes a los segmentos en 1
-                mascara[segmentation] = 1
-
-                # Agregar la máscara a la lista
-                listaMascaras.append(mascara)
-
-            # Combinar todas las máscaras en una sola matriz de etiquetas
-            labels = np.zeros_like(listaMascaras[0], dtype=np.uint32)
-            for i, mascara in enumerate(listaMascaras, start=1):
-                labels[mascara == 1] = i
+            labels = None
+            for i, ann in enumerate(mascaras, start=1):
+                y0, x0, recorte, dimensiones = ProcesarMascaras.recorteMascara(ann)
+                if labels is None:
+                    labels = np.zeros(dimensiones, dtype=np.uint32)
+                labels[y0:y0 + recorte.shape[0], x0:x0 + recorte.shape[1]][recorte] = i
 
             return labels
         except Exception:
@@ -105,7 +130,8 @@ class ProcesarMascaras:
 
         Outputs:
         - Una tupla que contiene:
-            - Una imagen de etiquetas que contiene todas las mascaras aplicadas.
+            - Una imagen de etiquetas que contiene todas las mascaras aplicadas, con la etiqueta n para la mascara n - 1
+              de la lista de mascaras filtradas.
             - Una lista de diccionarios que contiene informacion sobre las mascaras filtradas.
 
         '''
@@ -113,12 +139,14 @@ class ProcesarMascaras:
             mascarasFiltradas = []
             ordenarMascaras = sorted(mascarasInfo, key=lambda x: x['area'], reverse=True)
 
-            for enum, mascaraInfo in enumerate(ordenarMascaras):
-                segmentation = mascaraInfo['segmentation']
+            for mascaraInfo in ordenarMascaras:
                 area = mascaraInfo['area']
-                mnarray = np.array(segmentation, dtype=bool)
-                mnarray[imagenOriginal < min_intensity] = False
-                pixels = imagenOriginal[mnarray]
+                # Se trabaja en la caja envolvente con un margen mayor que el radio de la apertura, lo que da el mismo
+                # resultado que sobre la imagen completa
+                y0, x0, mnarray, _ = ProcesarMascaras.recorteMascara(mascaraInfo, margen=4)
+                region = (slice(y0, y0 + mnarray.shape[0]), slice(x0, x0 + mnarray.shape[1]))
+                mnarray[imagenOriginal[region] < min_intensity] = False
+                pixels = imagenOriginal[region][mnarray]
 
                 if pixels.size == 0:
                     continue
@@ -126,45 +154,62 @@ class ProcesarMascaras:
                 mnarray = morphology.opening(mnarray, morphology.disk(3))
 
                 if area > min_size and area < max_size:
-                    imagenEtiquetada[mnarray] = enum + 1
+                    # La etiqueta n corresponde a la mascara filtrada n - 1, como en mostrarLabels
                     mascarasFiltradas.append(mascaraInfo)
+                    imagenEtiquetada[region][mnarray] = len(mascarasFiltradas)
 
             return imagenEtiquetada, mascarasFiltradas
         except Exception:
             raise
     
     @staticmethod
-    def pintarCentroidesMascaras(mascaras: List[Dict[str, any]]) -> Tuple[np.ndarray, List[Tuple[int, int]]]:
+    def calcularCentroides(mascaras: List[Dict[str, any]]) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
         """
-        Pinta los centroides de las máscaras en una imagen.
+        Calcula los centroides de las máscaras junto con las propiedades de cada una, sin pintarlos en ninguna imagen.
 
         Args:
             mascaras (list[dict]): Lista de diccionarios que contienen información sobre las máscaras.
 
         Returns:
-            Tuple[np.ndarray, list]: Una tupla que contiene la imagen con los centroides pintados y una lista de coordenadas de los centroides.
+            Tuple[np.ndarray, dict]: Array (N, 2) con las coordenadas x, y de los centroides y diccionario con un array
+            de N valores por propiedad (area, predicted_iou y stability_score) en el mismo orden.
+        """
+        try:
+            centroides = np.zeros((len(mascaras), 2), dtype=np.int64)
+            propiedades = {clave: np.full(len(mascaras), np.nan) for clave in PROPIEDADES_CENTROIDES}
+
+            for i, mascara in enumerate(mascaras):
+                # Calcular el centroide de la máscara en su caja envolvente y pasarlo a coordenadas de la imagen
+                y0, x0, recorte, _ = ProcesarMascaras.recorteMascara(mascara)
+                centroide = center_of_mass(recorte)
+                centroides[i] = int(centroide[1] + x0), int(centroide[0] + y0)
+                for clave in PROPIEDADES_CENTROIDES:
+                    propiedades[clave][i] = mascara.get(clave, np.nan)
+
+            return centroides, propiedades
+        except Exception:
+            raise
+
+    @staticmethod
+    def pintarCentroides(centroides: np.ndarray, dimensiones: Tuple[int, int], radio: int = 3, valor: int = 255) -> np.ndarray:
+        """
+        Pinta los centroides en una imagen. Solo se usa al exportar la imagen con los puntos; en el visor los centroides
+        se muestran como una capa de puntos.
+
+        Args:
+            centroides (np.ndarray): Array (N, 2) con las coordenadas x, y de los centroides.
+            dimensiones (tuple[int, int]): Altura y anchura de la imagen.
+            radio (int): Radio de los puntos en pixeles.
+            valor (int): Valor de los puntos.
+
+        Returns:
+            np.ndarray: Imagen uint8 con los centroides al valor indicado sobre fondo 0.
         """
         try:
-            # Crear una imagen vacía del mismo tamaño que las máscaras
-            altura, anchura = mascaras[0]['segmentation'].shape
-            img = np.zeros((altura, anchura), dtype=np.uint8)
-
-            # Crear una lista para almacenar las posiciones de los centroides
-            centroides = []
-        
-            # Iterar sobre cada máscara y calcular el centroidee
-            for mascara in mascaras:
-                # Calcular el centroidee de la máscara
-                centroide = center_of_mass(mascara['segmentation'])
-
-                # Dibujar un punto en el centroidee de la máscara
-                centroideY, centroideX = map(int, centroide)
-                cv2.circle(img, (centroideX, centroideY), 3, (255, 255, 255), -1)
-                
-                # Agregar las coordenadas del centroidee a la lista de centroides
-                centroides.append((centroideX, centroideY))
-
-            return img, centroides
+            img = np.zeros(dimensiones, dtype=np.uint8)
+            for centroideX, centroideY in np.asarray(centroides, dtype=np.int64).reshape(-1, 2):
+                cv2.circle(img, (int(centroideX), int(centroideY)), radio, valor, -1)
+            return img
         except Exception:
             raise
 
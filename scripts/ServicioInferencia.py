@@ -0,0 +1,397 @@
+from scripts.Utils import Utils
+from scripts.Configuraciones import Configuraciones
+from scripts.CacheResultados import CacheResultados
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from collections import deque
+from typing import Union, List, Dict
+import argparse
+import threading
+import math
+import queue
+import json
+import time
+import sys
+import cv2
+import numpy as np
+
+# Tamaño maximo en bytes del cuerpo de una peticion de segmentacion. Los cuerpos mayores se rechazan sin leerlos
+TAMAÑO_MAXIMO_PETICION = 256 * 2**20
+
+class PeticionSegmentacion:
+    """
+    Clase que representa una peticion de segmentacion en espera de ser atendida por el hilo de inferencia.
+
+    Argumentos:
+    imagen (np.ndarray): Imagen (altura, anchura) en escala de grises.
+    configuracion (dict): Configuracion de la segmentacion (parametros, numCuadrantes, procesamiento y paramsProcesamiento).
+    claveCache (str o None): Clave de la segmentacion en la cache de resultados.
+    """
+
+    def __init__(self, imagen: np.ndarray, configuracion: Dict[str, any], claveCache: Union[str, None] = None):
+        self.imagen = imagen
+        self.configuracion = configuracion
+        self.claveCache = claveCache
+        self.llegada = time.perf_counter()
+        self.inicio = None
+        self.tamañoLote = None
+        self.resultados = None
+        self.error = None
+        self.abandonada = False       # El cliente ya recibio un error por tiempo de espera y la peticion no se atiende
+        self.terminada = threading.Event()
+
+class ServicioInferencia:
+    """
+    Clase que mantiene un modelo cargado y atiende peticiones de segmentacion de varios clientes a la vez.
+
+    Las peticiones se encolan en una cola acotada y un unico hilo de inferencia las recoge en micro-lotes: espera la
+    primera y reune las que lleguen durante un breve intervalo, hasta el tamaño de lote. Las imagenes (o los cuadrantes)
+    de todo el micro-lote se codifican en una sola pasada del codificador de SAM y cada peticion se segmenta despues a
+    partir de sus embeddings. Lleva ademas metricas de profundidad de cola, tamaño de lote y latencia.
+    """
+
+    def __init__(self, configuracionInicial: str = "conZoom", tamañoLote: int = 4, esperaMaxima: float = 0.05, capacidadCola: int = 32, usarCache: bool = True):
+
+        from scripts.TurbotSAM import TurbotSAM
+
+        try:
+            self.configuracionInicial = configuracionInicial
+            self.tamañoLote = tamañoLote
+            self.esperaMaxima = esperaMaxima
+            self.cola = queue.Queue(capacidadCola)
+            self.cacheResultados = CacheResultados() if usarCache else None
+
+            parametros = Configuraciones.obtener(configuracionInicial)["parametros"]
+            self.turbotSam = TurbotSAM(**parametros)
+            self.parametrosActuales = dict(parametros)
+
+            # Con cuadrantes, cada imagen aporta varias entradas al codificador
+            self.turbotSam.activarCacheEmbeddings(tamañoLote * 64)
+
+            self.cerrojo = threading.Lock()
+            self.latencias = deque(maxlen=1000)
+            self.esperas = deque(maxlen=1000)
+            self.metricas = {"peticiones": 0, "aciertosCache": 0, "rechazadas": 0, "abandonadas": 0, "errores": 0, "lotes": 0, "imagenesLote": 0, "colaMaxima": 0}
+            self.parar = threading.Event()
+            self.hilo = threading.Thread(target=self.__bucleInferencia, name="inferencia", daemon=True)
+            self.hilo.start()
+        except Exception:
+            raise
+
+    def configuracion(self, nombre: str, numCuadrantes: Union[int, None] = None, procesamiento: Union[bool, None] = None) -> Dict[str, any]:
+        """
+        Obtiene la configuracion de una peticion a partir de un preset y de los valores indicados en la peticion. Solo se
+        aceptan los nombres de Configuraciones.listar() y la configuracion inicial del servicio, nunca rutas de archivos
+        indicadas por el cliente.
+
+        Args:
+            nombre (str): Nombre de la configuracion.
+            numCuadrantes (int o None): Numero de cuadrantes: 0 para la imagen completa o un cuadrado perfecto. Si es
+                None se usa el del preset.
+            procesamiento (bool o None): Indica si se realiza el postprocesamiento. Si es None se usa el del preset.
+
+        Returns:
+            dict: La configuracion.
+
+        Raises:
+            KeyError: Si la configuracion no existe.
+            ValueError: Si el numero de cuadrantes no es valido.
+        """
+        try:
+            if numCuadrantes is not None and (numCuadrantes < 0 or math.isqrt(numCuadrantes) ** 2 != numCuadrantes):
+                raise ValueError(f"Numero de cuadrantes no valido: {numCuadrantes}. Debe ser 0 o un cuadrado perfecto (4, 9, 16...)")
+            if nombre != self.configuracionInicial and nombre not in Configuraciones.listar():
+                raise KeyError(f"No existe la configuración '{nombre}'. Configuraciones disponibles: {', '.join(Configuraciones.listar())}")
+            configuracion = Configuraciones.obtener(nombre)
+            if numCuadrantes is not None:
+                configuracion["numCuadrantes"] = numCuadrantes or None
+            if procesamiento is not None:
+                configuracion["procesamiento"] = procesamiento
+            return configuracion
+        except Exception:
+            raise
+
+    def segmentar(self, imagen: np.ndarray, configuracion: Dict[str, any], tiempoMaximo: float = 600.0) -> Dict[str, any]:
+        """
+        Segmenta una imagen, consultando antes la cache de resultados. Se llama desde los hilos del servidor HTTP y
+        espera a que el hilo de inferencia atienda la peticion.
+
+        Args:
+            imagen (np.ndarray): Imagen (altura, anchura) en escala de grises.
+            configuracion (dict): Configuracion obtenida con configuracion.
+            tiempoMaximo (float): Segundos maximos de espera.
+
+        Returns:
+            dict: Numero de rodaballos, centroides y tiempos de la peticion.
+
+        Raises:
+            queue.Full: Si la cola de peticiones esta llena.
+            TimeoutError: Si la peticion no termina en el tiempo maximo.
+        """
+        try:
+            llegada = time.perf_counter()
+            claveCache = None
+            if self.cacheResultados is not None:
+                claveCache = self.cacheResultados.clave(CacheResultados.huellaImagen(imagen), configuracion["parametros"], configuracion["numCuadrantes"], configuracion["procesamiento"], configuracion["paramsProcesamiento"])
+                resultados = self.cacheResultados.obtener(claveCache)
+                if resultados is not None:
+                    with self.cerrojo:
+                        self.metricas["peticiones"] += 1
+                        self.metricas["aciertosCache"] += 1
+                        self.latencias.append(time.perf_counter() - llegada)
+                    return ServicioInferencia.respuesta(resultados, configuracion, time.perf_counter() - llegada, 0.0, 0, True)
+
+            peticion = PeticionSegmentacion(imagen, configuracion, claveCache)
+            try:
+                self.cola.put_nowait(peticion)
+            except queue.Full:
+                with self.cerrojo:
+                    self.metricas["rechazadas"] += 1
+                raise
+            with self.cerrojo:
+                self.metricas["colaMaxima"] = max(self.metricas["colaMaxima"], self.cola.qsize())
+
+            if not peticion.terminada.wait(tiempoMaximo):
+                # El hilo de inferencia descarta la peticion si aun no la ha empezado
+                peticion.abandonada = True
+                with self.cerrojo:
+                    self.metricas["abandonadas"] += 1
+                raise TimeoutError(f"La segmentacion no ha terminado en {tiempoMaximo} s")
+            if peticion.error is not None:
+                raise peticion.error
+
+            latencia = time.perf_counter() - peticion.llegada
+            espera = peticion.inicio - peticion.llegada
+            with self.cerrojo:
+                self.metricas["peticiones"] += 1
+                self.latencias.append(latencia)
+                self.esperas.append(espera)
+            return ServicioInferencia.respuesta(peticion.resultados, configuracion, latencia, espera, peticion.tamañoLote, False)
+        except Exception:
+            raise
+
+    @staticmethod
+    def respuesta(resultados: Dict[str, any], configuracion: Dict[str, any], latencia: float, espera: float, tamañoLote: int, cache: bool) -> Dict[str, any]:
+        """
+        Construye la respuesta JSON de una segmentacion.
+
+        Args:
+            resultados (dict): Resultados de PipelineSegmentacion.ejecutar o de la cache de resultados.
+            configuracion (dict): Configuracion de la segmentacion.
+            latencia (float): Segundos desde la llegada de la peticion hasta su respuesta.
+            espera (float): Segundos que la peticion estuvo en la cola.
+            tamañoLote (int): Numero de peticiones del micro-lote en el que se atendio.
+            cache (bool): Indica si los resultados se han obtenido de la cache de resultados.
+
+        Returns:
+            dict: Respuesta serializable a JSON.
+        """
+        procesado = resultados["listaPuntosProcesados"] is not None
+        centroides = resultados["listaPuntosProcesados"] if procesado else resultados["listaPuntosGenerados"]
+        return {
+            "conteo": resultados["numeroRodCalculado"],
+            "centroides": np.asarray(centroides if centroides is not None else [], dtype=np.int64).reshape(-1, 2).tolist(),
+            "procesamiento": procesado,
+            "numCuadrantes": configuracion["numCuadrantes"],
+            "latencia": round(latencia, 4),
+            "espera": round(espera, 4),
+            "tamañoLote": tamañoLote,
+            "cache": cache,
+        }
+
+    def __recogerLote(self) -> List[PeticionSegmentacion]:
+        """
+        Espera una peticion y reune las que lleguen durante la espera maxima, hasta el tamaño de lote. Las peticiones
+        abandonadas por sus clientes se descartan.
+        """
+        try:
+            lote = [self.cola.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        limite = time.perf_counter() + self.esperaMaxima
+        while len(lote) < self.tamañoLote:
+            restante = limite - time.perf_counter()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self.cola.get(timeout=restante))
+            except queue.Empty:
+                break
+        return [peticion for peticion in lote if not peticion.abandonada]
+
+    def __bucleInferencia(self) -> None:
+        """
+        Bucle del hilo de inferencia: codifica cada micro-lote en una pasada y segmenta sus peticiones una a una.
+        """
+        from scripts.PipelineSegmentacion import PipelineSegmentacion
+
+        while not self.parar.is_set():
+            lote = self.__recogerLote()
+            if not lote:
+                continue
+            inicio = time.perf_counter()
+            for peticion in lote:
+                peticion.inicio = inicio
+                peticion.tamañoLote = len(lote)
+
+            # Codificar juntas las entradas de todo el lote. Con capas de recorte el generador codifica ademas cada
+            # recorte por separado, por lo que solo se adelantan las imagenes o los cuadrantes completos
+            try:
+                entradas = []
+                for peticion in lote:
+                    numCuadrantes = peticion.configuracion["numCuadrantes"]
+                    entradas.extend(Utils.recortarCuadrantes(peticion.imagen, numCuadrantes) if numCuadrantes else [peticion.imagen])
+                for i in range(0, len(entradas), self.tamañoLote):
+                    self.turbotSam.codificarLote(entradas[i:i + self.tamañoLote])
+            except Exception as e:
+                # Si la codificacion conjunta falla (por ejemplo por memoria), cada peticion se codifica por separado
+                print(f"[WARNING] No se ha podido codificar el lote de {len(lote)} peticiones: {str(e)}")
+
+            for peticion in lote:
+                # Una peticion puede abandonarse mientras se atienden las anteriores del lote
+                if peticion.abandonada:
+                    continue
+                try:
+                    if peticion.configuracion["parametros"] != self.parametrosActuales:
+                        self.turbotSam.configurarGenerador(**peticion.configuracion["parametros"])
+                        self.parametrosActuales = dict(peticion.configuracion["parametros"])
+                    configuracion = peticion.configuracion
+                    peticion.resultados = PipelineSegmentacion.ejecutar(self.turbotSam, peticion.imagen, configuracion["numCuadrantes"], configuracion["procesamiento"], configuracion["paramsProcesamiento"])
+                    if peticion.claveCache is not None:
+                        self.cacheResultados.guardarEnSegundoPlano(peticion.claveCache, peticion.resultados)
+                except Exception as e:
+                    peticion.error = e
+                    with self.cerrojo:
+                        self.metricas["errores"] += 1
+                finally:
+                    peticion.terminada.set()
+
+            # Las entradas del lote ya no se van a volver a usar
+            self.turbotSam.cacheEmbeddings.vaciar()
+            with self.cerrojo:
+                self.metricas["lotes"] += 1
+                self.metricas["imagenesLote"] += len(lote)
+
+    def obtenerMetricas(self) -> Dict[str, any]:
+        """
+        Obtiene las metricas del servicio.
+
+        Args:
+            None
+
+        Returns:
+            dict: Contadores de peticiones, profundidad de cola actual y maxima, tamaño medio de lote y percentiles de
+            latencia y de espera en cola en segundos.
+        """
+        with self.cerrojo:
+            latencias = np.array(self.latencias)
+            esperas = np.array(self.esperas)
+            metricas = dict(self.metricas)
+        percentiles = lambda valores: {f"p{p}": round(float(np.percentile(valores, p)), 4) for p in (50, 95, 99)} if len(valores) else None
+        metricas.update({
+            "cola": self.cola.qsize(),
+            "capacidadCola": self.cola.maxsize,
+            "tamañoMedioLote": round(metricas["imagenesLote"] / metricas["lotes"], 2) if metricas["lotes"] else None,
+            "latencia": percentiles(latencias),
+            "espera": percentiles(esperas),
+            "dispositivo": self.turbotSam.device,
+        })
+        return metricas
+
+    def detener(self) -> None:
+        self.parar.set()
+        self.hilo.join()
+
+class ManejadorPeticiones(BaseHTTPRequestHandler):
+    """
+    Manejador HTTP del servicio de inferencia.
+
+    GET /salud, GET /metricas y GET /configuraciones devuelven el estado del servicio. POST /segmentar recibe en el
+    cuerpo los bytes de una imagen (JPEG, PNG o TIFF) y, como parametros de la URL, la configuracion (por defecto la
+    inicial), el numero de cuadrantes (0 para la imagen completa) y si se realiza el postprocesamiento (0 o 1). Los
+    cuerpos de mas de TAMAÑO_MAXIMO_PETICION bytes se rechazan con 413.
+    """
+
+    def __responder(self, codigo: int, contenido: Dict[str, any]) -> None:
+        cuerpo = json.dumps(contenido).encode("utf-8")
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def do_GET(self) -> None:
+        servicio = self.server.servicio
+        ruta = urlparse(self.path).path
+        if ruta == "/salud":
+            self.__responder(200, {"estado": "ok", "dispositivo": servicio.turbotSam.device})
+        elif ruta == "/metricas":
+            self.__responder(200, servicio.obtenerMetricas())
+        elif ruta == "/configuraciones":
+            self.__responder(200, {"configuraciones": Configuraciones.listar()})
+        else:
+            self.__responder(404, {"error": f"Ruta desconocida: {ruta}"})
+
+    def do_POST(self) -> None:
+        servicio = self.server.servicio
+        url = urlparse(self.path)
+        if url.path != "/segmentar":
+            self.__responder(404, {"error": f"Ruta desconocida: {url.path}"})
+            return
+
+        try:
+            consulta = {clave: valores[-1] for clave, valores in parse_qs(url.query).items()}
+            numCuadrantes = int(consulta["cuadrantes"]) if "cuadrantes" in consulta else None
+            procesamiento = consulta["procesamiento"] not in ("0", "false") if "procesamiento" in consulta else None
+            configuracion = servicio.configuracion(consulta.get("configuracion", servicio.configuracionInicial), numCuadrantes, procesamiento)
+
+            longitud = int(self.headers.get("Content-Length", 0))
+            if longitud <= 0:
+                raise ValueError("La peticion no incluye la imagen en el cuerpo")
+            if longitud > TAMAÑO_MAXIMO_PETICION:
+                self.__responder(413, {"error": f"El cuerpo de la peticion supera el maximo de {TAMAÑO_MAXIMO_PETICION} bytes"})
+                return
+            imagen = cv2.imdecode(np.frombuffer(self.rfile.read(longitud), dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+            if imagen is None:
+                raise ValueError("El cuerpo de la peticion no es una imagen valida")
+        except (KeyError, ValueError) as e:
+            self.__responder(400, {"error": str(e)})
+            return
+
+        try:
+            self.__responder(200, servicio.segmentar(imagen, configuracion))
+        except queue.Full:
+            self.__responder(503, {"error": "Cola de peticiones llena, reintente mas tarde"})
+        except TimeoutError as e:
+            self.__responder(504, {"error": str(e)})
+        except Exception as e:
+            self.__responder(500, {"error": str(e)})
+
+    def log_message(self, formato: str, *argumentos) -> None:
+        print(f"[INFO] {self.address_string()} {formato % argumentos}")
+
+def main(argumentos: Union[List[str], None] = None) -> int:
+    parser = argparse.ArgumentParser(description="Servicio HTTP local de segmentacion de TURBOT SAM.")
+    parser.add_argument("--host", default="127.0.0.1", help="Direccion en la que escucha el servicio.")
+    parser.add_argument("--puerto", type=int, default=8000, help="Puerto en el que escucha el servicio.")
+    parser.add_argument("--configuracion", default="conZoom", help=f"Configuracion por defecto ({', '.join(Configuraciones.listar())}) o ruta de un JSON.")
+    parser.add_argument("--lote", type=int, default=4, help="Numero maximo de peticiones codificadas en una misma pasada.")
+    parser.add_argument("--espera", type=float, default=0.05, help="Segundos maximos de espera para completar un micro-lote.")
+    parser.add_argument("--cola", type=int, default=32, help="Numero maximo de peticiones en espera. Las demas reciben un 503.")
+    parser.add_argument("--sin-cache", action="store_true", help="No leer ni guardar resultados en la cache de resultados.")
+    args = parser.parse_args(argumentos)
+
+    servicio = ServicioInferencia(args.configuracion, args.lote, args.espera, args.cola, not args.sin_cache)
+    servidor = ThreadingHTTPServer((args.host, args.puerto), ManejadorPeticiones)
+    servidor.servicio = servicio
+    print(f"[INFO] Servicio escuchando en http://{args.host}:{args.puerto} (modelo en {servicio.turbotSam.device})")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    servidor.server_close()
+    servicio.detener()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,332 @@
+from multiprocessing import shared_memory
+from scripts.TurbotSAM import TurbotSAM, SegmentacionCancelada
+from scripts.PipelineSegmentacion import PipelineSegmentacion
+from scripts.Perfilador import perfilador
+from typing import Union, List, Tuple, Dict
+import multiprocessing
+import queue
+import time
+import numpy as np
+
+# Claves de los resultados de la segmentacion que son imagenes y viajan por memoria compartida. Los centroides y sus
+# propiedades son arrays pequeños y viajan por la cola
+CLAVES_IMAGENES = ("mascarasGeneradas", "mascarasProcesadas")
+
+# Claves de los resultados de la segmentacion que son listas de mascaras
+CLAVES_LISTAS_MASCARAS = ("listaMascaras", "listaMascarasProcesadas")
+
+def compartirArray(array: np.ndarray) -> Tuple[shared_memory.SharedMemory, Dict[str, any]]:
+    """
+    Copia un array en un bloque de memoria compartida nuevo.
+
+    Args:
+        array (np.ndarray): El array a compartir.
+
+    Returns:
+        Tuple[SharedMemory, dict]: El bloque de memoria compartida y el descriptor necesario para adjuntarlo desde otro proceso.
+    """
+    try:
+        memoria = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        vista = np.ndarray(array.shape, dtype=array.dtype, buffer=memoria.buf)
+        vista[...] = array
+        del vista
+        descriptor = {"nombre": memoria.name, "forma": array.shape, "dtype": array.dtype.str}
+        return memoria, descriptor
+    except Exception:
+        raise
+
+def adjuntarArray(descriptor: Dict[str, any]) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    """
+    Adjunta un bloque de memoria compartida creado en otro proceso y devuelve una vista sin copia sobre el.
+
+    Args:
+        descriptor (dict): Descriptor generado por compartirArray.
+
+    Returns:
+        Tuple[SharedMemory, np.ndarray]: El bloque de memoria compartida y el array que apunta a su contenido. El bloque
+        debe mantenerse referenciado mientras se use el array.
+    """
+    try:
+        memoria = shared_memory.SharedMemory(name=descriptor["nombre"])
+        array = np.ndarray(descriptor["forma"], dtype=np.dtype(descriptor["dtype"]), buffer=memoria.buf)
+        return memoria, array
+    except Exception:
+        raise
+
+def _bucleTrabajador(colaTareas: multiprocessing.Queue, colaEventos: multiprocessing.Queue, idCancelado: multiprocessing.Value, parametrosIniciales: Dict[str, Union[int, float]]) -> None:
+    """
+    Bucle principal del proceso trabajador. Carga el modelo una unica vez y atiende las tareas de segmentacion
+    hasta recibir None.
+
+    Args:
+        colaTareas (Queue): Cola por la que llegan las tareas desde la interfaz.
+        colaEventos (Queue): Cola por la que se envian los mensajes de progreso y los resultados.
+        idCancelado (Value): Identificador del ultimo trabajo cancelado desde la interfaz.
+        parametrosIniciales (dict): Parametros de segmentacion con los que se carga el modelo.
+
+    Returns:
+        None
+    """
+    memoriasPendientes = {}
+
+    try:
+        turbotSam = TurbotSAM(**parametrosIniciales)
+        parametrosActuales = dict(parametrosIniciales)
+        colaEventos.put(("listo", None, turbotSam.device))
+    except Exception as e:
+        colaEventos.put(("error", None, f"No se pudo cargar el modelo en el proceso de inferencia: {str(e)}"))
+        return
+
+    while True:
+        tarea = colaTareas.get()
+        if tarea is None:
+            break
+
+        tipo, idTrabajo = tarea["tipo"], tarea["id"]
+
+        # La interfaz ya ha adjuntado los resultados de este trabajo, se liberan los bloques del trabajador
+        if tipo == "liberar":
+            for memoria in memoriasPendientes.pop(idTrabajo, []):
+                memoria.close()
+                memoria.unlink()
+            continue
+
+        inicioTrabajo = time.perf_counter()
+
+        def notificar(nivel: str, mensaje: str, porcentaje: Union[float, None], etapa: Union[str, None] = None, cuadrante: Union[int, None] = None) -> None:
+            colaEventos.put(("log", idTrabajo, {
+                "nivel": nivel,
+                "mensaje": mensaje,
+                "etapa": etapa,
+                "cuadrante": cuadrante,
+                "porcentaje": porcentaje,
+                "tiempo": time.perf_counter() - inicioTrabajo,
+            }))
+
+        def comprobarCancelacion() -> None:
+            if idCancelado.value == idTrabajo:
+                raise SegmentacionCancelada()
+
+        # El perfilador solo se desactiva al terminar si lo ha activado la tarea, para no apagar el de TURBOTSAM_PERFIL
+        activadoPorTarea = tarea["perfil"] and not perfilador.activo
+        try:
+            comprobarCancelacion()
+
+            if tarea["parametros"] != parametrosActuales:
+                turbotSam.configurarGenerador(**tarea["parametros"])
+                parametrosActuales = dict(tarea["parametros"])
+
+            if activadoPorTarea:
+                perfilador.reiniciar()
+                perfilador.activar()
+            numEventos = len(perfilador.eventos())
+
+            memoriaImagen, imagen = adjuntarArray(tarea["imagen"])
+            try:
+                with perfilador.etapa("segmentacion", trabajo=idTrabajo):
+                    resultados = PipelineSegmentacion.ejecutar(turbotSam, imagen, tarea["numCuadrantes"], tarea["procesamiento"], tarea["paramsProcesamiento"], notificar, comprobarCancelacion)
+            finally:
+                del imagen
+                memoriaImagen.close()
+
+            # Las imagenes de resultados se envian por memoria compartida y las mascaras sin su segmentacion
+            memorias = []
+            with perfilador.etapa("compartirResultados"):
+                for clave in CLAVES_IMAGENES:
+                    if resultados[clave] is not None:
+                        memoria, resultados[clave] = compartirArray(resultados[clave])
+                        memorias.append(memoria)
+            resultados["perfil"] = perfilador.eventos()[numEventos:] if tarea["perfil"] else None
+            for clave in CLAVES_LISTAS_MASCARAS:
+                if resultados[clave] is not None:
+                    resultados[clave] = [{k: v for k, v in mascara.items() if k != "segmentation"} for mascara in resultados[clave]]
+            memoriasPendientes[idTrabajo] = memorias
+
+            colaEventos.put(("resultado", idTrabajo, resultados))
+        except SegmentacionCancelada:
+            colaEventos.put(("cancelado", idTrabajo))
+        except Exception as e:
+            colaEventos.put(("error", idTrabajo, str(e)))
+        finally:
+            if activadoPorTarea:
+                perfilador.desactivar()
+
+    for memorias in memoriasPendientes.values():
+        for memoria in memorias:
+            memoria.close()
+            memoria.unlink()
+
+class TrabajadorInferencia:
+    """
+    Clase que gestiona un proceso persistente encargado de la inferencia de SAM y del postprocesamiento.
+
+    El modelo se carga una unica vez al arrancar el proceso y se mantiene en memoria entre segmentaciones. Las imagenes
+    y las imagenes de etiquetas se intercambian mediante memoria compartida, mientras que el progreso, los mensajes y
+    los resultados ligeros viajan por una cola. Un fallo en la inferencia no afecta al proceso de la interfaz.
+    """
+
+    def __init__(self, parametrosIniciales: Dict[str, Union[int, float]]):
+
+        try:
+            self.contexto = multiprocessing.get_context("spawn")
+            self.parametrosIniciales = dict(parametrosIniciales)
+            self.proceso = None
+            self.colaTareas = None
+            self.colaEventos = None
+            self.iniciar()
+        except Exception:
+            raise
+
+    def iniciar(self) -> None:
+        """
+        Arranca el proceso trabajador y sus colas de comunicacion.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        try:
+            self.colaTareas = self.contexto.Queue()
+            self.colaEventos = self.contexto.Queue()
+            self.idCancelado = self.contexto.Value("q", 0, lock=False)
+            self.proceso = self.contexto.Process(target=_bucleTrabajador, args=(self.colaTareas, self.colaEventos, self.idCancelado, self.parametrosIniciales), daemon=True)
+            self.proceso.start()
+        except Exception:
+            raise
+
+    def estaVivo(self) -> bool:
+        """
+        Indica si el proceso trabajador sigue en ejecucion.
+
+        Args:
+            None
+
+        Returns:
+            bool: True si el proceso esta vivo.
+        """
+        return self.proceso is not None and self.proceso.is_alive()
+
+    def reiniciar(self) -> None:
+        """
+        Vuelve a arrancar el proceso trabajador tras una caida.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        try:
+            if self.proceso is not None and self.proceso.is_alive():
+                self.proceso.terminate()
+            self.proceso.join(timeout=5)
+            self.iniciar()
+        except Exception:
+            raise
+
+    def enviar(self, idTrabajo: int, descriptorImagen: Dict[str, any], parametros: Dict[str, Union[int, float]], numCuadrantes: Union[int, None], procesamiento: bool, paramsProcesamiento: Dict[str, Union[int, float]], perfil: bool = False) -> None:
+        """
+        Envia una tarea de segmentacion al proceso trabajador.
+
+        Args:
+            idTrabajo (int): Identificador del trabajo.
+            descriptorImagen (dict): Descriptor de la imagen en memoria compartida.
+            parametros (dict): Parametros de segmentacion de SAM.
+            numCuadrantes (int o None): Numero de cuadrantes o None para procesar la imagen completa.
+            procesamiento (bool): Indica si se realiza el postprocesamiento.
+            paramsProcesamiento (dict): Parametros de postprocesamiento.
+            perfil (bool): Indica si se registran los tiempos y la memoria de cada etapa.
+
+        Returns:
+            None
+        """
+        try:
+            self.colaTareas.put({
+                "tipo": "segmentar",
+                "id": idTrabajo,
+                "imagen": descriptorImagen,
+                "parametros": dict(parametros),
+                "numCuadrantes": numCuadrantes,
+                "procesamiento": procesamiento,
+                "paramsProcesamiento": dict(paramsProcesamiento),
+                "perfil": perfil,
+            })
+        except Exception:
+            raise
+
+    def cancelar(self, idTrabajo: int) -> None:
+        """
+        Solicita la cancelacion de un trabajo. El proceso trabajador la comprueba entre cuadrantes, entre lotes de
+        puntos y entre etapas, y responde con el evento ('cancelado', idTrabajo).
+
+        Args:
+            idTrabajo (int): Identificador del trabajo a cancelar.
+
+        Returns:
+            None
+        """
+        try:
+            self.idCancelado.value = idTrabajo
+        except Exception:
+            raise
+
+    def recibirEventos(self) -> List[tuple]:
+        """
+        Recoge sin bloquear todos los eventos pendientes enviados por el proceso trabajador.
+
+        Args:
+            None
+
+        Returns:
+            list[tuple]: Lista de eventos (tipo, idTrabajo, ...).
+        """
+        eventos = []
+        try:
+            while True:
+                eventos.append(self.colaEventos.get_nowait())
+        except queue.Empty:
+            return eventos
+
+    def adjuntarResultados(self, idTrabajo: int, resultados: Dict[str, any]) -> List[shared_memory.SharedMemory]:
+        """
+        Sustituye los descriptores de memoria compartida de los resultados por los arrays correspondientes y avisa al
+        trabajador de que puede liberar sus bloques.
+
+        Args:
+            idTrabajo (int): Identificador del trabajo.
+            resultados (dict): Resultados recibidos del trabajador.
+
+        Returns:
+            list[SharedMemory]: Bloques adjuntados, que deben mantenerse referenciados mientras se usen los arrays.
+        """
+        try:
+            memorias = []
+            for clave in CLAVES_IMAGENES:
+                if resultados[clave] is not None:
+                    memoria, resultados[clave] = adjuntarArray(resultados[clave])
+                    memorias.append(memoria)
+            self.colaTareas.put({"tipo": "liberar", "id": idTrabajo})
+            return memorias
+        except Exception:
+            raise
+
+    def detener(self) -> None:
+        """
+        Detiene el proceso trabajador de forma ordenada.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        try:
+            if self.estaVivo():
+                self.colaTareas.put(None)
+                self.proceso.join(timeout=5)
+            if self.estaVivo():
+                self.proceso.terminate()
+        except Exception:
+            raise
@@ -1,7 +1,157 @@
 from mobile_sam import sam_model_registry, SamAutomaticMaskGenerator
+from scripts.Perfilador import perfilador
+from scripts.Utils import Utils
+from scripts.Configuraciones import RUTA_CHECKPOINT
+from collections import OrderedDict
+import hashlib
+import time
 import torch
 import numpy as np
-from typing import Iterator, Tuple, List, Dict
+from typing import Iterator, Tuple, List, Dict, Callable, Union, Sequence
+
+class SegmentacionCancelada(Exception):
+    """
+    Excepcion lanzada cuando se cancela una segmentacion que estaba en curso.
+    """
+
+class CacheEmbeddings:
+    """
+    Cache LRU de las salidas del codificador de imagen de SAM, indexada por el contenido de la imagen o del recorte.
+
+    El codificador es la parte mas costosa de la segmentacion y su salida solo depende de la imagen, por lo que puede
+    reutilizarse entre segmentaciones de la misma imagen con distintos parametros. Se guarda tambien el tiempo que
+    costo cada codificacion para poder contabilizar el tiempo ahorrado.
+    """
+
+    def __init__(self, capacidad: int = 8):
+        self.capacidad = capacidad
+        self.entradas = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
+        self.tiempoAhorrado = 0.0
+
+    @staticmethod
+    def clave(imagen: np.ndarray, formato: str) -> str:
+        """
+        Calcula la clave de una imagen a partir de su contenido, su forma y su formato de color.
+
+        Args:
+            imagen (np.ndarray): La imagen o el recorte.
+            formato (str): Formato de color de la imagen ('RGB' o 'BGR').
+
+        Returns:
+            str: La clave de la imagen.
+        """
+        # En las vistas de tres canales de una imagen en escala de grises basta con leer un canal
+        datos = imagen[:, :, 0] if imagen.ndim == 3 and imagen.strides[2] == 0 else imagen
+        resumen = hashlib.blake2b(np.ascontiguousarray(datos).data, digest_size=16).hexdigest()
+        return f"{resumen}-{imagen.shape}-{imagen.dtype.str}-{formato}"
+
+    def obtener(self, clave: str) -> Union[Dict[str, any], None]:
+        """
+        Obtiene una entrada de la cache y la marca como usada recientemente.
+
+        Args:
+            clave (str): Clave de la imagen.
+
+        Returns:
+            dict o None: Estado del predictor guardado, o None si no esta en la cache.
+        """
+        entrada = self.entradas.get(clave)
+        if entrada is None:
+            self.fallos += 1
+            return None
+        self.entradas.move_to_end(clave)
+        self.aciertos += 1
+        self.tiempoAhorrado += entrada["tiempo"]
+        return entrada
+
+    def guardar(self, clave: str, entrada: Dict[str, any]) -> None:
+        """
+        Guarda una entrada en la cache descartando la menos usada si esta llena.
+
+        Args:
+            clave (str): Clave de la imagen.
+            entrada (dict): Estado del predictor (features, original_size, input_size) y tiempo de codificacion.
+
+        Returns:
+            None
+        """
+        if self.capacidad <= 0:
+            return
+        self.entradas[clave] = entrada
+        self.entradas.move_to_end(clave)
+        while len(self.entradas) > self.capacidad:
+            self.entradas.popitem(last=False)
+
+    def vaciar(self) -> None:
+        """
+        Elimina todas las entradas de la cache.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self.entradas.clear()
+
+class GeneradorMascarasCancelable(SamAutomaticMaskGenerator):
+    """
+    Generador automatico de mascaras de SAM que comprueba si se ha cancelado la segmentacion antes de procesar cada
+    lote de puntos. Registra ademas en el perfilador el codificador de imagen, cada lote del decodificador y cada
+    recorte; el tiempo propio de un recorte corresponde al filtrado y a la supresion no maxima (NMS).
+
+    Si se le asigna una CacheEmbeddings, el codificador solo se ejecuta para las imagenes que no estan en la cache.
+    """
+
+    comprobarCancelacion = None
+    cacheEmbeddings = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        codificar = self.predictor.set_image
+
+        def codificarMedido(imagen: np.ndarray, image_format: str = "RGB") -> None:
+            cache = self.cacheEmbeddings
+            if cache is None:
+                with perfilador.etapa("codificador"):
+                    return codificar(imagen, image_format)
+
+            clave = CacheEmbeddings.clave(imagen, image_format)
+            entrada = cache.obtener(clave)
+            if entrada is not None:
+                self.predictor.reset_image()
+                self.predictor.features = entrada["features"]
+                self.predictor.original_size = entrada["original_size"]
+                self.predictor.input_size = entrada["input_size"]
+                self.predictor.is_image_set = True
+                return
+
+            inicio = time.perf_counter()
+            with perfilador.etapa("codificador"):
+                codificar(imagen, image_format)
+                if self.predictor.features.is_cuda:
+                    torch.cuda.synchronize()
+            cache.guardar(clave, {
+                "features": self.predictor.features,
+                "original_size": self.predictor.original_size,
+                "input_size": self.predictor.input_size,
+                "tiempo": time.perf_counter() - inicio,
+            })
+
+        self.predictor.set_image = codificarMedido
+
+    def _process_crop(self, *args, **kwargs):
+        with perfilador.etapa("recorte"):
+            return super()._process_crop(*args, **kwargs)
+
+    def _process_batch(self, *args, **kwargs):
+        if self.comprobarCancelacion is not None:
+            self.comprobarCancelacion()
+        with perfilador.etapa("decodificador"):
+            return super()._process_batch(*args, **kwargs)
 
 class TurbotSAM: 
     """
@@ -32,14 +182,48 @@ class TurbotSAM:
                  min_mask_region_area):
         
         try:
-            self.checkpoint = "models/mobile_sam.pt"
+            self.checkpoint = RUTA_CHECKPOINT
             self.modelType = "vit_t"
             self.device = "cuda" if torch.cuda.is_available() else "cpu"
             self.sam = sam_model_registry[self.modelType](checkpoint=self.checkpoint)
             self.sam.to(device=self.device)
             self.sam.eval()
+            self.cacheEmbeddings = None
             
-            self.generadorMascaras = SamAutomaticMaskGenerator(
+            self.configurarGenerador(
+                points_per_side = points_per_side,
+                points_per_batch = points_per_batch,
+                pred_iou_thresh = pred_iou_thresh,
+                stability_score_thresh = stability_score_thresh,
+                stability_score_offset = stability_score_offset,
+                box_nms_thresh = box_nms_thresh,
+                crop_n_layers = crop_n_layers,
+                crop_nms_thresh = crop_nms_thresh,
+                crop_overlap_ratio = crop_overlap_ratio,
+                crop_n_points_downscale_factor = crop_n_points_downscale_factor,
+                min_mask_region_area = min_mask_region_area,
+            )
+        except Exception:
+            raise
+
+    def configurarGenerador(self,points_per_side,points_per_batch,pred_iou_thresh,
+                            stability_score_thresh,stability_score_offset,
+                            box_nms_thresh,crop_n_layers,crop_nms_thresh,
+                            crop_overlap_ratio,crop_n_points_downscale_factor,
+                            min_mask_region_area) -> None:
+        """
+        Genera el generador de mascaras con los parametros indicados reutilizando el modelo ya cargado.
+
+        Permite cambiar los parametros de segmentacion entre ejecuciones sin volver a cargar el checkpoint de SAM.
+
+        Args:
+            Los mismos parametros de segmentacion que recibe el constructor.
+
+        Returns:
+            None
+        """
+        try:
+            self.generadorMascaras = GeneradorMascarasCancelable(
                 model = self.sam,
                 points_per_side = points_per_side,
                 points_per_batch = points_per_batch,
@@ -53,31 +237,154 @@ class TurbotSAM:
                 crop_n_points_downscale_factor = crop_n_points_downscale_factor,
                 min_mask_region_area = min_mask_region_area,
             )
+            self.generadorMascaras.cacheEmbeddings = self.cacheEmbeddings
+        except Exception:
+            raise
+
+    def activarCacheEmbeddings(self, capacidad: int) -> CacheEmbeddings:
+        """
+        Activa la cache de salidas del codificador de imagen, que se conserva aunque se cambie de generador.
+
+        Args:
+            capacidad (int): Numero maximo de imagenes o recortes guardados. Con 0 se desactiva la cache.
+
+        Returns:
+            CacheEmbeddings: La cache activa, o None si se ha desactivado.
+        """
+        try:
+            self.cacheEmbeddings = CacheEmbeddings(capacidad) if capacidad > 0 else None
+            self.generadorMascaras.cacheEmbeddings = self.cacheEmbeddings
+            return self.cacheEmbeddings
+        except Exception:
+            raise
+
+    def codificarLote(self, imagenes: List[np.ndarray], formato: str = "RGB") -> int:
+        """
+        Codifica varias imagenes en una sola pasada del codificador y guarda sus salidas en la cache de embeddings, de
+        forma que las segmentaciones posteriores de esas imagenes no vuelvan a ejecutarlo.
+
+        Las imagenes pueden tener tamaños distintos, porque el modelo las redimensiona y rellena a la misma resolucion
+        de entrada. Requiere que la cache de embeddings este activa y tenga capacidad para todas las imagenes.
+
+        Args:
+            imagenes (list[np.ndarray]): Imagenes o cuadrantes a codificar.
+            formato (str): Formato de color de las imagenes ('RGB' o 'BGR').
+
+        Returns:
+            int: Numero de imagenes codificadas (las que ya estaban en la cache no se vuelven a codificar).
+        """
+        try:
+            if self.cacheEmbeddings is None:
+                raise ValueError("La cache de embeddings debe estar activa para codificar por lotes")
+            predictor = self.generadorMascaras.predictor
+            pendientes = {}
+            for imagen in map(Utils.expandirCanales, imagenes):
+                clave = CacheEmbeddings.clave(imagen, formato)
+                if clave not in self.cacheEmbeddings.entradas and clave not in pendientes:
+                    pendientes[clave] = imagen
+            if not pendientes:
+                return 0
+
+            entradas, tamaños = [], []
+            for imagen in pendientes.values():
+                if formato != self.sam.image_format:
+                    imagen = imagen[..., ::-1]
+                transformada = torch.as_tensor(predictor.transform.apply_image(imagen), device=self.device)
+                transformada = transformada.permute(2, 0, 1).contiguous()[None, :, :, :]
+                tamaños.append((imagen.shape[:2], tuple(transformada.shape[-2:])))
+                entradas.append(self.sam.preprocess(transformada))
+
+            inicio = time.perf_counter()
+            with torch.no_grad(), perfilador.etapa("codificadorLote", imagenes=len(entradas)):
+                features = self.sam.image_encoder(torch.cat(entradas))
+                if features.is_cuda:
+                    torch.cuda.synchronize()
+            tiempo = (time.perf_counter() - inicio) / len(entradas)
+
+            for i, clave in enumerate(pendientes):
+                self.cacheEmbeddings.guardar(clave, {
+                    "features": features[i:i + 1].clone(),
+                    "original_size": tamaños[i][0],
+                    "input_size": tamaños[i][1],
+                    "tiempo": tiempo,
+                })
+            return len(pendientes)
+        except Exception:
+            raise
+
+    def puntosSemilla(self, centroides: np.ndarray, cobertura: np.ndarray) -> np.ndarray:
+        """
+        Obtiene los puntos con los que segmentar una imagen a partir de los resultados de la imagen anterior de la misma
+        secuencia: los centroides aceptados en ella y los puntos de la cuadricula del generador que caen fuera de las
+        zonas ya resueltas.
+
+        Args:
+            centroides (np.ndarray): Array (N, 2) con las coordenadas x, y de los centroides en la imagen.
+            cobertura (np.ndarray): Imagen booleana, del tamaño de la imagen, con las zonas que no se muestrean.
+
+        Returns:
+            np.ndarray: Array (K, 2) de puntos x, y normalizados a [0, 1], como las cuadriculas de SAM.
+        """
+        try:
+            altura, anchura = cobertura.shape
+            escala = np.array([anchura, altura], dtype=np.float64)
+            cuadricula = self.generadorMascaras.point_grids[0]
+            x = np.minimum((cuadricula[:, 0] * anchura).astype(np.int64), anchura - 1)
+            y = np.minimum((cuadricula[:, 1] * altura).astype(np.int64), altura - 1)
+            libres = cuadricula[~cobertura[y, x]]
+            semillas = (np.asarray(centroides, dtype=np.float64).reshape(-1, 2) + 0.5) / escala
+            return np.concatenate([semillas, libres])
         except Exception:
             raise
 
-    def generarMascaras(self, imagen: np.ndarray) -> List[Dict[str, any]]:
+    def generarMascaras(self, imagen: np.ndarray, comprobarCancelacion: Union[Callable[[], None], None] = None, puntos: Union[np.ndarray, None] = None) -> List[Dict[str, any]]:
         """
         Genera mascaras a partir de una imagen utilizando el generador de mascaras asociado a esta instancia.
 
         Args:
-            imagen: La imagen de entrada.
+            imagen: La imagen de entrada, en escala de grises o de tres canales. Las imagenes en escala de grises se
+                pasan a SAM como una vista de tres canales sin copia.
+            comprobarCancelacion: Funcion que lanza SegmentacionCancelada si se ha cancelado la segmentacion. Se
+                comprueba antes de cada lote de puntos.
+            puntos: Puntos normalizados (K, 2) con los que segmentar la imagen en lugar de la cuadricula del generador,
+                como los de puntosSemilla. Solo sustituyen a la cuadricula de la imagen completa; las capas de recortes
+                mantienen las suyas.
 
         Returns:
             Las máscaras generadas.
         """
+        cuadriculas = self.generadorMascaras.point_grids
         try:
-            return self.generadorMascaras.generate(imagen)
+            self.generadorMascaras.comprobarCancelacion = comprobarCancelacion
+            if puntos is None:
+                with perfilador.etapa("generarMascaras"):
+                    return self.generadorMascaras.generate(Utils.expandirCanales(imagen))
+            if len(puntos) == 0:
+                return []
+            self.generadorMascaras.point_grids = [np.asarray(puntos, dtype=np.float64)] + list(cuadriculas[1:])
+            with perfilador.etapa("generarMascaras", puntos=len(puntos)):
+                return self.generadorMascaras.generate(Utils.expandirCanales(imagen))
         except Exception:
             raise
+        finally:
+            self.generadorMascaras.comprobarCancelacion = None
+            self.generadorMascaras.point_grids = cuadriculas
 
-    def generarMascarasPorCuadrante(self, cuadrantes: List[np.ndarray], postprocesamiento: bool) -> Iterator[Tuple[float, List[any], int]]:
+    def generarMascarasPorCuadrante(self, cuadrantes: Sequence[np.ndarray], postprocesamiento: bool, comprobarCancelacion: Union[Callable[[], None], None] = None, mascarasPrevias: Union[Dict[int, List[Dict[str, any]]], None] = None, acumular: bool = True, puntosPorCuadrante: Union[Dict[int, np.ndarray], None] = None) -> Iterator[Tuple[float, List[any], int]]:
         """
         Genera mascaras por cuadrante a partir de una lista de cuadrantes.
 
         Args:
-            cuadrantes: Lista de cuadrantes de la imagen.
+            cuadrantes: Lista de cuadrantes de la imagen, o secuencia que los lee bajo demanda al recorrerla.
             postprocesamiento: Indica si se realiza postprocesamiento.
+            comprobarCancelacion: Funcion que lanza SegmentacionCancelada si se ha cancelado la segmentacion. Se
+                comprueba entre cuadrantes y antes de cada lote de puntos.
+            mascarasPrevias: Mascaras ya generadas en una ejecucion anterior, por numero de cuadrante (desde 1). Esos
+                cuadrantes no se vuelven a segmentar.
+            acumular: Si es False, solo se conservan las mascaras del ultimo cuadrante, de forma que la memoria no crece
+                con el numero de cuadrantes.
+            puntosPorCuadrante: Puntos normalizados con los que segmentar cada cuadrante, por numero de cuadrante (desde
+                1), en lugar de la cuadricula del generador.
 
         Yields:
             Tuple[float, list[Any], int]: Una tupla que contiene el progreso, las mascaras por cuadrante y el contador.
@@ -89,8 +396,17 @@ class TurbotSAM:
             cont = 0
             
             for cuadrante in cuadrantes:
+                if comprobarCancelacion is not None:
+                    comprobarCancelacion()
                 cont += 1
-                masks = self.generarMascaras(cuadrante)
+                if mascarasPrevias is not None and cont in mascarasPrevias:
+                    masks = mascarasPrevias[cont]
+                else:
+                    with perfilador.etapa("cuadrante", cuadrante=cont):
+                        puntos = puntosPorCuadrante.get(cont) if puntosPorCuadrante is not None else None
+                        masks = self.generarMascaras(cuadrante, comprobarCancelacion, puntos)
+                if not acumular:
+                    mascarasPorCuadrante = []
                 mascarasPorCuadrante.append(masks)
                 porcentaje = (cont / numCuadrantes) * aux          
                 yield porcentaje, mascarasPorCuadrante, cont     
@@ -55,17 +55,17 @@ class Utils:
     @staticmethod
     def recortarCuadrantes(imagen: Union[np.ndarray, None], numCuadrantes: int) -> List[np.ndarray]:
         """
-        Recorta una imagen en cuadrantes.
+        Recorta una imagen en cuadrantes. Los cuadrantes son vistas sobre la imagen, sin copia.
 
         Args:
-            imagen (np.ndarray): La imagen a recortar.
+            imagen (np.ndarray): La imagen a recortar, de un canal o de tres.
             numCuadrantes (int): Numero total de cuadrantes deseados.
 
         Returns:
             list[np.ndarray]: Lista de cuadrantes de la imagen.
         """
         try:
-            altura, anchura, _ = imagen.shape
+            altura, anchura = imagen.shape[:2]
             raiz = int(np.sqrt(numCuadrantes))
             alturaCuadrante = altura // raiz
             anchuraCuadrante = anchura // raiz
@@ -87,17 +87,106 @@ class Utils:
         Obtiene las dimensiones de una imagen.
 
         Args:
-            imagen (np.ndarray): La imagen de la cual se obtendrán las dimensiones.
+            imagen (np.ndarray): La imagen de la cual se obtendrán las dimensiones, de un canal o de tres.
 
         Returns:
             tuple[int, int]: Altura y anchura de la imagen.
         """
         try:
-            altura, anchura, _ = imagen.shape
+            altura, anchura = imagen.shape[:2]
             return (altura, anchura)
         except Exception:
             raise
     
+    @staticmethod
+    def cargarImagen(ruta: str) -> np.ndarray:
+        """
+        Carga una imagen decodificandola una sola vez y directamente en escala de grises.
+
+        Es la imagen canonica de la aplicacion: un unico plano uint8 que comparten el visor, la segmentacion y el
+        postprocesamiento. Los tres canales que necesita SAM se obtienen con expandirCanales sin copiar la imagen.
+
+        Args:
+            ruta (str): Ruta del archivo de imagen.
+
+        Returns:
+            np.ndarray: Imagen (altura, anchura) en escala de grises.
+        """
+        try:
+            imagen = cv2.imread(ruta, cv2.IMREAD_GRAYSCALE)
+            if imagen is None:
+                raise ValueError(f"No se ha podido leer la imagen {ruta}")
+            return imagen
+        except Exception:
+            raise
+
+    @staticmethod
+    def cargarVistaPrevia(ruta: str, factor: int = 4) -> np.ndarray:
+        """
+        Carga una version reducida de una imagen en escala de grises para mostrarla mientras se carga la completa.
+
+        En los JPEG la reduccion se hace durante la decodificacion (escalado de la DCT), por lo que es varias veces mas
+        rapida que decodificar la imagen completa. En el resto de formatos OpenCV decodifica y reduce.
+
+        Args:
+            ruta (str): Ruta del archivo de imagen.
+            factor (int): Factor de reduccion: 2, 4 u 8.
+
+        Returns:
+            np.ndarray: Imagen reducida, de dimensiones aproximadas (altura / factor, anchura / factor).
+        """
+        try:
+            modos = {2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+            if factor not in modos:
+                raise ValueError(f"Factor de reduccion no soportado: {factor}")
+            imagen = cv2.imread(ruta, modos[factor])
+            if imagen is None:
+                raise ValueError(f"No se ha podido leer la imagen {ruta}")
+            return imagen
+        except Exception:
+            raise
+
+    @staticmethod
+    def construirPiramide(imagen: np.ndarray, tamañoMinimo: int = 512) -> List[np.ndarray]:
+        """
+        Construye una piramide multiescala para el visor, reduciendo a la mitad hasta que el lado mayor no supere
+        tamañoMinimo. El primer nivel es la propia imagen, sin copia; los demas suman como mucho un tercio de ella.
+
+        Args:
+            imagen (np.ndarray): Imagen de resolucion completa.
+            tamañoMinimo (int): Lado mayor a partir del cual se deja de reducir.
+
+        Returns:
+            list[np.ndarray]: Niveles de la piramide, de mayor a menor resolucion.
+        """
+        try:
+            niveles = [imagen]
+            while max(niveles[-1].shape[:2]) > tamañoMinimo:
+                altura, anchura = niveles[-1].shape[:2]
+                niveles.append(cv2.resize(niveles[-1], ((anchura + 1) // 2, (altura + 1) // 2), interpolation=cv2.INTER_AREA))
+            return niveles
+        except Exception:
+            raise
+
+    @staticmethod
+    def expandirCanales(imagen: np.ndarray) -> np.ndarray:
+        """
+        Obtiene una vista de tres canales iguales de una imagen en escala de grises, sin copiarla. Las imagenes que ya
+        tienen tres canales se devuelven sin cambios.
+
+        Args:
+            imagen (np.ndarray): Imagen (altura, anchura) o (altura, anchura, 3).
+
+        Returns:
+            np.ndarray: Vista de solo lectura (altura, anchura, 3).
+        """
+        try:
+            if imagen.ndim == 3:
+                return imagen
+            return np.broadcast_to(imagen[:, :, None], imagen.shape + (3,))
+        except Exception:
+            raise
+
     @staticmethod
     def convertRGB(imagen: Union[np.ndarray, None]) -> np.ndarray:
         """